@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Migración única de los JSON de ``base_datos/`` al backend SQLite.
+
+Importa pedidos, clientes, seguimiento de producción, cola de trabajos e
+historial a una tabla por entidad. Después se arranca KyberCore con
+``STORAGE_BACKEND=sqlite`` (y ``STORAGE_SQLITE_PATH`` si la base no está en
+``base_datos/kybercore.db``). Los archivos JSON no se modifican.
+
+Uso:
+    python scripts/migrate_json_to_sqlite.py [--source base_datos] [--database ruta.db] [--force]
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+# Añadir el directorio raíz al path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.database import (
+    CustomersRepository,
+    JobHistoryRepository,
+    OrdersRepository,
+    PrintQueueRepository,
+    ProductionRepository,
+)
+
+REPOSITORIES = [
+    ("orders.json", OrdersRepository),
+    ("customers.json", CustomersRepository),
+    ("production_tracking.json", ProductionRepository),
+    ("print_queue.json", PrintQueueRepository),
+    ("historial_trabajos.json", JobHistoryRepository),
+]
+
+
+def extract(repository, payload):
+    """Registros y metadata del payload JSON de un repositorio."""
+    records = list(payload.get(repository._data_key) or [])
+    metadata = dict(payload.get(repository._metadata_key) or {})
+    # historial_trabajos.json guarda los trabajos antiguos anidados en "historial_trabajos"
+    legacy = payload.get("historial_trabajos")
+    if isinstance(legacy, dict):
+        records = list(legacy.get("trabajos") or []) + records
+        metadata = {**(legacy.get("estadisticas") or {}), **metadata}
+    return records, metadata
+
+
+def migrate(source: Path, database: Path, force: bool = False) -> dict:
+    """Importa cada JSON existente en ``source``. Devuelve los registros importados por archivo."""
+    imported = {}
+    for filename, repository_class in REPOSITORIES:
+        path = source / filename
+        if not path.exists():
+            print(f"  ⏭️  {filename}: no existe")
+            continue
+        with path.open("r", encoding="utf-8") as fh:
+            payload = json.load(fh)
+
+        target = repository_class(base_path=source, storage="sqlite", database=database)
+        if target.count() and not force:
+            print(f"  ⚠️  {filename}: la tabla ya tiene datos (usa --force para reemplazarlos)")
+            continue
+        records, metadata = extract(target, payload)
+        target.save(records, metadata)
+        imported[filename] = len(records)
+        print(f"  ✅ {filename}: {len(records)} registros")
+    return imported
+
+
+def main():
+    root = Path(__file__).parent.parent
+    parser = argparse.ArgumentParser(description="Importa los JSON de base_datos a SQLite")
+    parser.add_argument("--source", type=Path, default=root / "base_datos", help="Directorio con los JSON")
+    parser.add_argument("--database", type=Path, help="Base SQLite de destino (por defecto <source>/kybercore.db)")
+    parser.add_argument("--force", action="store_true", help="Reemplaza las tablas que ya tengan datos")
+    args = parser.parse_args()
+
+    source = args.source.resolve()
+    database = (args.database or source / "kybercore.db").resolve()
+    print(f"🗄️  Migrando {source} -> {database}")
+    imported = migrate(source, database, force=args.force)
+    print(f"🎉 {sum(imported.values())} registros importados en {len(imported)} tablas")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,7 @@ from src.controllers import fleet_controller, recommender_controller, analysis_c
 
 # Importar routers del sistema de pedidos
 from src.api.routers import customers, orders, production, metrics
+from src.services.http_clients import APISLICER_POOL, http_clients
 
 # Cargar variables de entorno desde .env
 env_path = Path(__file__).parent.parent.parent / '.env'
@@ -26,6 +27,14 @@ else:
 async def lifespan(app: FastAPI):
     # Startup
     print("🚀 Iniciando KyberCore...")
+    from src.services.fleet_service import fleet_service
+    from src.services.shared_state import shared_state
+    # Con varios workers solo el líder sondea la flota (caché, telemetría, índice de archivos);
+    # el resto replica su estado. En un único proceso arranca todo directamente
+    await shared_state.start(fleet_service)
+    # Expiración periódica de las sesiones abandonadas del wizard
+    from src.database.wizard_session_store import wizard_sessions
+    await wizard_sessions.start()
     yield
     # Shutdown
     print("🛑 Cerrando KyberCore...")
@@ -34,6 +43,7 @@ async def lifespan(app: FastAPI):
         from src.services.websocket_service import websocket_manager
         from src.services.realtime_monitor import realtime_monitor
         from src.services.fleet_service import fleet_service
+        from src.services.shared_state import shared_state
         
         # Detener monitoreo primero
         await realtime_monitor.cleanup()
@@ -41,8 +51,18 @@ async def lifespan(app: FastAPI):
         # Cerrar WebSocket manager
         await websocket_manager.shutdown()
         
-        # Limpiar fleet service
+        # Limpiar fleet service y después dejar el liderazgo (otro worker toma el relevo)
         await fleet_service.cleanup()
+        await shared_state.stop()
+        
+        # Cerrar los pools HTTP compartidos (Moonraker, APISLICER, subidas)
+        await http_clients.close()
+        
+        # Volcar a disco las escrituras JSON aún pendientes
+        from src.database.wizard_session_store import wizard_sessions
+        from src.database.write_behind import write_behind
+        await wizard_sessions.stop()
+        write_behind.close()
         
         print("✅ KyberCore cerrado limpiamente")
     except Exception as e:
@@ -132,21 +152,21 @@ async def proxy_to_slicer(request: Request, path: str):
     headers.pop('host', None)
 
     try:
-        async with aiohttp.ClientSession() as session:
-            # Forward the request
-            async with session.request(
-                method=request.method,
-                url=apislicer_url,
-                headers=headers,
-                data=await request.body(),
-                params=request.query_params
-            ) as response:
-                # Get response content
-                content = await response.read()
-                return Response(
-                    content=content,
-                    status_code=response.status,
-                    headers=dict(response.headers)
-                )
+        session = await http_clients.get_session(APISLICER_POOL)
+        # Forward the request
+        async with session.request(
+            method=request.method,
+            url=apislicer_url,
+            headers=headers,
+            data=await request.body(),
+            params=request.query_params
+        ) as response:
+            # Get response content
+            content = await response.read()
+            return Response(
+                content=content,
+                status_code=response.status,
+                headers=dict(response.headers)
+            )
     except Exception as e:
         return {"error": f"Error connecting to APISLICER: {str(e)}"}
\ No newline at end of file
@@ -6,6 +6,8 @@ Endpoints para obtención de métricas, KPIs y análisis del sistema.
 from fastapi import APIRouter, HTTPException, Query
 
 from src.services import MetricsService
+from src.database.wizard_session_store import wizard_sessions
+from src.database.write_behind import write_behind
 
 router = APIRouter(prefix="/api/metrics", tags=["metrics"])
 service = MetricsService()
@@ -60,6 +62,12 @@ async def get_performance_indicators():
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/storage")
+async def get_storage_metrics():
+    """Obtiene métricas de la escritura diferida de los archivos JSON y del almacén de sesiones."""
+    return {**write_behind.get_metrics(), "wizard_sessions": wizard_sessions.get_stats()}
+
+
 # Endpoints de IA (preparados para futura integración)
 @router.get("/predict-demand")
 async def predict_demand(
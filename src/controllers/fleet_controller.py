@@ -1,13 +1,22 @@
-from fastapi import APIRouter, Request, HTTPException, File, UploadFile, Form
+from fastapi import APIRouter, Request, HTTPException, File, UploadFile, Form, Query
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from src.services.fleet_service import FleetService
 from src.models.printer import Printer
 from src.schemas.printer import PrinterCreate
 from pydantic import BaseModel
 from typing import List, Optional
+import base64
+import json
+import time
+from urllib.parse import quote
 
 from src.services.fleet_service import fleet_service
+from src.services.circuit_breaker import host_health
+from src.services.moonraker_query_planner import query_planner
+from src.services.http_clients import http_clients
+from src.services.bulk_commands import BULK_COMMANDS
+from src.services.shared_state import shared_state
 
 # Schema para comandos de impresora
 class PrinterCommand(BaseModel):
@@ -23,6 +32,9 @@ class BulkCommand(BaseModel):
     printer_ids: Optional[List[str]] = None  # Si es None, aplica a todas las impresoras
     filters: Optional[dict] = None  # Filtros para seleccionar impresoras: {'status': ['printing', 'idle'], 'tags': ['production']}
     confirmation_required: bool = True  # Para comandos destructivos
+    deadline: Optional[float] = None  # Segundos de espera por impresora (por defecto FLEET_BULK_DEADLINE)
+    batch_size: Optional[int] = None  # Impresoras por oleada; 0 = todas a la vez (los reinicios se escalonan por defecto)
+    batch_interval: Optional[float] = None  # Segundos entre oleadas
     
 # Schema para respuesta de comandos masivos
 class BulkCommandResult(BaseModel):
@@ -98,6 +110,25 @@ def delete_printer(printer_id: str):
         raise HTTPException(status_code=404, detail="Impresora no encontrada")
     return {"ok": True}
 
+@router.get("/printers/{printer_id}/telemetry")
+async def get_printer_telemetry(
+    printer_id: str,
+    metric: Optional[str] = Query(None, description="Métricas separadas por comas (por defecto todas)"),
+    from_: Optional[float] = Query(None, alias="from", description="Inicio (epoch s); negativo = segundos hacia atrás"),
+    to: Optional[float] = Query(None, description="Fin (epoch s); por defecto ahora"),
+    step: Optional[float] = Query(None, gt=0, description="Resolución deseada en segundos"),
+):
+    """Histórico de temperaturas y progreso de una impresora, reducido a la resolución pedida."""
+    if printer_id not in fleet_service.printers:
+        raise HTTPException(status_code=404, detail="Impresora no encontrada")
+    end = to if to is not None else time.time()
+    start = end + from_ if from_ is not None and from_ < 0 else from_
+    metrics = [m.strip() for m in metric.split(",") if m.strip()] if metric else None
+    try:
+        return fleet_service.telemetry.query(printer_id, metrics=metrics, start=start, end=end, step=step)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # Endpoint para enviar comandos a impresoras
 @router.post("/printers/{printer_id}/command")
 async def send_printer_command(printer_id: str, command: PrinterCommand):
@@ -144,26 +175,15 @@ async def send_printer_command(printer_id: str, command: PrinterCommand):
 async def send_bulk_command(bulk_command: BulkCommand):
     """Envía un comando a múltiples impresoras simultáneamente."""
     try:
-        # Obtener lista de impresoras objetivo
-        target_printers = await fleet_service.get_target_printers(
-            printer_ids=bulk_command.printer_ids,
-            filters=bulk_command.filters
-        )
+        target_printers = await _resolve_bulk_targets(bulk_command)
         
-        if not target_printers:
-            raise HTTPException(status_code=400, detail="No se encontraron impresoras que cumplan los criterios")
-        
-        # Validar comando
-        valid_commands = ["home", "pause", "resume", "cancel", "restart_klipper", "restart_firmware"]
-        if bulk_command.command not in valid_commands:
-            raise HTTPException(status_code=400, detail=f"Comando no válido: {bulk_command.command}")
-        
-        # Ejecutar comando en paralelo en todas las impresoras
+        # Ejecutar comando en paralelo (concurrencia acotada y plazo por impresora)
         results = await fleet_service.execute_bulk_command(
             printers=target_printers,
             command=bulk_command.command,
             axis=bulk_command.axis,
-            parameters=bulk_command.parameters or {}
+            parameters=bulk_command.parameters or {},
+            **_bulk_options(bulk_command)
         )
         
         # Analizar resultados
@@ -185,6 +205,71 @@ async def send_bulk_command(bulk_command: BulkCommand):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error ejecutando comando masivo: {str(e)}")
 
+@router.post("/bulk/command/stream")
+async def stream_bulk_command(bulk_command: BulkCommand):
+    """Envía un comando a múltiples impresoras y transmite cada resultado por SSE según llega.
+
+    Eventos: ``start`` (impresoras y oleadas), ``result`` (una por impresora) y ``done`` (resumen).
+    """
+    target_printers = await _resolve_bulk_targets(bulk_command)
+    options = _bulk_options(bulk_command)
+    waves = fleet_service.bulk_engine.plan_waves(target_printers, bulk_command.command, options.get("batch_size"))
+
+    async def events():
+        yield _sse("start", {
+            "command": bulk_command.command,
+            "total_printers": len(target_printers),
+            "waves": [[printer.id for printer in wave] for wave in waves],
+        })
+        successful = failed = 0
+        async for result in fleet_service.bulk_engine.stream(
+            target_printers,
+            bulk_command.command,
+            axis=bulk_command.axis,
+            parameters=bulk_command.parameters or {},
+            **options
+        ):
+            if result["success"]:
+                successful += 1
+            else:
+                failed += 1
+            yield _sse("result", result)
+        yield _sse("done", {
+            "total_printers": len(target_printers),
+            "successful": successful,
+            "failed": failed,
+            "summary": f"Comando {bulk_command.command} ejecutado en {len(target_printers)} impresoras: {successful} exitosos, {failed} fallidos"
+        })
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _resolve_bulk_targets(bulk_command: BulkCommand):
+    """Impresoras objetivo de un comando masivo según el estado en memoria (sin sondear la flota)."""
+    if bulk_command.command not in BULK_COMMANDS:
+        raise HTTPException(status_code=400, detail=f"Comando no válido: {bulk_command.command}")
+    target_printers = await fleet_service.get_target_printers(
+        printer_ids=bulk_command.printer_ids,
+        filters=bulk_command.filters
+    )
+    if not target_printers:
+        raise HTTPException(status_code=400, detail="No se encontraron impresoras que cumplan los criterios")
+    return target_printers
+
+def _bulk_options(bulk_command: BulkCommand) -> dict:
+    options = {
+        "deadline": bulk_command.deadline,
+        "batch_size": bulk_command.batch_size,
+        "batch_interval": bulk_command.batch_interval,
+    }
+    return {key: value for key, value in options.items() if value is not None}
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
 # 🚀 NUEVO: Endpoint para obtener información de selección masiva
 @router.get("/bulk/selection-info")
 async def get_bulk_selection_info():
@@ -275,8 +360,60 @@ async def validate_bulk_command(bulk_command: BulkCommand):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error validando comando: {str(e)}")
 
+# Endpoint de diagnóstico de la caché de estado y del planificador de polling
+@router.get("/state/metrics")
+async def get_fleet_state_metrics():
+    """Devuelve el estado de las suscripciones, las métricas del planificador adaptativo,
+    la salud (circuit breaker) de cada host, los contadores del planificador de consultas,
+    el estado del índice de archivos G-code, de las descargas, de las distribuciones y de los
+    comandos masivos, la reutilización de conexiones y las colas de los pools HTTP compartidos,
+    y el rol de este worker (líder o réplica) en el estado compartido de la flota."""
+    metrics = fleet_service.state_cache.get_cache_status()
+    metrics["hosts"] = host_health.snapshot()
+    metrics["query_planner"] = query_planner.get_stats()
+    metrics["file_index"] = fleet_service.file_index.get_stats()
+    metrics["transfers"] = fleet_service.transfers.get_stats()
+    metrics["distributions"] = fleet_service.distributor.get_stats()
+    metrics["bulk_commands"] = fleet_service.bulk_engine.get_stats()
+    metrics["http_pools"] = http_clients.get_stats()
+    metrics["cluster"] = shared_state.get_status()
+    metrics["sharding"] = fleet_service.sharding.get_status()
+    return metrics
+
+# === REPARTO DE LA FLOTA ENTRE NODOS ===
+
+@router.get("/sharding")
+async def get_sharding_status():
+    """Nodos vivos del reparto, impresoras de cada uno y antigüedad de su último latido."""
+    fleet_service.sharding.refresh()
+    return fleet_service.sharding.get_status()
+
+@router.get("/sharding/printers")
+async def get_fleet_wide_printers():
+    """Vista de toda la flota compuesta con el estado que reporta el nodo dueño de cada impresora."""
+    return await fleet_service.sharding.aggregate()
+
+@router.get("/sharding/local")
+async def get_local_printers():
+    """Impresoras que monitoriza este nodo; la consultan los demás nodos para la vista global."""
+    return await fleet_service.sharding.local_view()
+
 # === ENDPOINTS PARA GESTIÓN DE ARCHIVOS G-CODE ===
 
+@router.get("/files/search")
+async def search_gcode_files(
+    filename: str = Query(..., min_length=1, description="Nombre del archivo G-code"),
+    exact: bool = Query(True, description="False para buscar por subcadena sin distinguir mayúsculas"),
+):
+    """Impresoras de la flota que tienen un archivo, respondido desde el índice en memoria."""
+    matches = fleet_service.file_index.find(filename, exact=exact)
+    return {
+        "filename": filename,
+        "printers": matches,
+        "total_printers": len(matches),
+        "indexed_printers": len(fleet_service.file_index.get_stats()["printers"])
+    }
+
 @router.get("/printers/{printer_id}/files")
 async def list_printer_gcode_files(printer_id: str):
     """Lista archivos G-code disponibles en una impresora específica."""
@@ -321,10 +458,8 @@ async def upload_gcode_file(
         if not file.filename.lower().endswith(('.gcode', '.g', '.gco')):
             raise HTTPException(status_code=400, detail="El archivo debe ser un G-code (.gcode, .g, .gco)")
         
-        # Leer el contenido del archivo
-        file_content = await file.read()
-        
-        result = await fleet_service.upload_gcode_to_printer(printer_id, file_content, file.filename, start_print)
+        # El archivo recibido ya está en disco (o en memoria si es pequeño): se envía en streaming
+        result = await fleet_service.upload_gcode_to_printer(printer_id, file.file, file.filename, start_print)
         if not result:
             raise HTTPException(status_code=500, detail="Error subiendo archivo")
         
@@ -332,7 +467,7 @@ async def upload_gcode_file(
             "success": True,
             "printer_id": printer_id,
             "filename": file.filename,
-            "size": len(file_content),
+            "size": file.size,
             "start_print": start_print,
             "result": result
         }
@@ -341,6 +476,51 @@ async def upload_gcode_file(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error subiendo archivo: {str(e)}")
 
+@router.post("/files/distributions")
+async def distribute_gcode_file(
+    file: UploadFile = File(...),
+    printer_ids: List[str] = Form(...),
+    start_print: bool = Form(False)
+):
+    """Envía un mismo G-code a varias impresoras en paralelo.
+
+    Responde en cuanto el archivo está en disco; el progreso por impresora se
+    consulta en ``/files/distributions/{distribution_id}``.
+    """
+    if not file.filename.lower().endswith(('.gcode', '.g', '.gco')):
+        raise HTTPException(status_code=400, detail="El archivo debe ser un G-code (.gcode, .g, .gco)")
+    # Admite tanto campos repetidos como una lista separada por comas
+    printer_ids = [pid.strip() for value in printer_ids for pid in value.split(",") if pid.strip()]
+    try:
+        return await fleet_service.distribute_gcode(file.file, file.filename, printer_ids, start_print)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@router.get("/files/distributions")
+async def list_gcode_distributions():
+    """Distribuciones recientes, de la más nueva a la más antigua."""
+    return {"distributions": fleet_service.distributor.list_distributions()}
+
+@router.get("/files/distributions/{distribution_id}")
+async def get_gcode_distribution(distribution_id: str):
+    """Progreso de una distribución, con bytes enviados y estado por impresora."""
+    try:
+        return fleet_service.distributor.get(distribution_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Distribución {distribution_id} no encontrada")
+
+@router.post("/files/distributions/{distribution_id}/retry")
+async def retry_gcode_distribution(distribution_id: str):
+    """Reintenta solo las impresoras en las que falló la subida."""
+    try:
+        return fleet_service.distributor.retry(distribution_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Distribución {distribution_id} no encontrada")
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
 @router.post("/printers/{printer_id}/files/{filename}/print")
 async def start_print_job(printer_id: str, filename: str):
     """Inicia la impresión de un archivo G-code específico."""
@@ -378,42 +558,98 @@ async def delete_gcode_file(printer_id: str, filename: str):
         raise HTTPException(status_code=500, detail=f"Error eliminando archivo: {str(e)}")
 
 @router.get("/printers/{printer_id}/files/{filename}/thumbnails")
-async def get_gcode_thumbnails(printer_id: str, filename: str):
-    """Obtiene thumbnails de un archivo G-code específico."""
+async def get_gcode_thumbnails(printer_id: str, filename: str, request: Request):
+    """Obtiene thumbnails de un archivo G-code específico.
+
+    La respuesta lleva un ETag por versión del archivo para que el navegador
+    revalide sin volver a descargar los PNG.
+    """
     try:
+        if printer_id in fleet_service.printers:
+            cache_key = await fleet_service.get_thumbnail_cache_key(printer_id, filename)
+            if cache_key and request.headers.get("if-none-match") == f'"{cache_key}"':
+                return Response(status_code=304, headers=_thumbnail_headers(cache_key))
+        
         result = await fleet_service.get_printer_gcode_thumbnails(printer_id, filename)
         thumbnails = result.get("thumbnails", [])
-        return {
-            "printer_id": printer_id,
-            "filename": filename,
-            "thumbnails": thumbnails,
-            "total_thumbnails": len(thumbnails)
-        }
+        cache_key = result.get("cache_key")
+        if cache_key:
+            base_url = quote(request.url.path.rstrip("/"))
+            thumbnails = [
+                {**thumbnail, "url": f"{base_url}/{index}?v={cache_key}"} if thumbnail.get("data") else thumbnail
+                for index, thumbnail in enumerate(thumbnails)
+            ]
+        return JSONResponse(
+            content={
+                "printer_id": printer_id,
+                "filename": filename,
+                "thumbnails": thumbnails,
+                "total_thumbnails": len(thumbnails)
+            },
+            headers=_thumbnail_headers(cache_key) if cache_key else None
+        )
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error obteniendo thumbnails: {str(e)}")
 
+@router.get("/printers/{printer_id}/files/{filename}/thumbnails/{index}")
+async def get_gcode_thumbnail_image(printer_id: str, filename: str, index: int, v: Optional[str] = None):
+    """Devuelve un thumbnail como PNG; con ``?v=<versión>`` la respuesta es inmutable."""
+    try:
+        result = await fleet_service.get_printer_gcode_thumbnails(printer_id, filename)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    thumbnails = result.get("thumbnails", [])
+    if index < 0 or index >= len(thumbnails) or not thumbnails[index].get("data"):
+        raise HTTPException(status_code=404, detail="Thumbnail no encontrado")
+    
+    cache_key = result.get("cache_key")
+    headers = _thumbnail_headers(cache_key) if cache_key else {"Cache-Control": "no-cache"}
+    if cache_key and v == cache_key:
+        headers["Cache-Control"] = "private, max-age=31536000, immutable"
+    return Response(
+        content=base64.b64decode(thumbnails[index]["data"]),
+        media_type="image/png",
+        headers=headers
+    )
+
+def _thumbnail_headers(cache_key: str) -> dict:
+    return {"ETag": f'"{cache_key}"', "Cache-Control": "private, max-age=60"}
+
 @router.get("/printers/{printer_id}/files/{filename}")
-async def download_gcode_file(printer_id: str, filename: str):
-    """Descarga un archivo G-code de una impresora específica."""
+async def download_gcode_file(printer_id: str, filename: str, request: Request):
+    """Descarga un archivo G-code de una impresora específica.
+
+    El archivo se transmite en streaming desde Moonraker; admite ``Range`` para reanudar.
+    """
     try:
-        from fastapi.responses import Response
-        
-        file_content = await fleet_service.download_printer_gcode_file(printer_id, filename)
-        
-        return Response(
-            content=file_content,
-            media_type="application/octet-stream",
-            headers={
-                "Content-Disposition": f"attachment; filename={filename}",
-                "Content-Type": "application/octet-stream"
-            }
+        download = await fleet_service.open_printer_gcode_download(
+            printer_id, filename, request.headers.get("range")
         )
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error descargando archivo: {str(e)}")
+    
+    if download.status not in (200, 206):
+        status, headers = download.status, download.headers
+        await download.aclose()
+        if status == 404:
+            raise HTTPException(status_code=404, detail=f"Archivo {filename} no encontrado")
+        if status == 416:
+            return Response(status_code=416, headers=headers)
+        raise HTTPException(status_code=502, detail=f"Error descargando archivo: HTTP {status}")
+    
+    return StreamingResponse(
+        download.iter_chunks(),
+        status_code=download.status,
+        media_type="application/octet-stream",
+        headers={
+            **download.headers,
+            "Content-Disposition": f"attachment; filename={filename}"
+        }
+    )
 
 # 🆕 FASE 1: Endpoint para validar estado detallado de impresora
 @router.get("/{printer_id}/status")
@@ -12,6 +12,8 @@ import tempfile
 import logging
 import uuid
 
+from src.database.write_behind import write_behind
+
 # Importar servicio de extracción de imágenes de PDFs
 from src.services.pdf_image_extractor import process_project_pdfs
 
@@ -27,8 +29,7 @@ def load_projects_data():
     """Cargar datos de proyectos desde el archivo JSON"""
     json_path = os.path.join(os.path.dirname(__file__), "..", "..", "base_datos", "proyectos.json")
     try:
-        with open(json_path, 'r', encoding='utf-8') as file:
-            return json.load(file)
+        return write_behind.load_json(json_path)
     except FileNotFoundError:
         # Datos por defecto si no existe el archivo
         return {
@@ -46,8 +47,8 @@ def save_projects_data(data):
     """Guardar datos de proyectos en el archivo JSON"""
     json_path = os.path.join(os.path.dirname(__file__), "..", "..", "base_datos", "proyectos.json")
     try:
-        with open(json_path, 'w', encoding='utf-8') as file:
-            json.dump(data, file, indent=2, ensure_ascii=False)
+        # Escritura diferida y atómica: una ráfaga de cambios se agrupa en una sola escritura
+        write_behind.dump_json(json_path, data)
         return True
     except Exception as e:
         print(f"Error guardando proyectos: {e}")
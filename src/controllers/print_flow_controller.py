@@ -16,12 +16,28 @@ import logging
 import aiohttp
 import asyncio
 from pathlib import Path
+from urllib.parse import urlsplit
+
+from src.services.moonraker_client import MoonrakerClient
+from src.services.fleet_service import fleet_service
+from src.services.print_dispatcher import PRIORITIES
+from src.services.http_clients import APISLICER_POOL, MOONRAKER_POOL, http_clients
+from src.database import JobHistoryRepository, PrintQueueRepository
+from src.database.write_behind import write_behind
+from src.database.wizard_session_store import wizard_sessions
 
 # Configurar logging
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Espera máxima (s) a que Klipper termine de reiniciar antes de enviar un trabajo
+PRINT_FLOW_READY_WAIT = float(os.getenv("PRINT_FLOW_READY_WAIT", "10"))
+
+# Cola de trabajos del wizard e historial (JSON o SQLite según STORAGE_BACKEND)
+print_queue_repository = PrintQueueRepository()
+job_history_repository = JobHistoryRepository()
+
 # ===============================
 # MODELOS DE DATOS
 # ===============================
@@ -75,8 +91,7 @@ def load_project_data(project_id: str) -> Dict:
     json_path = os.path.join(os.path.dirname(__file__), "..", "..", "base_datos", "proyectos.json")
     
     try:
-        with open(json_path, 'r', encoding='utf-8') as file:
-            data = json.load(file)
+        data = write_behind.load_json(json_path)
             
         for proyecto in data["proyectos"]:
             if str(proyecto["id"]) == str(project_id):
@@ -215,23 +230,8 @@ def load_printers_data() -> Dict:
 
 def save_wizard_session(session_id: str, session_data: Dict):
     """Guarda el estado de la sesión del wizard"""
-    sessions_path = os.path.join(os.path.dirname(__file__), "..", "..", "base_datos", "wizard_sessions.json")
-    
     try:
-        # Cargar sesiones existentes
-        with open(sessions_path, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-        
-        # Actualizar o crear sesión
-        data["sessions"][session_id] = {
-            **session_data,
-            "updated_at": datetime.now().isoformat()
-        }
-        
-        # Guardar de vuelta
-        with open(sessions_path, 'w', encoding='utf-8') as file:
-            json.dump(data, file, indent=2, ensure_ascii=False)
-            
+        wizard_sessions.save(session_id, session_data)
         logger.info(f"Sesión {session_id} guardada correctamente")
         return True
         
@@ -241,13 +241,8 @@ def save_wizard_session(session_id: str, session_data: Dict):
 
 def load_wizard_session(session_id: str) -> Dict:
     """Carga el estado de la sesión del wizard"""
-    sessions_path = os.path.join(os.path.dirname(__file__), "..", "..", "base_datos", "wizard_sessions.json")
-    
     try:
-        with open(sessions_path, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-        
-        return data["sessions"].get(session_id, {})
+        return wizard_sessions.load(session_id)
         
     except Exception as e:
         logger.error(f"Error cargando sesión {session_id}: {str(e)}")
@@ -255,27 +250,10 @@ def load_wizard_session(session_id: str) -> Dict:
 
 def save_job_to_queue(job_data: Dict):
     """Añade un trabajo a la cola de impresión"""
-    queue_path = os.path.join(os.path.dirname(__file__), "..", "..", "base_datos", "print_queue.json")
-    
     try:
-        # Cargar cola existente
-        with open(queue_path, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-        
-        # Asignar posición en la cola
-        job_data["queue_position"] = data["metadata"]["next_queue_position"]
-        job_data["queued_at"] = datetime.now().isoformat()
-        
-        # Añadir a la cola
-        data["queue"].append(job_data)
-        data["metadata"]["next_queue_position"] += 1
-        
-        # Guardar de vuelta
-        with open(queue_path, 'w', encoding='utf-8') as file:
-            json.dump(data, file, indent=2, ensure_ascii=False)
-            
-        logger.info(f"Trabajo {job_data.get('job_id')} añadido a la cola en posición {job_data['queue_position']}")
-        return job_data["queue_position"]
+        queue_position = print_queue_repository.enqueue(job_data)
+        logger.info(f"Trabajo {job_data.get('job_id')} añadido a la cola en posición {queue_position}")
+        return queue_position
         
     except Exception as e:
         logger.error(f"Error añadiendo trabajo a la cola: {str(e)}")
@@ -283,44 +261,8 @@ def save_job_to_queue(job_data: Dict):
 
 def update_job_history(job_data: Dict):
     """Actualiza el historial de trabajos"""
-    history_path = os.path.join(os.path.dirname(__file__), "..", "..", "base_datos", "historial_trabajos.json")
-    
     try:
-        with open(history_path, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-        
-        # Añadir al historial
-        if "trabajos" not in data:
-            data["trabajos"] = []
-            
-        data["trabajos"].append({
-            **job_data,
-            "completed_at": datetime.now().isoformat()
-        })
-        
-        # Actualizar estadísticas
-        if "estadisticas" not in data:
-            data["estadisticas"] = {
-                "trabajos_exitosos": 0,
-                "trabajos_con_advertencias": 0,
-                "trabajos_fallidos": 0,
-                "tasa_exito": 0.0
-            }
-            
-        # Incrementar contadores según el estado
-        if job_data.get("status") == "completed":
-            data["estadisticas"]["trabajos_exitosos"] += 1
-        elif job_data.get("status") == "failed":
-            data["estadisticas"]["trabajos_fallidos"] += 1
-            
-        # Recalcular tasa de éxito
-        total_jobs = len(data["trabajos"])
-        if total_jobs > 0:
-            data["estadisticas"]["tasa_exito"] = (data["estadisticas"]["trabajos_exitosos"] / total_jobs) * 100
-        
-        with open(history_path, 'w', encoding='utf-8') as file:
-            json.dump(data, file, indent=2, ensure_ascii=False)
-            
+        job_history_repository.record_job(job_data)
         logger.info(f"Historial actualizado para trabajo {job_data.get('job_id')}")
         return True
         
@@ -1407,13 +1349,12 @@ def find_stl_file_path(project_or_filename, filename_or_session=None):
         from pathlib import Path
         proyectos_path = Path("/app/base_datos/proyectos.json")
         
-        if not proyectos_path.exists():
+        if not write_behind.exists(proyectos_path):
             logger.warning(f"⚠️  No se encontró base de datos de proyectos")
             return None
         
         try:
-            with open(proyectos_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            data = write_behind.load_json(proyectos_path)
             
             # Extraer la lista de proyectos del JSON (estructura: {estadisticas: {...}, proyectos: [...]})
             proyectos = data.get('proyectos', [])
@@ -1463,18 +1404,18 @@ async def process_single_stl(filename, file_path, config, session_id=None):
             
             apislicer_url = "http://apislicer:8000/generate-profile"
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(apislicer_url, json=profile_request, timeout=30) as response:
-                    if response.status == 200:
-                        profile_result = await response.json()
-                        if profile_result.get('success'):
-                            logger.info(f"Perfil personalizado generado: {profile_result['profile_name']}")
-                        else:
-                            logger.warning(f"Error generando perfil personalizado: {profile_result}")
-                            # Continuar con perfil base
+            session = await http_clients.get_session(APISLICER_POOL)
+            async with session.post(apislicer_url, json=profile_request, timeout=30) as response:
+                if response.status == 200:
+                    profile_result = await response.json()
+                    if profile_result.get('success'):
+                        logger.info(f"Perfil personalizado generado: {profile_result['profile_name']}")
                     else:
-                        logger.error(f"Error en generación de perfil: {response.status}")
+                        logger.warning(f"Error generando perfil personalizado: {profile_result}")
                         # Continuar con perfil base
+                else:
+                    logger.error(f"Error en generación de perfil: {response.status}")
+                    # Continuar con perfil base
         
         # Preparar datos para APISLICER
         data = aiohttp.FormData()
@@ -1512,48 +1453,48 @@ async def process_single_stl(filename, file_path, config, session_id=None):
         # URL de APISLICER (comunicación entre contenedores Docker)
         apislicer_url = "http://apislicer:8000/slice"
         
-        # Enviar a APISLICER
-        async with aiohttp.ClientSession() as session:
-            async with session.post(apislicer_url, data=data, timeout=60) as response:
-                if response.status == 200:
-                    # APISLICER devuelve directamente el archivo G-code
-                    gcode_content = await response.read()
-                    
-                    # Generar path para guardar el G-code (incluir session_id para filtrado)
-                    gcode_filename = filename.replace('.stl', '.gcode')
-                    if session_id:
-                        gcode_path = f"/tmp/kybercore_gcode_{session_id}_{gcode_filename}"
-                    else:
-                        gcode_path = f"/tmp/kybercore_gcode_{uuid.uuid4()}_{gcode_filename}"
-                    
-                    # Guardar el G-code devuelto
-                    try:
-                        with open(gcode_path, 'wb') as f:
-                            f.write(gcode_content)
-                        logger.info(f"G-code guardado: {gcode_path}")
-                    except Exception as e:
-                        logger.error(f"Error guardando G-code: {str(e)}")
-                        return create_mock_processing_result(filename, "error", f"Error guardando G-code: {str(e)}")
-                    
-                    # Estimar tiempo y otros parámetros del G-code
-                    estimated_stats = analyze_gcode_file(gcode_content)
-                    
-                    return {
-                        "filename": filename,
-                        "status": "success",
-                        "gcode_path": gcode_path,
-                        "gcode_size_bytes": len(gcode_content),
-                        "estimated_time_minutes": estimated_stats.get("time_minutes", 45),
-                        "layer_count": estimated_stats.get("layers", 200),
-                        "filament_used_grams": estimated_stats.get("filament_grams", 12.5),
-                        "processing_time_seconds": 15,  # Tiempo real de procesamiento
-                        "profile_used": profile_job_id if profile_job_id else config.get('printer_profile', 'ender3')
-                    }
+        # Enviar a APISLICER (conexión reutilizada del pool compartido)
+        session = await http_clients.get_session(APISLICER_POOL)
+        async with session.post(apislicer_url, data=data, timeout=60) as response:
+            if response.status == 200:
+                # APISLICER devuelve directamente el archivo G-code
+                gcode_content = await response.read()
+                
+                # Generar path para guardar el G-code (incluir session_id para filtrado)
+                gcode_filename = filename.replace('.stl', '.gcode')
+                if session_id:
+                    gcode_path = f"/tmp/kybercore_gcode_{session_id}_{gcode_filename}"
                 else:
-                    error_text = await response.text()
-                    logger.error(f"Error en APISLICER: {response.status} - {error_text}")
-                    return create_mock_processing_result(filename, "error", f"APISLICER error: {response.status}")
-                    
+                    gcode_path = f"/tmp/kybercore_gcode_{uuid.uuid4()}_{gcode_filename}"
+                
+                # Guardar el G-code devuelto
+                try:
+                    with open(gcode_path, 'wb') as f:
+                        f.write(gcode_content)
+                    logger.info(f"G-code guardado: {gcode_path}")
+                except Exception as e:
+                    logger.error(f"Error guardando G-code: {str(e)}")
+                    return create_mock_processing_result(filename, "error", f"Error guardando G-code: {str(e)}")
+                
+                # Estimar tiempo y otros parámetros del G-code
+                estimated_stats = analyze_gcode_file(gcode_content)
+                
+                return {
+                    "filename": filename,
+                    "status": "success",
+                    "gcode_path": gcode_path,
+                    "gcode_size_bytes": len(gcode_content),
+                    "estimated_time_minutes": estimated_stats.get("time_minutes", 45),
+                    "layer_count": estimated_stats.get("layers", 200),
+                    "filament_used_grams": estimated_stats.get("filament_grams", 12.5),
+                    "processing_time_seconds": 15,  # Tiempo real de procesamiento
+                    "profile_used": profile_job_id if profile_job_id else config.get('printer_profile', 'ender3')
+                }
+            else:
+                error_text = await response.text()
+                logger.error(f"Error en APISLICER: {response.status} - {error_text}")
+                return create_mock_processing_result(filename, "error", f"APISLICER error: {response.status}")
+                
     except asyncio.TimeoutError:
         logger.error(f"Timeout procesando {filename}")
         return create_mock_processing_result(filename, "error", "Timeout en APISLICER")
@@ -1954,18 +1895,6 @@ async def send_job_to_printer(job_id, settings):
         
         logger.info(f"Enviando trabajo {job_id} a impresora {printer_id} en {moonraker_url}")
         
-        # Verificar que la impresora esté disponible
-        printer_status = await check_printer_status(moonraker_url)
-        if not printer_status.get("success"):
-            logger.warning(f"Impresora no disponible: {printer_status.get('error')}")
-            return {
-                "success": False, 
-                "error": f"Impresora no disponible: {printer_status.get('error', 'Error desconocido')}",
-                "status_code": printer_status.get("status_code", 500)
-            }
-        
-        logger.info(f"✅ Impresora {printer_id} verificada y lista")
-        
         # Obtener archivos G-code generados de la sesión
         stl_processing = session_data.get("stl_processing", {})
         
@@ -1980,38 +1909,56 @@ async def send_job_to_printer(job_id, settings):
             logger.error("❌ No hay archivos G-code para enviar")
             return {"success": False, "error": "No hay archivos G-code para enviar"}
         
+        valid_files = [
+            file_info for file_info in processed_files
+            # Verificar si es el nuevo formato (con "success") o el viejo (con "status")
+            if (file_info.get("success") == True or file_info.get("status") == "success")
+            and file_info.get("gcode_path")
+        ]
+        
+        # Verificar que la impresora esté disponible
+        printer_status = await check_printer_status(moonraker_url, printer_id)
+        if printer_status.get("busy") and valid_files:
+            # Impresora ocupada: el despachador arrancará el trabajo en cuanto quede libre
+            return enqueue_job_for_printer(job_id, printer_id, valid_files, settings)
+        if not printer_status.get("success"):
+            logger.warning(f"Impresora no disponible: {printer_status.get('error')}")
+            return {
+                "success": False, 
+                "error": f"Impresora no disponible: {printer_status.get('error', 'Error desconocido')}",
+                "status_code": printer_status.get("status_code", 500)
+            }
+        
+        logger.info(f"✅ Impresora {printer_id} verificada y lista")
+        
         # 📤 NUEVO: Subir TODOS los archivos G-code válidos a la impresora
         uploaded_files = []
         failed_uploads = []
         
-        for file_info in processed_files:
-            # Verificar si es el nuevo formato (con "success") o el viejo (con "status")
-            is_success = file_info.get("success") == True or file_info.get("status") == "success"
-            
-            if is_success and file_info.get("gcode_path"):
-                filename = file_info.get('filename', 'unknown')
-                logger.info(f"📤 Subiendo archivo: {filename}")
-                
-                upload_result = await upload_gcode_to_printer(
-                    moonraker_url, 
-                    file_info["gcode_path"], 
-                    job_id
-                )
-                
-                if upload_result.get("success"):
-                    uploaded_files.append({
-                        "original_filename": filename,
-                        "gcode_filename": upload_result["filename"],
-                        "gcode_path": file_info["gcode_path"],
-                        "file_info": file_info
-                    })
-                    logger.info(f"✅ Archivo subido: {upload_result['filename']}")
-                else:
-                    failed_uploads.append({
-                        "filename": filename,
-                        "error": upload_result.get("error")
-                    })
-                    logger.warning(f"⚠️ Error subiendo {filename}: {upload_result.get('error')}")
+        logger.info(f"📤 Subiendo {len(valid_files)} archivo(s) en paralelo")
+        
+        # Las subidas van en streaming y en paralelo; la cola global del distribuidor limita la concurrencia
+        upload_results = await asyncio.gather(*(
+            upload_gcode_to_printer(printer_id, file_info["gcode_path"], job_id)
+            for file_info in valid_files
+        ))
+        
+        for file_info, upload_result in zip(valid_files, upload_results):
+            filename = file_info.get('filename', 'unknown')
+            if upload_result.get("success"):
+                uploaded_files.append({
+                    "original_filename": filename,
+                    "gcode_filename": upload_result["filename"],
+                    "gcode_path": file_info["gcode_path"],
+                    "file_info": file_info
+                })
+                logger.info(f"✅ Archivo subido: {upload_result['filename']}")
+            else:
+                failed_uploads.append({
+                    "filename": filename,
+                    "error": upload_result.get("error")
+                })
+                logger.warning(f"⚠️ Error subiendo {filename}: {upload_result.get('error')}")
         
         if not uploaded_files:
             logger.error("❌ No se pudo subir ningún archivo G-code")
@@ -2035,6 +1982,15 @@ async def send_job_to_printer(job_id, settings):
         
         logger.info(f"✅ Impresión iniciada exitosamente en {printer_id}")
         
+        # El despachador arranca los archivos restantes a medida que termine cada uno
+        fleet_service.dispatcher.track(
+            job_id,
+            printer_id,
+            [f["gcode_filename"] for f in uploaded_files],
+            priority=settings.get("priority", "normal"),
+            metadata={"session_id": job_id},
+        )
+        
         # Guardar información del trabajo en la cola (incluyendo TODOS los archivos)
         queue_position = save_job_to_queue({
             "job_id": job_id,
@@ -2069,89 +2025,117 @@ async def send_job_to_printer(job_id, settings):
         logger.error(f"Error enviando trabajo a impresora: {str(e)}")
         return {"success": False, "error": str(e)}
 
-async def check_printer_status(moonraker_url: str):
-    """Verifica que la impresora esté disponible y lista para recibir trabajos"""
+def enqueue_job_for_printer(job_id: str, printer_id: str, valid_files: List[Dict], settings: Dict):
+    """Deja el trabajo en la cola del despachador hasta que la impresora quede libre"""
+    priority = settings.get("priority", "normal")
+    job = fleet_service.dispatcher.enqueue(
+        [
+            {
+                "gcode_path": file_info["gcode_path"],
+                "filename": f"kybercore_{job_id}_{os.path.basename(file_info['gcode_path'])}"
+            }
+            for file_info in valid_files
+        ],
+        job_id=job_id,
+        printer_ids=[printer_id],
+        priority=priority if priority in PRIORITIES else "normal",
+        due=settings.get("due_date"),
+        metadata={"session_id": job_id},
+    )
+    queued_ids = [queued["job_id"] for queued in fleet_service.dispatcher.get_queue()["queued"]]
+    queue_position = queued_ids.index(job["job_id"]) + 1 if job["job_id"] in queued_ids else None
+    logger.info(f"⏳ Impresora {printer_id} ocupada: trabajo {job_id} en cola (posición {queue_position})")
+    
+    return {
+        "success": True,
+        "queued": True,
+        "printer_job_id": f"printer_{job_id}",
+        "message": f"Impresora ocupada. Trabajo en cola con {len(valid_files)} archivo(s); se iniciará al quedar libre",
+        "printer_id": printer_id,
+        "queue_position": queue_position,
+        "pending_files": [entry["filename"] for entry in job["files"]],
+        "failed_uploads": []
+    }
+
+async def check_printer_status(moonraker_url: str, printer_id: str = None):
+    """Verifica que la impresora esté disponible y lista para recibir trabajos.
+
+    Con ``printer_id`` se usa el snapshot vigente de la caché de la flota; si
+    Klipper está reiniciando se espera hasta ``PRINT_FLOW_READY_WAIT`` segundos
+    a que termine, resolviendo con la propia notificación de estado.
+    """
+    cache = fleet_service.state_cache
+    if printer_id and cache.is_fresh(printer_id, fleet_service.snapshot_max_age):
+        if cache.get_state(printer_id) == "startup":
+            await fleet_service.wait_for(
+                printer_id,
+                lambda status, meta: status.get("webhooks", {}).get("state") != "startup" or bool(meta.get("error_status")),
+                timeout=PRINT_FLOW_READY_WAIT,
+            )
+        if cache.is_fresh(printer_id, fleet_service.snapshot_max_age):
+            return _printer_readiness(cache.get_status(printer_id))
+
     try:
-        async with aiohttp.ClientSession() as session:
-            # Verificar conexión con Moonraker y estado de Klippy
-            async with session.get(f"{moonraker_url}/printer/info", timeout=10) as response:
-                if response.status == 503:
-                    # Klippy no está conectado
-                    error_data = await response.json()
-                    error_msg = error_data.get('error', {}).get('message', 'Klippy Host not connected')
-                    return {
-                        "success": False, 
-                        "error": f"Klipper no está conectado: {error_msg}",
-                        "status_code": 503
-                    }
-                elif response.status != 200:
-                    return {
-                        "success": False, 
-                        "error": f"Error conectando con Moonraker: HTTP {response.status}",
-                        "status_code": response.status
-                    }
-                
-                info = await response.json()
-                result = info.get("result", {})
-                printer_state = result.get("state", "")
-                
-                # Verificar que Klipper esté en estado "ready"
-                if printer_state != "ready":
-                    return {
-                        "success": False,
-                        "error": f"Impresora no está lista (estado: {printer_state})",
-                        "state": printer_state
-                    }
-                
-            # Verificar estado de la impresión
-            async with session.get(f"{moonraker_url}/printer/objects/query?print_stats", timeout=10) as response:
-                if response.status != 200:
-                    return {"success": False, "error": "No se pudo obtener estado de impresión"}
-                
-                status_data = await response.json()
-                print_stats = status_data.get("result", {}).get("status", {}).get("print_stats", {})
-                state = print_stats.get("state", "")
-                
-                if state in ["printing", "paused"]:
-                    return {"success": False, "error": f"Impresora ocupada (estado: {state})"}
-                
-                return {
-                    "success": True, 
-                    "state": state,
-                    "printer_state": printer_state,
-                    "info": result
-                }
-                
+        parsed = urlsplit(moonraker_url)
+        session = await http_clients.get_session(MOONRAKER_POOL)
+        client = MoonrakerClient(parsed.hostname, parsed.port or 80, session)
+        # Estado de Klippy y de la impresión en una sola consulta compartida
+        status_data = await client.query_objects(["webhooks", "print_stats"])
+        if not status_data or "result" not in status_data:
+            return {
+                "success": False,
+                "error": "Error conectando con Moonraker: la impresora no responde o Klipper no está conectado",
+                "status_code": 503
+            }
+        return _printer_readiness(status_data["result"].get("status", {}))
+            
     except asyncio.TimeoutError:
         return {"success": False, "error": "Timeout conectando con la impresora"}
     except Exception as e:
         return {"success": False, "error": f"Error verificando estado: {str(e)}"}
 
-async def upload_gcode_to_printer(moonraker_url: str, gcode_path: str, job_id: str):
-    """Sube el archivo G-code a la impresora"""
+def _printer_readiness(status: Dict[str, Any]):
+    """Evalúa los objetos ``webhooks`` y ``print_stats`` de Klipper para aceptar un trabajo"""
+    webhooks = status.get("webhooks", {})
+    printer_state = webhooks.get("state", "")
+    
+    # Verificar que Klipper esté en estado "ready"
+    if printer_state != "ready":
+        return {
+            "success": False,
+            "error": f"Impresora no está lista (estado: {printer_state})",
+            "state": printer_state
+        }
+    
+    state = status.get("print_stats", {}).get("state", "")
+    if state in ["printing", "paused"]:
+        return {"success": False, "busy": True, "error": f"Impresora ocupada (estado: {state})"}
+    
+    return {
+        "success": True, 
+        "state": state,
+        "printer_state": printer_state,
+        "info": webhooks
+    }
+
+async def upload_gcode_to_printer(printer_id: str, gcode_path: str, job_id: str):
+    """Sube el archivo G-code a la impresora en streaming desde disco"""
     try:
         if not os.path.exists(gcode_path):
             return {"success": False, "error": f"Archivo G-code no encontrado: {gcode_path}"}
         
         filename = f"kybercore_{job_id}_{os.path.basename(gcode_path)}"
+        distribution = await fleet_service.distributor.distribute(gcode_path, [printer_id], filename=filename)
+        target = distribution["targets"][printer_id]
+        if target["state"] != "completed":
+            return {"success": False, "error": f"Error subiendo archivo: {target['error']}"}
         
-        async with aiohttp.ClientSession() as session:
-            with open(gcode_path, 'rb') as f:
-                data = aiohttp.FormData()
-                data.add_field('file', f, filename=filename, content_type='text/plain')
-                data.add_field('root', 'gcodes')  # Directorio de destino en la impresora
-                
-                async with session.post(f"{moonraker_url}/server/files/upload", data=data, timeout=30) as response:
-                    if response.status != 201:
-                        error_text = await response.text()
-                        return {"success": False, "error": f"Error subiendo archivo: HTTP {response.status} - {error_text}"}
-                    
-                    result = await response.json()
-                    return {
-                        "success": True,
-                        "filename": filename,
-                        "path": result.get("result", {}).get("path", filename)
-                    }
+        return {
+            "success": True,
+            "filename": filename,
+            "path": target["path"] or filename,
+            "distribution_id": distribution["id"]
+        }
                     
     except Exception as e:
         return {"success": False, "error": f"Error en upload: {str(e)}"}
@@ -2159,23 +2143,23 @@ async def upload_gcode_to_printer(moonraker_url: str, gcode_path: str, job_id: s
 async def start_print_job(moonraker_url: str, filename: str):
     """Inicia la impresión del archivo G-code"""
     try:
-        async with aiohttp.ClientSession() as session:
-            # Comando para iniciar impresión
-            print_data = {
-                "filename": filename
+        session = await http_clients.get_session(MOONRAKER_POOL)
+        # Comando para iniciar impresión
+        print_data = {
+            "filename": filename
+        }
+        
+        async with session.post(f"{moonraker_url}/printer/print/start", json=print_data, timeout=10) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                return {"success": False, "error": f"Error iniciando impresión: HTTP {response.status} - {error_text}"}
+            
+            result = await response.json()
+            return {
+                "success": True,
+                "result": result.get("result", {})
             }
             
-            async with session.post(f"{moonraker_url}/printer/print/start", json=print_data, timeout=10) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    return {"success": False, "error": f"Error iniciando impresión: HTTP {response.status} - {error_text}"}
-                
-                result = await response.json()
-                return {
-                    "success": True,
-                    "result": result.get("result", {})
-                }
-                
     except Exception as e:
         return {"success": False, "error": f"Error iniciando impresión: {str(e)}"}
 
@@ -2263,6 +2247,31 @@ async def get_job_status(job_id: str):
         logger.error(f"Error obteniendo estado del trabajo {job_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
 
+@router.get("/print/queue")
+async def get_print_queue():
+    """
+    Cola del despachador: trabajos en espera (en orden de salida), en curso y finalizados.
+    """
+    return JSONResponse(content={"success": True, **fleet_service.dispatcher.get_queue()})
+
+@router.post("/print/queue/{job_id}/cancel")
+async def cancel_queued_job(job_id: str):
+    """
+    Cancela un trabajo de la cola. Si ya está imprimiendo, termina el archivo en curso pero no arranca los siguientes.
+    """
+    try:
+        job = fleet_service.dispatcher.cancel(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Trabajo {job_id} no encontrado en la cola")
+    return JSONResponse(content={"success": True, "job": job})
+
+@router.get("/print/dispatcher/metrics")
+async def get_dispatcher_metrics():
+    """
+    Tiempo ocioso y ocupado de cada impresora, utilización de la flota y latencia de despacho.
+    """
+    return JSONResponse(content={"success": True, "metrics": fleet_service.dispatcher.get_metrics()})
+
 def get_available_actions(status):
     """Obtiene las acciones disponibles según el estado del trabajo"""
     actions = {
@@ -8,14 +8,13 @@ from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse
 from typing import List, Dict, Any, Optional
 from ..services.production_service import ProductionService
-from ..services.fleet_service import FleetService
+from ..services.fleet_service import fleet_service
 from ..services.consumable_service import ConsumableService
 from ..models.order_models import ProductionBatch, BatchStatus, ProductionBatchCreate
 
 
 router = APIRouter()
 production_service = ProductionService()
-fleet_service = FleetService()
 consumable_service = ConsumableService()
 templates = Jinja2Templates(directory="src/web/templates")
 
@@ -2,11 +2,10 @@ from fastapi import APIRouter, HTTPException, Request
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse
 from src.services.recommender_service import RecommenderService
-from src.services.fleet_service import FleetService
+from src.services.fleet_service import fleet_service # Usamos este servicio para obtener los datos de las impresoras y filamentos
 
 router = APIRouter()
 recommender_service = RecommenderService()
-fleet_service = FleetService() # Usamos este servicio para obtener los datos de las impresoras y filamentos
 templates = Jinja2Templates(directory="src/web/templates")
 
 @router.get("/get_profile")
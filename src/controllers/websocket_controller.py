@@ -1,6 +1,8 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from src.services.websocket_service import websocket_manager
 from src.services.realtime_monitor import realtime_monitor
+from src.services.fleet_service import fleet_service
+from src.services.bulk_commands import BULK_COMMANDS
 import json
 import logging
 import asyncio
@@ -8,6 +10,9 @@ import asyncio
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# Comandos masivos lanzados por WebSocket que siguen transmitiendo resultados
+_bulk_tasks = set()
+
 @router.websocket("/ws/fleet")
 async def websocket_fleet_endpoint(websocket: WebSocket):
     """Endpoint WebSocket principal para monitoreo de flota con gestión mejorada"""
@@ -25,14 +30,7 @@ async def websocket_fleet_endpoint(websocket: WebSocket):
         if not realtime_monitor.monitoring and websocket_manager.get_connection_count() > 0:
             await realtime_monitor.start_monitoring()
         
-        # Enviar estado inicial con timeout
-        try:
-            await asyncio.wait_for(
-                realtime_monitor.force_update_all(),
-                timeout=10.0
-            )
-        except asyncio.TimeoutError:
-            logger.warning(f"Timeout enviando estado inicial a {client_id}")
+        # El estado inicial se envía como snapshot al suscribirse (subscribe_all / subscribe_printer)
         
         # Loop de manejo de mensajes del cliente
         while True:
@@ -105,6 +103,7 @@ async def handle_client_message(websocket: WebSocket, message: dict):
                     'type': 'subscription_confirmed',
                     'printer_id': printer_id
                 }, websocket)
+                await send_fleet_snapshot(websocket, [printer_id])
         
         elif message_type == 'unsubscribe_printer':
             printer_id = message.get('printer_id')
@@ -117,20 +116,21 @@ async def handle_client_message(websocket: WebSocket, message: dict):
         
         elif message_type == 'subscribe_all':
             # Suscribir a todas las impresoras disponibles con timeout
-            from src.services.fleet_service import fleet_service
-            
             try:
-                printers = await asyncio.wait_for(
-                    fleet_service.list_printers(),
-                    timeout=8.0
-                )
+                snapshot = await realtime_monitor.get_snapshot()
                 
-                for printer in printers:
-                    await websocket_manager.subscribe_to_printer(websocket, printer.id)
+                for printer in snapshot:
+                    await websocket_manager.subscribe_to_printer(websocket, printer['id'])
                 
                 await websocket_manager.send_personal_message({
                     'type': 'subscription_all_confirmed',
-                    'printer_count': len(printers)
+                    'printer_count': len(snapshot)
+                }, websocket)
+                
+                # Primera suscripción: estado completo, después solo deltas
+                await websocket_manager.send_personal_message({
+                    'type': 'fleet_snapshot',
+                    'printers': snapshot
                 }, websocket)
                 
             except asyncio.TimeoutError:
@@ -139,6 +139,12 @@ async def handle_client_message(websocket: WebSocket, message: dict):
                     'message': 'Timeout obteniendo lista de impresoras'
                 }, websocket)
         
+        elif message_type == 'resync':
+            # El cliente detectó un hueco en la secuencia de deltas
+            subscribed = websocket_manager.connection_metadata.get(websocket, {}).get('subscriptions', set())
+            requested = message.get('printer_ids') or list(subscribed)
+            await send_fleet_snapshot(websocket, [p for p in requested if p in subscribed])
+        
         elif message_type == 'ping':
             # Responder con pong para mantener conexión viva
             await websocket_manager.send_personal_message({
@@ -147,25 +153,8 @@ async def handle_client_message(websocket: WebSocket, message: dict):
         
         elif message_type == 'get_initial_data':
             # Enviar datos iniciales de la flota
-            from src.services.fleet_service import fleet_service
             try:
-                printers = await asyncio.wait_for(
-                    fleet_service.list_printers(),
-                    timeout=8.0
-                )
-                printers_data = []
-                for printer in printers:
-                    printer_dict = {
-                        'id': printer.id,
-                        'name': printer.name,
-                        'model': printer.model,
-                        'ip': printer.ip,
-                        'status': printer.status,
-                        'capabilities': printer.capabilities,
-                        'location': printer.location,
-                        'realtime_data': printer.realtime_data
-                    }
-                    printers_data.append(printer_dict)
+                printers_data = await realtime_monitor.get_snapshot()
                 if not printers_data:
                     await websocket_manager.send_personal_message({
                         'type': 'info',  # Cambiado de error a info
@@ -184,6 +173,12 @@ async def handle_client_message(websocket: WebSocket, message: dict):
                 'type': 'info',
                 'message': f'Tipo de mensaje desconocido: {message_type}'
             }, websocket)
+        elif message_type == 'bulk_command':
+            # Los resultados se envían según responde cada impresora sin bloquear este bucle
+            task = asyncio.create_task(run_bulk_command(websocket, message))
+            _bulk_tasks.add(task)
+            task.add_done_callback(_bulk_tasks.discard)
+        
         elif message_type == 'get_status':
             # Enviar estado del monitoreo
             status = realtime_monitor.get_monitoring_status()
@@ -205,6 +200,70 @@ async def handle_client_message(websocket: WebSocket, message: dict):
             'message': f'Error procesando mensaje: {str(e)}'
         }, websocket)
 
+async def run_bulk_command(websocket: WebSocket, message: dict):
+    """Ejecuta un comando masivo y envía al cliente un ``bulk_command_result`` por impresora"""
+    request_id = message.get('request_id')
+    command = message.get('command')
+    if command not in BULK_COMMANDS:
+        await websocket_manager.send_personal_message({
+            'type': 'error',
+            'request_id': request_id,
+            'message': f'Comando no válido: {command}'
+        }, websocket)
+        return
+    
+    try:
+        printers = await fleet_service.get_target_printers(
+            printer_ids=message.get('printer_ids'),
+            filters=message.get('filters')
+        )
+        successful = 0
+        async for result in fleet_service.bulk_engine.stream(
+            printers,
+            command,
+            axis=message.get('axis'),
+            parameters=message.get('parameters') or {},
+            deadline=message.get('deadline'),
+            batch_size=message.get('batch_size'),
+            batch_interval=message.get('batch_interval')
+        ):
+            successful += result['success']
+            await websocket_manager.send_personal_message({
+                'type': 'bulk_command_result',
+                'request_id': request_id,
+                'command': command,
+                'result': result
+            }, websocket)
+        await websocket_manager.send_personal_message({
+            'type': 'bulk_command_done',
+            'request_id': request_id,
+            'command': command,
+            'total_printers': len(printers),
+            'successful': successful,
+            'failed': len(printers) - successful
+        }, websocket)
+    except Exception as e:
+        logger.error(f"Error en comando masivo {command}: {e}")
+        await websocket_manager.send_personal_message({
+            'type': 'error',
+            'request_id': request_id,
+            'message': f'Error ejecutando comando masivo: {str(e)}'
+        }, websocket)
+
+async def send_fleet_snapshot(websocket: WebSocket, printer_ids):
+    """Envía el estado completo (con número de secuencia) de las impresoras indicadas"""
+    if not printer_ids:
+        return
+    try:
+        snapshot = await realtime_monitor.get_snapshot(printer_ids)
+    except asyncio.TimeoutError:
+        logger.warning("Timeout obteniendo snapshot de impresoras")
+        return
+    await websocket_manager.send_personal_message({
+        'type': 'fleet_snapshot',
+        'printers': snapshot
+    }, websocket)
+
 @router.get("/ws/status")
 async def get_websocket_status():
     """Endpoint REST para obtener estado de WebSockets"""
@@ -215,7 +274,8 @@ async def get_websocket_status():
             'printer_subscriptions': {
                 printer_id: len(subscribers) 
                 for printer_id, subscribers in websocket_manager.printer_subscriptions.items()
-            }
+            },
+            'send_queues': websocket_manager.get_queue_metrics()
         }
     except Exception as e:
         logger.error(f"Error obteniendo estado WebSocket: {e}")
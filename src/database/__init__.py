@@ -3,11 +3,15 @@
 from .customers_repository import CustomersRepository
 from .orders_repository import OrdersRepository
 from .production_repository import ProductionRepository
+from .print_queue_repository import PrintQueueRepository
+from .job_history_repository import JobHistoryRepository
 from .json_repository import JSONRepositoryError
 
 __all__ = [
     "CustomersRepository",
     "OrdersRepository",
     "ProductionRepository",
+    "PrintQueueRepository",
+    "JobHistoryRepository",
     "JSONRepositoryError",
 ]
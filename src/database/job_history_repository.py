@@ -0,0 +1,54 @@
+"""Repositorio especializado para el historial de trabajos."""
+
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Any, Dict, List
+
+from .json_repository import BaseJSONRepository
+
+
+class JobHistoryRepository(BaseJSONRepository):
+    _key_fields = ("id", "job_id")
+    _index_fields = ("status",)
+    _date_fields = ("completed_at",)
+    # La sección de metadata son las estadísticas agregadas: sin ``last_updated``
+    _stamp_last_updated = False
+
+    # Contador de ``estadisticas`` que corresponde a cada estado final
+    _STATUS_COUNTERS = {"completed": "trabajos_exitosos", "failed": "trabajos_fallidos"}
+
+    def __init__(self, **options: Any) -> None:
+        # Las estadísticas agregadas viven en la sección de metadata del archivo
+        super().__init__(
+            filename="historial_trabajos.json", data_key="trabajos", metadata_key="estadisticas", **options
+        )
+
+    def list_jobs(self) -> List[Dict]:
+        return self.load().get("trabajos", [])
+
+    def record_job(self, job: Dict) -> Dict:
+        """Registra un trabajo en el historial y actualiza los contadores.
+
+        Un trabajo ya registrado se sustituye: su estado anterior deja de contar.
+        """
+        with self._lock:
+            stats = {
+                "trabajos_exitosos": 0,
+                "trabajos_con_advertencias": 0,
+                "trabajos_fallidos": 0,
+                "tasa_exito": 0.0,
+                **self.get_metadata(),
+            }
+            previous = self.find(job.get("id") or job.get("job_id"))
+            if previous is not None:
+                counter = self._STATUS_COUNTERS.get(previous.get("status"))
+                if counter:
+                    stats[counter] = max(0, stats[counter] - 1)
+            counter = self._STATUS_COUNTERS.get(job.get("status"))
+            if counter:
+                stats[counter] += 1
+            record = {**job, "completed_at": datetime.now().isoformat()}
+            total = self.count() + (1 if previous is None else 0)
+            stats["tasa_exito"] = stats["trabajos_exitosos"] / total * 100
+            return self.upsert(record, metadata=stats)
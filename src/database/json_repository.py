@@ -2,39 +2,164 @@
 
 Proporciona utilidades comunes para cargar y guardar datos con metadata,
 controlando concurrencia básica y rutas relativas al proyecto.
+
+El payload parseado se conserva en memoria, compartido por todos los
+repositorios del proceso que usan el mismo archivo. Cada lectura lo valida
+con un ``stat`` (mtime, tamaño e inodo) para detectar ediciones externas y
+solo entonces vuelve a parsear el archivo; las escrituras actualizan la caché
+y el archivo a la vez. La escritura a disco es diferida y atómica
+(``write_behind``): los cambios que llegan en ráfaga se agrupan en una sola
+escritura y, mientras hay una versión pendiente, la caché es la fuente de verdad
+del proceso.
+
+Junto al payload se mantiene un índice de los registros (por clave primaria y
+por los campos que declare cada repositorio) que ``upsert``/``delete`` actualizan
+de forma incremental; cualquier otra modificación lo descarta y se reconstruye
+en la siguiente consulta.
+
+Con ``STORAGE_BACKEND=sqlite`` el repositorio delega en ``SQLiteBackend``
+(una tabla por entidad, escrituras por fila) manteniendo la misma interfaz.
 """
 
 from __future__ import annotations
 
 import json
+import os
 import threading
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 from datetime import datetime
 
+from .sqlite_backend import SQLiteBackend, get_store, normalize_timestamp
+from .write_behind import write_behind
+
 
 class JSONRepositoryError(RuntimeError):
     """Error base para operaciones de repositorios JSON."""
 
 
+class _CachedFile:
+    """Payload parseado de un archivo y el lock que protege archivo y caché."""
+
+    def __init__(self) -> None:
+        self.lock = threading.RLock()
+        self.payload: Optional[Dict[str, Any]] = None
+        self.signature: Optional[Tuple[int, int, int]] = None
+        self.index: Optional[_RecordIndex] = None
+        self.stats = {"hits": 0, "loads": 0, "writes": 0, "index_builds": 0}
+
+    def clear(self) -> None:
+        self.payload = None
+        self.index = None
+
+
+class _RecordIndex:
+    """Posición de cada registro por identificador y grupos por valor de campo."""
+
+    def __init__(self, records: List[Dict[str, Any]], key_fields: Tuple[str, ...], group_fields: Tuple[str, ...]):
+        self.key_fields = key_fields
+        self.group_fields = group_fields
+        # identificador (cualquiera de ``key_fields``) -> posición en la lista
+        self.positions: Dict[Any, int] = {}
+        # campo -> valor -> claves de los registros (dict como conjunto ordenado)
+        self.groups: Dict[str, Dict[Any, Dict[Any, None]]] = {field: {} for field in group_fields}
+        for position, record in enumerate(records):
+            self.add(record, position)
+
+    def key_of(self, record: Dict[str, Any]) -> Any:
+        for field in self.key_fields:
+            if record.get(field):
+                return record[field]
+        return None
+
+    def add(self, record: Dict[str, Any], position: int) -> None:
+        for field in self.key_fields:
+            if record.get(field):
+                self.positions[record[field]] = position
+        key = self.key_of(record)
+        for field in self.group_fields:
+            self.groups[field].setdefault(record.get(field), {})[key] = None
+
+    def remove(self, record: Dict[str, Any]) -> None:
+        for field in self.key_fields:
+            if record.get(field):
+                self.positions.pop(record[field], None)
+        key = self.key_of(record)
+        for field in self.group_fields:
+            bucket = self.groups[field].get(record.get(field))
+            if bucket is not None:
+                bucket.pop(key, None)
+                if not bucket:
+                    del self.groups[field][record.get(field)]
+
+    def shift_after(self, position: int) -> None:
+        """Ajusta las posiciones tras eliminar el registro en ``position``."""
+        for identifier, current in self.positions.items():
+            if current > position:
+                self.positions[identifier] = current - 1
+
+
+_cached_files: Dict[Path, _CachedFile] = {}
+_cached_files_lock = threading.Lock()
+
+
+def _cached_file(path: Path) -> _CachedFile:
+    with _cached_files_lock:
+        cached = _cached_files.get(path)
+        if cached is None:
+            cached = _cached_files[path] = _CachedFile()
+        return cached
+
+
 class BaseJSONRepository:
     """Repositorio base para manejar archivos JSON con metadata y datos."""
 
+    # Campos que identifican un registro (se acepta cualquiera de ellos en las búsquedas)
+    _key_fields: Tuple[str, ...] = ("id",)
+    # Campos con índice secundario para ``find_by``
+    _index_fields: Tuple[str, ...] = ()
+    # Campos de fecha para ``find_between`` (columnas indexadas en SQLite)
+    _date_fields: Tuple[str, ...] = ()
+    # Marca ``last_updated`` en la sección de metadata al escribir
+    _stamp_last_updated = True
+
     def __init__(
         self,
         filename: str,
         data_key: str,
         metadata_key: str = "metadata",
         base_path: Optional[Path] = None,
+        storage: Optional[str] = None,
+        database: Optional[Path] = None,
     ) -> None:
-        self._lock = threading.RLock()
+        """
+        Args:
+            storage: ``"json"`` o ``"sqlite"`` (por defecto ``STORAGE_BACKEND``, o JSON)
+            database: Base SQLite (por defecto ``STORAGE_SQLITE_PATH``, o ``kybercore.db`` junto al JSON)
+        """
         self._data_key = data_key
         self._metadata_key = metadata_key
         self._file_path = self._resolve_path(filename, base_path)
+        self._backend: Optional[SQLiteBackend] = None
 
+        storage = (storage or os.getenv("STORAGE_BACKEND") or "json").lower()
+        if storage == "sqlite":
+            database = database or os.getenv("STORAGE_SQLITE_PATH") or self._file_path.parent / "kybercore.db"
+            self._backend = SQLiteBackend(
+                get_store(Path(database)),
+                table=self._file_path.stem,
+                data_key=data_key,
+                metadata_key=metadata_key,
+                key_fields=self._key_fields,
+                index_fields=self._index_fields,
+                date_fields=self._date_fields,
+                stamp_last_updated=self._stamp_last_updated,
+            )
+        elif storage != "json":
+            raise JSONRepositoryError(f"Backend de almacenamiento desconocido: {storage}")
         # Inicializar el archivo si no existe
-        if not self._file_path.exists():
+        elif not write_behind.exists(self._file_path):
             self._initialize_file()
 
     @staticmethod
@@ -48,59 +173,284 @@ class BaseJSONRepository:
     def _initialize_file(self) -> None:
         """Crea un archivo JSON vacío con metadata mínima."""
         initial_payload = {
-            self._metadata_key: {
-                "version": "1.0",
-                "last_updated": datetime.utcnow().isoformat(),
-            },
+            self._metadata_key: self._stamp({"version": "1.0"}),
             self._data_key: [],
         }
         self._file_path.parent.mkdir(parents=True, exist_ok=True)
         self._write_json(initial_payload)
 
-    def _read_json(self) -> Dict[str, Any]:
+    @property
+    def _cache(self) -> _CachedFile:
+        # Se resuelve en cada uso: la ruta puede reasignarse tras construir el repositorio
+        return _cached_file(self._file_path)
+
+    @property
+    def _lock(self) -> threading.RLock:
+        if self._backend is not None:
+            return self._backend.lock
+        return self._cache.lock
+
+    def _signature(self) -> Tuple[int, int, int]:
         try:
-            with self._file_path.open("r", encoding="utf-8") as fh:
-                return json.load(fh)
+            st = os.stat(self._file_path)
         except FileNotFoundError as exc:
             raise JSONRepositoryError(f"Archivo no encontrado: {self._file_path}") from exc
-        except json.JSONDecodeError as exc:
-            raise JSONRepositoryError(
-                f"Archivo JSON corrupto en {self._file_path}: {exc.msg}"
-            ) from exc
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _read_json(self) -> Dict[str, Any]:
+        """Payload del archivo: el de la caché si el archivo no cambió desde que se leyó."""
+        cache = self._cache
+        with cache.lock:
+            pending = write_behind.pending(self._file_path)
+            if pending is not None:
+                # Versión aún sin escribir: el disco está atrasado respecto al proceso
+                if cache.payload is None:
+                    cache.payload = json.loads(pending)
+                    cache.stats["loads"] += 1
+                else:
+                    cache.stats["hits"] += 1
+                return cache.payload
+            signature = self._signature()
+            if cache.payload is not None and cache.signature == signature:
+                cache.stats["hits"] += 1
+                return cache.payload
+            cache.clear()
+            try:
+                with self._file_path.open("r", encoding="utf-8") as fh:
+                    payload = json.load(fh)
+            except FileNotFoundError as exc:
+                raise JSONRepositoryError(f"Archivo no encontrado: {self._file_path}") from exc
+            except json.JSONDecodeError as exc:
+                raise JSONRepositoryError(
+                    f"Archivo JSON corrupto en {self._file_path}: {exc.msg}"
+                ) from exc
+            # Firma tomada antes de leer: una escritura concurrente externa fuerza otra lectura
+            cache.payload, cache.signature = payload, signature
+            cache.stats["loads"] += 1
+            return payload
 
     def _write_json(self, payload: Dict[str, Any]) -> None:
-        with self._file_path.open("w", encoding="utf-8") as fh:
-            json.dump(payload, fh, indent=2, ensure_ascii=False)
+        cache = self._cache
+        path = self._file_path
+
+        def flushed(signature: Tuple[int, int, int]) -> None:
+            # El archivo ya tiene la última versión: las lecturas vuelven a validarse con stat
+            with cache.lock:
+                if write_behind.pending(path) is None:
+                    cache.signature = signature
+
+        with cache.lock:
+            try:
+                # Se serializa al encolar: un valor no serializable falla aquí y no llega al archivo
+                content = json.dumps(payload, indent=2, ensure_ascii=False)
+                cache.payload, cache.signature = payload, None
+                write_behind.write(path, content, on_flushed=flushed)
+            except BaseException:
+                cache.clear()
+                raise
+            cache.stats["writes"] += 1
 
     def load(self) -> Dict[str, Any]:
-        """Carga el contenido completo del archivo."""
+        """Carga el contenido completo del archivo.
+
+        Devuelve el payload en caché: los cambios deben pasar por ``save`` o
+        ``update_payload`` para llegar al archivo.
+        """
+        if self._backend is not None:
+            return self._backend.load()
         with self._lock:
             return self._read_json()
 
     def save(self, data: Dict[str, Any], metadata: Optional[Dict[str, Any]] = None) -> None:
         """Guarda los datos y actualiza metadata opcional."""
+        if self._backend is not None:
+            return self._backend.save(data, metadata)
         with self._lock:
-            payload = self._read_json()
-            payload[self._data_key] = data
-            if metadata is not None:
-                payload[self._metadata_key].update(metadata)
-            payload[self._metadata_key]["last_updated"] = datetime.utcnow().isoformat()
+            try:
+                payload = self._read_json()
+                payload[self._data_key] = data
+                if metadata is not None:
+                    payload[self._metadata_key].update(metadata)
+                self._stamp(payload[self._metadata_key])
+            except BaseException:
+                self._cache.clear()
+                raise
+            self._cache.index = None
             self._write_json(payload)
 
     def update_payload(self, updater) -> Dict[str, Any]:
         """Aplica una función de actualización atómica al payload."""
+        if self._backend is not None:
+            return self._backend.update_payload(updater)
         with self._lock:
-            payload = self._read_json()
-            new_payload = updater(payload)
-            if self._metadata_key in new_payload:
-                new_payload[self._metadata_key]["last_updated"] = datetime.utcnow().isoformat()
-            else:
-                metadata = payload.get(self._metadata_key, {})
-                metadata["last_updated"] = datetime.utcnow().isoformat()
-                new_payload[self._metadata_key] = metadata
+            try:
+                payload = self._read_json()
+                new_payload = updater(payload)
+                if self._metadata_key in new_payload:
+                    self._stamp(new_payload[self._metadata_key])
+                else:
+                    new_payload[self._metadata_key] = self._stamp(payload.get(self._metadata_key, {}))
+            except BaseException:
+                # El updater pudo modificar a medias el payload en caché: se relee del archivo
+                self._cache.clear()
+                raise
+            # El updater puede haber cambiado cualquier registro: el índice se reconstruye al usarse
+            self._cache.index = None
             self._write_json(new_payload)
             return new_payload
 
+    def invalidate(self) -> None:
+        """Descarta el payload en caché; la siguiente lectura vuelve a parsear el archivo."""
+        if self._backend is not None:
+            return
+        with self._lock:
+            write_behind.flush(self._file_path)
+            self._cache.clear()
+
+    # === REGISTROS INDEXADOS ===
+
+    def _records(self) -> Tuple[List[Dict[str, Any]], _RecordIndex]:
+        """Lista de registros del payload y su índice (construido si hace falta)."""
+        cache = self._cache
+        with cache.lock:
+            payload = self._read_json()
+            records = payload.setdefault(self._data_key, [])
+            if cache.index is None:
+                cache.index = _RecordIndex(records, self._key_fields, self._index_fields)
+                cache.stats["index_builds"] += 1
+            return records, cache.index
+
+    def find(self, key: Any) -> Optional[Dict[str, Any]]:
+        """Registro cuyo identificador es ``key`` (None si no existe)."""
+        if self._backend is not None:
+            return self._backend.find(key)
+        with self._lock:
+            records, index = self._records()
+            position = index.positions.get(key)
+            return records[position] if position is not None else None
+
+    def find_by(self, field: str, value: Any) -> List[Dict[str, Any]]:
+        """Registros con ``field == value``, en el orden del archivo."""
+        if self._backend is not None:
+            return self._backend.filter_by(**{field: value})
+        with self._lock:
+            records, index = self._records()
+            keys = index.groups[field].get(value, {})
+            positions = sorted(index.positions[key] for key in keys)
+            return [records[position] for position in positions]
+
+    def filter_by(self, **criteria: Any) -> List[Dict[str, Any]]:
+        """Registros que cumplen todos los criterios (``None`` = sin filtro).
+
+        Parte del grupo indexado más pequeño y filtra el resto sobre él.
+        """
+        if self._backend is not None:
+            return self._backend.filter_by(**criteria)
+        criteria = {field: value for field, value in criteria.items() if value is not None}
+        with self._lock:
+            records, index = self._records()
+            if not criteria:
+                return list(records)
+            field = min(criteria, key=lambda f: len(index.groups[f].get(criteria[f], {})))
+            candidates = self.find_by(field, criteria.pop(field))
+            return [r for r in candidates if all(r.get(f) == v for f, v in criteria.items())]
+
+    def find_between(self, field: str, start: Any = None, end: Any = None) -> List[Dict[str, Any]]:
+        """Registros con la fecha ``field`` en ``[start, end)`` (extremos opcionales)."""
+        if self._backend is not None:
+            return self._backend.find_between(field, start, end)
+        start, end = normalize_timestamp(start), normalize_timestamp(end)
+        with self._lock:
+            records, _ = self._records()
+            matches = []
+            for record in records:
+                value = normalize_timestamp(record.get(field))
+                if value is None or (start and value < start) or (end and value >= end):
+                    continue
+                matches.append(record)
+            return matches
+
+    def count(self) -> int:
+        """Número de registros."""
+        if self._backend is not None:
+            return self._backend.count()
+        with self._lock:
+            return len(self._records()[0])
+
+    def get_metadata(self) -> Dict[str, Any]:
+        """Metadata del repositorio."""
+        if self._backend is not None:
+            return self._backend.get_metadata()
+        with self._lock:
+            return self._read_json().get(self._metadata_key, {})
+
+    def upsert(self, record: Dict[str, Any], metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Inserta o reemplaza un registro por su identificador y lo persiste.
+
+        ``metadata`` se fusiona con la metadata del repositorio en la misma escritura.
+        """
+        if self._backend is not None:
+            return self._backend.upsert(record, metadata)
+        with self._lock:
+            records, index = self._records()
+            position = index.positions.get(index.key_of(record))
+            try:
+                if position is None:
+                    records.append(record)
+                    position = len(records) - 1
+                else:
+                    index.remove(records[position])
+                    records[position] = record
+                index.add(record, position)
+                self._touch(metadata)
+            except BaseException:
+                self._cache.clear()
+                raise
+            self._write_json(self._cache.payload)
+            return record
+
+    def delete(self, key: Any) -> bool:
+        """Elimina el registro ``key``; False si no existía."""
+        if self._backend is not None:
+            return self._backend.delete(key)
+        with self._lock:
+            records, index = self._records()
+            position = index.positions.get(key)
+            if position is None:
+                return False
+            try:
+                index.remove(records.pop(position))
+                index.shift_after(position)
+                self._touch()
+            except BaseException:
+                self._cache.clear()
+                raise
+            self._write_json(self._cache.payload)
+            return True
+
+    def _touch(self, metadata: Optional[Dict[str, Any]] = None) -> None:
+        current = self._cache.payload.setdefault(self._metadata_key, {})
+        current.update(metadata or {})
+        self._stamp(current)
+
+    def _stamp(self, metadata: Dict[str, Any]) -> Dict[str, Any]:
+        if self._stamp_last_updated:
+            metadata["last_updated"] = datetime.utcnow().isoformat()
+        else:
+            metadata.pop("last_updated", None)
+        return metadata
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        if self._backend is not None:
+            return self._backend.get_stats()
+        cache = self._cache
+        return {
+            "file": str(self._file_path),
+            "cached": cache.payload is not None,
+            "pending_write": write_behind.pending(self._file_path) is not None,
+            **cache.stats,
+        }
+
     @property
     def file_path(self) -> Path:
         return self._file_path
@@ -2,56 +2,40 @@
 
 from __future__ import annotations
 
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional
 
 from .json_repository import BaseJSONRepository, JSONRepositoryError
 
 
 class OrdersRepository(BaseJSONRepository):
-    def __init__(self) -> None:
-        super().__init__(filename="orders.json", data_key="orders")
+    _key_fields = ("id", "order_id")
+    _index_fields = ("customer_id", "status")
+    _date_fields = ("created_at",)
+
+    def __init__(self, **options: Any) -> None:
+        super().__init__(filename="orders.json", data_key="orders", **options)
 
     def list_orders(self) -> List[Dict]:
         payload = self.load()
         return payload.get("orders", [])
 
+    def list_orders_by(self, customer_id: Optional[str] = None, status: Optional[str] = None) -> List[Dict]:
+        """Pedidos filtrados por cliente y/o estado usando los índices secundarios."""
+        return self.filter_by(customer_id=customer_id, status=status)
+
+    def list_orders_created_between(self, start: Any = None, end: Any = None) -> List[Dict]:
+        """Pedidos con ``created_at`` en ``[start, end)``."""
+        return self.find_between("created_at", start, end)
+
     def get_order_by_id(self, order_id: str) -> Dict:
-        orders = self.list_orders()
-        try:
-            return next(o for o in orders if o.get("id") == order_id or o.get("order_id") == order_id)
-        except StopIteration as exc:
-            raise JSONRepositoryError(f"Pedido {order_id} no encontrado") from exc
+        order = self.find(order_id)
+        if order is None:
+            raise JSONRepositoryError(f"Pedido {order_id} no encontrado")
+        return order
 
     def upsert_order(self, order: Dict) -> Dict:
-        def updater(payload: Dict) -> Dict:
-            orders: List[Dict] = payload.get("orders", [])
-            existing_index: Optional[int] = None
-            order_id = order.get("id") or order.get("order_id")
-            
-            for idx, existing in enumerate(orders):
-                existing_id = existing.get("id") or existing.get("order_id")
-                if existing_id == order_id:
-                    existing_index = idx
-                    break
-            
-            if existing_index is None:
-                orders.append(order)
-            else:
-                orders[existing_index] = order
-            payload["orders"] = orders
-            return payload
-
-        updated = self.update_payload(updater)
-        order_id = order.get("id") or order.get("order_id")
-        return next(o for o in updated["orders"] if (o.get("id") or o.get("order_id")) == order_id)
+        return self.upsert(order)
 
     def delete_order(self, order_id: str) -> None:
-        def updater(payload: Dict) -> Dict:
-            orders: List[Dict] = payload.get("orders", [])
-            filtered = [o for o in orders if o.get("id") != order_id and o.get("order_id") != order_id]
-            if len(filtered) == len(orders):
-                raise JSONRepositoryError(f"Pedido {order_id} no encontrado para eliminar")
-            payload["orders"] = filtered
-            return payload
-
-        self.update_payload(updater)
+        if not self.delete(order_id):
+            raise JSONRepositoryError(f"Pedido {order_id} no encontrado para eliminar")
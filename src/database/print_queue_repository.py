@@ -0,0 +1,29 @@
+"""Repositorio especializado para la cola de trabajos del wizard."""
+
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from .json_repository import BaseJSONRepository
+
+
+class PrintQueueRepository(BaseJSONRepository):
+    _key_fields = ("job_id",)
+    _index_fields = ("status", "printer_id")
+    _date_fields = ("queued_at",)
+
+    def __init__(self, **options: Any) -> None:
+        super().__init__(filename="print_queue.json", data_key="queue", **options)
+
+    def list_jobs(self, status: Optional[str] = None) -> List[Dict]:
+        return self.filter_by(status=status)
+
+    def enqueue(self, job: Dict) -> int:
+        """Añade el trabajo con la siguiente posición de la cola y la devuelve."""
+        with self._lock:
+            position = self.get_metadata().get("next_queue_position", 1)
+            job["queue_position"] = position
+            job["queued_at"] = datetime.now().isoformat()
+            self.upsert(job, metadata={"next_queue_position": position + 1})
+        return position
@@ -2,22 +2,35 @@
 
 from __future__ import annotations
 
-from typing import Dict, List
+from typing import Any, Dict, List, Optional
 
 from .json_repository import BaseJSONRepository
 
 
 class ProductionRepository(BaseJSONRepository):
-    def __init__(self) -> None:
-        super().__init__(filename="production_tracking.json", data_key="production_tracking")
+    _index_fields = ("order_id", "status")
+    _date_fields = ("created_at",)
+
+    def __init__(self, **options: Any) -> None:
+        super().__init__(filename="production_tracking.json", data_key="production_tracking", **options)
 
     def list_batches(self) -> List[Dict]:
         payload = self.load()
         return payload.get("production_tracking", [])
 
+    def list_batches_by(self, order_id: Optional[str] = None, status: Optional[str] = None) -> List[Dict]:
+        """Lotes filtrados por pedido y/o estado usando los índices secundarios."""
+        return self.filter_by(order_id=order_id, status=status)
+
+    def list_batches_created_between(self, start: Any = None, end: Any = None) -> List[Dict]:
+        """Lotes con ``created_at`` en ``[start, end)``."""
+        return self.find_between("created_at", start, end)
+
     def get_batch(self, batch_id: str) -> Dict:
-        batches = self.list_batches()
-        for batch in batches:
-            if batch.get("id") == batch_id:
-                return batch
-        raise ValueError(f"Lote {batch_id} no encontrado")
+        batch = self.find(batch_id)
+        if batch is None:
+            raise ValueError(f"Lote {batch_id} no encontrado")
+        return batch
+
+    def upsert_batch(self, batch: Dict) -> Dict:
+        return self.upsert(batch)
@@ -0,0 +1,278 @@
+"""Backend SQLite para los repositorios.
+
+Alternativa a los archivos JSON de ``base_datos/``: cada entidad es una tabla
+de una base SQLite en modo WAL (lectores concurrentes con un escritor). El
+registro completo se guarda como JSON en la columna ``data`` (líneas, items y
+demás estructuras anidadas) y los campos por los que se busca (claves, índices
+secundarios y fechas) se copian a columnas propias con su índice.
+
+Las escrituras son por fila: ``upsert``/``delete`` tocan un registro en una
+transacción en lugar de reescribir el archivo entero, y los filtros por rango
+de fechas (métricas) se resuelven en SQL.
+
+Se activa con ``STORAGE_BACKEND=sqlite``; la base por defecto es
+``kybercore.db`` junto a los JSON (``STORAGE_SQLITE_PATH`` la cambia). Los
+datos existentes se importan con ``scripts/migrate_json_to_sqlite.py``.
+"""
+
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+
+def normalize_timestamp(value: Any) -> Optional[str]:
+    """Fecha ISO comparable como texto (UTC sin zona, con microsegundos); None si no es fecha."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat(timespec="microseconds")
+
+
+class SQLiteStore:
+    """Conexión a una base SQLite compartida por todas las tablas del proceso."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.lock = threading.RLock()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Transacciones explícitas (BEGIN IMMEDIATE) bajo ``lock``
+        self.conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS repository_metadata (entity TEXT PRIMARY KEY, data TEXT NOT NULL)"
+        )
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+_stores: Dict[Path, SQLiteStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(path: Path) -> SQLiteStore:
+    """Conexión compartida para la base ``path``."""
+    path = Path(path).resolve()
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = SQLiteStore(path)
+        return store
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+class SQLiteBackend:
+    """Tabla de una entidad con la misma interfaz de datos que ``BaseJSONRepository``."""
+
+    def __init__(
+        self,
+        store: SQLiteStore,
+        table: str,
+        data_key: str,
+        metadata_key: str = "metadata",
+        key_fields: Tuple[str, ...] = ("id",),
+        index_fields: Tuple[str, ...] = (),
+        date_fields: Tuple[str, ...] = (),
+        stamp_last_updated: bool = True,
+    ) -> None:
+        self.store = store
+        self.table = table
+        self.data_key = data_key
+        self.metadata_key = metadata_key
+        self.key_fields = key_fields
+        self.date_fields = date_fields
+        self.stamp_last_updated = stamp_last_updated
+        self.columns = list(dict.fromkeys(key_fields + index_fields + date_fields))
+        self.stats = {"reads": 0, "writes": 0}
+        self._create_table()
+
+    @property
+    def lock(self) -> threading.RLock:
+        return self.store.lock
+
+    def _create_table(self) -> None:
+        columns = "".join(f", {_quote(column)}" for column in self.columns)
+        with self.store.transaction() as conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {_quote(self.table)} "
+                f"(pos INTEGER PRIMARY KEY AUTOINCREMENT{columns}, data TEXT NOT NULL)"
+            )
+            for column in self.columns:
+                conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS {_quote(f'ix_{self.table}_{column}')} "
+                    f"ON {_quote(self.table)} ({_quote(column)})"
+                )
+
+    # === FILAS ===
+
+    def _column_value(self, field: str, value: Any) -> Any:
+        if field in self.date_fields:
+            return normalize_timestamp(value)
+        if isinstance(value, (dict, list)):
+            return json.dumps(value, ensure_ascii=False)
+        return value
+
+    def _row(self, record: Dict[str, Any]) -> List[Any]:
+        values = [self._column_value(column, record.get(column)) for column in self.columns]
+        # Se serializa antes de tocar la tabla: un valor no serializable aborta la escritura
+        return values + [json.dumps(record, ensure_ascii=False)]
+
+    def _insert(self, conn: sqlite3.Connection, records: List[Dict[str, Any]]) -> None:
+        names = "".join(f"{_quote(column)}, " for column in self.columns)
+        marks = ", ".join("?" for _ in range(len(self.columns) + 1))
+        conn.executemany(
+            f"INSERT INTO {_quote(self.table)} ({names}data) VALUES ({marks})",
+            [self._row(record) for record in records],
+        )
+
+    def _select(self, where: str = "", params: Tuple[Any, ...] = (), limit: str = "") -> List[Dict[str, Any]]:
+        with self.lock:
+            rows = self.store.conn.execute(
+                f"SELECT data FROM {_quote(self.table)} {where} ORDER BY pos {limit}", params
+            ).fetchall()
+            self.stats["reads"] += 1
+        return [json.loads(data) for data, in rows]
+
+    def _key_of(self, record: Dict[str, Any]) -> Any:
+        for field in self.key_fields:
+            if record.get(field):
+                return record[field]
+        return None
+
+    def _key_where(self) -> str:
+        return "WHERE " + " OR ".join(f"{_quote(field)} = ?" for field in self.key_fields)
+
+    # === METADATA ===
+
+    def get_metadata(self) -> Dict[str, Any]:
+        with self.lock:
+            row = self.store.conn.execute(
+                "SELECT data FROM repository_metadata WHERE entity = ?", (self.table,)
+            ).fetchone()
+        return json.loads(row[0]) if row else {"version": "1.0"}
+
+    def _write_metadata(self, conn: sqlite3.Connection, metadata: Dict[str, Any]) -> None:
+        if self.stamp_last_updated:
+            metadata["last_updated"] = datetime.utcnow().isoformat()
+        else:
+            metadata.pop("last_updated", None)
+        conn.execute(
+            "INSERT OR REPLACE INTO repository_metadata (entity, data) VALUES (?, ?)",
+            (self.table, json.dumps(metadata, ensure_ascii=False)),
+        )
+
+    # === INTERFAZ DEL REPOSITORIO ===
+
+    def load(self) -> Dict[str, Any]:
+        with self.lock:
+            return {self.metadata_key: self.get_metadata(), self.data_key: self._select()}
+
+    def save(self, data: List[Dict[str, Any]], metadata: Optional[Dict[str, Any]] = None) -> None:
+        with self.store.transaction() as conn:
+            current = self.get_metadata()
+            conn.execute(f"DELETE FROM {_quote(self.table)}")
+            self._insert(conn, data)
+            self._write_metadata(conn, {**current, **(metadata or {})})
+            self.stats["writes"] += 1
+
+    def update_payload(self, updater: Callable[[Dict[str, Any]], Dict[str, Any]]) -> Dict[str, Any]:
+        with self.store.transaction() as conn:
+            payload = self.load()
+            new_payload = updater(payload)
+            metadata = new_payload.setdefault(self.metadata_key, payload[self.metadata_key])
+            conn.execute(f"DELETE FROM {_quote(self.table)}")
+            self._insert(conn, new_payload.get(self.data_key, []))
+            self._write_metadata(conn, metadata)
+            self.stats["writes"] += 1
+            return new_payload
+
+    def find(self, key: Any) -> Optional[Dict[str, Any]]:
+        records = self._select(self._key_where(), (key,) * len(self.key_fields), limit="LIMIT 1")
+        return records[0] if records else None
+
+    def filter_by(self, **criteria: Any) -> List[Dict[str, Any]]:
+        criteria = {field: value for field, value in criteria.items() if value is not None}
+        unknown = set(criteria) - set(self.columns)
+        if unknown:
+            raise KeyError(f"Campos sin índice en {self.table}: {', '.join(sorted(unknown))}")
+        where = " AND ".join(f"{_quote(field)} = ?" for field in criteria)
+        params = tuple(self._column_value(field, value) for field, value in criteria.items())
+        return self._select(f"WHERE {where}" if where else "", params)
+
+    def find_between(self, field: str, start: Any = None, end: Any = None) -> List[Dict[str, Any]]:
+        conditions, params = [f"{_quote(field)} IS NOT NULL"], []
+        if start is not None:
+            conditions.append(f"{_quote(field)} >= ?")
+            params.append(normalize_timestamp(start))
+        if end is not None:
+            conditions.append(f"{_quote(field)} < ?")
+            params.append(normalize_timestamp(end))
+        return self._select("WHERE " + " AND ".join(conditions), tuple(params))
+
+    def count(self) -> int:
+        with self.lock:
+            return self.store.conn.execute(f"SELECT COUNT(*) FROM {_quote(self.table)}").fetchone()[0]
+
+    def upsert(self, record: Dict[str, Any], metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        row = self._row(record)
+        key = self._key_of(record)
+        with self.store.transaction() as conn:
+            existing = None
+            if key is not None:
+                existing = conn.execute(
+                    f"SELECT pos FROM {_quote(self.table)} {self._key_where()} ORDER BY pos LIMIT 1",
+                    (key,) * len(self.key_fields),
+                ).fetchone()
+            if existing is None:
+                self._insert(conn, [record])
+            else:
+                assignments = ", ".join(f"{_quote(column)} = ?" for column in self.columns + ["data"])
+                conn.execute(f"UPDATE {_quote(self.table)} SET {assignments} WHERE pos = ?", row + [existing[0]])
+            self._write_metadata(conn, {**self.get_metadata(), **(metadata or {})})
+            self.stats["writes"] += 1
+        return record
+
+    def delete(self, key: Any) -> bool:
+        with self.store.transaction() as conn:
+            existing = conn.execute(
+                f"SELECT pos FROM {_quote(self.table)} {self._key_where()} ORDER BY pos LIMIT 1",
+                (key,) * len(self.key_fields),
+            ).fetchone()
+            if existing is None:
+                return False
+            conn.execute(f"DELETE FROM {_quote(self.table)} WHERE pos = ?", (existing[0],))
+            self._write_metadata(conn, self.get_metadata())
+            self.stats["writes"] += 1
+            return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"backend": "sqlite", "database": str(self.store.path), "table": self.table, **self.stats}
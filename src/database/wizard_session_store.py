@@ -0,0 +1,285 @@
+"""Almacén de sesiones del wizard de impresión: un archivo por sesión.
+
+``wizard_sessions.json`` guardaba todas las sesiones en un único documento, así
+que cada paso del wizard (y cada archivo que procesa ``RotationWorker``)
+parseaba y reescribía todas las sesiones pasadas para tocar una.
+
+Aquí cada sesión es ``<directorio>/<session_id>.json``: cargar o guardar una
+sesión cuesta lo mismo haya las sesiones que haya. Las sesiones usadas
+recientemente se conservan en un LRU en memoria, validado con un ``stat`` para
+ver los cambios de otros workers. Las escrituras pasan por ``write_behind``
+(agrupadas y atómicas).
+
+Las sesiones que siguen en el ``wizard_sessions.json`` antiguo se leen de él
+(se parsea una vez por proceso) hasta que se guardan de nuevo en su propio
+archivo. El job de expiración borra las sesiones sin actividad durante
+``ttl`` segundos y compacta el archivo antiguo, que se elimina al quedar vacío.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import copy
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from .write_behind import write_behind
+
+logger = logging.getLogger(__name__)
+
+_BASE_PATH = Path(__file__).resolve().parents[2] / "base_datos"
+
+
+def _signature(path: Path) -> Optional[Tuple[int, int, int]]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+class WizardSessionStore:
+    """Sesiones del wizard con un archivo por sesión, LRU en memoria y expiración por TTL."""
+
+    def __init__(
+        self,
+        directory: Path,
+        legacy_path: Optional[Path] = None,
+        cache_size: int = 128,
+        ttl: float = 7 * 24 * 3600,
+        expiry_interval: float = 3600.0,
+    ) -> None:
+        """
+        Args:
+            directory: Directorio con un JSON por sesión
+            legacy_path: ``wizard_sessions.json`` antiguo del que se leen las sesiones no migradas
+            cache_size: Sesiones que se conservan en memoria
+            ttl: Segundos sin actividad tras los que una sesión se da por abandonada
+            expiry_interval: Segundos entre pasadas del job de expiración
+        """
+        self.directory = Path(directory)
+        self.legacy_path = Path(legacy_path) if legacy_path else None
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.expiry_interval = expiry_interval
+        self._lock = threading.RLock()
+        # session_id -> (firma del archivo o None si hay escritura pendiente, sesión)
+        self._cache: "OrderedDict[str, Tuple[Optional[Tuple[int, int, int]], Dict[str, Any]]]" = OrderedDict()
+        self._legacy: Optional[Dict[str, Any]] = None
+        self._legacy_signature: Optional[Tuple[int, int, int]] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"hits": 0, "misses": 0, "legacy_reads": 0, "saves": 0, "expired": 0}
+
+    def _path(self, session_id: str) -> Path:
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", session_id).lstrip(".") or "_"
+        return self.directory / f"{name}.json"
+
+    # === LRU ===
+
+    def _remember(self, session_id: str, signature: Optional[Tuple[int, int, int]], session: Dict[str, Any]) -> None:
+        self._cache[session_id] = (signature, session)
+        self._cache.move_to_end(session_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _cached(self, session_id: str, path: Path) -> Optional[Dict[str, Any]]:
+        entry = self._cache.get(session_id)
+        if entry is None:
+            return None
+        signature, session = entry
+        # Válida si la escritura es de este proceso y sigue pendiente, o si el archivo no cambió
+        if write_behind.pending(path) is None and signature != _signature(path):
+            del self._cache[session_id]
+            return None
+        self._cache.move_to_end(session_id)
+        return session
+
+    # === SESIONES ===
+
+    def load(self, session_id: str) -> Dict[str, Any]:
+        """Sesión ``session_id`` (dict vacío si no existe)."""
+        path = self._path(session_id)
+        with self._lock:
+            session = self._cached(session_id, path)
+            if session is not None:
+                self.stats["hits"] += 1
+                return copy.deepcopy(session)
+            self.stats["misses"] += 1
+            pending = write_behind.pending(path) is not None
+            # Firma tomada antes de leer: un cambio concurrente fuerza otra lectura
+            signature = _signature(path)
+            try:
+                session = write_behind.load_json(path)
+            except FileNotFoundError:
+                session = self._legacy_sessions().get(session_id)
+                if session is None:
+                    return {}
+                self.stats["legacy_reads"] += 1
+            self._remember(session_id, None if pending else signature, session)
+            return copy.deepcopy(session)
+
+    def save(self, session_id: str, session_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Guarda la sesión completa (sustituye a la anterior) y marca ``updated_at``."""
+        session = copy.deepcopy({**session_data, "updated_at": datetime.now().isoformat()})
+        path = self._path(session_id)
+
+        def flushed(signature: Tuple[int, int, int]) -> None:
+            with self._lock:
+                entry = self._cache.get(session_id)
+                if entry is not None and entry[1] is session and write_behind.pending(path) is None:
+                    self._cache[session_id] = (signature, session)
+
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._remember(session_id, None, session)
+            try:
+                write_behind.dump_json(path, session, on_flushed=flushed)
+            except BaseException:
+                self._cache.pop(session_id, None)
+                raise
+            self.stats["saves"] += 1
+        return session
+
+    def delete(self, session_id: str) -> None:
+        path = self._path(session_id)
+        with self._lock:
+            self._cache.pop(session_id, None)
+            write_behind.flush(path)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    # === ARCHIVO ANTIGUO ===
+
+    def _legacy_sessions(self) -> Dict[str, Any]:
+        """Sesiones de ``wizard_sessions.json`` (parseado una vez mientras no cambie)."""
+        if self.legacy_path is None:
+            return {}
+        signature = _signature(self.legacy_path)
+        if signature is None:
+            self._legacy, self._legacy_signature = None, None
+            return {}
+        if self._legacy is None or signature != self._legacy_signature:
+            try:
+                self._legacy = write_behind.load_json(self.legacy_path).get("sessions", {})
+            except (OSError, ValueError) as e:
+                logger.error(f"No se pudo leer {self.legacy_path}: {e}")
+                self._legacy = {}
+            self._legacy_signature = signature
+        return self._legacy
+
+    # === EXPIRACIÓN ===
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """Borra las sesiones sin actividad durante ``ttl`` y compacta el archivo antiguo.
+
+        Devuelve el número de sesiones eliminadas.
+        """
+        now = time.time() if now is None else now
+        cutoff = now - self.ttl
+        removed = 0
+        with self._lock:
+            write_behind.flush()
+            if self.directory.exists():
+                for entry in os.scandir(self.directory):
+                    if not entry.name.endswith(".json"):
+                        continue
+                    try:
+                        if entry.stat().st_mtime >= cutoff:
+                            continue
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        continue
+                    self._cache.pop(entry.name[:-len(".json")], None)
+                    removed += 1
+            removed += self._compact_legacy(cutoff)
+            self.stats["expired"] += removed
+        if removed:
+            logger.info(f"🧹 {removed} sesión(es) del wizard expiradas")
+        return removed
+
+    def _compact_legacy(self, cutoff: float) -> int:
+        legacy = self._legacy_sessions()
+        if not legacy:
+            return 0
+        keep = {}
+        for session_id, session in legacy.items():
+            if self._path(session_id).exists():
+                # Ya guardada en su propio archivo: la copia antigua sobra
+                continue
+            if self._last_activity(session) >= cutoff:
+                keep[session_id] = session
+        removed = len(legacy) - len(keep)
+        for session_id in legacy.keys() - keep.keys():
+            self._cache.pop(session_id, None)
+        if not keep:
+            try:
+                os.remove(self.legacy_path)
+            except FileNotFoundError:
+                pass
+        elif removed:
+            data = write_behind.load_json(self.legacy_path)
+            data["sessions"] = keep
+            write_behind.dump_json(self.legacy_path, data)
+            write_behind.flush(self.legacy_path)
+        self._legacy, self._legacy_signature = None, None
+        return removed
+
+    @staticmethod
+    def _last_activity(session: Dict[str, Any]) -> float:
+        for field in ("updated_at", "completed_at", "created_at"):
+            value = session.get(field)
+            if not value:
+                continue
+            try:
+                return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+            except ValueError:
+                continue
+        return 0.0
+
+    async def start(self) -> None:
+        """Arranca el job periódico de expiración."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._expiry_loop(), name="wizard_session_expiry")
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _expiry_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.expire)
+            except Exception as e:
+                logger.error(f"Error expirando sesiones del wizard: {e}")
+            await asyncio.sleep(self.expiry_interval)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "directory": str(self.directory),
+                "cached_sessions": len(self._cache),
+                "cache_size": self.cache_size,
+                "ttl_seconds": self.ttl,
+                **self.stats,
+            }
+
+
+# Instancia global del almacén de sesiones
+wizard_sessions = WizardSessionStore(
+    directory=Path(os.getenv("WIZARD_SESSIONS_DIR", str(_BASE_PATH / "wizard_sessions"))),
+    legacy_path=_BASE_PATH / "wizard_sessions.json",
+    cache_size=int(os.getenv("WIZARD_SESSION_CACHE_SIZE", "128")),
+    ttl=float(os.getenv("WIZARD_SESSION_TTL_HOURS", "168")) * 3600,
+    expiry_interval=float(os.getenv("WIZARD_SESSION_EXPIRY_INTERVAL", "3600")),
+)
@@ -0,0 +1,326 @@
+"""Escritura diferida (write-behind) y atómica de los archivos JSON.
+
+Cada guardado de un JSON de ``base_datos/`` reescribía el archivo entero en la
+misma petición, truncándolo primero: una ráfaga de cambios pagaba una
+escritura completa por cambio y un corte a mitad dejaba el archivo corrupto.
+
+``WriteBehindWriter`` agrupa (group commit) las escrituras de un mismo archivo
+que llegan dentro de una ventana corta y solo escribe la última versión, en un
+hilo propio y de forma atómica: archivo temporal en el mismo directorio,
+``fsync`` y ``os.replace``. Un archivo en disco es siempre una versión completa.
+
+Mientras una versión está pendiente, las lecturas del proceso deben pasar por
+``pending``/``load_json``/``exists`` para verla. Otros procesos (workers) ven el
+cambio al vaciarse la ventana (``STORAGE_WRITE_BEHIND_WINDOW`` segundos; 0 =
+escritura atómica inmediata). ``flush`` vuelca lo pendiente; el hook de apagado
+de la aplicación y ``atexit`` lo llaman para no perder cambios.
+
+Una escritura que falla (disco lleno, permisos) se reintenta ``max_retries``
+veces en segundo plano. Agotados los reintentos, la versión sigue pendiente
+pero el archivo pasa a escribirse en el momento: la siguiente escritura
+propaga el error a quien guarda, como antes del write-behind, y ``flush`` y
+``close`` lanzan ``OSError`` mientras quede algo sin escribir.
+
+El contenido se serializa al encolarlo: los errores de serialización llegan a
+quien guarda y cada versión encolada es una instantánea inmutable.
+"""
+
+from __future__ import annotations
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+PathLike = Union[str, Path]
+FlushCallback = Callable[[Tuple[int, int, int]], None]
+
+
+class _PendingWrite:
+    """Última versión pendiente de un archivo."""
+
+    def __init__(self, content: str, deadline: float, now: float) -> None:
+        self.content = content
+        self.deadline = deadline
+        self.queued_at = now
+        self.version = 0
+        self.callbacks: List[FlushCallback] = []
+        self.failures = 0
+        self.error: Optional[OSError] = None
+
+
+def atomic_write(path: Path, content: str) -> Tuple[int, int, int]:
+    """Escribe ``content`` en ``path`` vía temporal + fsync + rename. Devuelve la firma (mtime, tamaño, inodo)."""
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            fh.write(content)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    # El rename solo es durable cuando el directorio llega a disco
+    try:
+        dir_fd = os.open(path.parent, os.O_RDONLY)
+    except OSError:
+        pass
+    else:
+        try:
+            os.fsync(dir_fd)
+        except OSError:
+            pass
+        finally:
+            os.close(dir_fd)
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+class WriteBehindWriter:
+    """Cola de escrituras diferidas por archivo con volcado agrupado en un hilo."""
+
+    def __init__(self, window: float = 0.05, max_retries: int = 5) -> None:
+        """
+        Args:
+            window: Segundos que se acumulan cambios de un archivo antes de escribirlo (0 = inmediato)
+            max_retries: Intentos fallidos tras los que se deja de reintentar en segundo plano
+        """
+        self.window = window
+        self.max_retries = max(1, max_retries)
+        self._pending: Dict[Path, _PendingWrite] = {}
+        self._condition = threading.Condition()
+        # Serializa las escrituras a disco: una versión antigua nunca pisa a una nueva
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._flush_latencies: List[float] = []
+        self.stats = {
+            "writes_requested": 0,
+            "writes_coalesced": 0,
+            "flushes": 0,
+            "bytes_written": 0,
+            "errors": 0,
+        }
+
+    @staticmethod
+    def _key(path: PathLike) -> Path:
+        return Path(path).resolve()
+
+    # === ESCRITURA ===
+
+    def write(self, path: PathLike, content: str, on_flushed: Optional[FlushCallback] = None) -> None:
+        """Encola ``content`` como nueva versión de ``path``.
+
+        ``on_flushed(firma)`` se llama cuando esa versión (o una posterior) llega a disco.
+        Sin ventana, con el escritor cerrado o con el archivo fallando de forma persistente,
+        escribe en el momento y propaga los errores.
+        """
+        key = self._key(path)
+        with self._condition:
+            entry = self._pending.get(key)
+            synchronous = self.window <= 0 or self._closed or (
+                entry is not None and entry.failures >= self.max_retries
+            )
+        if synchronous:
+            self._write_now(key, content, on_flushed)
+            return
+
+        now = time.monotonic()
+        with self._condition:
+            self.stats["writes_requested"] += 1
+            entry = self._pending.get(key)
+            if entry is None:
+                entry = self._pending[key] = _PendingWrite(content, now + self.window, now)
+                self._condition.notify()
+            else:
+                # Group commit: solo se escribirá la última versión
+                self.stats["writes_coalesced"] += 1
+                entry.content = content
+                entry.version += 1
+            if on_flushed is not None:
+                entry.callbacks.append(on_flushed)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="json_write_behind", daemon=True)
+                self._thread.start()
+
+    def _write_now(self, key: Path, content: str, on_flushed: Optional[FlushCallback]) -> None:
+        """Escribe ``content`` en el momento; si falla, la versión pendiente anterior se conserva."""
+        with self._flush_lock:
+            started = time.perf_counter()
+            with self._condition:
+                self.stats["writes_requested"] += 1
+            try:
+                signature = atomic_write(key, content)
+            except OSError:
+                with self._condition:
+                    self.stats["errors"] += 1
+                raise
+            self._record_flush(started, len(content))
+            with self._condition:
+                # Una versión pendiente anterior queda sustituida por esta
+                entry = self._pending.pop(key, None)
+        for callback in (entry.callbacks if entry else []) + ([on_flushed] if on_flushed else []):
+            callback(signature)
+
+    def _flush_entry(self, key: Path) -> Optional[OSError]:
+        """Escribe la versión pendiente de ``key``. Devuelve el error si falló (queda pendiente)."""
+        with self._flush_lock:
+            with self._condition:
+                entry = self._pending.get(key)
+                if entry is None:
+                    return None
+                content, version = entry.content, entry.version
+            started = time.perf_counter()
+            try:
+                signature = atomic_write(key, content)
+            except OSError as e:
+                with self._condition:
+                    self.stats["errors"] += 1
+                    entry.failures += 1
+                    entry.error = e
+                    exhausted = entry.failures >= self.max_retries
+                    # Agotados los reintentos, solo se vuelve a intentar al escribir, volcar o cerrar
+                    entry.deadline = float("inf") if exhausted else time.monotonic() + max(self.window, 0.5)
+                if exhausted:
+                    logger.error(f"Error escribiendo {key} ({entry.failures} intentos), sin más reintentos: {e}")
+                else:
+                    logger.warning(f"Error escribiendo {key} (intento {entry.failures}): {e}")
+                return e
+            self._record_flush(started, len(content))
+            with self._condition:
+                if entry.version != version:
+                    # Llegó otra versión durante la escritura: se escribirá en su propia ventana
+                    entry.deadline = time.monotonic() + self.window
+                    entry.failures, entry.error = 0, None
+                    return None
+                del self._pending[key]
+                callbacks, entry.callbacks = entry.callbacks, []
+        # Fuera del lock: los callbacks toman el lock de la caché de quien escribió
+        for callback in callbacks:
+            try:
+                callback(signature)
+            except Exception as e:
+                logger.error(f"Error tras escribir {key}: {e}")
+        return None
+
+    def _record_flush(self, started: float, size: int) -> None:
+        with self._condition:
+            self.stats["flushes"] += 1
+            self.stats["bytes_written"] += size
+            self._flush_latencies.append(time.perf_counter() - started)
+            del self._flush_latencies[:-500]
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while True:
+                    if self._closed:
+                        # ``close`` ya volcó todo; lo que falló se informó allí
+                        return
+                    now = time.monotonic()
+                    due = [key for key, entry in self._pending.items() if entry.deadline <= now]
+                    if due:
+                        break
+                    # Los archivos sin más reintentos (deadline infinito) no despiertan al hilo
+                    deadlines = [entry.deadline for entry in self._pending.values() if entry.deadline != float("inf")]
+                    self._condition.wait(min(deadlines) - now if deadlines else None)
+            for key in due:
+                self._flush_entry(key)
+
+    def flush(self, path: Optional[PathLike] = None) -> None:
+        """Escribe ya lo pendiente (de ``path`` o de todos los archivos).
+
+        Lanza ``OSError`` con los archivos que no se pudieron escribir (siguen pendientes).
+        """
+        with self._condition:
+            keys = [self._key(path)] if path is not None else list(self._pending)
+        errors = []
+        for key in keys:
+            # Una versión que llegue durante la escritura también se vuelca
+            while self.pending(key) is not None:
+                error = self._flush_entry(key)
+                if error is not None:
+                    errors.append(f"{key}: {error}")
+                    break
+        if errors:
+            raise OSError(f"No se pudieron escribir {len(errors)} archivo(s): {'; '.join(errors)}")
+
+    def close(self) -> None:
+        """Vuelca todo y pasa a escritura inmediata (apagado de la aplicación).
+
+        Lanza ``OSError`` si algún archivo no se pudo escribir.
+        """
+        try:
+            self.flush()
+        finally:
+            with self._condition:
+                self._closed = True
+                self._condition.notify_all()
+                thread, self._thread = self._thread, None
+            if thread is not None and thread is not threading.current_thread():
+                thread.join(timeout=5)
+
+    # === LECTURA ===
+
+    def pending(self, path: PathLike) -> Optional[str]:
+        """Contenido pendiente de ``path`` (None si el disco está al día)."""
+        with self._condition:
+            entry = self._pending.get(self._key(path))
+            return entry.content if entry is not None else None
+
+    def exists(self, path: PathLike) -> bool:
+        return self.pending(path) is not None or os.path.exists(path)
+
+    def load_json(self, path: PathLike) -> Any:
+        """Parsea ``path`` viendo la versión pendiente si la hay (FileNotFoundError si no existe)."""
+        content = self.pending(path)
+        if content is None:
+            with open(path, "r", encoding="utf-8") as fh:
+                return json.load(fh)
+        return json.loads(content)
+
+    def dump_json(self, path: PathLike, data: Any, on_flushed: Optional[FlushCallback] = None) -> None:
+        """Serializa ``data`` como en los JSON de ``base_datos/`` y lo encola."""
+        self.write(path, json.dumps(data, indent=2, ensure_ascii=False), on_flushed)
+
+    # === MÉTRICAS ===
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._condition:
+            now = time.monotonic()
+            latencies = sorted(self._flush_latencies)
+            oldest = min((entry.queued_at for entry in self._pending.values()), default=None)
+            return {
+                "window_seconds": self.window,
+                "pending_files": len(self._pending),
+                "failing_files": sorted(str(key) for key, entry in self._pending.items() if entry.failures),
+                "oldest_pending_seconds": round(now - oldest, 3) if oldest is not None else 0.0,
+                **self.stats,
+                "coalescing_ratio": round(
+                    self.stats["writes_requested"] / self.stats["flushes"], 2
+                ) if self.stats["flushes"] else 0.0,
+                "flush_latency_ms": {
+                    "last": round(self._flush_latencies[-1] * 1000, 3) if latencies else 0.0,
+                    "avg": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+                    "p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 3) if latencies else 0.0,
+                    "max": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+                },
+            }
+
+
+# Instancia global del escritor
+write_behind = WriteBehindWriter(
+    window=float(os.getenv("STORAGE_WRITE_BEHIND_WINDOW", "0.05")),
+    max_retries=int(os.getenv("STORAGE_WRITE_BEHIND_RETRIES", "5")),
+)
+atexit.register(write_behind.close)
@@ -10,3 +10,5 @@ class Printer(BaseModel):
     capabilities: Optional[List[str]] = None
     location: Optional[str] = None
     realtime_data: dict = {}
+    # Salud del host según su circuit breaker; no se persiste
+    health: Optional[dict] = None
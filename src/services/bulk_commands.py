@@ -0,0 +1,155 @@
+"""
+Motor de comandos masivos sobre la flota.
+
+Los destinos se resuelven con el último estado conocido (snapshot en memoria),
+sin sondear la flota antes de actuar, así que un ``pause`` de emergencia sale
+hacia la primera impresora en milisegundos. Los comandos se ejecutan con
+concurrencia acotada y un plazo por impresora, y cada resultado se entrega en
+cuanto esa impresora responde. Los comandos disruptivos (reinicios) se
+despliegan por oleadas escalonadas para no tumbar toda la flota a la vez.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Comandos aceptados por el motor
+BULK_COMMANDS = ("home", "pause", "resume", "cancel", "restart_klipper", "restart_firmware")
+
+# Comandos que se despliegan escalonados por defecto
+STAGGERED_COMMANDS = ("restart_klipper", "restart_firmware", "restart_klipper_service")
+
+
+class BulkCommandEngine:
+    """Ejecuta un comando en varias impresoras y entrega los resultados según llegan."""
+
+    def __init__(
+        self,
+        fleet,
+        max_concurrency: int = 16,
+        deadline: float = 10.0,
+        stagger_batch: int = 5,
+        stagger_interval: float = 5.0,
+    ):
+        """
+        Args:
+            fleet: FleetService que ejecuta cada comando individual
+            max_concurrency: Comandos en vuelo como máximo (en todas las ejecuciones)
+            deadline: Segundos que se espera a cada impresora antes de darla por fallida
+            stagger_batch: Impresoras por oleada en los comandos escalonados
+            stagger_interval: Segundos entre el final de una oleada y el inicio de la siguiente
+        """
+        self.fleet = fleet
+        self.deadline = deadline
+        self.stagger_batch = stagger_batch
+        self.stagger_interval = stagger_interval
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        # Ejecuciones cuyo consumidor se fue: siguen hasta terminar los comandos ya lanzados
+        self._detached = set()
+        self.stats = {"runs": 0, "commands": 0, "succeeded": 0, "failed": 0, "timed_out": 0}
+
+    def plan_waves(self, printers: List[Any], command: str, batch_size: Optional[int] = None) -> List[List[Any]]:
+        """Reparte los destinos en oleadas; los comandos no disruptivos van en una sola."""
+        if batch_size is None:
+            batch_size = self.stagger_batch if command in STAGGERED_COMMANDS else 0
+        if not batch_size or batch_size >= len(printers):
+            return [list(printers)]
+        return [printers[i:i + batch_size] for i in range(0, len(printers), batch_size)]
+
+    async def stream(
+        self,
+        printers: List[Any],
+        command: str,
+        axis: Optional[str] = None,
+        parameters: Optional[Dict[str, Any]] = None,
+        deadline: Optional[float] = None,
+        batch_size: Optional[int] = None,
+        batch_interval: Optional[float] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Lanza el comando y produce un resultado por impresora en orden de llegada.
+
+        Si el consumidor deja de iterar, los comandos ya lanzados terminan igualmente
+        (no se deja una pausa de emergencia a medias), pero no se inician más oleadas.
+        """
+        waves = self.plan_waves(printers, command, batch_size)
+        interval = self.stagger_interval if batch_interval is None else batch_interval
+        deadline = deadline or self.deadline
+        results: asyncio.Queue = asyncio.Queue()
+        abandoned = asyncio.Event()
+        self.stats["runs"] += 1
+
+        async def dispatch():
+            for index, wave in enumerate(waves):
+                if index:
+                    await asyncio.sleep(interval)
+                    if abandoned.is_set():
+                        logger.warning(f"Comando masivo {command} abandonado: quedan {len(waves) - index} oleada(s) sin lanzar")
+                        return
+                await asyncio.gather(*(
+                    self._run_one(printer, command, axis, parameters, deadline, index, results)
+                    for printer in wave
+                ))
+
+        dispatcher = asyncio.create_task(dispatch())
+        delivered = 0
+        try:
+            while delivered < len(printers):
+                if dispatcher.done():
+                    if results.empty():
+                        dispatcher.result()  # propaga errores inesperados del despachador
+                        break
+                    result = results.get_nowait()
+                else:
+                    getter = asyncio.ensure_future(results.get())
+                    await asyncio.wait({getter, dispatcher}, return_when=asyncio.FIRST_COMPLETED)
+                    if not getter.done():
+                        getter.cancel()
+                        continue
+                    result = getter.result()
+                delivered += 1
+                yield result
+        finally:
+            if not dispatcher.done():
+                abandoned.set()
+                self._detached.add(dispatcher)
+                dispatcher.add_done_callback(self._detached.discard)
+
+    async def run(self, printers: List[Any], command: str, **kwargs) -> List[Dict[str, Any]]:
+        """Como ``stream`` pero espera a todas las impresoras; resultados en orden de llegada."""
+        return [result async for result in self.stream(printers, command, **kwargs)]
+
+    async def _run_one(self, printer, command, axis, parameters, deadline, wave, results: asyncio.Queue):
+        started = time.monotonic()
+        result = {"printer_id": printer.id, "printer_name": printer.name, "wave": wave}
+        try:
+            async with self._semaphore:
+                self.stats["commands"] += 1
+                outcome = await asyncio.wait_for(
+                    self.fleet._execute_single_command(printer, command, axis, parameters),
+                    timeout=deadline,
+                )
+            result.update({"success": True, "result": outcome})
+            self.stats["succeeded"] += 1
+        except asyncio.TimeoutError:
+            result.update({"success": False, "error": f"Sin respuesta en {deadline:g}s", "timed_out": True})
+            self.stats["failed"] += 1
+            self.stats["timed_out"] += 1
+        except Exception as e:
+            result.update({"success": False, "error": str(e)})
+            self.stats["failed"] += 1
+        result["duration_ms"] = round((time.monotonic() - started) * 1000, 1)
+        result["timestamp"] = datetime.now().isoformat()
+        await results.put(result)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "max_concurrency": self.max_concurrency,
+            "deadline": self.deadline,
+            "detached_runs": len(self._detached),
+        }
@@ -0,0 +1,217 @@
+"""
+Circuit breaker por host de Moonraker y puntuación de salud.
+
+Cada host (``ip:puerto``) tiene un breaker con tres estados:
+
+- ``closed``: las peticiones pasan y se registran latencia y errores.
+- ``open``: tras varios fallos seguidos o una tasa de error alta las peticiones
+  se rechazan al instante, sin esperar timeouts de red.
+- ``half_open``: pasado el tiempo de enfriamiento se deja pasar una única
+  petición de prueba; si funciona el circuito se cierra, si no vuelve a abrirse
+  con un enfriamiento mayor.
+"""
+
+import logging
+import time
+from collections import deque
+from enum import Enum
+from typing import Any, Deque, Dict, Optional, Tuple
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitState(str, Enum):
+    """Estados posibles de un circuit breaker"""
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(aiohttp.ClientConnectionError):
+    """Petición rechazada porque el circuito del host está abierto.
+
+    Hereda de ``ClientConnectionError`` para que los manejadores existentes de
+    ``aiohttp.ClientError`` la traten como un host inalcanzable.
+    """
+
+
+class CircuitBreaker:
+    """Circuit breaker con estadísticas móviles de latencia y errores para un host."""
+
+    def __init__(
+        self,
+        host: str,
+        failure_threshold: int = 3,
+        error_rate_threshold: float = 0.5,
+        window_size: int = 20,
+        min_samples: int = 10,
+        open_timeout: float = 10.0,
+        max_open_timeout: float = 120.0,
+        slow_latency: float = 1.0,
+    ):
+        """
+        Args:
+            host: Identificador del host (``ip:puerto``)
+            failure_threshold: Fallos consecutivos que abren el circuito
+            error_rate_threshold: Tasa de error en la ventana que abre el circuito
+            window_size: Número de peticiones de la ventana móvil
+            min_samples: Muestras mínimas antes de evaluar la tasa de error
+            open_timeout: Enfriamiento inicial antes de pasar a half-open
+            max_open_timeout: Enfriamiento máximo tras reaperturas sucesivas
+            slow_latency: Latencia (s) a partir de la cual se penaliza la salud
+        """
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.min_samples = min_samples
+        self.base_open_timeout = open_timeout
+        self.max_open_timeout = max_open_timeout
+        self.slow_latency = slow_latency
+
+        self.state = CircuitState.CLOSED
+        self.open_timeout = open_timeout
+        self._window: Deque[Tuple[bool, float]] = deque(maxlen=window_size)
+        self._consecutive_failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_in_flight = False
+        self._last_success: Optional[float] = None
+        self._last_failure: Optional[float] = None
+        self.times_opened = 0
+        self.rejected = 0
+
+    # === CONTROL DE PETICIONES ===
+
+    def is_open(self) -> bool:
+        """True si las peticiones se rechazarían ahora mismo (sin cambiar de estado)."""
+        if self.state == CircuitState.OPEN:
+            return time.monotonic() - self._opened_at < self.open_timeout
+        return self.state == CircuitState.HALF_OPEN and self._probe_in_flight
+
+    def allow_request(self) -> bool:
+        """Decide si una petición puede salir hacia el host."""
+        if self.state == CircuitState.CLOSED:
+            return True
+        if self.state == CircuitState.OPEN:
+            if time.monotonic() - self._opened_at >= self.open_timeout:
+                logger.info(f"Circuito de {self.host} en half-open: enviando petición de prueba")
+                self.state = CircuitState.HALF_OPEN
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+        # HALF_OPEN: solo una petición de prueba a la vez
+        if self._probe_in_flight:
+            self.rejected += 1
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def record_success(self, latency: float):
+        self._window.append((True, latency))
+        self._consecutive_failures = 0
+        self._last_success = time.monotonic()
+        if self.state != CircuitState.CLOSED:
+            logger.info(f"Circuito de {self.host} cerrado tras petición exitosa")
+            self.state = CircuitState.CLOSED
+            self.open_timeout = self.base_open_timeout
+            self._probe_in_flight = False
+
+    def record_failure(self, latency: float):
+        self._window.append((False, latency))
+        self._consecutive_failures += 1
+        self._last_failure = time.monotonic()
+
+        if self.state == CircuitState.HALF_OPEN:
+            self._probe_in_flight = False
+            self._open(min(self.open_timeout * 2, self.max_open_timeout))
+        elif self.state == CircuitState.CLOSED and self._should_trip():
+            self._open(self.base_open_timeout)
+
+    def _should_trip(self) -> bool:
+        if self._consecutive_failures >= self.failure_threshold:
+            return True
+        return len(self._window) >= self.min_samples and self.error_rate >= self.error_rate_threshold
+
+    def _open(self, timeout: float):
+        self.state = CircuitState.OPEN
+        self.open_timeout = timeout
+        self._opened_at = time.monotonic()
+        self.times_opened += 1
+        logger.warning(f"Circuito de {self.host} abierto durante {timeout:.0f}s")
+
+    # === ESTADÍSTICAS ===
+
+    @property
+    def error_rate(self) -> float:
+        if not self._window:
+            return 0.0
+        return sum(1 for ok, _ in self._window if not ok) / len(self._window)
+
+    @property
+    def avg_latency(self) -> Optional[float]:
+        latencies = [latency for ok, latency in self._window if ok]
+        if not latencies:
+            return None
+        return sum(latencies) / len(latencies)
+
+    @property
+    def health_score(self) -> int:
+        """Puntuación 0-100: 0 con el circuito abierto, 100 sin errores y latencia baja."""
+        if self.state == CircuitState.OPEN:
+            return 0
+        if self.state == CircuitState.HALF_OPEN:
+            return 25
+        score = 100.0 * (1.0 - self.error_rate)
+        latency = self.avg_latency
+        if latency is not None and latency > self.slow_latency:
+            score -= min(30.0, 30.0 * (latency - self.slow_latency) / self.slow_latency)
+        return max(0, int(round(score)))
+
+    def get_health(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        latency = self.avg_latency
+        return {
+            "host": self.host,
+            "state": self.state.value,
+            "score": self.health_score,
+            "error_rate": round(self.error_rate, 3),
+            "avg_latency_ms": round(latency * 1000, 1) if latency is not None else None,
+            "samples": len(self._window),
+            "consecutive_failures": self._consecutive_failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+            "retry_in": round(max(0.0, self._opened_at + self.open_timeout - now), 1)
+            if self.state == CircuitState.OPEN else None,
+        }
+
+
+class HostHealthRegistry:
+    """Registro global de circuit breakers indexado por host."""
+
+    def __init__(self, **breaker_options):
+        self._breaker_options = breaker_options
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get_breaker(self, host: str) -> CircuitBreaker:
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(host, **self._breaker_options)
+            self._breakers[host] = breaker
+        return breaker
+
+    def get_health(self, host: str) -> Dict[str, Any]:
+        return self.get_breaker(host).get_health()
+
+    def is_available(self, host: str) -> bool:
+        """True si el host no tiene el circuito abierto."""
+        breaker = self._breakers.get(host)
+        return breaker is None or not breaker.is_open()
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {host: breaker.get_health() for host, breaker in self._breakers.items()}
+
+
+# Instancia global compartida por todos los MoonrakerClient
+host_health = HostHealthRegistry()
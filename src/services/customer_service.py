@@ -21,7 +21,8 @@ class CustomerService:
 
     def get_all_customers(self) -> List[Customer]:
         """Obtiene todos los clientes del sistema."""
-        customers_data = self._repo.list_customers()
+        # Copias: los dicts del repositorio son los de su caché y no deben modificarse
+        customers_data = [dict(customer) for customer in self._repo.list_customers()]
         
         # Convertir strings de fechas a objetos datetime si es necesario
         for customer in customers_data:
@@ -35,7 +36,7 @@ class CustomerService:
     def get_customer(self, customer_id: str) -> Customer:
         """Obtiene un cliente por ID."""
         try:
-            customer_data = self._repo.get_customer_by_id(customer_id)
+            customer_data = dict(self._repo.get_customer_by_id(customer_id))
             
             # Convertir strings de fechas a objetos datetime si es necesario
             if isinstance(customer_data.get('created_at'), str):
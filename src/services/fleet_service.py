@@ -1,48 +1,136 @@
 import uuid
 import json
 import os
+import shutil
 import asyncio
 import aiohttp
 from src.models.printer import Printer
 from src.schemas.printer import PrinterCreate
 from src.services.moonraker_client import MoonrakerClient
+from src.services.circuit_breaker import CircuitOpenError, host_health
+from src.services.printer_state_cache import (
+    SUBSCRIBED_OBJECTS, PrinterStateCache, build_realtime_data, klippy_state_in
+)
+from src.services.telemetry_store import TelemetryStore
+from src.services.gcode_file_index import GcodeFileIndex
+from src.services.thumbnail_cache import ThumbnailCache, thumbnail_cache_key
+from src.services.gcode_transfer import GcodeDownload, TransferMonitor
+from src.services.gcode_distribution import GcodeDistributor
+from src.services.bulk_commands import BulkCommandEngine
+from src.services.print_dispatcher import PrintDispatcher
+from src.services.sharding import FleetSharding, create_registry
+from src.services.http_clients import MOONRAKER_POOL, http_clients
 import logging
 
 # Configuración del logger
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Objetos de Klipper que se consultan para el estado de una impresora
+STATUS_OBJECTS = list(SUBSCRIBED_OBJECTS)
+
 class FleetService:
     def __init__(self, printers_file='base_datos/printers.json'):
         self.printers_file = printers_file
         self.printers = self._load_printers()
-        self._session = None
+        # Callbacks ``callback()`` tras guardar printers.json (p. ej. avisar a otros workers)
+        self._printers_listeners = []
         self._session_timeout = aiohttp.ClientTimeout(
             total=10,  # Timeout total de 10 segundos
             connect=3,  # Timeout de conexión de 3 segundos
             sock_read=5  # Timeout de lectura de 5 segundos
         )
+        # Reparto de las impresoras entre nodos KyberCore (hashing consistente sobre los IDs)
+        self.sharding = FleetSharding(
+            self,
+            registry=create_registry(),
+            node_id=os.getenv("FLEET_CLUSTER_NODE_ID"),
+            url=os.getenv("FLEET_CLUSTER_URL"),
+            heartbeat_interval=float(os.getenv("FLEET_CLUSTER_HEARTBEAT", "2")),
+            node_ttl=float(os.getenv("FLEET_CLUSTER_NODE_TTL", "10")),
+        )
+        # Pool HTTP compartido con el resto de servicios que hablan con Moonraker
+        self._pool_per_host = int(os.getenv("HTTP_MOONRAKER_PER_HOST", "5"))
+        self._pool_min_size = int(os.getenv("HTTP_MOONRAKER_MIN_POOL", "10"))
+        http_clients.configure(
+            MOONRAKER_POOL,
+            limit=self._moonraker_pool_limit(),
+            limit_per_host=self._pool_per_host,
+            timeout=self._session_timeout,
+        )
+        # Snapshot en memoria alimentado por suscripciones WebSocket de Moonraker
+        self.state_cache = PrinterStateCache(self)
+        # Antigüedad máxima (s) de un snapshot HTTP para considerarlo vigente
+        self.snapshot_max_age = 15.0
+        # Intervalo (s) de consulta de ``wait_for`` cuando la caché de estado no está activa
+        self.wait_poll_interval = 2.0
+        # Antigüedad máxima (s) aceptada para /printer/info memorizado (hostname, versiones)
+        self.printer_info_max_age = 300.0
+        # Histórico de temperaturas y progreso; los puntos de 10 s se vuelcan junto a printers.json
+        spill_path = None
+        if os.getenv("FLEET_TELEMETRY_SPILL", "true").lower() == "true":
+            spill_path = os.path.join(os.path.dirname(printers_file) or ".", "telemetry.jsonl")
+        self.telemetry = TelemetryStore(spill_path=spill_path)
+        self.state_cache.add_listener(self._record_telemetry)
+        # Índice de archivos G-code de la flota, mantenido con notify_filelist_changed
+        self.file_index = GcodeFileIndex(
+            self,
+            reconcile_interval=float(os.getenv("FLEET_FILE_INDEX_RECONCILE", "600")),
+        )
+        self.state_cache.add_notification_handler("notify_filelist_changed", self.file_index.handle_filelist_changed)
+        # Descargas de G-code en streaming y su rendimiento
+        self.transfers = TransferMonitor()
+        # Thumbnails extraídos, en disco junto a printers.json y direccionados por versión del archivo
+        self.thumbnail_cache = ThumbnailCache(
+            os.path.join(os.path.dirname(printers_file) or ".", "thumbnails"),
+            max_bytes=int(os.getenv("FLEET_THUMBNAIL_CACHE_MB", "200")) * 1024 * 1024,
+        )
+        # Comandos masivos con concurrencia acotada, plazo por impresora y reinicios escalonados
+        self.bulk_engine = BulkCommandEngine(
+            self,
+            max_concurrency=int(os.getenv("FLEET_BULK_CONCURRENCY", "16")),
+            deadline=float(os.getenv("FLEET_BULK_DEADLINE", "10")),
+            stagger_batch=int(os.getenv("FLEET_BULK_STAGGER_BATCH", "5")),
+            stagger_interval=float(os.getenv("FLEET_BULK_STAGGER_INTERVAL", "5")),
+        )
+        # Subidas en paralelo de un G-code a varias impresoras, con límite global
+        self.distributor = GcodeDistributor(
+            self,
+            max_concurrency=int(os.getenv("FLEET_DISTRIBUTION_CONCURRENCY", "20")),
+            max_bandwidth_bps=float(os.getenv("FLEET_DISTRIBUTION_MAX_MBPS", "0")) * 1e6 / 8,
+            max_attempts=int(os.getenv("FLEET_DISTRIBUTION_ATTEMPTS", "3")),
+        )
+        # Cola de impresión despachada automáticamente a las impresoras que quedan libres
+        self.dispatcher = PrintDispatcher(
+            self,
+            log_path=os.path.join(os.path.dirname(printers_file) or ".", "print_dispatch.jsonl"),
+            sweep_interval=float(os.getenv("FLEET_DISPATCH_SWEEP_INTERVAL", "5")),
+            start_grace=float(os.getenv("FLEET_DISPATCH_START_GRACE", "60")),
+        )
+        self.state_cache.add_listener(self.dispatcher.observe)
+        self.sharding.add_listener(self._on_ownership_changed)
+
+    def _moonraker_pool_limit(self):
+        """Conexiones totales del pool de Moonraker: crece con el número de impresoras del nodo."""
+        return max(self._pool_min_size, self._pool_per_host * len(self.owned_printer_ids()))
+
+    def owned_printer_ids(self):
+        """IDs de las impresoras que monitoriza este nodo (todas si no hay reparto)."""
+        return [printer_id for printer_id in self.printers if self.sharding.owns(printer_id)]
+
+    def _on_ownership_changed(self):
+        """Un nodo entró o salió del reparto: se ajustan suscripciones y despacho."""
+        self.state_cache.sync_printers()
+        self.dispatcher.wake(self.owned_printer_ids())
 
     async def _get_session(self):
-        """Obtiene o crea una sesión HTTP reutilizable"""
-        if self._session is None or self._session.closed:
-            connector = aiohttp.TCPConnector(
-                limit=10,  # Máximo 10 conexiones concurrentes
-                limit_per_host=5,  # Máximo 5 por host
-                ttl_dns_cache=300,  # Cache DNS por 5 minutos
-                use_dns_cache=True,
-            )
-            self._session = aiohttp.ClientSession(
-                timeout=self._session_timeout,
-                connector=connector
-            )
-        return self._session
+        """Sesión HTTP compartida del pool de Moonraker, dimensionado según la flota"""
+        http_clients.set_limit(MOONRAKER_POOL, self._moonraker_pool_limit())
+        return await http_clients.get_session(MOONRAKER_POOL)
 
     async def close_session(self):
         """Cierra la sesión HTTP de forma segura"""
-        if self._session and not self._session.closed:
-            await self._session.close()
-            self._session = None
+        await http_clients.close_pool(MOONRAKER_POOL)
 
     def _load_printers(self):
         if os.path.exists(self.printers_file):
@@ -57,19 +145,97 @@ class FleetService:
 
     def _save_printers(self):
         try:
-            with open(self.printers_file, 'w') as f:
-                printers_to_save = {p_id: p.model_dump(exclude={'realtime_data'}) for p_id, p in self.printers.items()}
+            # Escritura atómica: otros workers pueden estar releyendo el fichero
+            tmp_file = f"{self.printers_file}.tmp"
+            with open(tmp_file, 'w') as f:
+                printers_to_save = {p_id: p.model_dump(exclude={'realtime_data', 'health'}) for p_id, p in self.printers.items()}
                 json.dump(printers_to_save, f, indent=4)
+            os.replace(tmp_file, self.printers_file)
         except Exception as e:
             logger.error(f"Error guardando impresoras: {e}")
+            return
+        for listener in list(self._printers_listeners):
+            try:
+                listener()
+            except Exception as e:
+                logger.error(f"Error notificando cambio de impresoras: {e}")
+
+    def add_printers_listener(self, callback):
+        """Registra un callback que se invoca cada vez que se guarda printers.json."""
+        self._printers_listeners.append(callback)
+
+    def reload_printers(self):
+        """Relee printers.json tras un cambio hecho por otro worker."""
+        try:
+            with open(self.printers_file, 'r') as f:
+                loaded = {p_id: Printer(**p_data) for p_id, p_data in json.load(f).items()}
+        except Exception as e:
+            # Se conserva la lista actual: mejor desfasada que vacía
+            logger.error(f"Error releyendo impresoras: {e}")
+            return
+        for printer_id in set(self.printers) - set(loaded):
+            self.printers.pop(printer_id)
+            self.telemetry.forget(printer_id)
+            self.file_index.forget(printer_id)
+        for printer_id, printer in loaded.items():
+            current = self.printers.get(printer_id)
+            self.printers[printer_id] = printer
+            if current is not None and current.ip != printer.ip and self.state_cache.running:
+                self.state_cache.restart_printer(printer_id)
+        self.state_cache.sync_printers()
+
+    async def start_background(self, replay_telemetry: bool = True):
+        """Arranca el trabajo en segundo plano contra la flota (solo en el worker líder).
+
+        Args:
+            replay_telemetry: False si el histórico de telemetría ya está cargado en memoria
+        """
+        # Primero el reparto: la caché solo se suscribe a las impresoras de este nodo
+        await self.sharding.start()
+        # Histórico de telemetría antes que la caché: las muestras en vivo van detrás del
+        # histórico recuperado. Después se programa el volcado periódico
+        await self.telemetry.start(replay=replay_telemetry)
+        if os.getenv("FLEET_STATE_CACHE_ENABLED", "true").lower() == "true":
+            # Snapshot en memoria: suscripciones WebSocket + polling adaptativo de respaldo
+            await self.state_cache.start(
+                subscribe=os.getenv("FLEET_MOONRAKER_SUBSCRIPTIONS", "true").lower() == "true"
+            )
+        if os.getenv("FLEET_FILE_INDEX_ENABLED", "true").lower() == "true":
+            # Índice de archivos G-code: indexación inicial y reconciliación periódica
+            await self.file_index.start()
+        if os.getenv("FLEET_DISPATCHER_ENABLED", "true").lower() == "true":
+            # Despacho automático de la cola a las impresoras libres
+            await self.dispatcher.start()
 
-    async def list_printers(self):
-        """Lista las impresoras y enriquece sus datos con el estado de Moonraker."""
+    async def start_mirror(self):
+        """Arranca como réplica: el estado llega del worker líder, sin tráfico hacia las impresoras."""
+        # El histórico se lee sin compactar (el fichero pertenece al líder) y antes que
+        # la réplica de la caché, para que las muestras en vivo queden detrás
+        if self.telemetry.spill_path:
+            await self.telemetry.replay(compact=False)
+        if os.getenv("FLEET_STATE_CACHE_ENABLED", "true").lower() == "true":
+            await self.state_cache.start_mirror()
+
+    async def list_printers(self, owned_only: bool = False):
+        """Lista las impresoras y enriquece sus datos con el estado de Moonraker.
+
+        Args:
+            owned_only: Solo las impresoras que monitoriza este nodo
+        """
         printers_list = list(self.printers.values())
+        if owned_only:
+            printers_list = [printer for printer in printers_list if self.sharding.owns(printer.id)]
         
         if not printers_list:
             return printers_list
         
+        # Con la caché activa el estado se lee del snapshot, sin tráfico a las impresoras
+        if self.state_cache.running:
+            for printer in printers_list:
+                self.state_cache.apply_to_printer(printer)
+                printer.health = self.get_printer_health(printer)
+            return printers_list
+        
         session = await self._get_session()
         
         # Procesar impresoras en lotes para evitar sobrecarga
@@ -89,6 +255,8 @@ class FleetService:
             except Exception as e:
                 logger.error(f"Error procesando lote de impresoras: {e}")
         
+        for printer in printers_list:
+            printer.health = self.get_printer_health(printer)
         return printers_list
 
     async def _update_printer_status(self, printer, session):
@@ -98,139 +266,79 @@ class FleetService:
         
         client = MoonrakerClient(ip, port, session)
         
+        # Con el circuito abierto no se espera a la red: último estado conocido, marcado como obsoleto
+        if client.breaker.is_open():
+            logger.debug(f"Circuito abierto para {printer.name}, se devuelve el último estado conocido")
+            self._mark_stale(printer)
+            return
+        
         try:
-            # Obtener información básica con timeout
-            printer_info = await asyncio.wait_for(
-                client.get_printer_info(), 
+            # Una sola consulta objects/query con estado de Klippy, temperaturas y progreso
+            result = await asyncio.wait_for(
+                client.query_objects(STATUS_OBJECTS),
                 timeout=5.0
             )
             
-            if printer_info and 'result' in printer_info:
-                logger.debug(f"Estado de la impresora {printer.name}: {printer_info['result'].get('state', 'unknown')}")
-                printer.status = printer_info['result'].get('state', 'unknown')
-                printer.realtime_data = printer_info['result']
-
-                # Obtener temperaturas con timeout separado
-                try:
-                    temperatures = await asyncio.wait_for(
-                        client.get_temperatures(),
-                        timeout=3.0
-                    )
-                    
-                    if temperatures and 'result' in temperatures and 'status' in temperatures['result']:
-                        extruder_data = temperatures['result']['status'].get('extruder', {})
-                        heater_bed_data = temperatures['result']['status'].get('heater_bed', {})
-
-                        extruder_temp = extruder_data.get('temperature', 'N/A')
-                        extruder_target = extruder_data.get('target', 'N/A')
-                        #advance
-                        pressure_advance = extruder_data.get('pressure_advance', 'N/A')
-                        smooth_time = extruder_data.get('smooth_time', 'N/A')
-                        motion_queue = extruder_data.get('motion_queue', 'N/A')
-
-                        bed_temp = heater_bed_data.get('temperature', 'N/A')
-                        bed_target = heater_bed_data.get('target', 'N/A')
-
-                        printer.realtime_data.update({
-                            'extruder_temp': extruder_temp,
-                            'extruder_target': extruder_target,
-                            'bed_temp': bed_temp,
-                            'bed_target': bed_target,
-                            'pressure_advance': pressure_advance,
-                            'smooth_time': smooth_time,
-                            'motion_queue': motion_queue
-                        })
-
-                        logger.debug(f"Temperatura del hotend: {extruder_temp}/{extruder_target}, Temperatura de la cama: {bed_temp}/{bed_target}")
-                    else:
-                        logger.debug(f"No se pudieron obtener las temperaturas para la impresora {printer.name}")
-                        
-                except asyncio.TimeoutError:
-                    logger.warning(f"Timeout obteniendo temperaturas para {printer.name}")
-                except Exception as e:
-                    logger.warning(f"Error obteniendo temperaturas para {printer.name}: {e}")
-
-                # Obtener progreso de impresión
+            if result and 'result' in result and 'status' in result['result']:
+                status = result['result']['status']
+                printer.status = status.get('webhooks', {}).get('state', 'unknown')
+                logger.debug(f"Estado de la impresora {printer.name}: {printer.status}")
+                
+                # Hostname y versiones apenas cambian: se aceptan de la memoria durante minutos
+                info = None
                 try:
-                    print_stats = await asyncio.wait_for(
-                        client.get_print_stats(),
+                    printer_info = await asyncio.wait_for(
+                        client.get_printer_info(max_age=self.printer_info_max_age),
                         timeout=3.0
                     )
-                    
-                    if print_stats and 'result' in print_stats and 'status' in print_stats['result']:
-                        virtual_sdcard_data = print_stats['result']['status'].get('virtual_sdcard', {})
-                        print_stats_data = print_stats['result']['status'].get('print_stats', {})
-                                                
-                        # Calcular progreso basado en virtual_sdcard
-                        progress = virtual_sdcard_data.get('progress', 0.0) * 100
-                        
-                        # Información adicional de estadísticas de impresión
-                        state = print_stats_data.get('state', 'unknown')
-                        filename = print_stats_data.get('filename', '')
-                        total_duration = print_stats_data.get('total_duration', 0)
-                        print_duration = print_stats_data.get('print_duration', 0)
-                        filament_used = print_stats_data.get('filament_used', 0)
-
-                        printer.realtime_data.update({
-                            'print_progress': round(progress, 1),
-                            'print_state': state,
-                            'print_filename': filename,
-                            'print_total_duration': total_duration,
-                            'print_duration': print_duration,
-                            'filament_used': filament_used                        
-                        })
-                        
-                        logger.debug(f"Progreso de impresión para {printer.name}: {progress:.1f}% - Estado: {state}")
-                    else:
-                        logger.debug(f"No se pudieron obtener estadísticas de impresión para {printer.name}")
-                        printer.realtime_data.update({
-                            'print_progress': 0,
-                            'print_state': 'unknown',
-                            'print_filename': '',
-                            'print_total_duration': 0,
-                            'print_duration': 0,
-                            'filament_used': 0
-                        })
-                        
+                    if printer_info and 'result' in printer_info:
+                        info = printer_info['result']
                 except asyncio.TimeoutError:
-                    logger.warning(f"Timeout obteniendo progreso de impresión para {printer.name}")
-                    printer.realtime_data.update({
-                        'print_progress': 0,
-                        'print_state': 'unknown',
-                        'print_filename': '',
-                        'print_total_duration': 0,
-                        'print_duration': 0,
-                        'filament_used': 0
-                    })
-                except Exception as e:
-                    logger.warning(f"Error obteniendo progreso de impresión para {printer.name}: {e}")
-                    printer.realtime_data.update({
-                        'print_progress': 0,
-                        'print_state': 'unknown',
-                        'print_filename': '',
-                        'print_total_duration': 0,
-                        'print_duration': 0,
-                        'filament_used': 0
-                    })
-                    
+                    logger.warning(f"Timeout obteniendo información de {printer.name}")
+                
+                printer.realtime_data = build_realtime_data(status, info)
+                self.telemetry.record(printer.id, printer.realtime_data)
             else:
                 logger.warning(f"No se pudo conectar a la impresora {printer.name} en {ip}:{port}")
-                printer.status = "unreachable"
-                printer.realtime_data = None
+                self._mark_stale(printer, "unreachable")
                 
         except asyncio.TimeoutError:
             logger.warning(f"Timeout conectando a impresora {printer.name}")
-            printer.status = "timeout"
-            printer.realtime_data = None
+            self._mark_stale(printer, "timeout")
         except Exception as e:
             logger.error(f"Error conectando a impresora {printer.name}: {e}")
-            printer.status = "error"
-            printer.realtime_data = None
+            self._mark_stale(printer, "error")
         finally:
             # Asegurar que realtime_data siempre existe
             if not hasattr(printer, 'realtime_data') or printer.realtime_data is None:
                 printer.realtime_data = {}
 
+    def _record_telemetry(self, printer_id, delta):
+        """Listener de la caché: registra una muestra de telemetría con cada cambio de estado."""
+        if printer_id in self.printers:
+            self.telemetry.record(printer_id, self.state_cache.get_realtime_data(printer_id))
+
+    def _mark_stale(self, printer, status=None):
+        """Conserva los últimos datos conocidos de la impresora marcándolos como obsoletos."""
+        if status:
+            printer.status = status
+        data = dict(printer.realtime_data or {})
+        if data:
+            data['stale'] = True
+        printer.realtime_data = data
+
+    def _host_key(self, printer):
+        ip, port = self._parse_ip_port(printer.ip)
+        return f"{ip}:{port}"
+
+    def get_printer_health(self, printer):
+        """Salud del host de la impresora según su circuit breaker (estado, puntuación, latencia)."""
+        return host_health.get_health(self._host_key(printer))
+
+    def is_printer_available(self, printer):
+        """False si el circuito del host está abierto y no merece la pena contactarlo."""
+        return host_health.is_available(self._host_key(printer))
+
     def _parse_ip_port(self, ip_field):
         """Extrae IP y puerto del campo ip. Si no hay puerto, usa 7125 por defecto."""
         if ':' in ip_field:
@@ -241,7 +349,10 @@ class FleetService:
     async def get_printer(self, printer_id):
         """Obtiene una impresora específica y actualiza su estado"""
         printer = self.printers.get(printer_id)
-        if printer:
+        if printer and self.state_cache.running:
+            self.state_cache.apply_to_printer(printer)
+            printer.health = self.get_printer_health(printer)
+        elif printer:
             session = await self._get_session()
             try:
                 await asyncio.wait_for(
@@ -252,6 +363,7 @@ class FleetService:
                 logger.warning(f"Timeout actualizando impresora {printer_id}")
             except Exception as e:
                 logger.error(f"Error actualizando impresora {printer_id}: {e}")
+            printer.health = self.get_printer_health(printer)
         return printer
 
     def add_printer(self, printer_data: PrinterCreate):
@@ -260,16 +372,20 @@ class FleetService:
         printer = Printer(id=printer_id, **printer_data.model_dump())
         self.printers[printer_id] = printer
         self._save_printers()
+        self.state_cache.sync_printers()
         return printer
 
     def update_printer(self, printer_id, printer_data: PrinterCreate):
         """Actualiza una impresora existente"""
         if printer_id in self.printers:
             printer = self.printers[printer_id]
+            previous_ip = printer.ip
             update_data = printer_data.model_dump(exclude_unset=True)
             for key, value in update_data.items():
                 setattr(printer, key, value)
             self._save_printers()
+            if printer.ip != previous_ip and self.state_cache.running:
+                self.state_cache.restart_printer(printer_id)
             return printer
         return None
 
@@ -278,6 +394,9 @@ class FleetService:
         if printer_id in self.printers:
             deleted_printer = self.printers.pop(printer_id)
             self._save_printers()
+            self.state_cache.sync_printers()
+            self.telemetry.forget(printer_id)
+            self.file_index.forget(printer_id)
             return deleted_printer
         return None
 
@@ -435,6 +554,12 @@ class FleetService:
     async def cleanup(self):
         """Limpieza de recursos al cerrar"""
         logger.info("Limpiando recursos de FleetService")
+        await self.dispatcher.stop()
+        await self.state_cache.stop()
+        await self.sharding.stop()
+        await self.file_index.stop()
+        await self.distributor.stop()
+        await self.telemetry.stop()
         await self.close_session()
         logger.info("FleetService limpiado")
 
@@ -466,11 +591,22 @@ class FleetService:
 
     # 🚀 NUEVOS MÉTODOS PARA COMANDOS MASIVOS
 
+    def get_known_printers(self):
+        """Impresoras con el último estado conocido del snapshot en memoria, sin tráfico de red."""
+        printers_list = list(self.printers.values())
+        if self.state_cache.running:
+            for printer in printers_list:
+                self.state_cache.apply_to_printer(printer)
+                printer.health = self.get_printer_health(printer)
+        return printers_list
+
     async def get_target_printers(self, printer_ids=None, filters=None):
-        """Obtiene la lista de impresoras objetivo basado en IDs específicos o filtros."""
+        """Obtiene la lista de impresoras objetivo basado en IDs específicos o filtros.
+
+        Se resuelve con el estado en memoria: un comando urgente no espera a sondear la flota.
+        """
         try:
-            # Obtener todas las impresoras
-            all_printers = await self.list_printers()
+            all_printers = self.get_known_printers()
             
             # Si se especificaron IDs específicos, usar solo esos
             if printer_ids:
@@ -481,7 +617,10 @@ class FleetService:
             # Aplicar filtros adicionales si existen
             if filters:
                 if "status" in filters:
-                    target_printers = [p for p in target_printers if p.status == filters["status"]]
+                    statuses = filters["status"]
+                    if isinstance(statuses, str):
+                        statuses = [statuses]
+                    target_printers = [p for p in target_printers if p.status in statuses]
                 
                 if "tags" in filters and filters["tags"]:
                     target_printers = [p for p in target_printers 
@@ -490,6 +629,9 @@ class FleetService:
                 
                 if "exclude_printing" in filters and filters["exclude_printing"]:
                     target_printers = [p for p in target_printers if p.status != "printing"]
+                
+                if filters.get("exclude_unhealthy"):
+                    target_printers = [p for p in target_printers if self.is_printer_available(p)]
             
             return target_printers
             
@@ -497,42 +639,15 @@ class FleetService:
             logger.error(f"Error obteniendo impresoras objetivo: {e}")
             raise
 
-    async def execute_bulk_command(self, printers, command, axis=None, parameters=None):
-        """Ejecuta un comando en múltiples impresoras de forma concurrente."""
+    async def execute_bulk_command(self, printers, command, axis=None, parameters=None, **options):
+        """Ejecuta un comando en múltiples impresoras y devuelve los resultados en el orden de ``printers``.
+
+        Para recibir cada resultado según llega usar ``bulk_engine.stream``.
+        """
         try:
-            from datetime import datetime
-            
-            # Crear tareas para ejecución en paralelo
-            tasks = []
-            for printer in printers:
-                task = self._execute_single_command(printer, command, axis, parameters)
-                tasks.append(task)
-            
-            # Ejecutar todas las tareas en paralelo con timeout
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-            
-            # Procesar resultados y excepciones
-            processed_results = []
-            for i, result in enumerate(results):
-                printer = printers[i]
-                if isinstance(result, Exception):
-                    processed_results.append({
-                        "printer_id": printer.id,
-                        "printer_name": printer.name,
-                        "success": False,
-                        "error": str(result),
-                        "timestamp": datetime.now().isoformat()
-                    })
-                else:
-                    processed_results.append({
-                        "printer_id": printer.id,
-                        "printer_name": printer.name,
-                        "success": True,
-                        "result": result,
-                        "timestamp": datetime.now().isoformat()
-                    })
-            
-            return processed_results
+            results = await self.bulk_engine.run(printers, command, axis=axis, parameters=parameters, **options)
+            order = {printer.id: index for index, printer in enumerate(printers)}
+            return sorted(results, key=lambda result: order[result["printer_id"]])
             
         except Exception as e:
             logger.error(f"Error ejecutando comando masivo: {e}")
@@ -543,6 +658,10 @@ class FleetService:
         try:
             printer_id = printer.id
             
+            # Hosts con el circuito abierto fallan al instante en vez de agotar timeouts
+            if not self.is_printer_available(printer):
+                raise CircuitOpenError(f"Impresora {printer_id} no disponible (circuito abierto)")
+            
             # Log de inicio
             logger.info(f"Ejecutando comando {command} en impresora {printer_id}")
             
@@ -615,47 +734,20 @@ class FleetService:
     # === GESTIÓN DE ARCHIVOS G-CODE ===
 
     async def list_printer_gcode_files(self, printer_id: str):
-        """Lista archivos G-code disponibles en una impresora específica."""
+        """Lista archivos G-code disponibles en una impresora específica.
+
+        Se responde desde el índice de archivos; la primera vez se indexa la impresora.
+        """
         printer = self.printers.get(printer_id)
         if not printer:
             raise ValueError(f"Impresora con ID {printer_id} no encontrada")
         
         try:
-            ip, port = self._parse_ip_port(printer.ip)
-            session = await self._get_session()
-            client = MoonrakerClient(ip, port, session)
-            
-            files = await client.list_gcode_files()
+            if not self.file_index.is_synced(printer_id):
+                await self.file_index.refresh(printer_id)
+            files = self.file_index.list_files(printer_id)
             logger.info(f"Archivos G-code listados para {printer.name}: {len(files)} archivos")
-            
-            # Enriquecer con metadatos
-            enriched_files = []
-            for f in files:
-                try:
-                    filename = f.get('path')  # La clave correcta es 'path', no 'filename'
-                    if not filename:
-                        continue
-                        
-                    metadata = await client.get_gcode_metadata(filename)
-                    estimated_time = None
-                    
-                    if metadata and 'result' in metadata:
-                        estimated_time = metadata['result'].get('estimated_time')
-                    
-                    enriched_files.append({
-                        **f,
-                        'filename': filename,  # Añadir 'filename' para compatibilidad
-                        'estimated_time': estimated_time
-                    })
-                except Exception as e:
-                    logger.warning(f"Error obteniendo metadatos para archivo: {e}")
-                    enriched_files.append({
-                        **f,
-                        'filename': f.get('path', 'unknown'),
-                        'estimated_time': None
-                    })
-            
-            return enriched_files
+            return files
             
         except Exception as e:
             logger.error(f"Error listando archivos G-code para {printer.name}: {e}")
@@ -667,6 +759,10 @@ class FleetService:
         if not printer:
             raise ValueError(f"Impresora con ID {printer_id} no encontrada")
         
+        cached = self.file_index.get_metadata(printer_id, filename)
+        if cached is not None:
+            return cached
+        
         try:
             ip, port = self._parse_ip_port(printer.ip)
             session = await self._get_session()
@@ -674,6 +770,7 @@ class FleetService:
             
             metadata = await client.get_gcode_metadata(filename)
             logger.info(f"Metadatos obtenidos para {filename} en {printer.name}")
+            self.file_index.store_metadata(printer_id, filename, metadata)
             return metadata
             
         except Exception as e:
@@ -693,12 +790,37 @@ class FleetService:
             
             result = await client.upload_gcode_file(file_data, filename, start_print)
             logger.info(f"Archivo {filename} subido a {printer.name} (inicio automático: {start_print})")
+            if result is not None and self.file_index.is_synced(printer_id):
+                self.file_index.schedule_refresh(printer_id)
             return result
             
         except Exception as e:
             logger.error(f"Error subiendo {filename} a {printer.name}: {e}")
             raise
 
+    async def distribute_gcode(self, fileobj, filename: str, printer_ids, start_print: bool = False):
+        """Copia un G-code recibido a disco y lo distribuye en paralelo a varias impresoras.
+
+        Returns:
+            Estado de la distribución recién lanzada (ver ``GcodeDistributor``)
+        """
+        unknown = [printer_id for printer_id in printer_ids if printer_id not in self.printers]
+        if unknown:
+            raise ValueError(f"Impresoras no encontradas: {', '.join(unknown)}")
+
+        spool_dir = os.path.join(os.path.dirname(self.printers_file) or ".", "distributions", uuid.uuid4().hex[:12])
+        source_path = os.path.join(spool_dir, os.path.basename(filename))
+
+        def spool():
+            os.makedirs(spool_dir, exist_ok=True)
+            with open(source_path, "wb") as f:
+                shutil.copyfileobj(fileobj, f, 1024 * 1024)
+
+        await asyncio.to_thread(spool)
+        return self.distributor.submit(
+            source_path, printer_ids, filename=filename, start_print=start_print, owns_source=True
+        )
+
     async def start_printer_print(self, printer_id: str, filename: str):
         """Inicia la impresión de un archivo G-code en una impresora específica."""
         printer = self.printers.get(printer_id)
@@ -731,6 +853,8 @@ class FleetService:
             
             result = await client.delete_gcode_file(filename)
             logger.info(f"Archivo {filename} eliminado de {printer.name}")
+            if result is not None and self.file_index.is_synced(printer_id):
+                self.file_index.schedule_refresh(printer_id)
             return result
             
         except Exception as e:
@@ -738,7 +862,11 @@ class FleetService:
             raise
 
     async def get_printer_gcode_thumbnails(self, printer_id: str, filename: str):
-        """Obtiene thumbnails de un archivo G-code específico, incluyendo los embebidos en comentarios."""
+        """Obtiene thumbnails de un archivo G-code específico, incluyendo los embebidos en comentarios.
+
+        Los thumbnails se guardan en la caché en disco por versión del archivo, así que
+        solo se extraen de la impresora la primera vez que se piden.
+        """
         printer = self.printers.get(printer_id)
         if not printer:
             raise ValueError(f"Impresora con ID {printer_id} no encontrada")
@@ -748,89 +876,117 @@ class FleetService:
             session = await self._get_session()
             client = MoonrakerClient(ip, port, session)
             
-            # Intentar obtener thumbnails usando el nuevo método que lee del G-code
-            thumbnails = await client.get_gcode_thumbnail_data(filename)
-            
-            # Debug logging para verificar estructura de datos
-            logger.info(f"🔍 Thumbnails desde get_gcode_thumbnail_data para {filename}:")
-            for i, thumb in enumerate(thumbnails):
-                logger.info(f"  Thumbnail {i+1}: {thumb.keys() if isinstance(thumb, dict) else type(thumb)}")
-                if isinstance(thumb, dict):
-                    logger.info(f"    - width: {thumb.get('width')}")
-                    logger.info(f"    - height: {thumb.get('height')}")
-                    logger.info(f"    - size: {thumb.get('size')}")
-                    logger.info(f"    - data present: {'data' in thumb}")
-                    if 'data' in thumb:
-                        data_length = len(thumb['data']) if thumb['data'] else 0
-                        logger.info(f"    - data length: {data_length}")
-                        if thumb['data']:
-                            logger.info(f"    - data preview: {thumb['data'][:50]}...")
-            
-            # Si no hay thumbnails, intentar con el método tradicional
-            if not thumbnails:
-                logger.info(f"🔄 Probando método tradicional para {filename}")
-                thumbnails = await client.get_thumbnails(filename)
-                
-                # Debug logging para método tradicional
-                logger.info(f"🔍 Thumbnails desde get_thumbnails para {filename}:")
-                for i, thumb in enumerate(thumbnails):
-                    logger.info(f"  Thumbnail {i+1}: {thumb.keys() if isinstance(thumb, dict) else type(thumb)}")
+            cache_key = await self.get_thumbnail_cache_key(printer_id, filename)
+            if cache_key is None:
+                thumbnails = await self._extract_gcode_thumbnails(printer_id, client, filename)
+            else:
+                thumbnails = await self.thumbnail_cache.get_or_create(
+                    cache_key,
+                    lambda: self._extract_gcode_thumbnails(printer_id, client, filename)
+                )
             
             logger.info(f"✅ Thumbnails finales para {filename} en {printer.name}: {len(thumbnails)} encontrados")
             return {
                 "filename": filename,
                 "printer_id": printer_id,
-                "thumbnails": thumbnails
+                "thumbnails": thumbnails,
+                "cache_key": cache_key
             }
             
         except Exception as e:
             logger.error(f"Error obteniendo thumbnails de {filename} en {printer.name}: {e}")
             raise
 
-    async def download_printer_gcode_file(self, printer_id: str, filename: str):
-        """Descarga un archivo G-code de una impresora específica."""
+    async def get_thumbnail_cache_key(self, printer_id: str, filename: str):
+        """Clave de caché de los thumbnails según la versión indexada del archivo (None si no se conoce)."""
+        if not self.file_index.is_synced(printer_id):
+            await self.file_index.refresh(printer_id)
+        entry = self.file_index.get_entry(printer_id, filename)
+        if entry is None:
+            return None
+        return thumbnail_cache_key(printer_id, filename, entry.get('modified'), entry.get('size'))
+
+    async def _extract_gcode_thumbnails(self, printer_id: str, client: MoonrakerClient, filename: str):
+        # Los metadatos indexados evitan una consulta más a Moonraker
+        metadata = self.file_index.get_metadata(printer_id, filename)
+        thumbnails = await client.get_gcode_thumbnail_data(filename, metadata=metadata)
+        
+        # Si no hay thumbnails, intentar con el método tradicional
+        if not thumbnails:
+            logger.info(f"🔄 Probando método tradicional para {filename}")
+            thumbnails = await client.get_thumbnails(filename)
+        return thumbnails
+
+    async def open_printer_gcode_download(self, printer_id: str, filename: str, range_header: str = None):
+        """Abre la descarga en streaming de un archivo G-code de una impresora específica.
+
+        El cuerpo no se carga en memoria: se reenvía en trozos con ``GcodeDownload.iter_chunks``.
+        """
         printer = self.printers.get(printer_id)
         if not printer:
             raise ValueError(f"Impresora {printer_id} no encontrada")
         
+        ip, port = self._parse_ip_port(printer.ip)
+        session = await self._get_session()
+        client = MoonrakerClient(ip, port, session)
+        
+        download = GcodeDownload(self.transfers, printer_id, filename)
         try:
-            ip, port = self._parse_ip_port(printer.ip)
-            session = await self._get_session()
-            client = MoonrakerClient(ip, port, session)
-            
-            file_content = await client.download_gcode_file(filename)
-            if file_content is None:
-                raise ValueError(f"No se pudo descargar el archivo {filename}")
-            
-            logger.info(f"✅ Archivo {filename} descargado desde {printer.name}")
-            return file_content
-            
+            await download.open(client.open_gcode_download(filename, range_header))
         except Exception as e:
             logger.error(f"Error descargando archivo {filename} desde {printer.name}: {e}")
             raise
+        return download
 
     async def get_detailed_printer_status(self, printer_id: str):
         """
-        Obtiene el estado detallado de una impresora consultando directamente Moonraker.
+        Obtiene el estado detallado de una impresora.
+        Usa el snapshot de la caché si está vigente y, si no, consulta directamente Moonraker.
         Devuelve información completa sobre disponibilidad, estado, errores y capacidades.
         """
         printer = self.printers.get(printer_id)
         if not printer:
             raise ValueError(f"Impresora {printer_id} no encontrada")
         
+        if self.state_cache.is_fresh(printer_id, self.snapshot_max_age):
+            status = self.state_cache.get_status(printer_id)
+            webhooks = status.get('webhooks', {})
+            return self._build_detailed_status(
+                printer,
+                webhooks.get('state', 'unknown'),
+                webhooks.get('state_message', ''),
+                status
+            )
+
+        if not self.is_printer_available(printer):
+            health = self.get_printer_health(printer)
+            return {
+                "printer_id": printer_id,
+                "printer_name": printer.name,
+                "reachable": False,
+                "stale": True,
+                "status": "unreachable",
+                "last_known_state": self.state_cache.get_status(printer_id).get("webhooks", {}).get("state", printer.status),
+                "state_message": "Circuito abierto: la impresora ha fallado repetidamente",
+                "can_print": False,
+                "health": health,
+                "errors": [f"Host sin respuesta, siguiente intento en {health['retry_in']}s"],
+                "recommendation": "Verifica que la impresora esté encendida y conectada a la red"
+            }
+
         try:
             ip, port = self._parse_ip_port(printer.ip)
             session = await self._get_session()
             client = MoonrakerClient(ip, port, session)
-            
-            # Intentar obtener información básica con timeout
+
+            # Estado de Klippy, temperaturas y progreso en una sola consulta
             try:
-                printer_info = await asyncio.wait_for(
-                    client.get_printer_info(),
+                result = await asyncio.wait_for(
+                    client.query_objects(STATUS_OBJECTS),
                     timeout=5.0
                 )
                 
-                if not printer_info or 'result' not in printer_info:
+                if not result or 'result' not in result or 'status' not in result['result']:
                     return {
                         "printer_id": printer_id,
                         "printer_name": printer.name,
@@ -842,101 +998,14 @@ class FleetService:
                         "recommendation": "Verifica que la impresora esté encendida y conectada a la red"
                     }
                 
-                result = printer_info['result']
-                state = result.get('state', 'unknown')
-                state_message = result.get('state_message', '')
-                
-                # Determinar si puede imprimir
-                can_print = state == 'ready'
-                is_error = state == 'error' or state == 'shutdown'
-                is_printing = state == 'printing'
-                is_startup = state == 'startup'
-                
-                # Obtener temperaturas
-                temperatures = {}
-                try:
-                    temp_data = await asyncio.wait_for(
-                        client.get_temperatures(),
-                        timeout=3.0
-                    )
-                    if temp_data and 'result' in temp_data and 'status' in temp_data['result']:
-                        status = temp_data['result']['status']
-                        temperatures = {
-                            "extruder": {
-                                "current": status.get('extruder', {}).get('temperature', 0),
-                                "target": status.get('extruder', {}).get('target', 0)
-                            },
-                            "bed": {
-                                "current": status.get('heater_bed', {}).get('temperature', 0),
-                                "target": status.get('heater_bed', {}).get('target', 0)
-                            }
-                        }
-                except Exception as e:
-                    logger.warning(f"No se pudieron obtener temperaturas: {e}")
-                
-                # Obtener estadísticas de impresión
-                print_stats = {}
-                current_file = None
-                progress = 0
-                try:
-                    stats_data = await asyncio.wait_for(
-                        client.get_print_stats(),
-                        timeout=3.0
-                    )
-                    if stats_data and 'result' in stats_data and 'status' in stats_data['result']:
-                        status = stats_data['result']['status']
-                        print_stats_obj = status.get('print_stats', {})
-                        virtual_sdcard = status.get('virtual_sdcard', {})
-                        
-                        current_file = print_stats_obj.get('filename', None)
-                        progress = virtual_sdcard.get('progress', 0) * 100
-                        print_stats = {
-                            "state": print_stats_obj.get('state', 'unknown'),
-                            "filename": current_file,
-                            "progress": round(progress, 2)
-                        }
-                except Exception as e:
-                    logger.warning(f"No se pudieron obtener estadísticas de impresión: {e}")
-                
-                # Construir lista de errores si los hay
-                errors = []
-                if is_error:
-                    if state_message:
-                        errors.append(state_message)
-                    else:
-                        errors.append("La impresora reporta un estado de error")
-                
-                # Generar recomendación
-                recommendation = None
-                if not can_print:
-                    if is_error:
-                        recommendation = "Se detectó un error. Se intentará recuperación automática mediante reinicio de firmware y homing."
-                    elif is_printing:
-                        recommendation = "La impresora está actualmente imprimiendo. Puedes pausar o cancelar el trabajo actual, o elegir otra impresora."
-                    elif state == 'paused':
-                        recommendation = "La impresora está en pausa. Puedes reanudar o cancelar el trabajo actual."
-                    elif is_startup:
-                        recommendation = "La impresora se está iniciando. Por favor espera unos momentos y actualiza el estado."
-                    else:
-                        recommendation = f"Estado actual: {state}. Verifica el estado de la impresora antes de continuar."
-                
-                return {
-                    "printer_id": printer_id,
-                    "printer_name": printer.name,
-                    "reachable": True,
-                    "status": state,
-                    "state_message": state_message,
-                    "can_print": can_print,
-                    "is_printing": is_printing,
-                    "is_error": is_error,
-                    "is_startup": is_startup,
-                    "errors": errors,
-                    "recommendation": recommendation,
-                    "temperatures": temperatures,
-                    "print_stats": print_stats,
-                    "capabilities": printer.capabilities or [],
-                    "location": printer.location
-                }
+                status_objects = result['result']['status']
+                webhooks = status_objects.get('webhooks', {})
+                return self._build_detailed_status(
+                    printer,
+                    webhooks.get('state', 'unknown'),
+                    webhooks.get('state_message', ''),
+                    status_objects
+                )
                 
             except asyncio.TimeoutError:
                 return {
@@ -963,6 +1032,78 @@ class FleetService:
                 "recommendation": "Verifica la configuración de la impresora y la conectividad"
             }
 
+    def _build_detailed_status(self, printer, state, state_message, status_objects):
+        """Construye la respuesta de estado detallado a partir de los objetos de Klipper."""
+        # Determinar si puede imprimir
+        can_print = state == 'ready'
+        is_error = state == 'error' or state == 'shutdown'
+        is_printing = state == 'printing'
+        is_startup = state == 'startup'
+        
+        temperatures = {}
+        if 'extruder' in status_objects or 'heater_bed' in status_objects:
+            temperatures = {
+                "extruder": {
+                    "current": status_objects.get('extruder', {}).get('temperature', 0),
+                    "target": status_objects.get('extruder', {}).get('target', 0)
+                },
+                "bed": {
+                    "current": status_objects.get('heater_bed', {}).get('temperature', 0),
+                    "target": status_objects.get('heater_bed', {}).get('target', 0)
+                }
+            }
+        
+        print_stats = {}
+        if 'print_stats' in status_objects or 'virtual_sdcard' in status_objects:
+            print_stats_obj = status_objects.get('print_stats', {})
+            virtual_sdcard = status_objects.get('virtual_sdcard', {})
+            progress = (virtual_sdcard.get('progress') or 0) * 100
+            print_stats = {
+                "state": print_stats_obj.get('state', 'unknown'),
+                "filename": print_stats_obj.get('filename', None),
+                "progress": round(progress, 2)
+            }
+        
+        # Construir lista de errores si los hay
+        errors = []
+        if is_error:
+            if state_message:
+                errors.append(state_message)
+            else:
+                errors.append("La impresora reporta un estado de error")
+        
+        # Generar recomendación
+        recommendation = None
+        if not can_print:
+            if is_error:
+                recommendation = "Se detectó un error. Se intentará recuperación automática mediante reinicio de firmware y homing."
+            elif is_printing:
+                recommendation = "La impresora está actualmente imprimiendo. Puedes pausar o cancelar el trabajo actual, o elegir otra impresora."
+            elif state == 'paused':
+                recommendation = "La impresora está en pausa. Puedes reanudar o cancelar el trabajo actual."
+            elif is_startup:
+                recommendation = "La impresora se está iniciando. Por favor espera unos momentos y actualiza el estado."
+            else:
+                recommendation = f"Estado actual: {state}. Verifica el estado de la impresora antes de continuar."
+        
+        return {
+            "printer_id": printer.id,
+            "printer_name": printer.name,
+            "reachable": True,
+            "status": state,
+            "state_message": state_message,
+            "can_print": can_print,
+            "is_printing": is_printing,
+            "is_error": is_error,
+            "is_startup": is_startup,
+            "errors": errors,
+            "recommendation": recommendation,
+            "temperatures": temperatures,
+            "print_stats": print_stats,
+            "capabilities": printer.capabilities or [],
+            "location": printer.location
+        }
+
     async def recover_printer(self, printer_id: str, recovery_method: str = "full"):
         """
         Intenta recuperar una impresora que está en estado de error.
@@ -998,6 +1139,8 @@ class FleetService:
                     "message": "Reiniciando firmware de Klipper..."
                 })
                 
+                # Eventos de Klipper vistos antes del reinicio: la espera exige uno posterior
+                klippy_events = self.state_cache.get_klippy_events(printer_id)
                 restart_result = await client.restart_firmware()
                 
                 if restart_result.get("success"):
@@ -1012,7 +1155,7 @@ class FleetService:
                         "message": "Esperando a que la impresora esté lista..."
                     })
                     
-                    ready = await self._wait_printer_ready(printer_id, timeout=30)
+                    ready = await self._wait_printer_ready(printer_id, timeout=30, klippy_events=klippy_events)
                     
                     if ready:
                         recovery_steps[-1]["status"] = "completed"
@@ -1057,8 +1200,8 @@ class FleetService:
                     recovery_steps[-1]["message"] = "Home ejecutado exitosamente"
                     logger.info(f"✅ Home completado para {printer.name}")
                     
-                    # Esperar un poco para que se estabilice
-                    await asyncio.sleep(3)
+                    # Dar hasta 3 s para que Klipper se estabilice en ``ready``
+                    await self.wait_for(printer_id, klippy_state_in("ready"), timeout=3)
                     
                     # Verificar estado final
                     recovery_steps.append({
@@ -1119,48 +1262,75 @@ class FleetService:
                 "message": f"Error durante recuperación: {str(e)}"
             }
     
-    async def _wait_printer_ready(self, printer_id: str, timeout: int = 30):
+    async def wait_for(self, printer_id: str, predicate, timeout: float = 30.0) -> bool:
+        """Espera a que el estado de una impresora cumpla ``predicate(status, meta)``.
+
+        Se resuelve con las actualizaciones que ya recibe la caché (notificaciones
+        WebSocket o polling del planificador), sin tráfico adicional por cada espera.
+        Si la caché no está activa (o la impresora es de otro nodo) se consulta la
+        impresora cada ``wait_poll_interval``.
+
+        Args:
+            printer_id: ID de la impresora
+            predicate: ``predicate(status, meta) -> bool`` sobre los objetos de Klipper
+            timeout: Tiempo máximo de espera en segundos
+
+        Returns:
+            bool: True si la condición se cumplió, False si timeout
+        """
+        if printer_id not in self.printers:
+            raise ValueError(f"Impresora {printer_id} no encontrada")
+        if self.state_cache.running and self.sharding.owns(printer_id):
+            return await self.state_cache.wait_for(printer_id, predicate, timeout)
+
+        async def poll():
+            while True:
+                await asyncio.sleep(self.wait_poll_interval)
+                await self.state_cache.poll_printer(printer_id)
+
+        await self.state_cache.poll_printer(printer_id)
+        poller = asyncio.create_task(poll(), name=f"wait_for_{printer_id}")
+        try:
+            return await self.state_cache.wait_for(printer_id, predicate, timeout)
+        finally:
+            poller.cancel()
+
+    async def _wait_printer_ready(self, printer_id: str, timeout: int = 30, klippy_events=None):
         """Espera a que una impresora esté lista después de un reinicio.
+
+        Se resuelve con el primer ``ready`` posterior a un evento de Klipper
+        (cambio de ``webhooks.state``, ``notify_klippy_*`` o resuscripción)
+        ocurrido después de ``klippy_events``. Las actualizaciones de
+        temperatura no cuentan: un ``ready`` previo al reinicio no lo resuelve.
+        Si no llega a tiempo se acepta una impresora alcanzable en un estado
+        sin error (``shutdown``/``startup``), porque el siguiente paso será el homing.
         
         Args:
             printer_id: ID de la impresora
             timeout: Tiempo máximo de espera en segundos
+            klippy_events: ``get_klippy_events`` tomado antes de enviar el reinicio (None = ahora)
             
         Returns:
             bool: True si la impresora está lista, False si timeout
         """
-        start_time = asyncio.get_event_loop().time()
-        poll_interval = 2  # segundos
-        
+        is_ready = klippy_state_in("ready")
+        if klippy_events is None:
+            klippy_events = self.state_cache.get_klippy_events(printer_id)
+
+        def restarted(status, meta):
+            return is_ready(status, meta) and meta.get("klippy_events", 0) > klippy_events
+
         logger.info(f"⏳ Esperando a que impresora {printer_id} esté lista (timeout: {timeout}s)...")
-        
-        while asyncio.get_event_loop().time() - start_time < timeout:
-            try:
-                status = await self.get_detailed_printer_status(printer_id)
-                
-                logger.debug(f"Estado actual: reachable={status.get('reachable')}, status={status.get('status')}")
-                
-                # Si está en ready, perfecto
-                if status.get("reachable") and status.get("status") == "ready":
-                    logger.info(f"✅ Impresora {printer_id} está ready")
-                    return True
-                
-                # Si está alcanzable y en estado shutdown (esperando homing), también es válido
-                # porque el siguiente paso será hacer el homing
-                if status.get("reachable") and status.get("status") in ["shutdown", "startup"]:
-                    logger.info(f"✅ Impresora {printer_id} está alcanzable (estado: {status.get('status')})")
-                    return True
-                
-                # Si está alcanzable en cualquier otro estado no-error, también aceptar
-                if status.get("reachable") and status.get("status") not in ["error", "offline", "timeout"]:
-                    logger.info(f"✅ Impresora {printer_id} está alcanzable (estado: {status.get('status')})")
-                    return True
-                    
-            except Exception as e:
-                logger.debug(f"Error verificando estado durante espera: {e}")
-            
-            await asyncio.sleep(poll_interval)
-        
+
+        if await self.wait_for(printer_id, restarted, timeout):
+            logger.info(f"✅ Impresora {printer_id} está ready")
+            return True
+
+        status = await self.get_detailed_printer_status(printer_id)
+        if status.get("reachable") and status.get("status") not in ["error", "offline", "timeout"]:
+            logger.info(f"✅ Impresora {printer_id} está alcanzable (estado: {status.get('status')})")
+            return True
+
         logger.warning(f"⏱️ Timeout esperando a que impresora {printer_id} esté lista")
         return False
 
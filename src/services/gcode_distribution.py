@@ -0,0 +1,339 @@
+"""
+Distribución de un mismo G-code a varias impresoras en paralelo.
+
+El archivo se lee de disco en trozos y se envía en streaming a
+``/server/files/upload`` de cada impresora, sin cargarlo entero en memoria.
+Todas las subidas comparten un límite global de concurrencia y, opcionalmente,
+de ancho de banda, de modo que cargar una tirada de producción en toda la
+flota tarda lo que la impresora más lenta y no la suma de todas. El progreso
+se registra por impresora y los reintentos solo repiten los destinos fallidos.
+"""
+
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+
+import aiohttp
+
+from src.services.http_clients import UPLOADS_POOL, http_clients
+from src.services.moonraker_client import UPLOAD_TIMEOUT, MoonrakerClient
+
+logger = logging.getLogger(__name__)
+
+# Tamaño de los trozos que se leen de disco y se envían a cada impresora
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+
+class BandwidthLimiter:
+    """Token bucket compartido por todas las subidas (bytes por segundo, 0 = sin límite)."""
+
+    def __init__(self, rate_bps: float = 0):
+        self.rate_bps = rate_bps
+        self._tokens = rate_bps
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def consume(self, nbytes: int):
+        if not self.rate_bps:
+            return
+        # El lock reparte el ancho de banda por turnos entre las subidas
+        async with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate_bps, self._tokens + (now - self._updated) * self.rate_bps)
+            self._updated = now
+            self._tokens -= nbytes
+            if self._tokens < 0:
+                await asyncio.sleep(-self._tokens / self.rate_bps)
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Los rechazos 4xx de Moonraker (ruta o archivo inválidos) no se arreglan reintentando."""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500 or error.status in (408, 429)
+    return True
+
+
+class GcodeDistributor:
+    """Motor de distribución con progreso por destino y reintento selectivo."""
+
+    def __init__(
+        self,
+        fleet,
+        max_concurrency: int = 20,
+        max_bandwidth_bps: float = 0,
+        max_attempts: int = 3,
+        retry_backoff: float = 1.0,
+        history: int = 50,
+    ):
+        """
+        Args:
+            fleet: FleetService que resuelve las impresoras y mantiene el índice de archivos
+            max_concurrency: Subidas simultáneas como máximo en toda la flota
+            max_bandwidth_bps: Ancho de banda total de subida en bytes/s (0 = sin límite)
+            max_attempts: Intentos automáticos por destino antes de darlo por fallido
+            retry_backoff: Espera base (s) entre intentos, se duplica en cada uno
+            history: Distribuciones finalizadas que se conservan para consulta y reintento
+        """
+        self.fleet = fleet
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max(1, max_attempts)
+        self.retry_backoff = retry_backoff
+        self.history = history
+        self.limiter = BandwidthLimiter(max_bandwidth_bps)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # Pool propio: las subidas largas no ocupan las conexiones de las consultas de estado
+        http_clients.configure(UPLOADS_POOL, limit=max_concurrency, limit_per_host=2, timeout=UPLOAD_TIMEOUT)
+        self._distributions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.totals = {"distributions": 0, "uploads": 0, "completed": 0, "failed": 0, "retries": 0, "bytes": 0}
+
+    # === API PÚBLICA ===
+
+    def submit(
+        self,
+        source_path: str,
+        printer_ids: Iterable[str],
+        filename: Optional[str] = None,
+        start_print: bool = False,
+        owns_source: bool = False,
+    ) -> Dict[str, Any]:
+        """Registra una distribución y la lanza en segundo plano.
+
+        Args:
+            source_path: G-code en disco que se envía a todas las impresoras
+            printer_ids: Impresoras de destino (se ignoran duplicados)
+            filename: Nombre con el que se guarda en las impresoras (por defecto el del archivo)
+            start_print: Iniciar la impresión en cada destino al terminar la subida
+            owns_source: Borrar ``source_path`` cuando la distribución salga del histórico
+
+        Returns:
+            Estado público de la distribución, con su ``id`` para consultar el progreso
+        """
+        if not os.path.isfile(source_path):
+            raise FileNotFoundError(f"Archivo G-code no encontrado: {source_path}")
+        printer_ids = list(dict.fromkeys(printer_ids))
+        if not printer_ids:
+            raise ValueError("No se indicó ninguna impresora de destino")
+
+        record = {
+            "id": uuid.uuid4().hex[:12],
+            "filename": filename or os.path.basename(source_path),
+            "source_path": source_path,
+            "total_bytes": os.path.getsize(source_path),
+            "start_print": start_print,
+            "state": "running",
+            "created_at": time.time(),
+            "finished_at": None,
+            "targets": {printer_id: self._new_target(printer_id) for printer_id in printer_ids},
+            "_owns_source": owns_source,
+        }
+        self._distributions[record["id"]] = record
+        self.totals["distributions"] += 1
+        self._trim_history()
+        self._launch(record, printer_ids)
+        logger.info(f"Distribución {record['id']}: {record['filename']} a {len(printer_ids)} impresora(s)")
+        return self._public(record)
+
+    async def distribute(self, source_path: str, printer_ids: Iterable[str], **kwargs) -> Dict[str, Any]:
+        """Como ``submit`` pero espera a que terminen todas las subidas."""
+        distribution = self.submit(source_path, printer_ids, **kwargs)
+        return await self.wait(distribution["id"])
+
+    def retry(self, distribution_id: str) -> Dict[str, Any]:
+        """Vuelve a lanzar solo los destinos fallidos de una distribución finalizada."""
+        record = self._distributions.get(distribution_id)
+        if record is None:
+            raise KeyError(distribution_id)
+        if distribution_id in self._tasks:
+            raise ValueError(f"La distribución {distribution_id} sigue en curso")
+        if not os.path.isfile(record["source_path"]):
+            raise FileNotFoundError(f"El archivo de origen ya no existe: {record['source_path']}")
+
+        failed = [pid for pid, target in record["targets"].items() if target["state"] == "failed"]
+        for printer_id in failed:
+            previous = record["targets"][printer_id]
+            record["targets"][printer_id] = self._new_target(printer_id, attempts=previous["attempts"])
+        if failed:
+            record["state"] = "running"
+            record["finished_at"] = None
+            self._distributions.move_to_end(distribution_id)
+            self.totals["retries"] += len(failed)
+            self._launch(record, failed)
+            logger.info(f"Distribución {distribution_id}: reintentando {len(failed)} destino(s)")
+        return self._public(record)
+
+    async def wait(self, distribution_id: str) -> Dict[str, Any]:
+        task = self._tasks.get(distribution_id)
+        if task is not None:
+            await asyncio.shield(task)
+        return self.get(distribution_id)
+
+    def get(self, distribution_id: str) -> Dict[str, Any]:
+        record = self._distributions.get(distribution_id)
+        if record is None:
+            raise KeyError(distribution_id)
+        return self._public(record)
+
+    def list_distributions(self) -> List[Dict[str, Any]]:
+        return [self._summary(record) for record in reversed(self._distributions.values())]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.totals,
+            "max_concurrency": self.max_concurrency,
+            "max_bandwidth_bps": self.limiter.rate_bps,
+            "active": [self._summary(self._distributions[key]) for key in self._tasks],
+        }
+
+    async def stop(self):
+        """Cancela las distribuciones en curso."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # === EJECUCIÓN ===
+
+    @staticmethod
+    def _new_target(printer_id: str, attempts: int = 0) -> Dict[str, Any]:
+        # Estados: queued -> uploading <-> retrying -> completed | failed
+        return {
+            "printer_id": printer_id,
+            "state": "queued",
+            "bytes_sent": 0,
+            "attempts": attempts,
+            "error": None,
+            "path": None,
+            "started_at": None,
+            "finished_at": None,
+        }
+
+    def _launch(self, record: Dict[str, Any], printer_ids: List[str]):
+        task = asyncio.create_task(self._run(record, printer_ids))
+        self._tasks[record["id"]] = task
+        task.add_done_callback(lambda _: self._tasks.pop(record["id"], None))
+
+    async def _run(self, record: Dict[str, Any], printer_ids: List[str]):
+        await asyncio.gather(*(self._upload_target(record, record["targets"][pid]) for pid in printer_ids))
+        states = [target["state"] for target in record["targets"].values()]
+        if all(state == "completed" for state in states):
+            record["state"] = "completed"
+        elif any(state == "completed" for state in states):
+            record["state"] = "partial"
+        else:
+            record["state"] = "failed"
+        record["finished_at"] = time.time()
+        logger.info(
+            f"Distribución {record['id']} {record['state']}: "
+            f"{states.count('completed')}/{len(states)} impresora(s) en "
+            f"{record['finished_at'] - record['created_at']:.1f}s"
+        )
+
+    async def _upload_target(self, record: Dict[str, Any], target: Dict[str, Any]):
+        printer_id = target["printer_id"]
+        printer = self.fleet.printers.get(printer_id)
+        if printer is None:
+            self._fail(target, f"Impresora {printer_id} no encontrada")
+            return
+
+        for attempt in range(1, self.max_attempts + 1):
+            target["attempts"] += 1
+            try:
+                async with self._semaphore:
+                    target["state"] = "uploading"
+                    target["bytes_sent"] = 0
+                    target["started_at"] = target["started_at"] or time.time()
+                    self.totals["uploads"] += 1
+                    ip, port = self.fleet._parse_ip_port(printer.ip)
+                    client = MoonrakerClient(ip, port, await http_clients.get_session(UPLOADS_POOL))
+                    result = await client.upload_gcode_stream(
+                        self._read_chunks(record["source_path"], target),
+                        record["filename"],
+                        start_print=record["start_print"],
+                    )
+            except asyncio.CancelledError:
+                self._fail(target, "Distribución cancelada")
+                raise
+            except Exception as e:
+                error = str(e) or e.__class__.__name__
+                if attempt == self.max_attempts or not _is_retryable(e):
+                    self._fail(target, error)
+                    logger.warning(f"Subida de {record['filename']} a {printer_id} fallida: {error}")
+                    return
+                target["state"] = "retrying"
+                target["error"] = error
+                await asyncio.sleep(self.retry_backoff * 2 ** (attempt - 1))
+                continue
+
+            target["state"] = "completed"
+            target["error"] = None
+            target["path"] = (result or {}).get("result", {}).get("item", {}).get("path", record["filename"])
+            target["finished_at"] = time.time()
+            self.totals["completed"] += 1
+            self.totals["bytes"] += target["bytes_sent"]
+            if self.fleet.file_index.is_synced(printer_id):
+                self.fleet.file_index.schedule_refresh(printer_id)
+            return
+
+    def _fail(self, target: Dict[str, Any], error: str):
+        target["state"] = "failed"
+        target["error"] = error
+        target["finished_at"] = time.time()
+        self.totals["failed"] += 1
+
+    async def _read_chunks(self, path: str, target: Dict[str, Any]) -> AsyncIterator[bytes]:
+        """Lee el archivo por trozos fuera del event loop, contando el progreso del destino."""
+        with open(path, "rb") as f:
+            while True:
+                chunk = await asyncio.to_thread(f.read, UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                await self.limiter.consume(len(chunk))
+                target["bytes_sent"] += len(chunk)
+                yield chunk
+
+    # === HISTÓRICO ===
+
+    def _trim_history(self):
+        finished = [key for key in self._distributions if key not in self._tasks]
+        for key in finished[:max(0, len(self._distributions) - self.history)]:
+            record = self._distributions.pop(key)
+            if record["_owns_source"]:
+                self._remove_source(record["source_path"])
+
+    @staticmethod
+    def _remove_source(path: str):
+        try:
+            os.remove(path)
+            os.rmdir(os.path.dirname(path))  # solo si queda vacío
+        except OSError:
+            pass
+
+    @staticmethod
+    def _summary(record: Dict[str, Any]) -> Dict[str, Any]:
+        targets = record["targets"].values()
+        return {
+            "id": record["id"],
+            "filename": record["filename"],
+            "state": record["state"],
+            "targets": len(record["targets"]),
+            "completed": sum(1 for target in targets if target["state"] == "completed"),
+            "failed": sum(1 for target in targets if target["state"] == "failed"),
+            "created_at": record["created_at"],
+        }
+
+    @staticmethod
+    def _public(record: Dict[str, Any]) -> Dict[str, Any]:
+        public = {key: value for key, value in record.items() if not key.startswith("_") and key != "targets"}
+        total = record["total_bytes"] or 1
+        public["targets"] = {
+            printer_id: {**target, "progress": round(min(1.0, target["bytes_sent"] / total), 4)}
+            for printer_id, target in record["targets"].items()
+        }
+        end = record["finished_at"] or time.time()
+        public["duration"] = round(end - record["created_at"], 3)
+        return public
@@ -0,0 +1,256 @@
+"""
+Índice en memoria de los archivos G-code de toda la flota.
+
+Guarda por impresora el listado de ``gcodes`` (ruta, tamaño, fecha de
+modificación) y los metadatos del slicer de cada archivo, de modo que el
+explorador de archivos y el reparto de trabajos respondan sin consultar a las
+impresoras. El índice se llena al arrancar, se mantiene al día con las
+notificaciones ``notify_filelist_changed`` de Moonraker y se reconcilia
+periódicamente por si se pierde alguna notificación.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from src.services.moonraker_client import MoonrakerClient
+
+logger = logging.getLogger(__name__)
+
+# Acciones de notify_filelist_changed que afectan a un único archivo
+FILE_ACTIONS = {"create_file", "modify_file", "delete_file", "move_file"}
+
+
+class GcodeFileIndex:
+    """Listado y metadatos de los G-code de cada impresora."""
+
+    def __init__(self, fleet, reconcile_interval: float = 600.0, metadata_concurrency: int = 4):
+        """
+        Args:
+            fleet: FleetService propietario (impresoras, sesión HTTP y salud de hosts)
+            reconcile_interval: Segundos entre reconciliaciones completas con cada impresora
+            metadata_concurrency: Consultas de metadatos simultáneas por impresora
+        """
+        self._fleet = fleet
+        self.reconcile_interval = reconcile_interval
+        self.metadata_concurrency = metadata_concurrency
+        self._files: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._synced_at: Dict[str, float] = {}
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self._background: set = set()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"refreshes": 0, "notifications": 0, "metadata_fetches": 0, "errors": 0}
+
+    # === CICLO DE VIDA ===
+
+    async def start(self):
+        """Lanza la indexación inicial y la reconciliación periódica en segundo plano."""
+        if self._task is not None:
+            return
+        self._task = asyncio.create_task(self._reconcile_loop(), name="gcode_file_index")
+        logger.info(f"Índice de archivos G-code activo (reconciliación cada {self.reconcile_interval:.0f}s)")
+
+    async def stop(self):
+        tasks = [t for t in (self._task, *self._refreshing.values(), *self._background) if t is not None]
+        self._task = None
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._refreshing.clear()
+        self._background.clear()
+
+    async def _reconcile_loop(self):
+        while True:
+            printer_ids = [
+                printer_id for printer_id in self._fleet.owned_printer_ids()
+                if self._fleet.is_printer_available(printer_id)
+            ]
+            await asyncio.gather(*(self.refresh(p) for p in printer_ids), return_exceptions=True)
+            await asyncio.sleep(self.reconcile_interval)
+
+    # === CONSULTA ===
+
+    def is_synced(self, printer_id: str) -> bool:
+        return printer_id in self._synced_at
+
+    def list_files(self, printer_id: str) -> List[Dict[str, Any]]:
+        """Archivos indexados de una impresora con el formato de ``list_printer_gcode_files``."""
+        return [self._public_entry(entry) for entry in self._files.get(printer_id, {}).values()]
+
+    def get_entry(self, printer_id: str, filename: str) -> Optional[Dict[str, Any]]:
+        """Entrada indexada de un archivo (ruta, tamaño, fecha de modificación), o None."""
+        return self._files.get(printer_id, {}).get(filename)
+
+    def get_metadata(self, printer_id: str, filename: str) -> Optional[Dict[str, Any]]:
+        """Metadatos memorizados con la misma forma que la respuesta de Moonraker."""
+        entry = self._files.get(printer_id, {}).get(filename)
+        if entry is None or entry.get("metadata") is None:
+            return None
+        return {"result": entry["metadata"]}
+
+    def find(self, filename: str, exact: bool = True) -> Dict[str, List[Dict[str, Any]]]:
+        """Impresoras que tienen un archivo, por nombre exacto o por subcadena (sin mayúsculas)."""
+        needle = filename.lower()
+        matches: Dict[str, List[Dict[str, Any]]] = {}
+        for printer_id, files in self._files.items():
+            if exact:
+                found = [files[filename]] if filename in files else []
+            else:
+                found = [entry for path, entry in files.items() if needle in path.lower()]
+            if found:
+                matches[printer_id] = [self._public_entry(entry) for entry in found]
+        return matches
+
+    def get_stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            **self.stats,
+            "printers": {
+                printer_id: {
+                    "files": len(self._files.get(printer_id, {})),
+                    "synced_ago": round(now - synced_at, 1),
+                }
+                for printer_id, synced_at in self._synced_at.items()
+            },
+        }
+
+    @staticmethod
+    def _public_entry(entry: Dict[str, Any]) -> Dict[str, Any]:
+        metadata = entry.get("metadata") or {}
+        public = {key: value for key, value in entry.items() if key != "metadata"}
+        public["filename"] = entry["path"]
+        public["estimated_time"] = metadata.get("estimated_time")
+        return public
+
+    # === ACTUALIZACIÓN ===
+
+    def forget(self, printer_id: str):
+        self._files.pop(printer_id, None)
+        self._synced_at.pop(printer_id, None)
+        task = self._refreshing.pop(printer_id, None)
+        if task is not None:
+            task.cancel()
+
+    def schedule_refresh(self, printer_id: str):
+        """Programa una reconciliación de la impresora sin esperar a que termine."""
+        self._spawn(self.refresh(printer_id))
+
+    async def refresh(self, printer_id: str) -> bool:
+        """Reconcilia el índice de una impresora con su listado actual.
+
+        Las reconciliaciones simultáneas de la misma impresora comparten la petición.
+        """
+        task = self._refreshing.get(printer_id)
+        if task is None:
+            task = asyncio.create_task(self._refresh(printer_id))
+            self._refreshing[printer_id] = task
+            task.add_done_callback(lambda _: self._refreshing.pop(printer_id, None))
+        return await asyncio.shield(task)
+
+    async def _refresh(self, printer_id: str) -> bool:
+        client = await self._client(printer_id)
+        if client is None:
+            return False
+        try:
+            listing = await client.fetch_gcode_files()
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.debug(f"No se pudo indexar los archivos de {printer_id}: {e}")
+            return False
+
+        previous = self._files.get(printer_id, {})
+        files: Dict[str, Dict[str, Any]] = {}
+        stale: List[str] = []
+        for item in listing:
+            path = item.get("path")
+            if not path:
+                continue
+            entry = dict(item)
+            known = previous.get(path)
+            if known is not None and self._same_version(known, entry) and known.get("metadata") is not None:
+                entry["metadata"] = known["metadata"]
+            else:
+                entry["metadata"] = None
+                stale.append(path)
+            files[path] = entry
+
+        if printer_id not in self._fleet.printers:
+            return False
+        self._files[printer_id] = files
+        self._synced_at[printer_id] = time.monotonic()
+        self.stats["refreshes"] += 1
+        await self._fetch_metadata(printer_id, client, stale)
+        return True
+
+    @staticmethod
+    def _same_version(known: Dict[str, Any], current: Dict[str, Any]) -> bool:
+        return known.get("modified") == current.get("modified") and known.get("size") == current.get("size")
+
+    async def _fetch_metadata(self, printer_id: str, client: MoonrakerClient, paths: List[str]):
+        semaphore = asyncio.Semaphore(self.metadata_concurrency)
+
+        async def fetch(path):
+            async with semaphore:
+                metadata = await client.get_gcode_metadata(path)
+            self.stats["metadata_fetches"] += 1
+            entry = self._files.get(printer_id, {}).get(path)
+            if entry is not None and metadata and "result" in metadata:
+                entry["metadata"] = metadata["result"]
+
+        await asyncio.gather(*(fetch(path) for path in paths), return_exceptions=True)
+
+    def store_metadata(self, printer_id: str, filename: str, metadata: Dict[str, Any]):
+        """Guarda metadatos obtenidos fuera del índice (consultas directas a la impresora)."""
+        entry = self._files.get(printer_id, {}).get(filename)
+        if entry is not None and metadata and "result" in metadata:
+            entry["metadata"] = metadata["result"]
+
+    def handle_filelist_changed(self, printer_id: str, params: List[Dict[str, Any]]):
+        """Aplica una notificación ``notify_filelist_changed`` de Moonraker."""
+        if printer_id not in self._synced_at:
+            # Sin listado base no se puede aplicar un cambio incremental
+            return
+        self.stats["notifications"] += 1
+        for change in params or []:
+            item = change.get("item") or {}
+            if item.get("root") != "gcodes":
+                continue
+            action = change.get("action")
+            if action not in FILE_ACTIONS:
+                # Cambios de directorios: más simple y seguro volver a listar
+                self.schedule_refresh(printer_id)
+                return
+
+            files = self._files.setdefault(printer_id, {})
+            if action in ("delete_file", "move_file"):
+                source = change.get("source_item") or item
+                if action == "delete_file" or source.get("root") == "gcodes":
+                    files.pop(source.get("path"), None)
+            if action != "delete_file":
+                path = item.get("path")
+                entry = {key: value for key, value in item.items() if key != "root"}
+                known = files.get(path)
+                entry["metadata"] = known.get("metadata") if known and self._same_version(known, entry) else None
+                files[path] = entry
+                if entry["metadata"] is None:
+                    self._spawn(self._fetch_single(printer_id, path))
+
+    async def _fetch_single(self, printer_id: str, path: str):
+        client = await self._client(printer_id)
+        if client is not None:
+            await self._fetch_metadata(printer_id, client, [path])
+
+    async def _client(self, printer_id: str) -> Optional[MoonrakerClient]:
+        printer = self._fleet.printers.get(printer_id)
+        if printer is None:
+            return None
+        ip, port = self._fleet._parse_ip_port(printer.ip)
+        session = await self._fleet._get_session()
+        return MoonrakerClient(ip, port, session)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
@@ -0,0 +1,128 @@
+"""
+Descargas de G-code en streaming desde Moonraker.
+
+El cuerpo se reenvía al cliente en trozos según llega, de modo que la memoria
+por transferencia es constante sea cual sea el tamaño del archivo. Cada
+transferencia queda registrada con sus bytes y su rendimiento para las
+métricas de la flota.
+"""
+
+import itertools
+import logging
+import time
+from collections import deque
+from contextlib import AsyncExitStack
+from typing import Any, AsyncIterator, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Tamaño de los trozos que se leen de Moonraker y se escriben al cliente
+CHUNK_SIZE = 64 * 1024
+
+# Cabeceras de la respuesta de Moonraker que se reenvían al cliente
+FORWARDED_HEADERS = ("Content-Length", "Content-Range", "Last-Modified", "ETag")
+
+
+class TransferMonitor:
+    """Transferencias activas y las últimas finalizadas, con su rendimiento."""
+
+    def __init__(self, history: int = 50):
+        self._ids = itertools.count(1)
+        self.active: Dict[int, Dict[str, Any]] = {}
+        self.recent = deque(maxlen=history)
+        self.totals = {"transfers": 0, "bytes": 0, "completed": 0, "aborted": 0, "failed": 0}
+
+    def begin(self, printer_id: str, filename: str) -> Dict[str, Any]:
+        record = {
+            "id": next(self._ids),
+            "printer_id": printer_id,
+            "filename": filename,
+            "bytes": 0,
+            "expected_bytes": None,
+            "started_at": time.time(),
+            "_started": time.monotonic(),
+        }
+        self.active[record["id"]] = record
+        self.totals["transfers"] += 1
+        return record
+
+    def finish(self, record: Dict[str, Any], outcome: str):
+        if self.active.pop(record["id"], None) is None:
+            return
+        record["outcome"] = outcome
+        self.totals[outcome] += 1
+        self.totals["bytes"] += record["bytes"]
+        self.recent.append(self._public(record))
+        logger.info(
+            f"Transferencia de {record['filename']} ({record['printer_id']}) {outcome}: "
+            f"{record['bytes']} bytes a {self._public(record)['throughput_bps'] / 1e6:.1f} MB/s"
+        )
+
+    @staticmethod
+    def _public(record: Dict[str, Any]) -> Dict[str, Any]:
+        duration = time.monotonic() - record["_started"]
+        public = {key: value for key, value in record.items() if not key.startswith("_")}
+        public["duration"] = round(duration, 3)
+        public["throughput_bps"] = round(record["bytes"] / duration) if duration > 0 else 0
+        return public
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.totals,
+            "active": [self._public(record) for record in self.active.values()],
+            "recent": list(self.recent),
+        }
+
+
+class GcodeDownload:
+    """Respuesta de Moonraker abierta y lista para reenviarse en streaming.
+
+    La conexión con la impresora permanece abierta hasta que se consume el
+    cuerpo con ``iter_chunks`` o se llama a ``aclose``.
+    """
+
+    def __init__(self, monitor: TransferMonitor, printer_id: str, filename: str):
+        self._monitor = monitor
+        self._stack = AsyncExitStack()
+        self._record = monitor.begin(printer_id, filename)
+        self._response = None
+        self.status: Optional[int] = None
+        self.headers: Dict[str, str] = {}
+
+    async def open(self, response_context):
+        """Entra en el contexto de la petición a Moonraker y toma estado y cabeceras."""
+        try:
+            self._response = await self._stack.enter_async_context(response_context)
+        except BaseException:
+            self._monitor.finish(self._record, "failed")
+            raise
+        self.status = self._response.status
+        self.headers = {
+            name: self._response.headers[name]
+            for name in FORWARDED_HEADERS if name in self._response.headers
+        }
+        self.headers["Accept-Ranges"] = "bytes"
+        if "Content-Length" in self.headers:
+            self._record["expected_bytes"] = int(self.headers["Content-Length"])
+        return self
+
+    async def iter_chunks(self, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+        outcome = "aborted"
+        try:
+            async for chunk in self._response.content.iter_chunked(chunk_size):
+                self._record["bytes"] += len(chunk)
+                yield chunk
+            outcome = "completed"
+        except Exception as e:
+            outcome = "failed"
+            logger.error(f"Error transfiriendo {self._record['filename']}: {e}")
+            raise
+        finally:
+            # Si el cliente corta la descarga el generador se cierra aquí y se libera la conexión
+            self._monitor.finish(self._record, outcome)
+            await self._stack.aclose()
+
+    async def aclose(self):
+        """Libera la conexión sin transferir el cuerpo (p. ej. respuestas de error)."""
+        self._monitor.finish(self._record, "failed" if self.status not in (200, 206) else "aborted")
+        await self._stack.aclose()
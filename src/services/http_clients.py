@@ -0,0 +1,210 @@
+"""
+Registro central de clientes HTTP salientes.
+
+Cada destino (impresoras Moonraker, APISLICER, subidas de G-code) tiene un
+pool con su propia sesión aiohttp, límites de conexiones totales y por host,
+keep-alive y timeouts por defecto. Las sesiones se crean perezosamente en el
+event loop en curso y se cierran en el shutdown de la aplicación, de modo que
+las conexiones se reutilizan entre peticiones en lugar de abrir un socket (y
+un handshake) por llamada.
+
+El pool de Moonraker crece con la flota: ``set_limit`` amplía el límite total
+sin recrear la sesión ni cortar las transferencias en curso.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Nombres de los pools
+MOONRAKER_POOL = "moonraker"
+APISLICER_POOL = "apislicer"
+UPLOADS_POOL = "uploads"
+
+# Segundos que una conexión ociosa se mantiene abierta para reutilizarla
+KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30"))
+
+
+class _ResizableConnector(aiohttp.TCPConnector):
+    """TCPConnector cuyo límite total puede cambiar con la sesión abierta."""
+
+    def set_limit(self, limit: int):
+        grow = limit - self._limit
+        self._limit = limit
+        # Las peticiones que esperaban conexión pueden continuar con el nuevo margen
+        for _ in range(max(0, grow)):
+            self._release_waiter()
+
+
+class _Pool:
+    """Configuración, sesión y métricas de un destino."""
+
+    def __init__(self, name: str, limit: int, limit_per_host: int, timeout: aiohttp.ClientTimeout):
+        self.name = name
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.in_flight = 0
+        self.stats = {
+            "requests": 0,
+            "errors": 0,
+            "connections_created": 0,
+            "connections_reused": 0,
+            "queued": 0,
+            "queue_wait_total": 0.0,
+            "queue_wait_max": 0.0,
+            "sessions_created": 0,
+        }
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        """Hooks de aiohttp que alimentan las métricas de reutilización y de cola."""
+        trace = aiohttp.TraceConfig()
+        stats = self.stats
+
+        async def on_request_start(session, ctx, params):
+            self.in_flight += 1
+            stats["requests"] += 1
+
+        async def on_request_end(session, ctx, params):
+            self.in_flight -= 1
+
+        async def on_request_exception(session, ctx, params):
+            self.in_flight -= 1
+            stats["errors"] += 1
+
+        async def on_queued_start(session, ctx, params):
+            ctx.queued_at = time.monotonic()
+            stats["queued"] += 1
+
+        async def on_queued_end(session, ctx, params):
+            waited = time.monotonic() - ctx.queued_at
+            stats["queue_wait_total"] += waited
+            stats["queue_wait_max"] = max(stats["queue_wait_max"], waited)
+
+        async def on_create_end(session, ctx, params):
+            stats["connections_created"] += 1
+
+        async def on_reuse(session, ctx, params):
+            stats["connections_reused"] += 1
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_request_end.append(on_request_end)
+        trace.on_request_exception.append(on_request_exception)
+        trace.on_connection_queued_start.append(on_queued_start)
+        trace.on_connection_queued_end.append(on_queued_end)
+        trace.on_connection_create_end.append(on_create_end)
+        trace.on_connection_reuseconn.append(on_reuse)
+        return trace
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        connections = stats["connections_created"] + stats["connections_reused"]
+        stats["reuse_ratio"] = round(stats["connections_reused"] / connections, 3) if connections else 0.0
+        stats["queue_wait_total"] = round(stats["queue_wait_total"], 3)
+        stats["queue_wait_max"] = round(stats["queue_wait_max"], 3)
+        stats["in_flight"] = self.in_flight
+        stats["limit"] = self.limit
+        stats["limit_per_host"] = self.limit_per_host
+        stats["open"] = self.session is not None and not self.session.closed
+        return stats
+
+
+class HttpClientRegistry:
+    """Pools HTTP compartidos por destino, con el ciclo de vida de la aplicación."""
+
+    def __init__(self):
+        self._pools: Dict[str, _Pool] = {}
+
+    def configure(
+        self,
+        name: str,
+        limit: int = 100,
+        limit_per_host: int = 0,
+        timeout: Optional[aiohttp.ClientTimeout] = None,
+    ):
+        """Declara (o actualiza) un pool. Un pool ya abierto conserva su sesión.
+
+        Args:
+            limit: Conexiones simultáneas como máximo en todo el pool
+            limit_per_host: Conexiones simultáneas como máximo por host (0 = sin límite)
+            timeout: Timeout por defecto de las peticiones (cada llamada puede sobrescribirlo)
+        """
+        timeout = timeout or aiohttp.ClientTimeout(total=300)
+        pool = self._pools.get(name)
+        if pool is None:
+            self._pools[name] = _Pool(name, limit, limit_per_host, timeout)
+            return
+        pool.timeout = timeout
+        pool.limit_per_host = limit_per_host
+        self.set_limit(name, limit)
+
+    def set_limit(self, name: str, limit: int):
+        """Ajusta el límite total de conexiones de un pool sin cerrar su sesión."""
+        pool = self._pools[name]
+        if limit == pool.limit:
+            return
+        logger.info(f"Pool HTTP {name}: límite de conexiones {pool.limit} -> {limit}")
+        pool.limit = limit
+        if pool.session is not None and not pool.session.closed:
+            pool.session.connector.set_limit(limit)
+
+    async def get_session(self, name: str) -> aiohttp.ClientSession:
+        """Sesión del pool ``name``, creada en el primer uso dentro del event loop actual."""
+        pool = self._pools.get(name)
+        if pool is None:
+            raise KeyError(f"Pool HTTP no configurado: {name}")
+        loop = asyncio.get_running_loop()
+        if pool.session is not None and not pool.session.closed and pool.loop is loop:
+            return pool.session
+        if pool.session is not None and not pool.session.closed:
+            # La sesión pertenece a otro event loop (p. ej. reinicio de la app): no es utilizable
+            logger.warning(f"Pool HTTP {name}: descartando sesión de otro event loop")
+        connector = _ResizableConnector(
+            limit=pool.limit,
+            limit_per_host=pool.limit_per_host,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=300,
+        )
+        pool.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=pool.timeout,
+            trace_configs=[pool.trace_config()],
+        )
+        pool.loop = loop
+        pool.in_flight = 0
+        pool.stats["sessions_created"] += 1
+        return pool.session
+
+    async def close_pool(self, name: str):
+        pool = self._pools.get(name)
+        if pool and pool.session is not None and not pool.session.closed:
+            await pool.session.close()
+        if pool:
+            pool.session = None
+
+    async def close(self):
+        """Cierra todas las sesiones (shutdown de la aplicación)."""
+        for name in list(self._pools):
+            await self.close_pool(name)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {name: pool.get_stats() for name, pool in self._pools.items()}
+
+
+# Instancia global del registro
+http_clients = HttpClientRegistry()
+
+# APISLICER es un único host: el pool entero se dedica a él. Cada llamada fija su propio timeout
+http_clients.configure(
+    APISLICER_POOL,
+    limit=int(os.getenv("HTTP_APISLICER_POOL", "8")),
+    timeout=aiohttp.ClientTimeout(total=None, sock_connect=5),
+)
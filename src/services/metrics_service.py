@@ -82,20 +82,11 @@ class MetricsService:
 
     def get_order_metrics(self, period_days: int = 30) -> Dict:
         """Obtiene métricas detalladas de pedidos."""
-        orders_data = self._orders_repo.list_orders()
-        orders = [Order(**o) for o in orders_data]
-
         cutoff_date = datetime.utcnow() - timedelta(days=period_days)
 
-        # Filtrar por periodo
-        recent_orders = []
-        for order in orders:
-            try:
-                created = datetime.fromisoformat(order.created_at.replace("Z", "+00:00"))
-                if created >= cutoff_date:
-                    recent_orders.append(order)
-            except (ValueError, AttributeError):
-                continue
+        # Filtrar por periodo (en SQL con el backend SQLite)
+        orders_data = self._orders_repo.list_orders_created_between(start=cutoff_date)
+        recent_orders = [Order(**o) for o in orders_data]
 
         # Análisis por estado
         by_status = defaultdict(int)
@@ -131,20 +122,11 @@ class MetricsService:
 
     def get_production_metrics(self, period_days: int = 30) -> Dict:
         """Obtiene métricas detalladas de producción."""
-        batches_data = self._production_repo.list_batches()
-        batches = [ProductionBatch(**b) for b in batches_data]
-
         cutoff_date = datetime.utcnow() - timedelta(days=period_days)
 
-        # Filtrar por periodo
-        recent_batches = []
-        for batch in batches:
-            try:
-                created = datetime.fromisoformat(batch.created_at.replace("Z", "+00:00"))
-                if created >= cutoff_date:
-                    recent_batches.append(batch)
-            except (ValueError, AttributeError):
-                continue
+        # Filtrar por periodo (en SQL con el backend SQLite)
+        batches_data = self._production_repo.list_batches_created_between(start=cutoff_date)
+        recent_batches = [ProductionBatch(**b) for b in batches_data]
 
         # Análisis por estado
         by_status = defaultdict(int)
@@ -5,15 +5,45 @@ import asyncio
 import logging
 import base64
 import re
+import time
+from contextlib import asynccontextmanager
+
+from src.services.circuit_breaker import CircuitOpenError, host_health
+from src.services.moonraker_query_planner import query_planner
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Las descargas de archivos pueden durar minutos: solo se limita la inactividad
+DOWNLOAD_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=3, sock_read=30)
+
+# En las subidas Moonraker responde cuando ha recibido y movido el archivo completo
+UPLOAD_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=3, sock_read=60)
+
+# Bytes máximos que se leen de un G-code para extraer sus thumbnails
+THUMBNAIL_HEADER_BYTES = 512 * 1024
+
+_THUMBNAIL_END = re.compile(rb"; thumbnail(?:_\w+)? end|; THUMBNAIL_BLOCK_END")
+
+
+def _thumbnails_complete(buffer: bytes) -> bool:
+    """True si tras el último bloque de thumbnails ya aparece una línea de G-code (no comentario)."""
+    last_end = None
+    for last_end in _THUMBNAIL_END.finditer(buffer):
+        pass
+    if last_end is None:
+        return False
+    lines = buffer[last_end.end():].split(b"\n")[1:-1]  # solo líneas completas
+    return any(line.strip() and not line.lstrip().startswith(b";") for line in lines)
+
+
 class MoonrakerClient:
-    def __init__(self, printer_ip, port=7125, session=None):
+    def __init__(self, printer_ip, port=7125, session=None, breaker=None):
         self.base_url = f"http://{printer_ip}:{port}"
         self.websocket_url = f"ws://{printer_ip}:{port}/websocket"
+        # Circuit breaker compartido por todos los clientes del mismo host
+        self.breaker = breaker or host_health.get_breaker(f"{printer_ip}:{port}")
         self._session = session
         self._owns_session = False
         if self._session is None:
@@ -24,10 +54,45 @@ class MoonrakerClient:
         if self._owns_session:
             await self._session.close()
 
-    async def get_printer_info(self):
-        """Obtiene información general de la impresora."""
+    @asynccontextmanager
+    async def _request(self, method, url, **kwargs):
+        """Petición HTTP protegida por el circuit breaker del host.
+
+        Con el circuito abierto lanza ``CircuitOpenError`` sin tocar la red.
+        Solo los errores de conexión y los timeouts cuentan como fallos: una
+        respuesta HTTP de error indica que el host sigue vivo.
+        """
+        if not self.breaker.allow_request():
+            raise CircuitOpenError(f"Circuito abierto para {self.breaker.host}")
+        if method != "GET":
+            # Un comando puede cambiar el estado: el memo de consultas deja de valer
+            query_planner.invalidate(self.base_url)
+        started = time.monotonic()
+        responded = False
+        try:
+            async with self._session.request(method, url, **kwargs) as response:
+                responded = True
+                self.breaker.record_success(time.monotonic() - started)
+                yield response
+        except BaseException:
+            # Errores de conexión, timeouts o cancelación por ``wait_for``
+            if not responded:
+                self.breaker.record_failure(time.monotonic() - started)
+            raise
+
+    async def get_printer_info(self, max_age=0):
+        """Obtiene información general de la impresora.
+
+        Las llamadas concurrentes al mismo host comparten una única petición.
+
+        Args:
+            max_age: Si es mayor que 0, acepta un resultado memorizado de hasta esa antigüedad (s)
+        """
+        return await query_planner.printer_info(self, max_age)
+
+    async def _fetch_printer_info(self):
         try:
-            async with self._session.get(f"{self.base_url}/printer/info") as response:
+            async with self._request("GET", f"{self.base_url}/printer/info") as response:
                 response.raise_for_status()
                 printer_info = await response.json()
                 logger.info(f"Respuesta completa de la impresora: {json.dumps(printer_info, indent=2)}")
@@ -39,7 +104,7 @@ class MoonrakerClient:
     async def get_gcode_help(self):
         """Obtiene la lista de comandos G-code disponibles."""
         try:
-            async with self._session.get(f"{self.base_url}/printer/gcode/help") as response:
+            async with self._request("GET", f"{self.base_url}/printer/gcode/help") as response:
                 response.raise_for_status()
                 return await response.json()
         except aiohttp.ClientError as e:
@@ -49,7 +114,7 @@ class MoonrakerClient:
     async def post_gcode_script(self, script):
         """Envía un script G-code a la impresora."""
         try:
-            async with self._session.post(f"{self.base_url}/printer/gcode/script", params={'script': script}) as response:
+            async with self._request("POST", f"{self.base_url}/printer/gcode/script", params={'script': script}) as response:
                 response.raise_for_status()
                 return await response.json()
         except aiohttp.ClientError as e:
@@ -58,41 +123,65 @@ class MoonrakerClient:
 
     async def get_temperatures(self):
         """Obtiene las temperaturas del hotend y la cama."""
-        try:
-            # Usamos un GET request con los objetos como parámetros en la URL
-            async with self._session.get(f"{self.base_url}/printer/objects/query?extruder&heater_bed") as response:
-                response.raise_for_status()
-                temperatures = await response.json()
-                logger.info(f"Temperaturas obtenidas: {json.dumps(temperatures, indent=2)}")
-                return temperatures
-        except aiohttp.ClientError as e:
-            logger.error(f"Error al obtener temperaturas: {e}")
-            return None
+        return await self.query_objects(["extruder", "heater_bed"])
 
     async def get_print_stats(self):
         """Obtiene las estadísticas de impresión incluyendo el progreso."""
+        return await self.query_objects(["print_stats", "virtual_sdcard"])
+
+    async def query_objects(self, objects, max_age=None):
+        """Consulta objetos de Klipper a través del planificador compartido.
+
+        Los objetos pedidos al mismo host se fusionan en una sola petición
+        objects/query, las consultas concurrentes comparten la petición en vuelo
+        y los resultados se reutilizan durante un TTL corto.
+
+        Args:
+            objects: Iterable con los nombres de objetos (ej: ["extruder", "print_stats"])
+            max_age: Antigüedad máxima aceptable del resultado memorizado (s)
+        """
+        return await query_planner.query(self, objects, max_age)
+
+    async def _fetch_objects(self, objects):
+        """Petición objects/query directa, sin planificador."""
+        query = "&".join(objects)
         try:
-            async with self._session.get(f"{self.base_url}/printer/objects/query?print_stats&virtual_sdcard") as response:
+            async with self._request("GET", f"{self.base_url}/printer/objects/query?{query}") as response:
                 response.raise_for_status()
-                stats = await response.json()
-                logger.info(f"Estadísticas de impresión obtenidas: {json.dumps(stats, indent=2)}")
-                return stats
+                result = await response.json()
+                logger.debug(f"Objetos consultados ({query}): {json.dumps(result)}")
+                return result
         except aiohttp.ClientError as e:
-            logger.error(f"Error al obtener estadísticas de impresión: {e}")
+            logger.error(f"Error al consultar objetos {query}: {e}")
             return None
 
-    async def subscribe_to_updates(self, callback):
-        """Se suscribe a actualizaciones de estado vía WebSocket."""
+    async def subscribe_to_updates(self, callback, objects=None, on_subscribed=None, open_timeout=5):
+        """Se suscribe a actualizaciones de estado vía WebSocket.
+
+        Mantiene la conexión abierta entregando cada notificación a ``callback``
+        y retorna cuando se cierra; la reconexión es responsabilidad del llamador.
+
+        Args:
+            callback: Corrutina que recibe cada mensaje JSON-RPC de Moonraker;
+                si retorna False la conexión se cierra
+            objects: Objetos de Klipper a suscribir (por defecto los de estado general)
+            on_subscribed: Corrutina opcional que recibe el estado inicial completo
+            open_timeout: Segundos máximos para establecer la conexión
+
+        Returns:
+            bool: True si la suscripción llegó a establecerse
+        """
+        subscribed = False
         try:
             logger.info(f"Intentando conectar al WebSocket: {self.websocket_url}")
-            async with websockets.connect(self.websocket_url) as websocket:
+            async with websockets.connect(self.websocket_url, open_timeout=open_timeout) as websocket:
                 logger.info("Conexión WebSocket establecida.")
                 # Suscripción a objetos de estado relevantes
                 subscription_message = {
                     "jsonrpc": "2.0",
                     "method": "printer.objects.subscribe",
                     "params": {
-                        "objects": {
+                        "objects": objects or {
                             "webhooks": None,
                             "gcode_move": None,
                             "toolhead": None,
@@ -104,47 +193,61 @@ class MoonrakerClient:
                     },
                     "id": 1
                 }
-                logger.info(f"Enviando mensaje de suscripción: {json.dumps(subscription_message)}")
+                logger.debug(f"Enviando mensaje de suscripción: {json.dumps(subscription_message)}")
                 await websocket.send(json.dumps(subscription_message))
 
-                # Esperar la confirmación de la suscripción
-                initial_response = await websocket.recv()
-                logger.info(f"Respuesta de suscripción recibida: {initial_response}")
-
+                # Esperar la confirmación de la suscripción (pueden llegar notificaciones antes)
                 while True:
-                    message = await websocket.recv()
-                    data = json.loads(message)
-                    logger.info(f"Mensaje recibido: {data}")
+                    data = json.loads(await websocket.recv())
+                    if data.get("id") == subscription_message["id"]:
+                        break
                     await callback(data)
-        except (websockets.exceptions.ConnectionClosed, asyncio.CancelledError) as e:
+
+                if "error" in data:
+                    logger.warning(f"Suscripción rechazada por Moonraker: {data['error']}")
+                    return False
+
+                subscribed = True
+                logger.info(f"Suscripción confirmada en {self.websocket_url}")
+                if on_subscribed:
+                    await on_subscribed(data.get("result", {}).get("status", {}))
+
+                async for message in websocket:
+                    data = json.loads(message)
+                    logger.debug(f"Mensaje recibido: {data}")
+                    if await callback(data) is False:
+                        break
+        except asyncio.CancelledError:
+            raise
+        except websockets.exceptions.ConnectionClosed as e:
             logger.warning(f"Conexión WebSocket cerrada: {e}")
         except Exception as e:
-            logger.error(f"Error en la conexión WebSocket: {e}")
+            logger.warning(f"Error en la conexión WebSocket {self.websocket_url}: {e}")
+        return subscribed
 
     # === GESTIÓN DE ARCHIVOS G-CODE ===
     
     async def list_gcode_files(self):
         """Lista todos los archivos G-code disponibles en la impresora."""
         try:
-            async with self._session.get(f"{self.base_url}/server/files/list?root=gcodes") as response:
-                response.raise_for_status()
-                files_data = await response.json()
-                
-                if 'result' in files_data:
-                    files = files_data['result']
-                else:
-                    files = files_data
-                    
-                logger.info(f"Archivos G-code obtenidos: {len(files)} archivos")
-                return files
+            files = await self.fetch_gcode_files()
+            logger.info(f"Archivos G-code obtenidos: {len(files)} archivos")
+            return files
         except aiohttp.ClientError as e:
             logger.error(f"Error al listar archivos G-code: {e}")
             return []
 
+    async def fetch_gcode_files(self):
+        """Como ``list_gcode_files`` pero propaga los errores, para distinguir un fallo de un listado vacío."""
+        async with self._request("GET", f"{self.base_url}/server/files/list?root=gcodes") as response:
+            response.raise_for_status()
+            files_data = await response.json()
+            return files_data['result'] if 'result' in files_data else files_data
+
     async def get_gcode_metadata(self, filename):
         """Obtiene metadatos de un archivo G-code específico."""
         try:
-            async with self._session.get(f"{self.base_url}/server/files/metadata?filename={filename}") as response:
+            async with self._request("GET", f"{self.base_url}/server/files/metadata?filename={filename}") as response:
                 response.raise_for_status()
                 metadata = await response.json()
                 logger.info(f"Metadatos obtenidos para {filename}")
@@ -162,7 +265,9 @@ class MoonrakerClient:
             if start_print:
                 data.add_field('print', 'true')
 
-            async with self._session.post(f"{self.base_url}/server/files/upload", data=data) as response:
+            async with self._request(
+                "POST", f"{self.base_url}/server/files/upload", data=data, timeout=UPLOAD_TIMEOUT
+            ) as response:
                 response.raise_for_status()
                 result = await response.json()
                 logger.info(f"Archivo {filename} subido exitosamente")
@@ -171,10 +276,33 @@ class MoonrakerClient:
             logger.error(f"Error al subir archivo {filename}: {e}")
             return None
 
+    async def upload_gcode_stream(self, chunks, filename, start_print=False):
+        """Sube un G-code enviando el cuerpo en streaming desde un iterador asíncrono.
+
+        A diferencia de ``upload_gcode_file`` lanza una excepción si la subida
+        falla, para que quien distribuye pueda decidir si reintentar.
+
+        Args:
+            chunks: Iterador asíncrono de bytes con el contenido del archivo
+        """
+        data = aiohttp.FormData()
+        data.add_field('root', 'gcodes')
+        if start_print:
+            data.add_field('print', 'true')
+        data.add_field('file', chunks, filename=filename, content_type='application/octet-stream')
+
+        async with self._request(
+            "POST", f"{self.base_url}/server/files/upload", data=data, timeout=UPLOAD_TIMEOUT
+        ) as response:
+            response.raise_for_status()
+            result = await response.json()
+            logger.info(f"Archivo {filename} subido exitosamente (streaming)")
+            return result
+
     async def start_print(self, filename):
         """Inicia la impresión de un archivo G-code."""
         try:
-            async with self._session.post(f"{self.base_url}/printer/print/start?filename={filename}") as response:
+            async with self._request("POST", f"{self.base_url}/printer/print/start?filename={filename}") as response:
                 response.raise_for_status()
                 result = await response.text()
                 logger.info(f"Impresión iniciada: {filename}")
@@ -186,7 +314,7 @@ class MoonrakerClient:
     async def delete_gcode_file(self, filename):
         """Elimina un archivo G-code de la impresora."""
         try:
-            async with self._session.delete(f"{self.base_url}/server/files/gcodes/{filename}") as response:
+            async with self._request("DELETE", f"{self.base_url}/server/files/gcodes/{filename}") as response:
                 response.raise_for_status()
                 result = await response.json()
                 logger.info(f"Archivo {filename} eliminado exitosamente")
@@ -198,7 +326,7 @@ class MoonrakerClient:
     async def get_thumbnails(self, filename):
         """Obtiene información de thumbnails para un archivo G-code."""
         try:
-            async with self._session.get(f"{self.base_url}/server/files/thumbnails?filename={filename}") as response:
+            async with self._request("GET", f"{self.base_url}/server/files/thumbnails?filename={filename}") as response:
                 response.raise_for_status()
                 thumbnails = await response.json()
                 logger.info(f"Thumbnails obtenidos para {filename}: {len(thumbnails)} thumbnails")
@@ -207,57 +335,36 @@ class MoonrakerClient:
             logger.error(f"Error al obtener thumbnails de {filename}: {e}")
             return []
 
-    async def get_gcode_thumbnail_data(self, filename):
-        """Obtiene los datos de thumbnail embebidos en un archivo G-code."""
+    async def get_gcode_thumbnail_data(self, filename, metadata=None):
+        """Obtiene los datos de thumbnail embebidos en un archivo G-code.
+
+        Args:
+            metadata: Respuesta de metadatos ya conocida (se consulta a Moonraker si es None)
+        """
         try:
             # Primero intentar obtener metadatos que pueden incluir thumbnails
-            metadata = await self.get_gcode_metadata(filename)
+            if metadata is None:
+                metadata = await self.get_gcode_metadata(filename)
             if metadata and 'result' in metadata:
                 thumbnails_metadata = metadata['result'].get('thumbnails', [])
                 if thumbnails_metadata:
                     logger.info(f"📋 Metadatos de thumbnails encontrados para {filename}: {len(thumbnails_metadata)}")
-                    
-                    # Obtener los datos reales de cada thumbnail
-                    thumbnails_with_data = []
-                    for thumb_meta in thumbnails_metadata:
-                        # Obtener datos del thumbnail usando el relative_path
-                        relative_path = thumb_meta.get('relative_path')
-                        if relative_path:
-                            try:
-                                # Solicitar el thumbnail específico desde Moonraker
-                                async with self._session.get(f"{self.base_url}/server/files/gcodes/{relative_path}") as response:
-                                    if response.status == 200:
-                                        thumbnail_data = await response.read()
-                                        # Convertir a base64
-                                        import base64
-                                        data_b64 = base64.b64encode(thumbnail_data).decode('utf-8')
-                                        
-                                        # Combinar metadatos con datos
-                                        thumbnail_complete = thumb_meta.copy()
-                                        thumbnail_complete['data'] = data_b64
-                                        thumbnails_with_data.append(thumbnail_complete)
-                                        
-                                        logger.info(f"✅ Thumbnail obtenido: {thumb_meta.get('width')}x{thumb_meta.get('height')}, data length: {len(data_b64)}")
-                                    else:
-                                        logger.warning(f"⚠️ No se pudo obtener thumbnail: {relative_path} (status: {response.status})")
-                                        # Incluir sin datos
-                                        thumbnails_with_data.append(thumb_meta.copy())
-                            except Exception as e:
-                                logger.error(f"❌ Error obteniendo thumbnail {relative_path}: {e}")
-                                # Incluir sin datos
-                                thumbnails_with_data.append(thumb_meta.copy())
-                    
-                    return thumbnails_with_data
+                    # Los PNG extraídos por Moonraker se piden en paralelo
+                    thumbnails = await asyncio.gather(*(
+                        self._fetch_thumbnail_png(thumb_meta)
+                        for thumb_meta in thumbnails_metadata
+                        if thumb_meta.get('relative_path')
+                    ))
+                    return list(thumbnails)
             
-            # Si no hay thumbnails en metadatos, intentar leer el archivo directamente
+            # Si no hay thumbnails en metadatos, leer solo la cabecera del archivo
             logger.info(f"🔄 Probando extracción directa del G-code para {filename}")
-            async with self._session.get(f"{self.base_url}/server/files/gcodes/{filename}") as response:
-                if response.status == 200:
-                    content = await response.text()
-                    thumbnails = self._extract_thumbnails_from_gcode(content)
-                    if thumbnails:
-                        logger.info(f"✅ Thumbnails extraídos del G-code {filename}: {len(thumbnails)}")
-                        return thumbnails
+            header = await self.read_gcode_header(filename)
+            if header:
+                thumbnails = self._extract_thumbnails_from_gcode(header.decode('utf-8', errors='replace'))
+                if thumbnails:
+                    logger.info(f"✅ Thumbnails extraídos del G-code {filename}: {len(thumbnails)}")
+                    return thumbnails
                         
             logger.info(f"ℹ️ No se encontraron thumbnails para {filename}")
             return []
@@ -265,6 +372,41 @@ class MoonrakerClient:
             logger.error(f"❌ Error al obtener thumbnails de G-code {filename}: {e}")
             return []
 
+    async def _fetch_thumbnail_png(self, thumb_meta):
+        """Descarga un thumbnail extraído por Moonraker y lo devuelve en base64 junto a sus metadatos."""
+        relative_path = thumb_meta.get('relative_path')
+        thumbnail = thumb_meta.copy()
+        try:
+            async with self._request("GET", f"{self.base_url}/server/files/gcodes/{relative_path}") as response:
+                if response.status == 200:
+                    thumbnail['data'] = base64.b64encode(await response.read()).decode('utf-8')
+                    logger.info(f"✅ Thumbnail obtenido: {thumb_meta.get('width')}x{thumb_meta.get('height')}, data length: {len(thumbnail['data'])}")
+                else:
+                    # Se incluye sin datos
+                    logger.warning(f"⚠️ No se pudo obtener thumbnail: {relative_path} (status: {response.status})")
+        except Exception as e:
+            logger.error(f"❌ Error obteniendo thumbnail {relative_path}: {e}")
+        return thumbnail
+
+    async def read_gcode_header(self, filename, max_bytes=THUMBNAIL_HEADER_BYTES):
+        """Lee el principio de un G-code hasta pasar el último bloque de thumbnails.
+
+        Se pide un rango (``Range: bytes=0-N``) y además se lee en streaming, de modo
+        que aunque el servidor ignore el rango la descarga se corta en cuanto aparece
+        la primera línea de G-code tras el último ``; thumbnail end``.
+        """
+        buffer = bytearray()
+        headers = {'Range': f'bytes=0-{max_bytes - 1}'}
+        async with self._request("GET", f"{self.base_url}/server/files/gcodes/{filename}", headers=headers) as response:
+            if response.status not in (200, 206):
+                logger.warning(f"⚠️ No se pudo leer la cabecera de {filename} (status: {response.status})")
+                return None
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                buffer.extend(chunk)
+                if len(buffer) >= max_bytes or _thumbnails_complete(buffer):
+                    break
+        return bytes(buffer[:max_bytes])
+
     def _extract_thumbnails_from_gcode(self, gcode_content):
         """Extrae thumbnails de los comentarios THUMBNAIL_BLOCK_START/END en el G-code."""
         import base64
@@ -355,7 +497,7 @@ class MoonrakerClient:
     async def pause_print(self):
         """Pausa la impresión actual."""
         try:
-            async with self._session.post(f"{self.base_url}/printer/print/pause") as response:
+            async with self._request("POST", f"{self.base_url}/printer/print/pause") as response:
                 response.raise_for_status()
                 result = await response.text()
                 logger.info("Impresión pausada")
@@ -367,7 +509,7 @@ class MoonrakerClient:
     async def resume_print(self):
         """Reanuda la impresión pausada."""
         try:
-            async with self._session.post(f"{self.base_url}/printer/print/resume") as response:
+            async with self._request("POST", f"{self.base_url}/printer/print/resume") as response:
                 response.raise_for_status()
                 result = await response.text()
                 logger.info("Impresión reanudada")
@@ -379,7 +521,7 @@ class MoonrakerClient:
     async def cancel_print(self):
         """Cancela la impresión actual."""
         try:
-            async with self._session.post(f"{self.base_url}/printer/print/cancel") as response:
+            async with self._request("POST", f"{self.base_url}/printer/print/cancel") as response:
                 response.raise_for_status()
                 result = await response.text()
                 logger.info("Impresión cancelada")
@@ -391,7 +533,7 @@ class MoonrakerClient:
     async def download_gcode_file(self, filename: str):
         """Descarga el contenido de un archivo G-code."""
         try:
-            async with self._session.get(f"{self.base_url}/server/files/gcodes/{filename}") as response:
+            async with self._request("GET", f"{self.base_url}/server/files/gcodes/{filename}") as response:
                 if response.status == 200:
                     content = await response.read()
                     logger.info(f"✅ Archivo {filename} descargado correctamente ({len(content)} bytes)")
@@ -403,12 +545,26 @@ class MoonrakerClient:
             logger.error(f"❌ Error descargando archivo {filename}: {e}")
             return None
 
+    @asynccontextmanager
+    async def open_gcode_download(self, filename: str, range_header: str = None):
+        """Abre la descarga de un G-code sin leer el cuerpo, para reenviarlo en streaming.
+
+        Args:
+            range_header: Cabecera ``Range`` del cliente, reenviada para reanudar descargas
+        """
+        headers = {'Range': range_header} if range_header else {}
+        async with self._request(
+            "GET", f"{self.base_url}/server/files/gcodes/{filename}",
+            headers=headers, timeout=DOWNLOAD_TIMEOUT
+        ) as response:
+            yield response
+
     # === RECUPERACIÓN Y MANTENIMIENTO ===
     
     async def restart_firmware(self):
         """Reinicia el firmware de Klipper."""
         try:
-            async with self._session.post(f"{self.base_url}/printer/firmware_restart") as response:
+            async with self._request("POST", f"{self.base_url}/printer/firmware_restart") as response:
                 response.raise_for_status()
                 result = await response.json()
                 logger.info("✅ Reinicio de firmware iniciado")
@@ -420,7 +576,7 @@ class MoonrakerClient:
     async def restart_klipper(self):
         """Reinicia el servicio de Klipper."""
         try:
-            async with self._session.post(f"{self.base_url}/machine/services/restart?service=klipper") as response:
+            async with self._request("POST", f"{self.base_url}/machine/services/restart?service=klipper") as response:
                 response.raise_for_status()
                 result = await response.json()
                 logger.info("✅ Klipper restart iniciado")
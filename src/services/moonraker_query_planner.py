@@ -0,0 +1,151 @@
+"""
+Planificador de consultas a Moonraker compartido por todos los ``MoonrakerClient``.
+
+- Fusión: los objetos pedidos a un mismo host se agrupan en una sola petición
+  ``objects/query`` que incluye también los pedidos recientemente, de modo que
+  temperaturas, progreso y estado de Klippy viajan juntos.
+- Singleflight: una consulta cubierta por otra petición en vuelo al mismo host
+  espera su resultado en vez de lanzar una nueva.
+- Memo: los resultados se reutilizan durante un TTL corto por objeto.
+"""
+
+import asyncio
+import copy
+import logging
+import os
+import time
+from typing import Any, Dict, FrozenSet, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class MoonrakerQueryPlanner:
+    """Fusiona, deduplica y memoriza consultas ``objects/query`` y ``/printer/info`` por host."""
+
+    def __init__(self, ttl: float = 1.0, plan_window: float = 30.0):
+        """
+        Args:
+            ttl: Segundos durante los que un objeto consultado se sirve desde el memo
+            plan_window: Los objetos pedidos en esta ventana se añaden a cada consulta al host
+        """
+        self.ttl = ttl
+        self.plan_window = plan_window
+        # base_url -> {objeto: (instante, valor)}; valor None si Moonraker no lo devolvió
+        self._memo: Dict[str, Dict[str, Tuple[float, Optional[Dict]]]] = {}
+        self._eventtime: Dict[str, Any] = {}
+        # base_url -> {objeto: último instante en que se pidió}
+        self._recent: Dict[str, Dict[str, float]] = {}
+        # base_url -> (objetos, tarea) de la consulta en vuelo
+        self._inflight: Dict[str, Tuple[FrozenSet[str], asyncio.Task]] = {}
+        # base_url -> (instante, resultado) de /printer/info
+        self._info_memo: Dict[str, Tuple[float, Dict]] = {}
+        self._info_inflight: Dict[str, asyncio.Task] = {}
+        self.stats = {"requests": 0, "memo_hits": 0, "shared": 0}
+
+    # === OBJETOS DE KLIPPER ===
+
+    async def query(self, client, objects: Iterable[str], max_age: Optional[float] = None) -> Optional[Dict]:
+        """Devuelve ``{"result": {"eventtime", "status"}}`` con los objetos pedidos.
+
+        Args:
+            client: ``MoonrakerClient`` del host
+            objects: Nombres de los objetos de Klipper
+            max_age: Antigüedad máxima aceptable del memo (por defecto ``ttl``)
+        """
+        key = client.base_url
+        wanted = frozenset(objects)
+        now = time.monotonic()
+        max_age = self.ttl if max_age is None else max_age
+
+        recent = self._recent.setdefault(key, {})
+        for name in wanted:
+            recent[name] = now
+
+        memo = self._memo.get(key, {})
+        if wanted and all(name in memo and now - memo[name][0] <= max_age for name in wanted):
+            self.stats["memo_hits"] += 1
+            return self._subset(key, wanted)
+
+        inflight = self._inflight.get(key)
+        if inflight and wanted <= inflight[0]:
+            self.stats["shared"] += 1
+            result = await asyncio.shield(inflight[1])
+        else:
+            plan = wanted | {name for name, ts in recent.items() if now - ts <= self.plan_window}
+            task = asyncio.ensure_future(self._fetch(client, key, plan))
+            self._inflight[key] = (plan, task)
+            result = await asyncio.shield(task)
+
+        if result is None:
+            return None
+        return self._subset(key, wanted)
+
+    async def _fetch(self, client, key: str, plan: FrozenSet[str]) -> Optional[Dict]:
+        self.stats["requests"] += 1
+        try:
+            result = await client._fetch_objects(sorted(plan))
+        finally:
+            inflight = self._inflight.get(key)
+            if inflight and inflight[1] is asyncio.current_task():
+                del self._inflight[key]
+
+        if not result or 'result' not in result or 'status' not in result['result']:
+            return None
+        now = time.monotonic()
+        status = result['result']['status']
+        memo = self._memo.setdefault(key, {})
+        for name in plan:
+            memo[name] = (now, status.get(name))
+        self._eventtime[key] = result['result'].get('eventtime')
+        return result
+
+    def _subset(self, key: str, objects: FrozenSet[str]) -> Dict:
+        memo = self._memo.get(key, {})
+        status = {
+            name: copy.deepcopy(memo[name][1])
+            for name in objects
+            if name in memo and memo[name][1] is not None
+        }
+        return {"result": {"eventtime": self._eventtime.get(key), "status": status}}
+
+    # === /printer/info ===
+
+    async def printer_info(self, client, max_age: float = 0.0) -> Optional[Dict]:
+        """``/printer/info`` con singleflight y memo opcional (``max_age`` en segundos)."""
+        key = client.base_url
+        cached = self._info_memo.get(key)
+        if max_age and cached and time.monotonic() - cached[0] <= max_age:
+            self.stats["memo_hits"] += 1
+            return copy.deepcopy(cached[1])
+
+        task = self._info_inflight.get(key)
+        if task is not None:
+            self.stats["shared"] += 1
+        else:
+            task = asyncio.ensure_future(self._fetch_info(client, key))
+            self._info_inflight[key] = task
+        result = await asyncio.shield(task)
+        return copy.deepcopy(result)
+
+    async def _fetch_info(self, client, key: str) -> Optional[Dict]:
+        self.stats["requests"] += 1
+        try:
+            result = await client._fetch_printer_info()
+        finally:
+            if self._info_inflight.get(key) is asyncio.current_task():
+                del self._info_inflight[key]
+        if result:
+            self._info_memo[key] = (time.monotonic(), result)
+        return result
+
+    def invalidate(self, base_url: str):
+        """Descarta el memo de un host (p. ej. tras enviar un comando)."""
+        self._memo.pop(base_url, None)
+        self._info_memo.pop(base_url, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "hosts": len(self._recent), "in_flight": len(self._inflight)}
+
+
+# Instancia global compartida por todos los MoonrakerClient
+query_planner = MoonrakerQueryPlanner(ttl=float(os.getenv("MOONRAKER_QUERY_TTL", "1.0")))
@@ -33,14 +33,7 @@ class OrderService:
         status: Optional[str] = None,
     ) -> List[Order]:
         """Obtiene todos los pedidos con filtros opcionales."""
-        orders_data = self._repo.list_orders()
-        
-        if customer_id:
-            orders_data = [o for o in orders_data if o.get("customer_id") == customer_id]
-        
-        if status:
-            orders_data = [o for o in orders_data if o.get("status") == status]
-        
+        orders_data = self._repo.list_orders_by(customer_id=customer_id or None, status=status or None)
         return [Order(**data) for data in orders_data]
 
     def get_order(self, order_id: str) -> Order:
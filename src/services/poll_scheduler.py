@@ -0,0 +1,276 @@
+"""
+Planificador adaptativo de polling HTTP por impresora.
+
+Cada impresora tiene su propio instante de vencimiento e intervalo: rápido
+mientras imprime o calienta, lento en reposo y con back-off exponencial cuando
+no responde. Un pool acotado de workers ejecuta las consultas, de modo que un
+host lento nunca bloquea el ciclo del resto de la flota.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Estados de ``print_stats`` que requieren refresco rápido
+ACTIVE_PRINT_STATES = {"printing", "paused"}
+
+
+class _PollEntry:
+    """Estado de planificación de una impresora."""
+
+    __slots__ = (
+        "printer_id", "due", "interval", "failures", "in_flight",
+        "polls", "errors", "missed_deadlines", "last_refresh", "refresh_rate",
+    )
+
+    def __init__(self, printer_id: str, due: float, interval: float):
+        self.printer_id = printer_id
+        self.due = due
+        self.interval = interval
+        self.failures = 0
+        self.in_flight = False
+        self.polls = 0
+        self.errors = 0
+        self.missed_deadlines = 0
+        self.last_refresh: Optional[float] = None
+        self.refresh_rate = 0.0
+
+
+class AdaptivePollScheduler:
+    """Planificador de polling con intervalos adaptativos y pool de workers acotado."""
+
+    def __init__(
+        self,
+        poll_func: Callable[[str], Awaitable[bool]],
+        printer_ids_func: Callable[[], Iterable[str]],
+        activity_func: Callable[[str], str],
+        should_poll: Optional[Callable[[str], bool]] = None,
+        workers: int = 8,
+        poll_timeout: float = 8.0,
+        active_interval: float = 2.0,
+        idle_interval: float = 15.0,
+        offline_base_interval: float = 5.0,
+        offline_max_interval: float = 120.0,
+        tick: float = 0.25,
+    ):
+        """
+        Args:
+            poll_func: Corrutina ``poll_func(printer_id) -> bool`` que refresca una impresora
+            printer_ids_func: Devuelve los IDs de impresoras a planificar
+            activity_func: Clasifica una impresora como ``active``, ``idle`` u ``offline``
+            should_poll: Si devuelve False la impresora no necesita polling (p. ej. WebSocket activo)
+            workers: Número máximo de consultas simultáneas
+            poll_timeout: Tiempo máximo de una consulta individual
+            active_interval: Intervalo mientras imprime o calienta
+            idle_interval: Intervalo en reposo
+            offline_base_interval: Primer intervalo de back-off cuando no responde
+            offline_max_interval: Intervalo máximo de back-off
+            tick: Resolución del bucle de despacho
+        """
+        self._poll_func = poll_func
+        self._printer_ids_func = printer_ids_func
+        self._activity_func = activity_func
+        self._should_poll = should_poll or (lambda printer_id: True)
+        self.workers = workers
+        self.poll_timeout = poll_timeout
+        self.active_interval = active_interval
+        self.idle_interval = idle_interval
+        self.offline_base_interval = offline_base_interval
+        self.offline_max_interval = offline_max_interval
+        self.tick = tick
+
+        self._entries: Dict[str, _PollEntry] = {}
+        self._heap: List[Tuple[float, int, str]] = []
+        self._counter = itertools.count()
+        self._queue: Optional[asyncio.Queue] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self.running = False
+
+        self._total_polls = 0
+        self._total_errors = 0
+        self._missed_deadlines = 0
+        self._skipped = 0
+        self._started_at: Optional[float] = None
+
+    # === CICLO DE VIDA ===
+
+    async def start(self):
+        if self.running:
+            return
+        self.running = True
+        self._started_at = time.monotonic()
+        self._queue = asyncio.Queue(maxsize=self.workers)
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._dispatch_loop(), name="poll_scheduler_dispatch")]
+        self._tasks.extend(
+            asyncio.create_task(self._worker(), name=f"poll_scheduler_worker_{i}")
+            for i in range(self.workers)
+        )
+        logger.info(f"Planificador de polling iniciado con {self.workers} workers")
+
+    async def stop(self):
+        self.running = False
+        for task in self._tasks:
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("Planificador de polling detenido")
+
+    def wake(self, printer_id: str):
+        """Adelanta el siguiente polling de una impresora (p. ej. al perder su WebSocket)."""
+        entry = self._entries.get(printer_id)
+        now = time.monotonic()
+        if entry is None:
+            self._schedule(_PollEntry(printer_id, now, self.idle_interval))
+        elif not entry.in_flight and entry.due > now:
+            entry.due = now
+            heapq.heappush(self._heap, (now, next(self._counter), printer_id))
+        if self._wakeup:
+            self._wakeup.set()
+
+    # === PLANIFICACIÓN ===
+
+    def _schedule(self, entry: _PollEntry):
+        self._entries[entry.printer_id] = entry
+        heapq.heappush(self._heap, (entry.due, next(self._counter), entry.printer_id))
+
+    def _sync_printers(self, now: float):
+        printer_ids = set(self._printer_ids_func())
+        for printer_id in list(self._entries):
+            if printer_id not in printer_ids:
+                del self._entries[printer_id]
+        for printer_id in printer_ids:
+            if printer_id not in self._entries:
+                self._schedule(_PollEntry(printer_id, now, self.idle_interval))
+
+    def next_interval(self, printer_id: str, failures: int) -> float:
+        """Calcula el intervalo hasta el próximo polling según la actividad."""
+        activity = self._activity_func(printer_id)
+        if activity == "offline" or failures:
+            exponent = max(failures - 1, 0)
+            return min(self.offline_base_interval * (2 ** exponent), self.offline_max_interval)
+        if activity == "active":
+            return self.active_interval
+        return self.idle_interval
+
+    async def _dispatch_loop(self):
+        while self.running:
+            try:
+                now = time.monotonic()
+                self._sync_printers(now)
+
+                while self._heap and self._heap[0][0] <= now and not self._queue.full():
+                    due, _, printer_id = heapq.heappop(self._heap)
+                    entry = self._entries.get(printer_id)
+                    # Entradas obsoletas (reprogramadas o eliminadas)
+                    if entry is None or entry.in_flight or entry.due != due:
+                        continue
+                    if not self._should_poll(printer_id):
+                        self._skipped += 1
+                        entry.due = now + self.idle_interval
+                        heapq.heappush(self._heap, (entry.due, next(self._counter), printer_id))
+                        continue
+                    entry.in_flight = True
+                    self._queue.put_nowait(entry)
+
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.tick)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Error en el despacho del planificador: {e}")
+                await asyncio.sleep(1)
+
+    async def _worker(self):
+        while self.running:
+            try:
+                entry = await self._queue.get()
+            except asyncio.CancelledError:
+                break
+            try:
+                await self._run_poll(entry)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Error en worker del planificador ({entry.printer_id}): {e}")
+            finally:
+                entry.in_flight = False
+                if self._entries.get(entry.printer_id) is entry:
+                    heapq.heappush(self._heap, (entry.due, next(self._counter), entry.printer_id))
+                self._queue.task_done()
+
+    async def _run_poll(self, entry: _PollEntry):
+        started = time.monotonic()
+        # Un polling que arranca tarde más de medio intervalo cuenta como deadline perdido
+        if started - entry.due > max(self.tick * 2, entry.interval * 0.5):
+            entry.missed_deadlines += 1
+            self._missed_deadlines += 1
+
+        try:
+            success = await asyncio.wait_for(self._poll_func(entry.printer_id), timeout=self.poll_timeout)
+        except asyncio.TimeoutError:
+            success = False
+        except Exception as e:
+            logger.debug(f"Polling fallido para {entry.printer_id}: {e}")
+            success = False
+
+        finished = time.monotonic()
+        entry.polls += 1
+        self._total_polls += 1
+        if success:
+            if entry.last_refresh is not None:
+                elapsed = finished - entry.last_refresh
+                if elapsed > 0:
+                    rate = 1.0 / elapsed
+                    entry.refresh_rate = rate if entry.refresh_rate == 0 else 0.7 * entry.refresh_rate + 0.3 * rate
+            entry.last_refresh = finished
+            entry.failures = 0
+        else:
+            entry.errors += 1
+            entry.failures += 1
+            self._total_errors += 1
+
+        entry.interval = self.next_interval(entry.printer_id, entry.failures)
+        entry.due = finished + entry.interval
+
+    # === MÉTRICAS ===
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Contadores globales y por impresora del planificador."""
+        now = time.monotonic()
+        uptime = now - self._started_at if self._started_at else 0
+        return {
+            "running": self.running,
+            "workers": self.workers,
+            "printers": len(self._entries),
+            "in_flight": sum(1 for e in self._entries.values() if e.in_flight),
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "total_polls": self._total_polls,
+            "total_errors": self._total_errors,
+            "missed_deadlines": self._missed_deadlines,
+            "skipped_push_updated": self._skipped,
+            "polls_per_second": round(self._total_polls / uptime, 2) if uptime else 0,
+            "per_printer": {
+                printer_id: {
+                    "interval": entry.interval,
+                    "due_in": round(entry.due - now, 2),
+                    "failures": entry.failures,
+                    "polls": entry.polls,
+                    "errors": entry.errors,
+                    "missed_deadlines": entry.missed_deadlines,
+                    "refresh_rate_hz": round(entry.refresh_rate, 3),
+                    "last_refresh_age": round(now - entry.last_refresh, 2) if entry.last_refresh else None,
+                }
+                for printer_id, entry in self._entries.items()
+            },
+        }
@@ -0,0 +1,689 @@
+"""
+Despachador automático de la cola de impresión.
+
+Los trabajos esperan en una cola de prioridad en memoria (prioridad, fecha
+límite y orden de llegada) respaldada por un log JSONL de solo anexado. El
+despachador escucha los cambios de la caché de estado: cuando una impresora
+termina un archivo (``complete``) o queda lista sin imprimir, arranca el
+siguiente archivo del trabajo que tiene asignado o le entrega el siguiente
+trabajo compatible de la cola. Además contabiliza el tiempo ocioso y ocupado de
+cada impresora para medir la utilización de la flota.
+
+Solo el worker líder despacha. El resto anexa al mismo log los trabajos que
+encolan o cancelan y el líder los recoge al releerlo.
+"""
+
+import asyncio
+import copy
+import heapq
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from src.services.poll_scheduler import ACTIVE_PRINT_STATES
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:  # pragma: no cover - solo en plataformas sin flock
+    fcntl = None
+    FCNTL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Orden de la cola: menor rango primero
+PRIORITIES = {"urgent": 0, "high": 1, "normal": 2, "low": 3}
+
+# Estados de un trabajo
+QUEUED = "queued"
+STARTING = "starting"
+PRINTING = "printing"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = {COMPLETED, FAILED, CANCELLED}
+
+# ``print_stats.state`` en que la impresora puede recibir el siguiente archivo
+IDLE_PRINT_STATES = {"standby", "complete"}
+# ``print_stats.state`` que detienen el trabajo hasta que alguien revise la impresora
+FAILED_PRINT_STATES = {"cancelled", "error"}
+
+
+def _due_timestamp(due: Any) -> float:
+    """Convierte la fecha límite (ISO 8601 o epoch) en segundos; sin fecha va al final."""
+    if due is None or due == "":
+        return float("inf")
+    if isinstance(due, (int, float)):
+        return float(due)
+    try:
+        return datetime.fromisoformat(str(due)).timestamp()
+    except ValueError:
+        return float("inf")
+
+
+class PrintDispatcher:
+    """Cola de prioridad de trabajos que mantiene ocupadas las impresoras libres."""
+
+    def __init__(
+        self,
+        fleet,
+        log_path: Optional[str] = None,
+        sweep_interval: float = 5.0,
+        start_grace: float = 60.0,
+        max_attempts: int = 3,
+        keep_finished: int = 200,
+    ):
+        """
+        Args:
+            fleet: FleetService (impresoras, caché de estado, distribuidor de G-code)
+            log_path: Log JSONL de los trabajos (None = solo en memoria)
+            sweep_interval: Segundos entre barridos completos de la flota y del log
+            start_grace: Segundos para que una impresora confirme que empezó un archivo
+            max_attempts: Intentos de arrancar un trabajo antes de darlo por fallido
+            keep_finished: Trabajos finalizados que se conservan para consulta
+        """
+        self.fleet = fleet
+        self.log_path = log_path
+        self.sweep_interval = sweep_interval
+        self.start_grace = start_grace
+        self.max_attempts = max(1, max_attempts)
+        self.keep_finished = keep_finished
+        self.origin = f"{socket.gethostname()}:{os.getpid()}"
+        self.running = False
+
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self._heap: List[tuple] = []
+        self._in_heap: set = set()
+        # Trabajo asignado a cada impresora
+        self._active: Dict[str, str] = {}
+        self._dirty: set = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._log_inode: Optional[int] = None
+        self._log_offset = 0
+        self._log_partial = b""
+
+        # Contabilidad de utilización: fase actual por impresora y segundos acumulados
+        self._phases: Dict[str, tuple] = {}
+        self._seconds: Dict[str, Dict[str, float]] = {}
+        self._dispatch_latency = deque(maxlen=500)
+        self.stats = {"enqueued": 0, "dispatched": 0, "files_started": 0, "completed": 0, "failed": 0, "cancelled": 0}
+
+    # === API PÚBLICA ===
+
+    def enqueue(
+        self,
+        files: Iterable[Dict[str, Any]],
+        job_id: Optional[str] = None,
+        printer_ids: Optional[Iterable[str]] = None,
+        priority: Any = "normal",
+        due: Any = None,
+        capabilities: Optional[Iterable[str]] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """Encola un trabajo para la primera impresora compatible que quede libre.
+
+        Args:
+            files: Archivos en orden, cada uno con ``gcode_path`` local y opcionalmente ``filename`` remoto
+            job_id: Identificador (por defecto uno nuevo)
+            printer_ids: Impresoras candidatas (None = cualquiera)
+            priority: ``urgent``, ``high``, ``normal``, ``low`` o un rango numérico
+            due: Fecha límite (ISO 8601 o epoch); a igual prioridad sale antes la más próxima
+            capabilities: Capacidades que debe declarar la impresora
+            metadata: Datos libres que se devuelven con el trabajo
+
+        Returns:
+            Copia del trabajo encolado
+        """
+        file_list = []
+        for entry in files:
+            if not entry.get("gcode_path"):
+                raise ValueError("Cada archivo necesita 'gcode_path'")
+            file_list.append(self._new_file(entry.get("filename") or os.path.basename(entry["gcode_path"]),
+                                            gcode_path=entry["gcode_path"]))
+        if not file_list:
+            raise ValueError("El trabajo no tiene archivos")
+        if isinstance(priority, str) and priority not in PRIORITIES:
+            raise ValueError(f"Prioridad no válida: {priority}")
+
+        job = self._new_job(job_id, file_list, priority, metadata)
+        job.update({
+            "due": due,
+            "printer_ids": list(printer_ids) if printer_ids else None,
+            "capabilities": list(capabilities or []),
+        })
+        self.jobs[job["job_id"]] = job
+        self._push(job)
+        self._save(job)
+        self.stats["enqueued"] += 1
+        logger.info(f"Trabajo {job['job_id']} encolado ({len(file_list)} archivo(s), prioridad {priority})")
+        self._wake_idle()
+        return self._public(job)
+
+    def track(self, job_id: str, printer_id: str, filenames: List[str],
+              priority: Any = "normal", metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Registra un trabajo ya subido a una impresora cuyo primer archivo acaba de arrancar.
+
+        El despachador arrancará el resto de archivos a medida que terminen los anteriores.
+        """
+        if not filenames:
+            raise ValueError("El trabajo no tiene archivos")
+        file_list = [self._new_file(name, uploaded=True) for name in filenames]
+        file_list[0].update({"state": PRINTING, "started_at": time.time()})
+        job = self._new_job(job_id, file_list, priority, metadata)
+        job.update({"status": PRINTING, "printer_id": printer_id, "printer_ids": [printer_id], "started_at": time.time()})
+
+        self.jobs[job["job_id"]] = job
+        self._assign(job)
+        self._save(job)
+        self.stats["files_started"] += 1
+        return self._public(job)
+
+    def cancel(self, job_id: str) -> Dict[str, Any]:
+        """Cancela un trabajo: deja de arrancar sus archivos (la impresión en curso sigue)."""
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        if job["status"] not in FINISHED_STATES:
+            self._finish(job, CANCELLED, None)
+            if not self.running:
+                # Solo el líder escribe el trabajo completo; el resto deja la petición en el log
+                self._append({"op": "cancel", "job_id": job_id})
+        return self._public(job)
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        self._refresh_if_follower()
+        job = self.jobs.get(job_id)
+        return self._public(job) if job else None
+
+    def get_queue(self, finished: int = 20) -> Dict[str, Any]:
+        """Trabajos en espera en el orden en que saldrán, asignados y últimos finalizados."""
+        self._refresh_if_follower()
+        queued = sorted((job for job in self.jobs.values() if job["status"] == QUEUED), key=self._order)
+        active = [job for job in self.jobs.values() if job["status"] in (STARTING, PRINTING)]
+        done = sorted((job for job in self.jobs.values() if job["status"] in FINISHED_STATES),
+                      key=lambda job: job.get("finished_at") or 0, reverse=True)
+        return {
+            "dispatching": self.running,
+            "queued": [self._public(job) for job in queued],
+            "active": [self._public(job) for job in active],
+            "finished": [self._public(job) for job in done[:finished]],
+        }
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Tiempo ocioso/ocupado por impresora, utilización y latencia de despacho."""
+        now = time.monotonic()
+        printers = {}
+        idle_total = busy_total = 0.0
+        for printer_id in self.fleet.printers:
+            seconds = dict(self._seconds.get(printer_id, {}))
+            phase, since = self._phases.get(printer_id, ("unknown", now))
+            if phase in ("idle", "busy"):
+                seconds[phase] = seconds.get(phase, 0.0) + now - since
+            idle, busy = seconds.get("idle", 0.0), seconds.get("busy", 0.0)
+            idle_total += idle
+            busy_total += busy
+            printers[printer_id] = {
+                "phase": phase,
+                "idle_seconds": round(idle, 1),
+                "busy_seconds": round(busy, 1),
+                "utilization": round(busy / (idle + busy), 3) if idle + busy else None,
+                "idle_for": round(now - since, 1) if phase == "idle" else 0.0,
+                "job_id": self._active.get(printer_id),
+            }
+        latencies = sorted(self._dispatch_latency)
+        return {
+            "dispatching": self.running,
+            "queued": sum(1 for job in self.jobs.values() if job["status"] == QUEUED),
+            "active": len(self._active),
+            "stats": dict(self.stats),
+            "fleet": {
+                "idle_seconds": round(idle_total, 1),
+                "busy_seconds": round(busy_total, 1),
+                "utilization": round(busy_total / (idle_total + busy_total), 3) if idle_total + busy_total else None,
+            },
+            "dispatch_latency": {
+                "samples": len(latencies),
+                "p50_s": round(latencies[len(latencies) // 2], 3) if latencies else None,
+                "max_s": round(latencies[-1], 3) if latencies else None,
+            },
+            "printers": printers,
+        }
+
+    # === CICLO DE VIDA ===
+
+    async def start(self):
+        """Empieza a despachar (solo en el worker líder)."""
+        if self.running:
+            return
+        await asyncio.to_thread(self._load)
+        self.running = True
+        self._wakeup = asyncio.Event()
+        self._dirty.update(self.fleet.owned_printer_ids())
+        self._task = asyncio.create_task(self._dispatch_loop(), name="print_dispatcher")
+        queued = sum(1 for job in self.jobs.values() if job["status"] == QUEUED)
+        logger.info(f"Despachador de impresión iniciado ({queued} en cola, {len(self._active)} asignados)")
+
+    async def stop(self):
+        self.running = False
+        tasks = [task for task in (self._task, *self._workers.values()) if task is not None]
+        self._task = None
+        self._workers.clear()
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def observe(self, printer_id: str, delta: Dict):
+        """Listener de la caché de estado: contabiliza la fase y despierta el despacho."""
+        if delta and "webhooks" not in delta and "state" not in delta.get("print_stats", {}):
+            return
+        phase = self._phase_of(printer_id)
+        now = time.monotonic()
+        previous, since = self._phases.get(printer_id, (None, now))
+        if phase != previous:
+            if previous in ("idle", "busy"):
+                seconds = self._seconds.setdefault(printer_id, {})
+                seconds[previous] = seconds.get(previous, 0.0) + now - since
+            self._phases[printer_id] = (phase, now)
+        if self.running:
+            self._dirty.add(printer_id)
+            self._wakeup.set()
+
+    # === DESPACHO ===
+
+    async def _dispatch_loop(self):
+        last_sweep = time.monotonic()
+        while self.running:
+            timeout = max(0.0, self.sweep_interval - (time.monotonic() - last_sweep))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            # El barrido no depende de que venza la espera: con cambios de estado más
+            # frecuentes que ``sweep_interval`` la espera no llegaría a vencer nunca
+            if time.monotonic() - last_sweep >= self.sweep_interval:
+                last_sweep = time.monotonic()
+                # Barrido: trabajos encolados por otros workers y arranques sin confirmar
+                self._dirty.update(self.fleet.owned_printer_ids())
+                self._refresh()
+            try:
+                dirty, self._dirty = self._dirty, set()
+                for printer_id in dirty:
+                    if printer_id in self._workers or not self._dispatchable(printer_id):
+                        continue
+                    job = self._plan(printer_id)
+                    if job is not None:
+                        self._launch(printer_id, job)
+            except Exception as e:
+                logger.error(f"Error en el despachador de impresión: {e}")
+
+    def _launch(self, printer_id: str, job: Dict[str, Any]):
+        task = asyncio.create_task(self._start_next_file(printer_id, job), name=f"dispatch_{printer_id}")
+        self._workers[printer_id] = task
+
+        def done(_task, printer_id=printer_id):
+            self._workers.pop(printer_id, None)
+            if self.running:
+                self._dirty.add(printer_id)
+                self._wakeup.set()
+
+        task.add_done_callback(done)
+
+    def _plan(self, printer_id: str) -> Optional[Dict[str, Any]]:
+        """Decide qué arrancar en una impresora; devuelve el trabajo o None si no toca nada."""
+        cache = self.fleet.state_cache
+        if cache.get_state(printer_id) != "ready":
+            return None
+        print_stats = cache.get_object(printer_id, "print_stats")
+        state = print_stats.get("state")
+        filename = print_stats.get("filename")
+
+        job = self.jobs.get(self._active.get(printer_id))
+        current = job["files"][job["current"]] if job is not None else None
+        if current is not None and job["status"] == PRINTING and current["state"] == PRINTING:
+            if filename == current["filename"] and state in ACTIVE_PRINT_STATES:
+                current["confirmed"] = True
+                return None
+            if filename == current["filename"] and state == "complete":
+                self._file_completed(job, printer_id)
+            elif filename == current["filename"] and state in FAILED_PRINT_STATES:
+                self._finish(job, FAILED, f"Impresión de {filename} interrumpida ({state})")
+                return None
+            elif not current.get("confirmed") and time.time() - current["started_at"] > self.start_grace:
+                self._finish(job, FAILED, f"La impresora no empezó {current['filename']}")
+                return None
+            else:
+                # Sigue imprimiendo, o el estado aún refleja el archivo anterior
+                return None
+
+        if state not in IDLE_PRINT_STATES:
+            return None
+        job = self.jobs.get(self._active.get(printer_id))
+        if job is not None and job["status"] == PRINTING:
+            return job
+        job = self._pick(printer_id)
+        if job is not None:
+            job.update({"status": STARTING, "printer_id": printer_id})
+            job["attempts"] = job.get("attempts", 0) + 1
+            self._active[printer_id] = job["job_id"]
+            self._save(job)
+            self.stats["dispatched"] += 1
+        return job
+
+    def _pick(self, printer_id: str) -> Optional[Dict[str, Any]]:
+        """Saca de la cola el trabajo compatible más prioritario para la impresora."""
+        printer = self.fleet.printers.get(printer_id)
+        capabilities = set(printer.capabilities or []) if printer is not None else set()
+        skipped, chosen = [], None
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            job = self.jobs.get(entry[-1])
+            if job is None or job["status"] != QUEUED:
+                self._in_heap.discard(entry[-1])
+                continue
+            if (job.get("printer_ids") is None or printer_id in job["printer_ids"]) and \
+                    set(job.get("capabilities") or []) <= capabilities:
+                self._in_heap.discard(entry[-1])
+                chosen = job
+                break
+            skipped.append(entry)
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+        return chosen
+
+    async def _start_next_file(self, printer_id: str, job: Dict[str, Any]):
+        """Sube lo que falte del trabajo a la impresora y arranca su archivo actual."""
+        current = job["files"][job["current"]]
+        try:
+            for entry in job["files"][job["current"]:]:
+                if entry["uploaded"]:
+                    continue
+                distribution = await self.fleet.distributor.distribute(
+                    entry["gcode_path"], [printer_id], filename=entry["filename"]
+                )
+                target = distribution["targets"][printer_id]
+                if target["state"] != "completed":
+                    raise RuntimeError(f"Error subiendo {entry['filename']}: {target['error']}")
+                entry["filename"] = target["path"] or entry["filename"]
+                entry["uploaded"] = True
+
+            result = await self.fleet.start_printer_print(printer_id, current["filename"])
+            if not result or not result.get("success"):
+                raise RuntimeError((result or {}).get("error") or "Moonraker rechazó el inicio")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"No se pudo arrancar {current['filename']} en {printer_id}: {e}")
+            self._start_failed(job, printer_id, str(e))
+            return
+
+        if job["status"] == CANCELLED:
+            return
+        current.update({"state": PRINTING, "started_at": time.time()})
+        job["status"] = PRINTING
+        job["started_at"] = job.get("started_at") or current["started_at"]
+        self._save(job)
+        self.stats["files_started"] += 1
+        phase, since = self._phases.get(printer_id, (None, None))
+        if phase == "idle":
+            self._dispatch_latency.append(time.monotonic() - since)
+        logger.info(f"🚀 {printer_id}: {current['filename']} ({job['current'] + 1}/{len(job['files'])} de {job['job_id']})")
+
+    def _start_failed(self, job: Dict[str, Any], printer_id: str, error: str):
+        if job["status"] == CANCELLED:
+            return
+        self._active.pop(printer_id, None)
+        requeue = job["current"] == 0 and job.get("attempts", 0) < self.max_attempts and all(
+            entry.get("gcode_path") for entry in job["files"]
+        )
+        if not requeue:
+            self._finish(job, FAILED, error)
+            return
+        # Las subidas son por impresora: otra impresora necesitará los archivos de nuevo
+        for entry in job["files"]:
+            entry["uploaded"] = False
+        job.update({"status": QUEUED, "printer_id": None, "error": error})
+        self._push(job)
+        self._save(job)
+
+    def _file_completed(self, job: Dict[str, Any], printer_id: str):
+        current = job["files"][job["current"]]
+        current.update({"state": COMPLETED, "finished_at": time.time()})
+        if job["current"] + 1 < len(job["files"]):
+            job["current"] += 1
+            self._save(job)
+        else:
+            self._finish(job, COMPLETED, None)
+
+    def _assign(self, job: Dict[str, Any]):
+        """Asigna ``job`` a su impresora; el trabajo que tuviera asignado se da por fallido."""
+        printer_id = job["printer_id"]
+        previous = self.jobs.get(self._active.get(printer_id))
+        if previous is not None and previous is not job and previous["status"] not in FINISHED_STATES:
+            self._finish(previous, FAILED, f"Sustituido por el trabajo {job['job_id']}")
+        self._active[printer_id] = job["job_id"]
+        if self.running:
+            self._dirty.add(printer_id)
+            self._wakeup.set()
+
+    def _finish(self, job: Dict[str, Any], status: str, error: Optional[str]):
+        job.update({"status": status, "error": error, "finished_at": time.time()})
+        if self._active.get(job.get("printer_id")) == job["job_id"]:
+            del self._active[job["printer_id"]]
+        self.stats[status] += 1
+        self._save(job)
+        self._trim_finished()
+        if status == FAILED:
+            logger.warning(f"Trabajo {job['job_id']} fallido: {error}")
+        else:
+            logger.info(f"Trabajo {job['job_id']}: {status}")
+
+    def _trim_finished(self):
+        finished = [job for job in self.jobs.values() if job["status"] in FINISHED_STATES]
+        if len(finished) <= self.keep_finished:
+            return
+        finished.sort(key=lambda job: job.get("finished_at") or 0)
+        for job in finished[:len(finished) - self.keep_finished]:
+            del self.jobs[job["job_id"]]
+
+    def _phase_of(self, printer_id: str) -> str:
+        cache = self.fleet.state_cache
+        if cache.get_state(printer_id) != "ready":
+            return "offline"
+        if cache.get_object(printer_id, "print_stats").get("state") in ACTIVE_PRINT_STATES:
+            return "busy"
+        return "idle"
+
+    def _dispatchable(self, printer_id: str) -> bool:
+        return printer_id in self.fleet.printers and self.fleet.sharding.owns(printer_id)
+
+    def wake(self, printer_ids):
+        """Reevalúa ``printer_ids`` (p. ej. impresoras que acaban de pasar a este nodo)."""
+        if not self.running:
+            return
+        self._dirty.update(printer_ids)
+        self._wakeup.set()
+
+    def _wake_idle(self):
+        if not self.running:
+            return
+        self._dirty.update(pid for pid, (phase, _) in self._phases.items() if phase == "idle")
+        self._wakeup.set()
+
+    # === COLA ===
+
+    @staticmethod
+    def _new_file(filename: str, gcode_path: Optional[str] = None, uploaded: bool = False) -> Dict[str, Any]:
+        return {"filename": filename, "gcode_path": gcode_path, "uploaded": uploaded,
+                "state": "pending", "started_at": None, "finished_at": None}
+
+    @staticmethod
+    def _new_job(job_id: Optional[str], files: List[Dict[str, Any]], priority: Any,
+                 metadata: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        return {
+            "job_id": job_id or uuid.uuid4().hex[:12],
+            "status": QUEUED,
+            "priority": priority,
+            "due": None,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "printer_id": None,
+            "printer_ids": None,
+            "capabilities": [],
+            "files": files,
+            "current": 0,
+            "attempts": 0,
+            "error": None,
+            "metadata": metadata or {},
+        }
+
+    @staticmethod
+    def _order(job: Dict[str, Any]) -> tuple:
+        priority = job.get("priority")
+        rank = PRIORITIES.get(priority, PRIORITIES["normal"]) if isinstance(priority, str) else priority
+        return (rank, _due_timestamp(job.get("due")), job["created_at"], job["job_id"])
+
+    def _push(self, job: Dict[str, Any]):
+        if job["job_id"] not in self._in_heap:
+            self._in_heap.add(job["job_id"])
+            heapq.heappush(self._heap, self._order(job))
+
+    def _rebuild(self):
+        self._heap, self._in_heap, self._active = [], set(), {}
+        for job in self.jobs.values():
+            if job["status"] == QUEUED:
+                self._push(job)
+            elif job["status"] == STARTING:
+                # El arranque se interrumpió (p. ej. cambio de líder): vuelve a la cola
+                job.update({"status": QUEUED, "printer_id": None})
+                for entry in job["files"]:
+                    entry["uploaded"] = entry["uploaded"] and not entry.get("gcode_path")
+                self._push(job)
+            elif job["status"] == PRINTING and job.get("printer_id"):
+                self._active[job["printer_id"]] = job["job_id"]
+
+    @staticmethod
+    def _public(job: Dict[str, Any]) -> Dict[str, Any]:
+        return copy.deepcopy(job)
+
+    # === PERSISTENCIA ===
+
+    def _save(self, job: Dict[str, Any]):
+        self._append({"op": "job", "job": job})
+
+    def _append(self, record: Dict[str, Any]):
+        if not self.log_path:
+            return
+        record["origin"] = self.origin
+        line = json.dumps(record, separators=(",", ":"), default=str) + "\n"
+        try:
+            os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+            with self._locked():
+                with open(self.log_path, "a") as f:
+                    f.write(line)
+        except OSError as e:
+            logger.error(f"Error escribiendo la cola de impresión en {self.log_path}: {e}")
+
+    @contextmanager
+    def _locked(self):
+        """Lock entre procesos sobre un fichero aparte (sobrevive a la compactación del log)."""
+        with open(f"{self.log_path}.lock", "a") as lock:
+            if FCNTL_AVAILABLE:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if FCNTL_AVAILABLE:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _refresh_if_follower(self):
+        if not self.running:
+            self._refresh()
+
+    def _refresh(self):
+        """Aplica las líneas del log escritas por otros workers desde la última lectura."""
+        if not self.log_path:
+            return
+        try:
+            stat = os.stat(self.log_path)
+        except FileNotFoundError:
+            return
+        replay = stat.st_ino != self._log_inode or stat.st_size < self._log_offset
+        if replay:
+            # Primera lectura o log compactado por el líder: se relee entero
+            self._log_inode, self._log_offset, self._log_partial = stat.st_ino, 0, b""
+            if not self.running:
+                self.jobs.clear()
+        if stat.st_size == self._log_offset:
+            return
+        with open(self.log_path, "rb") as f:
+            f.seek(self._log_offset)
+            data = f.read()
+        self._log_offset += len(data)
+        lines = (self._log_partial + data).split(b"\n")
+        self._log_partial = lines.pop()
+        for line in lines:
+            try:
+                self._apply(json.loads(line), replay=replay and not self.running)
+            except (ValueError, KeyError, TypeError):
+                continue
+
+    def _apply(self, record: Dict[str, Any], replay: bool = False):
+        if record.get("origin") == self.origin and not replay:
+            return
+        if record["op"] == "job":
+            job = record["job"]
+            known = self.jobs.get(job["job_id"])
+            if self.running and known is not None and known["status"] != QUEUED:
+                # El líder es la fuente de verdad de los trabajos que ya despachó
+                return
+            self.jobs[job["job_id"]] = job
+            if self.running and job["status"] == QUEUED:
+                self._push(job)
+                self._wake_idle()
+            elif self.running and job["status"] in (STARTING, PRINTING) and job.get("printer_id"):
+                # Trabajo registrado con ``track()`` en otro worker: el líder arranca sus siguientes archivos
+                self._assign(job)
+        elif record["op"] == "cancel":
+            job = self.jobs.get(record["job_id"])
+            if job is not None and job["status"] not in FINISHED_STATES:
+                if self.running:
+                    self._finish(job, CANCELLED, None)
+                else:
+                    job.update({"status": CANCELLED, "finished_at": time.time()})
+
+    def _load(self):
+        """Reproduce el log completo y lo compacta (lo hace el líder al empezar a despachar)."""
+        if not self.log_path or not os.path.exists(self.log_path):
+            self._rebuild()
+            return
+        with self._locked():
+            self.jobs.clear()
+            with open(self.log_path, "rb") as f:
+                for line in f:
+                    try:
+                        self._apply(json.loads(line), replay=True)
+                    except (ValueError, KeyError, TypeError):
+                        continue
+            self._trim_finished()
+            self._rebuild()
+            tmp_path = f"{self.log_path}.tmp"
+            with open(tmp_path, "w") as f:
+                for job in sorted(self.jobs.values(), key=lambda job: job["created_at"]):
+                    f.write(json.dumps({"op": "job", "job": job, "origin": self.origin},
+                                       separators=(",", ":"), default=str) + "\n")
+            os.replace(tmp_path, self.log_path)
+            stat = os.stat(self.log_path)
+            self._log_inode, self._log_offset, self._log_partial = stat.st_ino, stat.st_size, b""
+        logger.info(f"Cola de impresión recuperada: {len(self.jobs)} trabajos desde {self.log_path}")
@@ -0,0 +1,585 @@
+"""
+Caché de estado de la flota alimentado por suscripciones WebSocket de Moonraker.
+
+Cada impresora mantiene una única suscripción ``printer.objects.subscribe`` de
+larga duración. Las notificaciones ``notify_status_update`` se aplican como deltas
+sobre un snapshot en memoria, de modo que los lectores (API, monitor en tiempo
+real, comandos masivos) no generan tráfico hacia las impresoras. Si la conexión
+WebSocket se pierde, se reconecta con back-off exponencial y mientras tanto el
+snapshot se mantiene mediante el planificador adaptativo de polling HTTP.
+
+``wait_for`` permite esperar condiciones sobre ese estado (p. ej. que Klipper
+vuelva a ``ready``) sin bucles de sondeo: los predicados se evalúan con cada
+cambio aplicado, venga del WebSocket, del polling o del worker líder.
+"""
+
+import asyncio
+import copy
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from src.services.moonraker_client import MoonrakerClient
+from src.services.poll_scheduler import ACTIVE_PRINT_STATES, AdaptivePollScheduler
+
+logger = logging.getLogger(__name__)
+
+# Predicado de ``wait_for``: recibe los objetos de Klipper y los metadatos (solo lectura)
+StatePredicate = Callable[[Dict[str, Dict], Dict[str, Any]], bool]
+
+# Objetos de Klipper que se mantienen en el snapshot de cada impresora
+SUBSCRIBED_OBJECTS = {
+    "webhooks": None,
+    "extruder": None,
+    "heater_bed": None,
+    "print_stats": None,
+    "virtual_sdcard": None,
+    "toolhead": None,
+    "fan": None,
+}
+
+
+def build_realtime_data(status: Dict[str, Dict], info: Optional[Dict] = None) -> Dict[str, Any]:
+    """Convierte el estado de objetos de Klipper al formato ``realtime_data`` de la API.
+
+    Args:
+        status: Objetos de Klipper (``webhooks``, ``extruder``, ``print_stats``...)
+        info: Resultado de ``/printer/info`` (hostname, versiones...), si se conoce
+
+    Returns:
+        dict con las mismas claves que ``FleetService._update_printer_status``
+    """
+    realtime_data = dict(info or {})
+    webhooks = status.get("webhooks", {})
+    extruder = status.get("extruder", {})
+    heater_bed = status.get("heater_bed", {})
+    print_stats = status.get("print_stats", {})
+    virtual_sdcard = status.get("virtual_sdcard", {})
+
+    if "state" in webhooks:
+        realtime_data["state"] = webhooks["state"]
+    if "state_message" in webhooks:
+        realtime_data["state_message"] = webhooks["state_message"]
+
+    realtime_data.update({
+        'extruder_temp': extruder.get('temperature', 'N/A'),
+        'extruder_target': extruder.get('target', 'N/A'),
+        'bed_temp': heater_bed.get('temperature', 'N/A'),
+        'bed_target': heater_bed.get('target', 'N/A'),
+        'pressure_advance': extruder.get('pressure_advance', 'N/A'),
+        'smooth_time': extruder.get('smooth_time', 'N/A'),
+        'motion_queue': extruder.get('motion_queue', 'N/A'),
+        'print_progress': round((virtual_sdcard.get('progress') or 0.0) * 100, 1),
+        'print_state': print_stats.get('state', 'unknown'),
+        'print_filename': print_stats.get('filename', ''),
+        'print_total_duration': print_stats.get('total_duration', 0),
+        'print_duration': print_stats.get('print_duration', 0),
+        'filament_used': print_stats.get('filament_used', 0),
+    })
+    return realtime_data
+
+
+def klippy_state_in(*states: str) -> StatePredicate:
+    """Predicado: la impresora responde y Klipper está en alguno de ``states``."""
+    def predicate(status: Dict[str, Dict], meta: Dict[str, Any]) -> bool:
+        return not meta.get("error_status") and status.get("webhooks", {}).get("state") in states
+    return predicate
+
+
+def ready_for_job(status: Dict[str, Dict], meta: Dict[str, Any]) -> bool:
+    """Predicado: Klipper listo y sin impresión en curso."""
+    return (
+        klippy_state_in("ready")(status, meta)
+        and status.get("print_stats", {}).get("state") not in ACTIVE_PRINT_STATES
+    )
+
+
+class PrinterStateCache:
+    """Snapshot en memoria del estado de cada impresora de la flota."""
+
+    def __init__(
+        self,
+        fleet,
+        reconnect_base_delay: float = 1.0,
+        reconnect_max_delay: float = 30.0,
+        poll_workers: int = 8,
+    ):
+        """
+        Args:
+            fleet: FleetService propietario (fuente de impresoras y sesión HTTP)
+            reconnect_base_delay: Espera inicial antes de reintentar el WebSocket
+            reconnect_max_delay: Espera máxima entre reintentos
+            poll_workers: Consultas HTTP simultáneas del planificador de polling
+        """
+        self._fleet = fleet
+        self.reconnect_base_delay = reconnect_base_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.subscriptions_enabled = True
+
+        self._status: Dict[str, Dict[str, Dict]] = {}
+        self._info: Dict[str, Dict] = {}
+        self._meta: Dict[str, Dict[str, Any]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._listeners: List[Callable[[str, Dict], Any]] = []
+        # Manejadores de otras notificaciones de Moonraker (p. ej. notify_filelist_changed)
+        self._notification_handlers: Dict[str, List[Callable[[str, List], Any]]] = {}
+        # Esperas pendientes por impresora: (predicado, futuro)
+        self._waiters: Dict[str, List[Tuple[StatePredicate, asyncio.Future]]] = {}
+        self.running = False
+        # En modo réplica el estado llega de otro worker (apply_remote), sin contactar impresoras
+        self.mirror = False
+
+        # Polling HTTP para impresoras sin WebSocket activo
+        self.scheduler = AdaptivePollScheduler(
+            poll_func=self.poll_printer,
+            printer_ids_func=lambda: self._fleet.owned_printer_ids(),
+            activity_func=self.get_activity,
+            should_poll=lambda printer_id: not self._meta.get(printer_id, {}).get("connected"),
+            workers=poll_workers,
+        )
+
+    # === CICLO DE VIDA ===
+
+    async def start(self, subscribe: bool = True):
+        """Inicia la caché.
+
+        Args:
+            subscribe: Si es False no se abren WebSockets y todo el estado llega por polling
+        """
+        if self.running:
+            return
+        self.running = True
+        self.subscriptions_enabled = subscribe
+        logger.info(f"Iniciando caché de estado de la flota (suscripciones: {subscribe})")
+        # El snapshot de una réplica se conserva, pero sus conexiones eran las del líder anterior
+        for meta in self._meta.values():
+            meta["connected"] = False
+        self.sync_printers()
+        await self.scheduler.start()
+
+    async def start_mirror(self):
+        """Inicia la caché como réplica: sin suscripciones ni polling propios."""
+        if self.running:
+            return
+        self.running = True
+        self.mirror = True
+        self.subscriptions_enabled = False
+        logger.info("Caché de estado de la flota en modo réplica")
+
+    async def stop(self):
+        """Cancela todas las suscripciones y espera a que terminen."""
+        self.running = False
+        self.mirror = False
+        await self.scheduler.stop()
+        tasks = list(self._tasks.values())
+        self._tasks.clear()
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        logger.info("Caché de estado de la flota detenida")
+
+    def sync_printers(self):
+        """Alinea las suscripciones activas con las impresoras registradas en este nodo."""
+        if not self.running:
+            return
+        printer_ids = set(self._fleet.owned_printer_ids())
+        for printer_id in list(self._tasks.keys()):
+            if printer_id not in printer_ids:
+                self._tasks.pop(printer_id).cancel()
+        # Impresoras borradas o que pasaron a otro nodo: su estado ya no es de este
+        for printer_id in list(self._status.keys() | self._meta.keys()):
+            if printer_id not in printer_ids:
+                self.forget(printer_id)
+
+        if self.mirror or not self.subscriptions_enabled:
+            return
+        for printer_id in printer_ids:
+            task = self._tasks.get(printer_id)
+            if task is None or task.done():
+                self._tasks[printer_id] = asyncio.create_task(
+                    self._run_printer(printer_id),
+                    name=f"printer_state_{printer_id}"
+                )
+
+    def restart_printer(self, printer_id: str):
+        """Reinicia la suscripción de una impresora (p. ej. tras cambiar su IP)."""
+        task = self._tasks.pop(printer_id, None)
+        if task:
+            task.cancel()
+        self.forget(printer_id)
+        self.sync_printers()
+
+    def forget(self, printer_id: str):
+        """Elimina todo el estado conocido de una impresora."""
+        self._status.pop(printer_id, None)
+        self._info.pop(printer_id, None)
+        self._meta.pop(printer_id, None)
+
+    # === LECTURA ===
+
+    def has_snapshot(self, printer_id: str) -> bool:
+        return printer_id in self._status
+
+    def get_status(self, printer_id: str) -> Dict[str, Dict]:
+        """Copia de los objetos de Klipper conocidos para una impresora."""
+        return copy.deepcopy(self._status.get(printer_id, {}))
+
+    def get_realtime_data(self, printer_id: str) -> Dict[str, Any]:
+        """``realtime_data`` calculado del snapshot sin copiar los objetos de Klipper."""
+        status = self._status.get(printer_id)
+        if status is None:
+            return {}
+        return build_realtime_data(status, self._info.get(printer_id))
+
+    def get_object(self, printer_id: str, name: str) -> Dict[str, Any]:
+        """Copia de un único objeto de Klipper (p. ej. ``print_stats``)."""
+        return dict(self._status.get(printer_id, {}).get(name, {}))
+
+    def get_meta(self, printer_id: str) -> Dict[str, Any]:
+        return dict(self._meta.get(printer_id, {}))
+
+    def get_info(self, printer_id: str) -> Optional[Dict[str, Any]]:
+        """Último ``/printer/info`` conocido (el mismo objeto mientras no cambie)."""
+        return self._info.get(printer_id)
+
+    def export_state(self) -> Dict[str, Dict[str, Any]]:
+        """Copia completa del snapshot (objetos, info y metadatos) de cada impresora."""
+        return {
+            printer_id: {
+                "status": copy.deepcopy(status),
+                "info": self._info.get(printer_id),
+                "meta": dict(self._meta.get(printer_id, {})),
+            }
+            for printer_id, status in self._status.items()
+        }
+
+    def get_state(self, printer_id: str) -> Optional[str]:
+        """Estado de Klipper (``ready``, ``shutdown``...) o el error de conexión registrado."""
+        meta = self._meta.get(printer_id, {})
+        if meta.get("error_status"):
+            return meta["error_status"]
+        return self._status.get(printer_id, {}).get("webhooks", {}).get("state")
+
+    def get_klippy_events(self, printer_id: str) -> int:
+        """Contador de eventos de Klipper: cambios de ``webhooks.state``, ``notify_klippy_*`` y resuscripciones.
+
+        No cambia con las actualizaciones de temperaturas u otros objetos.
+        """
+        return self._meta.get(printer_id, {}).get("klippy_events", 0)
+
+    def _klippy_event(self, printer_id: str):
+        meta = self._meta.setdefault(printer_id, {})
+        meta["klippy_events"] = meta.get("klippy_events", 0) + 1
+
+    def get_activity(self, printer_id: str) -> str:
+        """Clasifica la impresora como ``active``, ``idle`` u ``offline`` para el polling."""
+        if self._meta.get(printer_id, {}).get("error_status"):
+            return "offline"
+        if self._waiters.get(printer_id):
+            # Alguien espera un cambio: refresco rápido mientras no haya WebSocket
+            return "active"
+        status = self._status.get(printer_id)
+        if not status:
+            return "idle"
+        if status.get("print_stats", {}).get("state") in ACTIVE_PRINT_STATES:
+            return "active"
+        for heater in ("extruder", "heater_bed"):
+            target = status.get(heater, {}).get("target") or 0
+            if isinstance(target, (int, float)) and target > 0:
+                return "active"
+        return "idle"
+
+    def is_fresh(self, printer_id: str, max_age: float) -> bool:
+        """Indica si el snapshot se puede usar sin consultar a la impresora."""
+        meta = self._meta.get(printer_id)
+        if not meta or printer_id not in self._status or meta.get("error_status"):
+            return False
+        if meta.get("connected"):
+            return True
+        return time.monotonic() - meta.get("updated_at", 0) <= max_age
+
+    def apply_to_printer(self, printer) -> bool:
+        """Vuelca el snapshot sobre un objeto ``Printer``.
+
+        Returns:
+            bool: True si había información del snapshot para esa impresora
+        """
+        meta = self._meta.get(printer.id, {})
+        status = self._status.get(printer.id)
+        if meta.get("error_status"):
+            # Se conserva el último estado conocido, marcado como obsoleto
+            printer.status = meta["error_status"]
+            printer.realtime_data = {}
+            if status is not None:
+                printer.realtime_data = build_realtime_data(status, self._info.get(printer.id))
+                printer.realtime_data["stale"] = True
+            return True
+        if status is None:
+            printer.status = "offline"
+            printer.realtime_data = {}
+            return False
+        printer.status = status.get("webhooks", {}).get("state", "unknown")
+        printer.realtime_data = build_realtime_data(status, self._info.get(printer.id))
+        return True
+
+    def get_cache_status(self) -> Dict[str, Any]:
+        """Resumen del estado de la caché para diagnóstico."""
+        now = time.monotonic()
+        return {
+            "running": self.running,
+            "mirror": self.mirror,
+            "subscriptions_enabled": self.subscriptions_enabled,
+            "scheduler": self.scheduler.get_metrics(),
+            "printers": {
+                printer_id: {
+                    "source": meta.get("source"),
+                    "connected": meta.get("connected", False),
+                    "reconnects": meta.get("reconnects", 0),
+                    "age_seconds": round(now - meta["updated_at"], 2) if meta.get("updated_at") else None,
+                    "error_status": meta.get("error_status"),
+                }
+                for printer_id, meta in self._meta.items()
+            },
+        }
+
+    # === ESCRITURA ===
+
+    def add_listener(self, callback: Callable[[str, Dict], Any]):
+        """Registra un callback ``callback(printer_id, delta)`` para cada cambio aplicado."""
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[[str, Dict], Any]):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def add_notification_handler(self, method: str, callback: Callable[[str, List], Any]):
+        """Registra ``callback(printer_id, params)`` para un método JSON-RPC de Moonraker."""
+        self._notification_handlers.setdefault(method, []).append(callback)
+
+    async def wait_for(self, printer_id: str, predicate: StatePredicate,
+                       timeout: Optional[float] = None) -> bool:
+        """Espera a que ``predicate(status, meta)`` se cumpla para una impresora.
+
+        El predicado se evalúa con el snapshot actual y después con cada cambio
+        aplicado. Varias esperas sobre la misma impresora comparten esas
+        actualizaciones, sin consultas adicionales a Moonraker.
+
+        Returns:
+            bool: True si el predicado se cumplió, False si venció ``timeout``
+        """
+        if self._evaluate(printer_id, predicate):
+            return True
+        future = asyncio.get_running_loop().create_future()
+        waiter = (predicate, future)
+        waiters = self._waiters.setdefault(printer_id, [])
+        waiters.append(waiter)
+        if self.running and not self.mirror and not self._meta.get(printer_id, {}).get("connected"):
+            self.scheduler.wake(printer_id)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            waiters.remove(waiter)
+            if not waiters and self._waiters.get(printer_id) is waiters:
+                del self._waiters[printer_id]
+
+    def _evaluate(self, printer_id: str, predicate: StatePredicate) -> bool:
+        try:
+            return bool(predicate(self._status.get(printer_id, {}), self._meta.get(printer_id, {})))
+        except Exception as e:
+            logger.error(f"Error evaluando condición de estado para {printer_id}: {e}")
+            return False
+
+    def _resolve_waiters(self, printer_id: str):
+        for predicate, future in list(self._waiters.get(printer_id, ())):
+            if not future.done() and self._evaluate(printer_id, predicate):
+                future.set_result(True)
+
+    def apply_status(self, printer_id: str, delta: Dict[str, Dict], source: str = "websocket"):
+        """Aplica un delta de objetos de Klipper sobre el snapshot."""
+        status = self._status.setdefault(printer_id, {})
+        previous_state = status.get("webhooks", {}).get("state")
+        for obj_name, fields in delta.items():
+            if isinstance(fields, dict):
+                status.setdefault(obj_name, {}).update(fields)
+            else:
+                status[obj_name] = fields
+
+        if "webhooks" in delta and status.get("webhooks", {}).get("state") != previous_state:
+            self._klippy_event(printer_id)
+        meta = self._meta.setdefault(printer_id, {})
+        meta["updated_at"] = time.monotonic()
+        meta["source"] = source
+        meta.pop("error_status", None)
+        self._notify(printer_id, delta)
+
+    def set_info(self, printer_id: str, info: Dict[str, Any]):
+        """Guarda la información estática de ``/printer/info``."""
+        self._info[printer_id] = info
+        webhooks = {key: info[key] for key in ("state", "state_message") if key in info}
+        if webhooks:
+            self.apply_status(printer_id, {"webhooks": webhooks}, source="http")
+
+    def mark_error(self, printer_id: str, error_status: str):
+        """Registra que la impresora no responde (``unreachable``, ``timeout``, ``error``)."""
+        meta = self._meta.setdefault(printer_id, {})
+        previous = meta.get("error_status")
+        meta["error_status"] = error_status
+        meta["updated_at"] = time.monotonic()
+        meta["source"] = "http"
+        if previous != error_status:
+            self._notify(printer_id, {})
+
+    def apply_remote(self, printer_id: str, delta: Dict[str, Dict], meta: Dict[str, Any],
+                     info: Optional[Dict[str, Any]] = None):
+        """Aplica un cambio publicado por el worker líder (modo réplica).
+
+        Args:
+            delta: Objetos de Klipper cambiados
+            meta: ``connected``, ``error_status`` y ``source`` del líder
+            info: ``/printer/info`` si cambió desde la última publicación
+        """
+        if info is not None:
+            self._info[printer_id] = info
+        if delta:
+            self.apply_status(printer_id, delta, source=meta.get("source") or "leader")
+        local = self._meta.setdefault(printer_id, {})
+        local["connected"] = bool(meta.get("connected"))
+        if meta.get("error_status"):
+            self.mark_error(printer_id, meta["error_status"])
+        elif local.pop("error_status", None):
+            local["updated_at"] = time.monotonic()
+            self._notify(printer_id, {})
+
+    def dispatch_notification(self, printer_id: str, method: str, params: List):
+        """Entrega una notificación JSON-RPC a los manejadores registrados para ``method``."""
+        for handler in self._notification_handlers.get(method, ()):
+            try:
+                handler(printer_id, params)
+            except Exception as e:
+                logger.error(f"Error procesando {method} de {printer_id}: {e}")
+
+    def _notify(self, printer_id: str, delta: Dict):
+        if printer_id in self._waiters:
+            self._resolve_waiters(printer_id)
+        for listener in list(self._listeners):
+            try:
+                listener(printer_id, delta)
+            except Exception as e:
+                logger.error(f"Error en listener de estado para {printer_id}: {e}")
+
+    # === SUSCRIPCIÓN Y FALLBACK ===
+
+    async def _run_printer(self, printer_id: str):
+        """Mantiene la suscripción WebSocket de una impresora con reconexión automática."""
+        delay = self.reconnect_base_delay
+        meta = self._meta.setdefault(printer_id, {})
+
+        while self.running and printer_id in self._fleet.printers:
+            printer = self._fleet.printers[printer_id]
+            ip, port = self._fleet._parse_ip_port(printer.ip)
+            session = await self._fleet._get_session()
+            client = MoonrakerClient(ip, port, session)
+
+            async def on_message(message, printer_id=printer_id):
+                # Con la caché detenida se cierra la conexión aunque la cancelación se haya
+                # perdido (``wait_for`` de Python 3.11 puede absorberla en ``_refresh_info``)
+                if not self.running:
+                    return False
+                return await self._handle_notification(printer_id, message)
+
+            async def on_subscribed(status, printer_id=printer_id, client=client):
+                meta["connected"] = True
+                meta["source"] = "websocket"
+                if meta.get("reconnects"):
+                    # Resuscripción (p. ej. tras ``notify_klippy_ready``): snapshot posterior al evento
+                    self._klippy_event(printer_id)
+                self.apply_status(printer_id, status)
+                await self._refresh_info(printer_id, client)
+
+            subscribed = await client.subscribe_to_updates(
+                on_message,
+                objects=SUBSCRIBED_OBJECTS,
+                on_subscribed=on_subscribed,
+            )
+
+            meta["connected"] = False
+            if not self.running:
+                break
+            if subscribed:
+                meta["reconnects"] = meta.get("reconnects", 0) + 1
+                delay = self.reconnect_base_delay
+                if meta.pop("resubscribe", False):
+                    continue
+            else:
+                delay = min(delay * 2, self.reconnect_max_delay)
+
+            # Mientras no haya WebSocket, el planificador mantiene el snapshot vía HTTP
+            self.scheduler.wake(printer_id)
+            await asyncio.sleep(delay)
+
+    async def _handle_notification(self, printer_id: str, message: Dict):
+        """Aplica una notificación JSON-RPC; retorna False para renovar la suscripción."""
+        method = message.get("method")
+        params = message.get("params") or []
+
+        if method in ("notify_klippy_shutdown", "notify_klippy_disconnected", "notify_klippy_ready"):
+            self._klippy_event(printer_id)
+
+        if method == "notify_status_update" and params:
+            self.apply_status(printer_id, params[0])
+        elif method == "notify_klippy_shutdown":
+            self.apply_status(printer_id, {"webhooks": {"state": "shutdown"}})
+        elif method == "notify_klippy_disconnected":
+            self.apply_status(printer_id, {"webhooks": {
+                "state": "startup",
+                "state_message": "Klippy disconnected",
+            }})
+        elif method == "notify_klippy_ready":
+            # Klipper reinició: las suscripciones de objetos deben renovarse
+            self.apply_status(printer_id, {"webhooks": {"state": "ready", "state_message": "Printer is ready"}})
+            self._meta.setdefault(printer_id, {})["resubscribe"] = True
+            return False
+
+        self.dispatch_notification(printer_id, method, params)
+
+    async def _refresh_info(self, printer_id: str, client: MoonrakerClient):
+        try:
+            printer_info = await asyncio.wait_for(client.get_printer_info(), timeout=5.0)
+            if printer_info and 'result' in printer_info:
+                self.set_info(printer_id, printer_info['result'])
+        except asyncio.TimeoutError:
+            logger.debug(f"Timeout obteniendo /printer/info de {printer_id}")
+
+    async def poll_printer(self, printer_id: str) -> bool:
+        """Actualiza el snapshot de una impresora con una consulta HTTP.
+
+        Returns:
+            bool: True si la impresora respondió
+        """
+        printer = self._fleet.printers.get(printer_id)
+        if printer is None:
+            return False
+        ip, port = self._fleet._parse_ip_port(printer.ip)
+        session = await self._fleet._get_session()
+        client = MoonrakerClient(ip, port, session)
+        try:
+            result = await asyncio.wait_for(
+                client.query_objects(SUBSCRIBED_OBJECTS.keys()),
+                timeout=5.0
+            )
+            if result and 'result' in result and 'status' in result['result']:
+                self.apply_status(printer_id, result['result']['status'], source="http")
+                if printer_id not in self._info:
+                    await self._refresh_info(printer_id, client)
+                return True
+            self.mark_error(printer_id, "unreachable")
+        except asyncio.TimeoutError:
+            logger.warning(f"Timeout consultando estado de {printer.name}")
+            self.mark_error(printer_id, "timeout")
+        except Exception as e:
+            logger.error(f"Error consultando estado de {printer.name}: {e}")
+            self.mark_error(printer_id, "error")
+        return False
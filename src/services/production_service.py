@@ -36,14 +36,16 @@ class ProductionService:
 
     def get_batches_by_order(self, order_id: str) -> List[ProductionBatch]:
         """Obtiene todos los lotes asociados a un pedido."""
-        all_batches = self.get_all_batches()
-        return [b for b in all_batches if b.order_id == order_id]
+        return [ProductionBatch(**data) for data in self._repo.list_batches_by(order_id=order_id)]
 
     def get_active_batches(self) -> List[ProductionBatch]:
         """Obtiene lotes en producción activa."""
-        all_batches = self.get_all_batches()
         active_statuses = [BatchStatus.IN_PROGRESS, BatchStatus.QUEUED]
-        return [b for b in all_batches if b.status in active_statuses]
+        return [
+            ProductionBatch(**data)
+            for status in active_statuses
+            for data in self._repo.list_batches_by(status=status.value)
+        ]
 
     def create_batch_from_order(self, order_id: str, printer_id: Optional[str] = None) -> ProductionBatch:
         """
@@ -78,14 +80,8 @@ class ProductionService:
         
         batch = ProductionBatch(**batch_data)
         
-        # Guardar (usando updater del repositorio base)
-        def updater(payload):
-            batches = payload.get("production_tracking", [])
-            batches.append(batch.model_dump())
-            payload["production_tracking"] = batches
-            return payload
-        
-        self._repo.update_payload(updater)
+        # Guardar (el estado se persiste como texto para el índice por estado)
+        self._repo.upsert_batch(batch.model_dump(mode="json"))
         return batch
 
     def create_batch(self, batch_data: ProductionBatchCreate) -> ProductionBatch:
@@ -124,14 +120,8 @@ class ProductionService:
 
         batch = ProductionBatch(**batch_dict)
         
-        # Guardar
-        def updater(payload):
-            batches = payload.get("production_tracking", [])
-            batches.append(batch.model_dump())
-            payload["production_tracking"] = batches
-            return payload
-        
-        self._repo.update_payload(updater)
+        # Guardar (el estado se persiste como texto para el índice por estado)
+        self._repo.upsert_batch(batch.model_dump(mode="json"))
         return batch
 
     def update_batch_status(self, batch_id: str, new_status: BatchStatus) -> ProductionBatch:
@@ -147,16 +137,7 @@ class ProductionService:
             batch.completed_at = datetime.utcnow().isoformat()
 
         # Guardar
-        def updater(payload):
-            batches = payload.get("production_tracking", [])
-            for idx, b in enumerate(batches):
-                if b.get("id") == batch_id:
-                    batches[idx] = batch.model_dump()
-                    break
-            payload["production_tracking"] = batches
-            return payload
-
-        self._repo.update_payload(updater)
+        self._repo.upsert_batch(batch.model_dump(mode="json"))
         return batch
 
     def update_item_progress(
@@ -188,16 +169,7 @@ class ProductionService:
         batch.updated_at = datetime.utcnow().isoformat()
 
         # Guardar
-        def updater(payload):
-            batches = payload.get("production_tracking", [])
-            for idx, b in enumerate(batches):
-                if b.get("id") == batch_id:
-                    batches[idx] = batch.model_dump()
-                    break
-            payload["production_tracking"] = batches
-            return payload
-
-        self._repo.update_payload(updater)
+        self._repo.upsert_batch(batch.model_dump(mode="json"))
         return batch
 
     def get_production_statistics(self) -> Dict:
@@ -1,18 +1,52 @@
 import asyncio
 import logging
+import os
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, Tuple, Iterable
 from src.services.fleet_service import fleet_service
-from src.services.websocket_service import websocket_manager
+from src.services.websocket_service import websocket_manager, merge_printer_messages
 
 logger = logging.getLogger(__name__)
 
+_MISSING = object()
+
+
+def compute_delta(previous: Dict, current: Dict, prefix: str = "") -> Tuple[Dict, List[str]]:
+    """Diferencia campo a campo entre dos documentos de impresora.
+
+    Returns:
+        (changes, removed): ``changes`` contiene solo los campos nuevos o modificados
+        (los diccionarios anidados se comparan recursivamente) y ``removed`` las rutas
+        con puntos de los campos que han desaparecido.
+    """
+    changes: Dict[str, Any] = {}
+    removed: List[str] = []
+    for key, value in current.items():
+        old = previous.get(key, _MISSING)
+        if isinstance(value, dict) and isinstance(old, dict):
+            sub_changes, sub_removed = compute_delta(old, value, f"{prefix}{key}.")
+            if sub_changes:
+                changes[key] = sub_changes
+            removed.extend(sub_removed)
+        elif old is _MISSING or old != value:
+            changes[key] = value
+    removed.extend(f"{prefix}{key}" for key in previous if key not in current)
+    return changes, removed
+
 class RealtimeMonitor:
     def __init__(self):
         self.monitoring = False
         self.monitor_task: Optional[asyncio.Task] = None
         self.previous_data: Dict[str, Dict] = {}
         self.last_update: Dict[str, datetime] = {}
+        # Último documento enviado por impresora y su número de secuencia (protocolo de deltas)
+        self.sent_documents: Dict[str, Dict] = {}
+        self.sequences: Dict[str, int] = {}
+        # Cambios pendientes de enviar en el próximo tick, uno por impresora
+        self.pending_updates: Dict[str, Dict] = {}
+        self.tick_interval = float(os.getenv("FLEET_WS_TICK", "0.25"))
+        self.flush_task: Optional[asyncio.Task] = None
+        self.frames_sent = 0
         self.update_interval = 3.0  # Reducido a 3 segundos para updates más frecuentes
         self.significant_temp_change = 0.5  # Reducido a 0.5°C para mayor sensibilidad
         self._shutdown_event = asyncio.Event()
@@ -35,6 +69,10 @@ class RealtimeMonitor:
             self._monitor_loop(), 
             name="realtime_monitor_loop"
         )
+        self.flush_task = asyncio.create_task(
+            self._flush_loop(),
+            name="realtime_monitor_flush"
+        )
         
     async def stop_monitoring(self):
         """Detiene el monitoreo en tiempo real de forma segura"""
@@ -59,6 +97,10 @@ class RealtimeMonitor:
             except Exception as e:
                 logger.error(f"Error deteniendo monitor: {e}")
         
+        if self.flush_task and not self.flush_task.done():
+            self.flush_task.cancel()
+            await asyncio.gather(self.flush_task, return_exceptions=True)
+        
         logger.info("Monitoreo en tiempo real detenido completamente")
         
     async def _monitor_loop(self):
@@ -111,9 +153,42 @@ class RealtimeMonitor:
                     await asyncio.sleep(2)  # Pausa corta entre errores
                 
         logger.info("Loop de monitoreo finalizado")
+    
+    async def _flush_loop(self):
+        """Envía cada ``tick_interval`` los cambios acumulados en un único frame por cliente"""
+        while self.monitoring and not self._shutdown_event.is_set():
+            try:
+                await asyncio.wait_for(self._shutdown_event.wait(), timeout=self.tick_interval)
+                break
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush_updates()
+            except Exception as e:
+                logger.error(f"Error enviando frame de flota: {e}")
+    
+    async def flush_updates(self):
+        """Envía como ``fleet_update`` los cambios pendientes de todas las impresoras"""
+        if not self.pending_updates:
+            return
+        updates, self.pending_updates = list(self.pending_updates.values()), {}
+        await websocket_manager.broadcast_fleet_update(updates)
+        self.frames_sent += 1
+    
+    def _queue_update(self, update: Dict[str, Any]):
+        """Acumula el cambio de una impresora hasta el próximo tick, fusionándolo con el pendiente"""
+        printer_id = update['printer_id']
+        pending = self.pending_updates.get(printer_id)
+        if pending is not None:
+            update = merge_printer_messages(pending, update) or update
+        self.pending_updates[printer_id] = update
         
     async def _check_all_printers(self):
-        """Verifica todas las impresoras con límite de tiempo"""
+        """Verifica todas las impresoras leyendo el snapshot de la caché de estado.
+
+        El refresco contra Moonraker lo hacen las suscripciones y el planificador
+        adaptativo, por lo que aquí no hay límite de impresoras por ciclo.
+        """
         try:
             # Obtener datos con timeout
             printers = await asyncio.wait_for(
@@ -121,17 +196,12 @@ class RealtimeMonitor:
                 timeout=8.0
             )
             
-            # Procesar máximo 10 impresoras por ciclo para evitar sobrecarga
-            for i, printer in enumerate(printers[:10]):
+            for printer in printers:
                 if not self.monitoring or self._shutdown_event.is_set():
                     break
                     
                 await self._process_printer_data(printer)
                 
-                # Yield entre impresoras para no bloquear
-                if i % 3 == 0:
-                    await asyncio.sleep(0.1)
-                
         except asyncio.TimeoutError:
             logger.warning("Timeout obteniendo lista de impresoras")
         except Exception as e:
@@ -157,39 +227,66 @@ class RealtimeMonitor:
             should_update = self._should_send_update(printer_id, current_data)
             
             if should_update:
-                # Preparar datos para enviar
-                update_data = {
-                    'id': printer.id,
-                    'name': printer.name,
-                    'model': printer.model,
-                    'ip': printer.ip,
-                    'status': printer.status,
-                    'capabilities': printer.capabilities,
-                    'location': printer.location,
-                    'realtime_data': printer.realtime_data or {},
-                    'last_update': current_time.isoformat()
-                }
+                document = self._build_printer_document(printer)
+                previous = self.sent_documents.get(printer_id)
+                seq = self.sequences.get(printer_id, 0) + 1
                 
-                # Enviar actualización vía WebSocket con timeout
-                try:
-                    await asyncio.wait_for(
-                        websocket_manager.broadcast_printer_data(printer_id, update_data),
-                        timeout=2.0
-                    )
-                    
-                    # Actualizar datos previos y timestamp solo si envío fue exitoso
-                    self.previous_data[printer_id] = current_data.copy()
-                    self.last_update[printer_id] = current_time
-                    
-                    logger.debug(f"Enviada actualización para impresora {printer.name}")
-                    
-                except asyncio.TimeoutError:
-                    logger.warning(f"Timeout enviando actualización para {printer.name}")
-                except Exception as e:
-                    logger.error(f"Error enviando actualización para {printer.name}: {e}")
+                if previous is None:
+                    update = {'type': 'printer_snapshot', 'printer_id': printer_id, 'seq': seq, 'data': document}
+                else:
+                    changes, removed = compute_delta(previous, document)
+                    if not changes and not removed:
+                        # Nada que enviar: los clientes ya tienen este estado
+                        self.previous_data[printer_id] = current_data.copy()
+                        self.last_update[printer_id] = current_time
+                        return
+                    update = {'type': 'printer_delta', 'printer_id': printer_id, 'seq': seq, 'changes': changes}
+                    if removed:
+                        update['removed'] = removed
+                
+                # El envío se agrupa con el resto de impresoras en el próximo tick
+                self._queue_update(update)
+                self.sent_documents[printer_id] = document
+                self.sequences[printer_id] = seq
+                self.previous_data[printer_id] = current_data.copy()
+                self.last_update[printer_id] = current_time
+                logger.debug(f"Encolada actualización {seq} para impresora {printer.name}")
                     
         except Exception as e:
             logger.error(f"Error procesando datos de impresora {printer.id}: {e}")
+    
+    def _build_printer_document(self, printer) -> Dict[str, Any]:
+        """Documento completo de una impresora tal como lo ve el cliente."""
+        return {
+            'id': printer.id,
+            'name': printer.name,
+            'model': printer.model,
+            'ip': printer.ip,
+            'status': printer.status,
+            'capabilities': printer.capabilities,
+            'location': printer.location,
+            'realtime_data': dict(printer.realtime_data or {}),
+        }
+    
+    async def get_snapshot(self, printer_ids: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """Documentos completos con su número de secuencia, para suscripciones y resincronización.
+
+        Se devuelve el último documento enviado (no uno recién calculado) para que
+        los deltas posteriores se apliquen sobre la misma base que el resto de clientes.
+        """
+        wanted = set(printer_ids) if printer_ids else None
+        printers = await asyncio.wait_for(fleet_service.list_printers(), timeout=8.0)
+        snapshot = []
+        for printer in printers:
+            if wanted is not None and printer.id not in wanted:
+                continue
+            document = self.sent_documents.get(printer.id)
+            if document is None:
+                document = self._build_printer_document(printer)
+                self.sent_documents[printer.id] = document
+                self.sequences.setdefault(printer.id, 0)
+            snapshot.append({**document, 'seq': self.sequences[printer.id]})
+        return snapshot
             
     def _should_send_update(self, printer_id: str, current_data: Dict) -> bool:
         """Determina si se debe enviar una actualización basada en cambios significativos"""
@@ -238,12 +335,14 @@ class RealtimeMonitor:
         try:
             logger.info("Forzando actualización completa de todas las impresoras")
             self.previous_data.clear()  # Limpiar datos previos para forzar actualizaciones
+            self.sent_documents.clear()  # Los clientes recibirán snapshots completos
             
             # Usar timeout para evitar que se cuelgue
             await asyncio.wait_for(
                 self._check_all_printers(),
                 timeout=15.0
             )
+            await self.flush_updates()
         except asyncio.TimeoutError:
             logger.warning("Timeout en force_update_all")
         except Exception as e:
@@ -254,11 +353,16 @@ class RealtimeMonitor:
         return {
             'monitoring': self.monitoring,
             'update_interval': self.update_interval,
+            'tick_interval': self.tick_interval,
+            'pending_updates': len(self.pending_updates),
+            'frames_sent': self.frames_sent,
             'printers_monitored': len(self.previous_data),
+            'sequences': dict(self.sequences),
             'last_updates': {k: v.isoformat() for k, v in self.last_update.items()},
             'websocket_connections': websocket_manager.get_connection_count(),
             'error_count': getattr(self, '_error_count', 0),
-            'task_status': 'running' if self.monitor_task and not self.monitor_task.done() else 'stopped'
+            'task_status': 'running' if self.monitor_task and not self.monitor_task.done() else 'stopped',
+            'poll_scheduler': fleet_service.state_cache.scheduler.get_metrics()
         }
         
     async def cleanup(self):
@@ -267,6 +371,8 @@ class RealtimeMonitor:
         await self.stop_monitoring()
         self.previous_data.clear()
         self.last_update.clear()
+        self.sent_documents.clear()
+        self.pending_updates.clear()
         logger.info("Limpieza del monitor completada")
 
 # Instancia global del monitor
@@ -22,6 +22,8 @@ from src.controllers.print_flow_controller import (
     load_wizard_session, save_wizard_session, find_stl_file_path
 )
 from src.services.plating_service import plating_service
+from src.services.http_clients import APISLICER_POOL, http_clients
+from src.services.shared_state import shared_state
 import logging
 
 logger = logging.getLogger(__name__)
@@ -103,6 +105,7 @@ class RotationWorker:
                 created_at=datetime.now(),
                 started_at=datetime.now()
             )
+            self._share_task(task_id)
             
             # Crear directorio temporal para la sesión
             session_dir = Path(f"/tmp/kybercore_processing/{session_id}")
@@ -257,6 +260,7 @@ class RotationWorker:
                 async with semaphore:
                     # Actualizar contador de archivos en progreso
                     self.tasks[task_id].progress.in_progress += 1
+                    self._share_task(task_id)
                     
                     try:
                         result = await self._process_single_file(
@@ -307,6 +311,7 @@ class RotationWorker:
                 self.tasks[task_id].progress.percentage = (
                     (len(successful_results) + len(failed_results)) / len(files_to_process) * 100
                 )
+            self._share_task(task_id)
             
             # Actualizar sesión con resultados
             session_data = load_wizard_session(session_id)
@@ -342,6 +347,7 @@ class RotationWorker:
             self.tasks[task_id].status = TaskStatusEnum.COMPLETED
             self.tasks[task_id].results = successful_results + failed_results
             self.tasks[task_id].completed_at = datetime.now()
+            self._share_task(task_id)
             
             elapsed = time.time() - start_time
             logger.info(
@@ -359,6 +365,7 @@ class RotationWorker:
             self.tasks[task_id].status = TaskStatusEnum.FAILED
             self.tasks[task_id].error_message = error_msg
             self.tasks[task_id].completed_at = datetime.now()
+            self._share_task(task_id)
     
     async def _process_single_file(
         self,
@@ -620,48 +627,48 @@ class RotationWorker:
         
         for attempt in range(self.max_retries):
             try:
-                async with aiohttp.ClientSession() as session:
-                    # Preparar FormData
-                    data = aiohttp.FormData()
-                    data.add_field('file', file_bytes, filename=filename, content_type='application/octet-stream')
-                    
-                    # Agregar parámetros de configuración
-                    # IMPORTANTE: Usar 'in' para detectar si la clave existe, no confiar solo en .get()
-                    # porque improvement_threshold=0 es un valor válido y debe respetarse
-                    threshold = config.get('improvement_threshold', 5.0) if 'improvement_threshold' in config else 5.0
-                    
-                    data.add_field('method', config.get('method', 'auto'))
-                    data.add_field('improvement_threshold', str(threshold))
-                    data.add_field('max_iterations', str(config.get('max_iterations', 50)))
-                    data.add_field('learning_rate', str(config.get('learning_rate', 0.1)))
-                    data.add_field('rotation_step', str(config.get('rotation_step', 15)))
-                    data.add_field('max_rotations', str(config.get('max_rotations', 24)))
-                    
-                    logger.debug(f"🎯 Enviando threshold a APISLICER: {threshold}")
-                    
-                    # Llamar a APISLICER con timeout
-                    timeout = aiohttp.ClientTimeout(total=120)
-                    async with session.post(
-                        'http://apislicer:8000/auto-rotate-upload',
-                        data=data,
-                        timeout=timeout
-                    ) as response:
-                        if response.status == 200:
-                            rotated_bytes = await response.read()
-                            
-                            # Extraer metadata de headers
-                            rotation_info = {
-                                "applied": response.headers.get('X-Rotation-Applied', 'false').lower() == 'true',
-                                "degrees": json.loads(response.headers.get('X-Rotation-Degrees', '[0,0,0]')),
-                                "improvement": float(response.headers.get('X-Improvement-Percentage', '0')),
-                                "contact_area": float(response.headers.get('X-Contact-Area', '0')),
-                                "original_area": float(response.headers.get('X-Original-Area', '0'))
-                            }
-                            
-                            return rotated_bytes, rotation_info
-                        else:
-                            error_text = await response.text()
-                            raise Exception(f"APISLICER HTTP {response.status}: {error_text}")
+                session = await http_clients.get_session(APISLICER_POOL)
+                # Preparar FormData
+                data = aiohttp.FormData()
+                data.add_field('file', file_bytes, filename=filename, content_type='application/octet-stream')
+                
+                # Agregar parámetros de configuración
+                # IMPORTANTE: Usar 'in' para detectar si la clave existe, no confiar solo en .get()
+                # porque improvement_threshold=0 es un valor válido y debe respetarse
+                threshold = config.get('improvement_threshold', 5.0) if 'improvement_threshold' in config else 5.0
+                
+                data.add_field('method', config.get('method', 'auto'))
+                data.add_field('improvement_threshold', str(threshold))
+                data.add_field('max_iterations', str(config.get('max_iterations', 50)))
+                data.add_field('learning_rate', str(config.get('learning_rate', 0.1)))
+                data.add_field('rotation_step', str(config.get('rotation_step', 15)))
+                data.add_field('max_rotations', str(config.get('max_rotations', 24)))
+                
+                logger.debug(f"🎯 Enviando threshold a APISLICER: {threshold}")
+                
+                # Llamar a APISLICER con timeout
+                timeout = aiohttp.ClientTimeout(total=120)
+                async with session.post(
+                    'http://apislicer:8000/auto-rotate-upload',
+                    data=data,
+                    timeout=timeout
+                ) as response:
+                    if response.status == 200:
+                        rotated_bytes = await response.read()
+                        
+                        # Extraer metadata de headers
+                        rotation_info = {
+                            "applied": response.headers.get('X-Rotation-Applied', 'false').lower() == 'true',
+                            "degrees": json.loads(response.headers.get('X-Rotation-Degrees', '[0,0,0]')),
+                            "improvement": float(response.headers.get('X-Improvement-Percentage', '0')),
+                            "contact_area": float(response.headers.get('X-Contact-Area', '0')),
+                            "original_area": float(response.headers.get('X-Original-Area', '0'))
+                        }
+                        
+                        return rotated_bytes, rotation_info
+                    else:
+                        error_text = await response.text()
+                        raise Exception(f"APISLICER HTTP {response.status}: {error_text}")
             
             except asyncio.TimeoutError as e:
                 last_exception = e
@@ -705,22 +712,22 @@ class RotationWorker:
         
         for attempt in range(self.max_retries):
             try:
-                async with aiohttp.ClientSession() as session:
-                    data = aiohttp.FormData()
-                    data.add_field('file', file_bytes, filename=filename, content_type='application/octet-stream')
-                    data.add_field('custom_profile', profile_config.get('job_id', ''))
-                    
-                    timeout = aiohttp.ClientTimeout(total=180)
-                    async with session.post(
-                        'http://apislicer:8000/slice',
-                        data=data,
-                        timeout=timeout
-                    ) as response:
-                        if response.status == 200:
-                            return await response.read()
-                        else:
-                            error_text = await response.text()
-                            raise Exception(f"APISLICER HTTP {response.status}: {error_text}")
+                session = await http_clients.get_session(APISLICER_POOL)
+                data = aiohttp.FormData()
+                data.add_field('file', file_bytes, filename=filename, content_type='application/octet-stream')
+                data.add_field('custom_profile', profile_config.get('job_id', ''))
+                
+                timeout = aiohttp.ClientTimeout(total=180)
+                async with session.post(
+                    'http://apislicer:8000/slice',
+                    data=data,
+                    timeout=timeout
+                ) as response:
+                    if response.status == 200:
+                        return await response.read()
+                    else:
+                        error_text = await response.text()
+                        raise Exception(f"APISLICER HTTP {response.status}: {error_text}")
             
             except asyncio.TimeoutError as e:
                 last_exception = e
@@ -753,7 +760,20 @@ class RotationWorker:
         Returns:
             TaskStatus si existe, None si no
         """
-        return self.tasks.get(task_id)
+        task = self.tasks.get(task_id)
+        if task is None:
+            # La tarea puede estar ejecutándose en otro worker
+            shared = shared_state.get_task(task_id)
+            if shared is not None:
+                task = TaskStatus.model_validate(shared)
+        return task
+    
+    def _share_task(self, task_id: str):
+        """Publica el estado de la tarea para que el polling funcione desde cualquier worker."""
+        try:
+            shared_state.put_task(task_id, self.tasks[task_id].model_dump(mode="json"))
+        except Exception as e:
+            logger.warning(f"No se pudo compartir el estado de la tarea {task_id}: {e}")
     
     def cleanup_old_tasks(self, max_age_hours: int = 24):
         """
@@ -773,6 +793,7 @@ class RotationWorker:
         
         for task_id in tasks_to_remove:
             del self.tasks[task_id]
+            shared_state.delete_task(task_id)
         
         if tasks_to_remove:
             logger.info(f"🧹 Limpiadas {len(tasks_to_remove)} tareas antiguas")
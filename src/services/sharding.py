@@ -0,0 +1,331 @@
+"""
+Reparto de la flota entre varios nodos KyberCore.
+
+Un solo proceso sondea todas las impresoras, así que el polling y el fan-out
+de WebSocket quedan limitados por un único event loop. Con varios nodos (p. ej.
+uno por sede) cada impresora pertenece a uno solo, elegido por hashing
+consistente sobre su ID: cada nodo mantiene suscripciones, polling, índice de
+archivos y despacho únicamente de sus impresoras, y la capacidad crece con el
+número de nodos.
+
+La pertenencia se descubre con un registro intercambiable. Cada nodo publica
+periódicamente un latido; el que deja de latir durante ``node_ttl`` segundos
+sale del anillo y sus impresoras pasan a los supervivientes (con hashing
+consistente solo se mueven esas). Cualquier nodo compone la vista global de la
+flota pidiendo a los demás la de sus impresoras.
+
+Registros:
+    FileNodeRegistry: directorio compartido (volumen común, NFS) con un fichero
+        JSON por nodo. Se activa con ``FLEET_CLUSTER_DIR``.
+
+Un registro implementa ``register(node_id, info)``, ``deregister(node_id)`` y
+``members() -> {node_id: info}``; sin registro el nodo es el único dueño de
+toda la flota (modo por defecto).
+"""
+
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import os
+import socket
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import aiohttp
+
+from src.services.http_clients import http_clients
+
+logger = logging.getLogger(__name__)
+
+# Pool HTTP para las consultas entre nodos
+CLUSTER_POOL = "cluster"
+
+# Ruta con la que cada nodo expone la vista de sus propias impresoras
+LOCAL_VIEW_PATH = "/api/fleet/sharding/local"
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.sha1(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Anillo de hashing consistente con réplicas virtuales por nodo."""
+
+    def __init__(self, nodes: Iterable[str] = (), replicas: int = 64):
+        self.replicas = replicas
+        self.nodes = sorted(set(nodes))
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas))
+        self._keys = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def owner(self, key: str) -> Optional[str]:
+        """Nodo responsable de ``key`` (None si el anillo está vacío)."""
+        if not self._keys:
+            return None
+        index = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._owners[index]
+
+
+class FileNodeRegistry:
+    """Registro de nodos sobre un directorio compartido: ``<dir>/<node_id>.json``."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, node_id: str) -> str:
+        return os.path.join(self.directory, f"{node_id.replace(os.sep, '_')}.json")
+
+    def register(self, node_id: str, info: Dict[str, Any]):
+        path = self._path(node_id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(info, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    def deregister(self, node_id: str):
+        try:
+            os.remove(self._path(node_id))
+        except FileNotFoundError:
+            pass
+
+    def members(self) -> Dict[str, Dict[str, Any]]:
+        members = {}
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    info = json.load(f)
+            except (OSError, ValueError):
+                # Fichero borrado o a medio escribir por otro nodo: se verá en la siguiente lectura
+                continue
+            members[info["node_id"]] = info
+        return members
+
+
+class FleetSharding:
+    """Pertenencia de este nodo al reparto y propiedad de cada impresora."""
+
+    def __init__(
+        self,
+        fleet,
+        registry=None,
+        node_id: Optional[str] = None,
+        url: Optional[str] = None,
+        heartbeat_interval: float = 2.0,
+        node_ttl: float = 10.0,
+        replicas: int = 64,
+        request_timeout: float = 5.0,
+    ):
+        """
+        Args:
+            fleet: FleetService propietario
+            registry: Registro de nodos (None = un único nodo dueño de toda la flota)
+            node_id: Identificador del nodo, común a todos sus workers (por defecto el hostname)
+            url: URL base con la que los demás nodos llegan a este
+            heartbeat_interval: Segundos entre latidos y relecturas del registro
+            node_ttl: Segundos sin latido tras los que un nodo se da por caído
+            replicas: Puntos virtuales de cada nodo en el anillo
+            request_timeout: Timeout de la consulta de la vista de otro nodo
+        """
+        self._fleet = fleet
+        self.registry = registry
+        self.node_id = node_id or socket.gethostname()
+        self.url = (url or f"http://{socket.gethostname()}:{os.getenv('PORT', '8000')}").rstrip("/")
+        self.heartbeat_interval = heartbeat_interval
+        self.node_ttl = node_ttl
+        self.replicas = replicas
+        self.members: Dict[str, Dict[str, Any]] = {}
+        self.ring = HashRing(replicas=replicas)
+        self._listeners: List[Callable[[], Any]] = []
+        self._task: Optional[asyncio.Task] = None
+        self._started_at = time.time()
+        self.stats = {"heartbeats": 0, "rebalances": 0, "remote_views": 0, "remote_failures": 0}
+        http_clients.configure(CLUSTER_POOL, limit=20, timeout=aiohttp.ClientTimeout(total=request_timeout))
+
+    @property
+    def enabled(self) -> bool:
+        return self.registry is not None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def add_listener(self, callback: Callable[[], Any]):
+        """Registra ``callback()``, llamado cuando cambia el reparto de impresoras."""
+        self._listeners.append(callback)
+
+    # === PROPIEDAD ===
+
+    def owner_of(self, printer_id: str) -> Optional[str]:
+        return self.ring.owner(printer_id) if self.enabled else self.node_id
+
+    def owns(self, printer_id: str) -> bool:
+        """True si este nodo debe monitorizar la impresora.
+
+        Con el anillo aún vacío (nodo sin arrancar) se asume la propiedad: un
+        worker réplica solo ve el estado que le publica su líder.
+        """
+        owner = self.owner_of(printer_id)
+        return owner is None or owner == self.node_id
+
+    # === CICLO DE VIDA ===
+
+    async def start(self):
+        """Entra en el reparto (solo el worker líder del nodo late en el registro)."""
+        if not self.enabled or self.running:
+            return
+        self.heartbeat()
+        self.refresh()
+        logger.info(f"Nodo {self.node_id}: {len(self.members)} nodo(s) en el reparto de la flota")
+        self._task = asyncio.create_task(self._heartbeat_loop(), name="fleet_sharding")
+
+    async def stop(self):
+        """Sale del reparto: el resto de nodos asume sus impresoras sin esperar al TTL."""
+        task, self._task = self._task, None
+        if task is None:
+            return
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        try:
+            self.registry.deregister(self.node_id)
+        except OSError as e:
+            logger.warning(f"No se pudo retirar el nodo {self.node_id} del registro: {e}")
+
+    def heartbeat(self):
+        self.registry.register(self.node_id, {
+            "node_id": self.node_id,
+            "url": self.url,
+            "started_at": self._started_at,
+            "heartbeat_at": time.time(),
+            "printers": sum(1 for printer_id in self._fleet.printers if self.owns(printer_id)),
+        })
+        self.stats["heartbeats"] += 1
+
+    def refresh(self) -> bool:
+        """Relee el registro y reconstruye el anillo. Devuelve True si cambió el reparto."""
+        if not self.enabled:
+            return False
+        now = time.time()
+        members = {
+            node_id: info for node_id, info in self.registry.members().items()
+            if now - info.get("heartbeat_at", 0) <= self.node_ttl
+        }
+        if self.running:
+            # Un nodo activo nunca se excluye a sí mismo aunque su latido se retrase
+            members.setdefault(self.node_id, {"node_id": self.node_id, "url": self.url, "heartbeat_at": now})
+        self.members = members
+        if set(members) == set(self.ring.nodes):
+            return False
+        previous = self.ring.nodes
+        self.ring = HashRing(members, replicas=self.replicas)
+        self.stats["rebalances"] += 1
+        logger.info(f"Nodo {self.node_id}: reparto de la flota {previous} -> {self.ring.nodes}")
+        for callback in self._listeners:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Error aplicando el nuevo reparto de la flota: {e}")
+        return True
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await asyncio.to_thread(self.heartbeat)
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error en el latido del nodo {self.node_id}: {e}")
+
+    # === VISTA GLOBAL ===
+
+    async def local_view(self) -> Dict[str, Any]:
+        """Impresoras de este nodo con su estado, tal como las pide otro nodo."""
+        printers = await self._fleet.list_printers(owned_only=True)
+        return {
+            "node_id": self.node_id,
+            "printers": [self._serialize(printer) for printer in printers],
+        }
+
+    async def _remote_view(self, member: Dict[str, Any]) -> Dict[str, Any]:
+        session = await http_clients.get_session(CLUSTER_POOL)
+        async with session.get(f"{member['url'].rstrip('/')}{LOCAL_VIEW_PATH}") as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def aggregate(self) -> Dict[str, Any]:
+        """Vista de toda la flota: cada impresora con el estado que reporta su nodo dueño.
+
+        Las impresoras cuyo nodo no responde (o que cambian de dueño en este
+        momento) se devuelven con ``status="unknown"`` y ``stale=True``.
+        """
+        self.refresh()
+        local = await self.local_view()
+        peers = [info for node_id, info in self.members.items() if node_id != self.node_id and info.get("url")]
+        results = await asyncio.gather(*(self._remote_view(info) for info in peers), return_exceptions=True)
+
+        nodes = {self.node_id: {"ok": True, "url": self.url, "printers": len(local["printers"])}}
+        printers: Dict[str, Dict[str, Any]] = {}
+        for entry in local["printers"]:
+            printers[entry["id"]] = {**entry, "node": self.node_id}
+        for info, result in zip(peers, results):
+            node_id = info["node_id"]
+            if isinstance(result, Exception):
+                self.stats["remote_failures"] += 1
+                logger.warning(f"Nodo {node_id} no devolvió su vista de la flota: {result}")
+                nodes[node_id] = {"ok": False, "url": info["url"], "error": str(result) or type(result).__name__}
+                continue
+            self.stats["remote_views"] += 1
+            nodes[node_id] = {"ok": True, "url": info["url"], "printers": len(result.get("printers", []))}
+            for entry in result.get("printers", []):
+                printers.setdefault(entry["id"], {**entry, "node": node_id})
+
+        for printer_id, printer in self._fleet.printers.items():
+            if printer_id not in printers:
+                entry = self._serialize(printer)
+                entry.update(status="unknown", realtime_data={}, node=self.owner_of(printer_id), stale=True)
+                printers[printer_id] = entry
+
+        return {
+            "node_id": self.node_id,
+            "nodes": nodes,
+            "total": len(printers),
+            "printers": list(printers.values()),
+        }
+
+    @staticmethod
+    def _serialize(printer) -> Dict[str, Any]:
+        entry = printer.model_dump(mode="json")
+        if entry.get("realtime_data") is None:
+            entry["realtime_data"] = {}
+        return entry
+
+    def get_status(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            "enabled": self.enabled,
+            "node_id": self.node_id,
+            "url": self.url,
+            "running": self.running,
+            "owned_printers": sum(1 for printer_id in self._fleet.printers if self.owns(printer_id)),
+            "nodes": {
+                node_id: {
+                    "url": info.get("url"),
+                    "printers": info.get("printers"),
+                    "heartbeat_age_seconds": round(now - info.get("heartbeat_at", now), 2),
+                }
+                for node_id, info in self.members.items()
+            },
+            **self.stats,
+        }
+
+
+def create_registry():
+    """Registro de nodos configurado por entorno (None = un solo nodo)."""
+    directory = os.getenv("FLEET_CLUSTER_DIR")
+    if directory:
+        return FileNodeRegistry(directory)
+    return None
@@ -0,0 +1,534 @@
+"""
+Estado de la flota compartido entre workers de uvicorn.
+
+Con varios workers cada proceso tiene su propio ``fleet_service``; sin
+coordinación, todos sondearían las impresoras y cada uno vería un estado
+distinto. Este módulo elige un único líder (lock ``flock`` sobre un fichero:
+el kernel lo libera si el proceso muere y otro worker toma el relevo) que es el
+único que mantiene suscripciones WebSocket, polling, índice de archivos y
+volcado de telemetría. El líder publica los deltas de estado en un canal de
+difusión y guarda periódicamente un snapshot completo; el resto de workers
+arrancan la caché en modo réplica, cargan el snapshot y aplican los deltas,
+así que cualquier worker sirve HTTP y WebSocket con los mismos datos.
+
+Solo se comparte el estado de la flota. Los datos de ``base_datos/``
+(proyectos, sesiones del wizard, pedidos, cola e historial) se leen, modifican
+y escriben por proceso, así que el despliegue sigue con un único worker.
+
+Backends:
+    LocalStateBackend: en memoria, para un único proceso (modo por defecto).
+    FileStateBackend: directorio compartido (p. ej. ``/dev/shm/kybercore``) con
+        un fichero JSON por clave y un diario de eventos segmentado de solo
+        anexado. Se activa con ``FLEET_SHARED_STATE_DIR``.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:  # pragma: no cover - solo en plataformas sin flock
+    fcntl = None
+    FCNTL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Canales de difusión
+STATE_CHANNEL = "fleet.state"
+PRINTERS_CHANNEL = "fleet.printers"
+NOTIFICATION_CHANNEL = "fleet.notification"
+
+# Espacios de claves
+FLEET_NAMESPACE = "fleet"
+TASKS_NAMESPACE = "tasks"
+
+# Notificaciones de Moonraker que el líder reenvía al resto de workers
+RELAYED_NOTIFICATIONS = ("notify_filelist_changed",)
+
+
+def _merge_delta(target: Dict[str, Any], delta: Dict[str, Any]):
+    """Acumula un delta de objetos de Klipper sobre otro pendiente de publicar."""
+    for obj_name, fields in delta.items():
+        if isinstance(fields, dict) and isinstance(target.get(obj_name), dict):
+            target[obj_name].update(fields)
+        elif isinstance(fields, dict):
+            target[obj_name] = dict(fields)
+        else:
+            target[obj_name] = fields
+
+
+class LocalStateBackend:
+    """Backend en memoria: un solo proceso, que siempre es el líder."""
+
+    distributed = False
+
+    def __init__(self, history: int = 10000):
+        self._kv: Dict[str, Dict[str, Any]] = {}
+        self._events: deque = deque(maxlen=history)
+        self._next_seq = 0
+        self._leader: Optional[str] = None
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        return self._kv.get(namespace, {}).get(key)
+
+    def set(self, namespace: str, key: str, value: Any):
+        self._kv.setdefault(namespace, {})[key] = value
+
+    def delete(self, namespace: str, key: str):
+        self._kv.get(namespace, {}).pop(key, None)
+
+    def publish(self, channel: str, data: Any, origin: Optional[str] = None):
+        self._events.append((self._next_seq, {"channel": channel, "origin": origin, "data": data}))
+        self._next_seq += 1
+
+    def cursor(self) -> int:
+        """Posición actual del final del canal."""
+        return self._next_seq
+
+    def read_events(self, cursor: Optional[int]) -> Tuple[List[Dict[str, Any]], int]:
+        """Eventos publicados desde ``cursor`` (None = los más antiguos retenidos)."""
+        cursor = cursor or 0
+        return [event for seq, event in self._events if seq >= cursor], self._next_seq
+
+    def try_acquire_leadership(self, worker_id: str) -> bool:
+        if self._leader in (None, worker_id):
+            self._leader = worker_id
+            return True
+        return False
+
+    def release_leadership(self):
+        self._leader = None
+
+    def close(self):
+        self.release_leadership()
+
+
+class FileStateBackend:
+    """Backend sobre un directorio compartido por todos los workers del host.
+
+    - Claves: ``<dir>/kv/<namespace>/<key>.json``, escritas con ``os.replace``
+      para que un lector nunca vea un fichero a medias.
+    - Canal: segmentos ``<dir>/events/<n>.log`` con un evento JSON por línea.
+      Los escritores anexan bajo ``flock``; al superar ``segment_bytes`` se abre
+      el segmento siguiente y se borran los más antiguos que ``keep_segments``.
+      Cada lector recuerda ``(segmento, offset)`` y lee lo nuevo por polling.
+    - Liderazgo: ``flock`` exclusivo sobre ``<dir>/leader.lock``.
+    """
+
+    distributed = True
+
+    def __init__(self, directory: str, segment_bytes: int = 4 * 1024 * 1024, keep_segments: int = 4):
+        if not FCNTL_AVAILABLE:
+            raise RuntimeError("FileStateBackend requiere fcntl.flock (POSIX)")
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.keep_segments = keep_segments
+        self._events_dir = os.path.join(directory, "events")
+        os.makedirs(self._events_dir, exist_ok=True)
+        os.makedirs(os.path.join(directory, "kv"), exist_ok=True)
+        self._lock_path = os.path.join(directory, "events.lock")
+        self._leader_path = os.path.join(directory, "leader.lock")
+        self._leader_fd: Optional[int] = None
+        # Lector: segmento abierto y bytes de una línea aún incompleta
+        self._reader = None
+        self._reader_segment: Optional[int] = None
+        self._partial = b""
+
+    # === CLAVES ===
+
+    def _key_path(self, namespace: str, key: str) -> str:
+        safe_key = key.replace(os.sep, "_")
+        return os.path.join(self.directory, "kv", namespace, f"{safe_key}.json")
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        try:
+            with open(self._key_path(namespace, key)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def set(self, namespace: str, key: str, value: Any):
+        path = self._key_path(namespace, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(value, f, separators=(",", ":"), default=str)
+        os.replace(tmp_path, path)
+
+    def delete(self, namespace: str, key: str):
+        try:
+            os.remove(self._key_path(namespace, key))
+        except FileNotFoundError:
+            pass
+
+    # === CANAL ===
+
+    def _segments(self) -> List[int]:
+        return sorted(int(name[:-4]) for name in os.listdir(self._events_dir) if name.endswith(".log"))
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self._events_dir, f"{segment}.log")
+
+    def publish(self, channel: str, data: Any, origin: Optional[str] = None):
+        line = json.dumps({"channel": channel, "origin": origin, "data": data},
+                          separators=(",", ":"), default=str).encode() + b"\n"
+        with open(self._lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                segments = self._segments() or [0]
+                current = segments[-1]
+                path = self._segment_path(current)
+                if os.path.exists(path) and os.path.getsize(path) >= self.segment_bytes:
+                    current += 1
+                    path = self._segment_path(current)
+                    for old in segments:
+                        if old <= current - self.keep_segments:
+                            os.remove(self._segment_path(old))
+                with open(path, "ab") as f:
+                    f.write(line)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def cursor(self) -> Tuple[int, int]:
+        segments = self._segments()
+        if not segments:
+            return (0, 0)
+        return (segments[-1], os.path.getsize(self._segment_path(segments[-1])))
+
+    def read_events(self, cursor) -> Tuple[List[Dict[str, Any]], Tuple[int, int]]:
+        """Eventos anexados desde ``cursor`` (None = desde el segmento más antiguo retenido)."""
+        segments = self._segments()
+        if cursor is None:
+            cursor = (segments[0] if segments else 0, 0)
+        segment, offset = cursor
+        if self._reader is None or self._reader_segment != segment:
+            self._open_reader(segment, offset, segments)
+
+        events: List[Dict[str, Any]] = []
+        while self._reader is not None:
+            # Se lista antes de leer: si ya existe el siguiente segmento, este no volverá a crecer
+            following = [s for s in self._segments() if s > self._reader_segment]
+            lines = (self._partial + self._reader.read()).split(b"\n")
+            self._partial = lines.pop()
+            for line in lines:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    logger.warning("Evento compartido ilegible descartado")
+            if self._partial or not following:
+                break
+            self._open_reader(following[0], 0, following)
+
+        if self._reader is None:
+            return events, (segment, offset)
+        return events, (self._reader_segment, self._reader.tell() - len(self._partial))
+
+    def _open_reader(self, segment: int, offset: int, segments: List[int]):
+        if self._reader is not None:
+            self._reader.close()
+        self._reader, self._partial = None, b""
+        if segment not in segments:
+            # El segmento ya se borró (lector muy retrasado): se sigue por el más antiguo
+            later = [s for s in segments if s > segment]
+            if not later:
+                self._reader_segment = segment
+                return
+            logger.warning(f"Segmento de eventos {segment} ya no existe; se continúa en {later[0]}")
+            segment, offset = later[0], 0
+        self._reader = open(self._segment_path(segment), "rb")
+        self._reader.seek(offset)
+        self._reader_segment = segment
+
+    # === LIDERAZGO ===
+
+    def try_acquire_leadership(self, worker_id: str) -> bool:
+        if self._leader_fd is not None:
+            return True
+        fd = os.open(self._leader_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, json.dumps({"worker_id": worker_id, "since": time.time()}).encode())
+        self._leader_fd = fd
+        return True
+
+    def get_leader(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._leader_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def release_leadership(self):
+        if self._leader_fd is not None:
+            fcntl.flock(self._leader_fd, fcntl.LOCK_UN)
+            os.close(self._leader_fd)
+            self._leader_fd = None
+
+    def close(self):
+        self.release_leadership()
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+
+class SharedFleetState:
+    """Coordina el rol de este worker (líder o réplica) sobre un backend compartido."""
+
+    def __init__(
+        self,
+        backend,
+        worker_id: Optional[str] = None,
+        publish_interval: float = 0.1,
+        poll_interval: float = 0.05,
+        snapshot_interval: float = 5.0,
+        election_interval: float = 2.0,
+    ):
+        """
+        Args:
+            backend: LocalStateBackend o FileStateBackend
+            worker_id: Identificador de este worker (por defecto ``host:pid``)
+            publish_interval: Segundos entre publicaciones de deltas acumulados (líder)
+            poll_interval: Segundos entre lecturas del canal (réplicas)
+            snapshot_interval: Segundos entre snapshots completos de la flota (líder)
+            election_interval: Segundos entre intentos de tomar el liderazgo (réplicas)
+        """
+        self.backend = backend
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.publish_interval = publish_interval
+        self.poll_interval = poll_interval
+        self.snapshot_interval = snapshot_interval
+        self.election_interval = election_interval
+        self.role: Optional[str] = None
+        self._fleet = None
+        self._tasks: List[asyncio.Task] = []
+        self._cursor = None
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._published_info: Dict[str, Any] = {}
+        self.stats = {"published": 0, "received": 0, "snapshots": 0, "promotions": 0}
+
+    @property
+    def distributed(self) -> bool:
+        return self.backend.distributed
+
+    @property
+    def is_leader(self) -> bool:
+        return self.role in ("leader", "standalone")
+
+    # === CICLO DE VIDA ===
+
+    async def start(self, fleet):
+        """Arranca el worker como líder (sondea la flota) o como réplica del líder."""
+        self._fleet = fleet
+        if not self.distributed:
+            self.role = "standalone"
+            await fleet.start_background()
+            return
+        fleet.add_printers_listener(self._on_printers_saved)
+        if self.backend.try_acquire_leadership(self.worker_id):
+            await self._become_leader(replay_telemetry=True)
+        else:
+            await self._become_follower()
+        self._tasks.append(asyncio.create_task(self._event_loop(), name="shared_state_events"))
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if self.role == "leader":
+            self._flush_pending()
+        if self._fleet is not None and self.distributed:
+            self._fleet.state_cache.remove_listener(self._on_state_change)
+        self.backend.close()
+        self.role = None
+
+    async def _become_leader(self, replay_telemetry: bool):
+        fleet = self._fleet
+        self.role = "leader"
+        logger.info(f"Worker {self.worker_id}: líder de la flota (sondea las impresoras)")
+        fleet.state_cache.add_listener(self._on_state_change)
+        for method in RELAYED_NOTIFICATIONS:
+            fleet.state_cache.add_notification_handler(method, self._relay_notification(method))
+        await fleet.start_background(replay_telemetry=replay_telemetry)
+        self.write_snapshot()
+        self._tasks.append(asyncio.create_task(self._leader_loop(), name="shared_state_leader"))
+
+    async def _become_follower(self):
+        self.role = "follower"
+        logger.info(f"Worker {self.worker_id}: réplica del estado de la flota")
+        # Primero el cursor del snapshot y luego los deltas posteriores: no se pierde ningún cambio
+        snapshot = self.backend.get(FLEET_NAMESPACE, "snapshot")
+        self._cursor = snapshot["cursor"] if snapshot else None
+        await self._fleet.start_mirror()
+        if snapshot:
+            for printer_id, entry in snapshot.get("printers", {}).items():
+                self._fleet.state_cache.apply_remote(printer_id, entry.get("status", {}), entry.get("meta", {}), entry.get("info"))
+        self._tasks.append(asyncio.create_task(self._election_loop(), name="shared_state_election"))
+
+    async def _promote(self):
+        """Una réplica toma el relevo de un líder caído."""
+        self.stats["promotions"] += 1
+        await self._fleet.state_cache.stop()
+        await self._become_leader(replay_telemetry=False)
+
+    # === LÍDER ===
+
+    def _on_state_change(self, printer_id: str, delta: Dict):
+        _merge_delta(self._pending.setdefault(printer_id, {}), delta)
+
+    def _relay_notification(self, method: str) -> Callable[[str, List], None]:
+        def relay(printer_id, params):
+            self.backend.publish(NOTIFICATION_CHANNEL, {"method": method, "printer_id": printer_id, "params": params},
+                                 origin=self.worker_id)
+        return relay
+
+    def _flush_pending(self):
+        """Publica en un solo evento los deltas acumulados desde la última publicación."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        cache = self._fleet.state_cache
+        updates = {}
+        for printer_id, delta in pending.items():
+            update = {"delta": delta, "meta": self._public_meta(cache.get_meta(printer_id))}
+            info = cache.get_info(printer_id)
+            if info is not None and self._published_info.get(printer_id) is not info:
+                update["info"] = info
+                self._published_info[printer_id] = info
+            updates[printer_id] = update
+        self.backend.publish(STATE_CHANNEL, updates, origin=self.worker_id)
+        self.stats["published"] += 1
+
+    @staticmethod
+    def _public_meta(meta: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "connected": meta.get("connected", False),
+            "error_status": meta.get("error_status"),
+            "source": meta.get("source"),
+        }
+
+    def write_snapshot(self):
+        """Guarda el estado completo junto con la posición del canal a partir de la que aplicar deltas."""
+        self._flush_pending()
+        printers = self._fleet.state_cache.export_state()
+        for entry in printers.values():
+            entry["meta"] = self._public_meta(entry["meta"])
+        self.backend.set(FLEET_NAMESPACE, "snapshot", {
+            "leader": self.worker_id,
+            "written_at": time.time(),
+            "cursor": self.backend.cursor(),
+            "printers": printers,
+        })
+        self.stats["snapshots"] += 1
+
+    async def _leader_loop(self):
+        last_snapshot = time.monotonic()
+        while True:
+            await asyncio.sleep(self.publish_interval)
+            try:
+                self._flush_pending()
+                if time.monotonic() - last_snapshot >= self.snapshot_interval:
+                    self.write_snapshot()
+                    last_snapshot = time.monotonic()
+            except Exception as e:
+                logger.error(f"Error publicando estado compartido: {e}")
+
+    # === RÉPLICA ===
+
+    async def _election_loop(self):
+        while self.role == "follower":
+            await asyncio.sleep(self.election_interval)
+            if self.backend.try_acquire_leadership(self.worker_id):
+                logger.warning(f"Worker {self.worker_id}: el líder anterior cayó, se toma el relevo")
+                await self._promote()
+                return
+
+    async def _event_loop(self):
+        """Lee el canal y aplica los eventos publicados por otros workers."""
+        if self._cursor is None and self.role == "leader":
+            self._cursor = self.backend.cursor()
+        while True:
+            try:
+                events, self._cursor = self.backend.read_events(self._cursor)
+                for event in events:
+                    if event.get("origin") != self.worker_id:
+                        self.stats["received"] += 1
+                        self._apply_event(event)
+            except Exception as e:
+                logger.error(f"Error leyendo el canal de estado compartido: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    def _apply_event(self, event: Dict[str, Any]):
+        channel, data = event.get("channel"), event.get("data")
+        if channel == PRINTERS_CHANNEL:
+            self._fleet.reload_printers()
+        elif self.role != "follower":
+            return
+        elif channel == STATE_CHANNEL:
+            for printer_id, update in data.items():
+                self._fleet.state_cache.apply_remote(printer_id, update.get("delta", {}), update.get("meta", {}), update.get("info"))
+        elif channel == NOTIFICATION_CHANNEL:
+            self._fleet.state_cache.dispatch_notification(data["printer_id"], data["method"], data.get("params") or [])
+
+    def _on_printers_saved(self):
+        """``printers.json`` cambió en este worker: el resto debe releerlo."""
+        self.backend.publish(PRINTERS_CHANNEL, {}, origin=self.worker_id)
+
+    # === TAREAS ===
+
+    def put_task(self, task_id: str, data: Dict[str, Any]):
+        """Publica el estado de una tarea para que cualquier worker pueda responder a su polling."""
+        if self.distributed:
+            self.backend.set(TASKS_NAMESPACE, task_id, data)
+
+    def get_task(self, task_id: str) -> Optional[Dict[str, Any]]:
+        if not self.distributed:
+            return None
+        return self.backend.get(TASKS_NAMESPACE, task_id)
+
+    def delete_task(self, task_id: str):
+        if self.distributed:
+            self.backend.delete(TASKS_NAMESPACE, task_id)
+
+    def get_status(self) -> Dict[str, Any]:
+        status = {
+            "worker_id": self.worker_id,
+            "role": self.role,
+            "backend": type(self.backend).__name__,
+            **self.stats,
+        }
+        if self.distributed:
+            status["leader"] = self.backend.get_leader()
+            snapshot = self.backend.get(FLEET_NAMESPACE, "snapshot")
+            status["snapshot_age_seconds"] = round(time.time() - snapshot["written_at"], 2) if snapshot else None
+        return status
+
+
+def _create_backend():
+    directory = os.getenv("FLEET_SHARED_STATE_DIR")
+    if directory:
+        try:
+            return FileStateBackend(directory)
+        except RuntimeError as e:
+            logger.warning(f"{e}; se usa el estado local de un solo proceso")
+    return LocalStateBackend()
+
+
+# Instancia global del coordinador
+shared_state = SharedFleetState(
+    _create_backend(),
+    snapshot_interval=float(os.getenv("FLEET_SHARED_SNAPSHOT_INTERVAL", "5")),
+    election_interval=float(os.getenv("FLEET_LEADER_RETRY_INTERVAL", "2")),
+)
@@ -0,0 +1,394 @@
+"""
+Almacén de telemetría de la flota en memoria.
+
+Cada impresora guarda sus métricas en buffers circulares de NumPy a varias
+resoluciones (muestras crudas, 10 s, 1 min y 10 min), de modo que la memoria
+por impresora está acotada y las consultas de periodos largos se sirven desde
+la resolución más gruesa que cubre el rango pedido.
+
+Opcionalmente los puntos de 10 s se vuelcan periódicamente a un fichero JSONL
+de solo anexado que se reproduce al arrancar, para conservar el histórico
+entre reinicios.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Métricas registradas (claves de ``realtime_data``)
+METRICS = (
+    "extruder_temp",
+    "extruder_target",
+    "bed_temp",
+    "bed_target",
+    "print_progress",
+    "filament_used",
+)
+
+# (resolución en segundos, capacidad); resolución 0 = muestras crudas
+TIERS = (
+    (0, 720),      # ~25 min a una muestra cada 2 s
+    (10, 1080),    # 3 horas
+    (60, 1440),    # 24 horas
+    (600, 1008),   # 7 días
+)
+
+# Resolución de los puntos que se vuelcan a disco
+SPILL_RESOLUTION = 10
+
+
+class _RingBuffer:
+    """Buffer circular de instantes y filas de métricas."""
+
+    def __init__(self, capacity: int, width: int):
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.values = np.full((capacity, width), np.nan, dtype=np.float32)
+        self.head = 0
+        self.size = 0
+
+    def append(self, timestamp: float, row: np.ndarray):
+        self.times[self.head] = timestamp
+        self.values[self.head] = row
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def oldest(self) -> Optional[float]:
+        if not self.size:
+            return None
+        return float(self.times[(self.head - self.size) % self.capacity])
+
+    def ordered(self):
+        """Devuelve (instantes, valores) en orden cronológico."""
+        if self.size < self.capacity:
+            return self.times[:self.size], self.values[:self.size]
+        order = np.roll(np.arange(self.capacity), -self.head)
+        return self.times[order], self.values[order]
+
+
+class _Tier:
+    """Una resolución: buffer circular más el acumulador del intervalo abierto."""
+
+    def __init__(self, resolution: int, capacity: int, width: int):
+        self.resolution = resolution
+        self.ring = _RingBuffer(capacity, width)
+        self._bucket: Optional[float] = None
+        self._sums = np.zeros(width, dtype=np.float64)
+        self._counts = np.zeros(width, dtype=np.int64)
+
+    def covers(self, start: float) -> bool:
+        oldest = self.ring.oldest()
+        return oldest is not None and oldest <= start
+
+    def add(self, timestamp: float, row: np.ndarray) -> Optional[tuple]:
+        """Añade una muestra; devuelve ``(instante, fila)`` si se cerró un intervalo."""
+        if self.resolution == 0:
+            self.ring.append(timestamp, row)
+            return None
+
+        closed = None
+        bucket = math.floor(timestamp / self.resolution) * self.resolution
+        if self._bucket is not None and bucket != self._bucket and self._counts.any():
+            closed = (self._bucket, self._mean())
+            self.ring.append(*closed)
+            self._sums[:] = 0
+            self._counts[:] = 0
+        self._bucket = bucket
+
+        mask = ~np.isnan(row)
+        self._sums[mask] += row[mask]
+        self._counts[mask] += 1
+        return closed
+
+    def _mean(self) -> np.ndarray:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = self._sums / self._counts
+        mean[self._counts == 0] = np.nan
+        return mean.astype(np.float32)
+
+
+class _PrinterSeries:
+    """Todas las resoluciones de una impresora."""
+
+    def __init__(self):
+        self.tiers = [_Tier(resolution, capacity, len(METRICS)) for resolution, capacity in TIERS]
+        self.last_sample: Optional[float] = None
+
+    def add(self, timestamp: float, row: np.ndarray, min_resolution: int = 0) -> Optional[tuple]:
+        spilled = None
+        for tier in self.tiers:
+            if tier.resolution < min_resolution:
+                continue
+            closed = tier.add(timestamp, row)
+            if closed is not None and tier.resolution == SPILL_RESOLUTION:
+                spilled = closed
+        self.last_sample = timestamp
+        return spilled
+
+    def select_tier(self, start: float, step: Optional[float]) -> _Tier:
+        """Resolución más fina que cubre ``start`` sin ser más gruesa que ``step``.
+
+        Si ninguna llega tan atrás se usa la que conserve el dato más antiguo.
+        """
+        candidates = [tier for tier in self.tiers if step is None or tier.resolution <= step]
+        for tier in candidates:
+            if tier.covers(start):
+                return tier
+        with_data = [tier for tier in candidates if tier.ring.size]
+        if not with_data:
+            return candidates[0]
+        return min(with_data, key=lambda tier: tier.ring.oldest())
+
+
+def _to_float(value: Any) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return np.nan
+    return float(value)
+
+
+class TelemetryStore:
+    """Series temporales por impresora con reducción multirresolución."""
+
+    def __init__(self, spill_path: Optional[str] = None, spill_interval: float = 60.0,
+                 min_sample_interval: float = 1.0):
+        """
+        Args:
+            spill_path: Fichero JSONL donde volcar los puntos de 10 s (None = sin persistencia)
+            spill_interval: Segundos entre volcados a disco
+            min_sample_interval: Separación mínima entre muestras crudas de una impresora
+        """
+        self.spill_path = spill_path
+        self.spill_interval = spill_interval
+        self.min_sample_interval = min_sample_interval
+        self._series: Dict[str, _PrinterSeries] = {}
+        self._pending: List[Dict[str, Any]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    # === REGISTRO ===
+
+    def record(self, printer_id: str, realtime_data: Dict[str, Any], timestamp: Optional[float] = None) -> bool:
+        """Registra una muestra a partir del ``realtime_data`` de una impresora.
+
+        Returns:
+            bool: False si la muestra se descartó por llegar demasiado pronto o no tener métricas
+        """
+        if not realtime_data:
+            return False
+        timestamp = time.time() if timestamp is None else timestamp
+        series = self._series.get(printer_id)
+        if series is None:
+            series = self._series[printer_id] = _PrinterSeries()
+        elif series.last_sample is not None and timestamp - series.last_sample < self.min_sample_interval:
+            return False
+
+        row = np.array([_to_float(realtime_data.get(metric)) for metric in METRICS], dtype=np.float32)
+        if np.isnan(row).all():
+            return False
+
+        spilled = series.add(timestamp, row)
+        if spilled is not None and self._task is not None:
+            point_time, values = spilled
+            self._pending.append({
+                "printer_id": printer_id,
+                "t": point_time,
+                "v": [None if np.isnan(v) else round(float(v), 3) for v in values],
+            })
+        return True
+
+    def forget(self, printer_id: str):
+        self._series.pop(printer_id, None)
+
+    # === CONSULTA ===
+
+    def query(
+        self,
+        printer_id: str,
+        metrics: Optional[Iterable[str]] = None,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        step: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """Devuelve la serie de una impresora entre ``start`` y ``end`` (epoch en segundos).
+
+        Args:
+            metrics: Métricas a devolver (por defecto todas)
+            start: Inicio del rango (por defecto, la última hora)
+            end: Fin del rango (por defecto, ahora)
+            step: Resolución deseada en segundos; se reagrupa si es más gruesa que la almacenada
+        """
+        metrics = list(metrics) if metrics else list(METRICS)
+        unknown = [m for m in metrics if m not in METRICS]
+        if unknown:
+            raise ValueError(f"Métricas no soportadas: {', '.join(unknown)}")
+
+        end = time.time() if end is None else end
+        start = end - 3600 if start is None else start
+        response = {
+            "printer_id": printer_id,
+            "from": start,
+            "to": end,
+            "resolution": None,
+            "timestamps": [],
+            "metrics": {m: [] for m in metrics},
+        }
+        series = self._series.get(printer_id)
+        if series is None:
+            return response
+
+        tier = series.select_tier(start, step)
+        times, values = tier.ring.ordered()
+        mask = (times >= start) & (times <= end)
+        times = times[mask]
+        columns = [METRICS.index(m) for m in metrics]
+        values = values[mask][:, columns]
+
+        resolution = tier.resolution
+        if step and step > tier.resolution and len(times):
+            times, values = self._rebucket(times, values, step)
+            resolution = step
+
+        response["resolution"] = resolution
+        response["timestamps"] = [round(float(t), 3) for t in times]
+        for i, metric in enumerate(metrics):
+            response["metrics"][metric] = [None if np.isnan(v) else round(float(v), 3) for v in values[:, i]]
+        return response
+
+    @staticmethod
+    def _rebucket(times: np.ndarray, values: np.ndarray, step: float):
+        """Media por intervalos de ``step`` segundos ignorando huecos (NaN)."""
+        buckets = np.floor(times / step) * step
+        unique, inverse = np.unique(buckets, return_inverse=True)
+        valid = ~np.isnan(values)
+        sums = np.zeros((len(unique), values.shape[1]), dtype=np.float64)
+        counts = np.zeros((len(unique), values.shape[1]), dtype=np.int64)
+        np.add.at(sums, inverse, np.where(valid, values, 0.0))
+        np.add.at(counts, inverse, valid)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = sums / counts
+        means[counts == 0] = np.nan
+        return unique, means
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "printers": len(self._series),
+            "pending_spill": len(self._pending),
+            "spill_path": self.spill_path,
+            "memory_bytes": sum(
+                tier.ring.times.nbytes + tier.ring.values.nbytes
+                for series in self._series.values() for tier in series.tiers
+            ),
+        }
+
+    # === PERSISTENCIA ===
+
+    async def start(self, replay: bool = True):
+        """Reproduce el histórico en disco y lanza el volcado periódico.
+
+        Args:
+            replay: False si el histórico ya está en memoria (p. ej. una réplica que pasa a líder)
+        """
+        if not self.spill_path or self._task is not None:
+            return
+        if replay:
+            await self.replay()
+        self._task = asyncio.create_task(self._spill_loop(), name="telemetry_spill")
+        logger.info(f"Telemetría persistida en {self.spill_path} cada {self.spill_interval:.0f}s")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self.flush()
+
+    async def _spill_loop(self):
+        while True:
+            await asyncio.sleep(self.spill_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error volcando telemetría a disco: {e}")
+
+    def flush(self):
+        """Anexa al fichero los puntos de 10 s pendientes."""
+        if not self._pending or not self.spill_path:
+            return
+        pending, self._pending = self._pending, []
+        os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+        with open(self.spill_path, "a") as f:
+            for point in pending:
+                f.write(json.dumps(point, separators=(",", ":")) + "\n")
+
+    async def replay(self, compact: bool = True):
+        """Como ``load``, leyendo el fichero en un hilo.
+
+        El histórico se reconstruye en estructuras nuevas fuera del event loop y
+        se incorpora después en el loop, sin tocar las series mientras se registran
+        muestras en vivo.
+        """
+        self._adopt(await asyncio.to_thread(self._read_spill, compact))
+
+    def load(self, compact: bool = True):
+        """Reconstruye las resoluciones de 10 s en adelante desde el fichero.
+
+        Los puntos más antiguos que el horizonte de la resolución más gruesa se
+        descartan y, si eran mayoría y ``compact`` es True, el fichero se compacta
+        (solo debe hacerlo el proceso que escribe en él).
+        """
+        self._adopt(self._read_spill(compact))
+
+    def _read_spill(self, compact: bool) -> Dict[str, _PrinterSeries]:
+        """Series nuevas con los puntos del fichero (no toca las de la instancia)."""
+        loaded: Dict[str, _PrinterSeries] = {}
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return loaded
+        resolution, capacity = TIERS[-1]
+        horizon = time.time() - resolution * capacity
+        kept: List[str] = []
+        dropped = 0
+        with open(self.spill_path) as f:
+            for line in f:
+                try:
+                    point = json.loads(line)
+                    if point["t"] < horizon:
+                        dropped += 1
+                        continue
+                    row = np.array([np.nan if v is None else v for v in point["v"]], dtype=np.float32)
+                except (ValueError, KeyError, TypeError):
+                    dropped += 1
+                    continue
+                series = loaded.get(point["printer_id"])
+                if series is None:
+                    series = loaded[point["printer_id"]] = _PrinterSeries()
+                series.add(point["t"], row, min_resolution=SPILL_RESOLUTION)
+                kept.append(line)
+
+        if compact and dropped > len(kept):
+            tmp_path = f"{self.spill_path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.writelines(kept)
+            os.replace(tmp_path, self.spill_path)
+        logger.info(f"Telemetría recuperada: {len(kept)} puntos ({dropped} descartados)")
+        return loaded
+
+    def _adopt(self, loaded: Dict[str, _PrinterSeries]):
+        """Incorpora el histórico leído; las muestras en vivo posteriores se reaplican encima en orden."""
+        for printer_id, series in loaded.items():
+            live = self._series.get(printer_id)
+            if live is not None:
+                # Los buffers deben quedar en orden cronológico: el histórico primero y
+                # después las muestras crudas registradas mientras se leía el fichero
+                times, values = live.tiers[0].ring.ordered()
+                for timestamp, row in zip(times.tolist(), values):
+                    if series.last_sample is None or timestamp > series.last_sample:
+                        series.add(timestamp, row)
+            self._series[printer_id] = series
@@ -0,0 +1,138 @@
+"""
+Caché en disco de thumbnails de archivos G-code.
+
+Cada entrada se direcciona por impresora + archivo + versión (fecha de
+modificación y tamaño según el índice de archivos), por lo que nunca hay que
+invalidarla: un archivo modificado produce una clave nueva y la antigua acaba
+saliendo por LRU cuando la caché supera su tamaño máximo.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def thumbnail_cache_key(printer_id: str, filename: str, modified: Any, size: Any) -> str:
+    """Clave estable de los thumbnails de una versión concreta de un archivo."""
+    raw = f"{printer_id}\0{filename}\0{modified}\0{size}".encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()[:32]
+
+
+class ThumbnailCache:
+    """Thumbnails serializados en disco con expulsión LRU por tamaño total."""
+
+    def __init__(self, cache_dir: str, max_bytes: int = 200 * 1024 * 1024):
+        """
+        Args:
+            cache_dir: Directorio donde se guardan las entradas (se crea al primer uso)
+            max_bytes: Tamaño máximo de la caché en disco
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._loaded = False
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load_index(self):
+        """Reconstruye el orden LRU a partir de los ficheros existentes (por fecha de acceso)."""
+        self._loaded = True
+        if not os.path.isdir(self.cache_dir):
+            return
+        found = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            stat = os.stat(os.path.join(self.cache_dir, name))
+            found.append((stat.st_mtime, name[:-5], stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+
+    async def get_or_create(
+        self,
+        key: str,
+        producer: Callable[[], Awaitable[List[Dict[str, Any]]]],
+    ) -> List[Dict[str, Any]]:
+        """Devuelve los thumbnails de ``key`` o los obtiene con ``producer`` y los guarda.
+
+        Las peticiones simultáneas de la misma clave comparten una única extracción.
+        """
+        cached = await asyncio.to_thread(self._read, key)
+        if cached is not None:
+            self.stats["hits"] += 1
+            return cached
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.stats["misses"] += 1
+            task = asyncio.create_task(self._produce(key, producer))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _produce(self, key, producer) -> List[Dict[str, Any]]:
+        thumbnails = await producer()
+        # Solo se guardan resultados completos; un fallo de red se reintenta en la próxima petición
+        if thumbnails and all(thumb.get("data") for thumb in thumbnails):
+            await asyncio.to_thread(self._write, key, thumbnails)
+        return thumbnails
+
+    def _read(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        if not self._loaded:
+            self._load_index()
+        if key not in self._entries:
+            return None
+        try:
+            with open(self._path(key)) as f:
+                thumbnails = json.load(f)
+            os.utime(self._path(key))
+        except (OSError, ValueError):
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return thumbnails
+
+    def _write(self, key: str, thumbnails: List[Dict[str, Any]]):
+        if not self._loaded:
+            self._load_index()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        payload = json.dumps(thumbnails, separators=(",", ":")).encode("utf-8")
+        if len(payload) > self.max_bytes:
+            return
+        tmp_path = f"{self._path(key)}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, self._path(key))
+
+        self._total_bytes += len(payload) - self._entries.pop(key, 0)
+        self._entries[key] = len(payload)
+        while self._total_bytes > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.stats["evictions"] += 1
+
+    def _drop(self, key: str):
+        self._total_bytes -= self._entries.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+        }
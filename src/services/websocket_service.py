@@ -1,36 +1,293 @@
 from fastapi import WebSocket, WebSocketDisconnect
-from typing import List, Dict, Set
+from typing import List, Dict, Set, Optional, Deque, Any, Tuple
+from collections import deque
 import json
+import os
+import time
 import asyncio
 import logging
 from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
 
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+    logger.warning("msgpack no está disponible. Los clientes WebSocket recibirán JSON.")
+
+# Subprotocolos WebSocket con los que el cliente negocia la codificación de los frames.
+# La compresión permessage-deflate la negocia el servidor (uvicorn) de forma independiente.
+SUBPROTOCOL_MSGPACK = 'kybercore.msgpack.v1'
+SUBPROTOCOL_JSON = 'kybercore.json.v1'
+
+# Mensajes de impresora que pueden fusionarse en la cola de un cliente lento
+COALESCIBLE_TYPES = {'printer_delta', 'printer_snapshot', 'printer_update'}
+
+# Clave de cola de los frames agregados de la flota
+FLEET_UPDATE_KEY = 'fleet'
+
+
+def _deep_merge(base: dict, changes: dict) -> dict:
+    result = dict(base)
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(result.get(key), dict):
+            result[key] = _deep_merge(result[key], value)
+        else:
+            result[key] = value
+    return result
+
+
+def _remove_path(target: dict, path: str):
+    parts = path.split('.')
+    node = target
+    for part in parts[:-1]:
+        node = node.get(part) if isinstance(node, dict) else None
+        if node is None:
+            return
+    if isinstance(node, dict):
+        node.pop(parts[-1], None)
+
+
+def _has_path(target: dict, path: str) -> bool:
+    node = target
+    for part in path.split('.'):
+        if not isinstance(node, dict) or part not in node:
+            return False
+        node = node[part]
+    return True
+
+
+def merge_printer_messages(older: dict, newer: dict) -> Optional[dict]:
+    """Fusiona dos mensajes pendientes de la misma impresora en uno equivalente.
+
+    Un delta fusionado conserva ``from_seq`` (primera secuencia que cubre) para
+    que el cliente siga detectando huecos. Devuelve None si no se pueden fusionar.
+    """
+    if newer['type'] == 'fleet_update':
+        if older['type'] != 'fleet_update':
+            return None
+        return {**newer, 'updates': merge_printer_updates(older['updates'], newer['updates'])}
+    if newer['type'] in ('printer_snapshot', 'printer_update'):
+        return newer
+    if newer['type'] != 'printer_delta':
+        return None
+    removed = newer.get('removed', [])
+
+    if older['type'] == 'printer_snapshot':
+        data = _deep_merge(older['data'], newer['changes'])
+        for path in removed:
+            _remove_path(data, path)
+        return {**older, 'seq': newer['seq'], 'data': data, 'timestamp': newer.get('timestamp')}
+
+    if older['type'] == 'printer_delta':
+        changes = _deep_merge(older['changes'], newer['changes'])
+        for path in removed:
+            _remove_path(changes, path)
+        merged_removed = [p for p in older.get('removed', []) if not _has_path(newer['changes'], p)]
+        merged_removed.extend(p for p in removed if p not in merged_removed)
+        merged = {**newer, 'changes': changes, 'from_seq': older.get('from_seq', older['seq'])}
+        merged.pop('removed', None)
+        if merged_removed:
+            merged['removed'] = merged_removed
+        return merged
+
+    return None
+
+
+def negotiate_encoding(offered: List[str]) -> Tuple[Optional[str], str]:
+    """Elige subprotocolo y codificación a partir de los subprotocolos ofrecidos por el cliente.
+
+    Returns:
+        (subprotocol, encoding): subprotocolo a aceptar (None si el cliente no ofreció
+        ninguno conocido) y codificación de los frames salientes (``msgpack`` o ``json``).
+    """
+    if SUBPROTOCOL_MSGPACK in offered and MSGPACK_AVAILABLE:
+        return SUBPROTOCOL_MSGPACK, 'msgpack'
+    if SUBPROTOCOL_JSON in offered:
+        return SUBPROTOCOL_JSON, 'json'
+    return None, 'json'
+
+
+def merge_printer_updates(older: List[dict], newer: List[dict]) -> List[dict]:
+    """Fusiona por impresora dos listas de mensajes de impresora conservando el orden."""
+    merged = list(older)
+    position = {update['printer_id']: i for i, update in enumerate(merged)}
+    for update in newer:
+        index = position.get(update['printer_id'])
+        combined = merge_printer_messages(merged[index], update) if index is not None else None
+        if combined is None:
+            position[update['printer_id']] = len(merged)
+            merged.append(update)
+        else:
+            merged[index] = combined
+    return merged
+
+
+class _Outgoing:
+    """Mensaje saliente serializado una sola vez por codificación y compartido por todos los destinatarios."""
+
+    __slots__ = ('message', 'key', '_text', '_binary')
+
+    def __init__(self, message: dict, key: Optional[str] = None):
+        self.message = message
+        self.key = key
+        self._text: Optional[str] = None
+        self._binary: Optional[bytes] = None
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = json.dumps(self.message)
+        return self._text
+
+    @property
+    def binary(self) -> bytes:
+        if self._binary is None:
+            self._binary = msgpack.packb(self.message, use_bin_type=True)
+        return self._binary
+
+
+class _ClientWriter:
+    """Cola de envío acotada y tarea escritora dedicada de una conexión.
+
+    Un cliente lento solo retrasa su propia cola: cuando se llena se fusiona el
+    mensaje con el pendiente de la misma impresora (``coalesce``) o se descarta el
+    más antiguo (``drop_oldest``), y si sigue rezagado más de ``max_lag_seconds``
+    segundos se desconecta.
+    """
+
+    def __init__(self, manager: 'WebSocketManager', websocket: WebSocket, client_id: str, encoding: str = 'json'):
+        self.manager = manager
+        self.websocket = websocket
+        self.client_id = client_id
+        self.encoding = encoding
+        self.queue: Deque[_Outgoing] = deque()
+        self._pending_by_key: Dict[str, _Outgoing] = {}
+        self._wakeup = asyncio.Event()
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.bytes_sent = 0
+        self.behind_since: Optional[float] = None
+        self.task = asyncio.create_task(self._run(), name=f"ws_writer_{client_id}")
+
+    def enqueue(self, item: _Outgoing) -> bool:
+        """Encola un mensaje. Devuelve False si el cliente lleva demasiado tiempo rezagado."""
+        manager = self.manager
+        full = len(self.queue) >= manager.max_queue_size
+        if full and item.key and manager.overflow_policy == 'coalesce':
+            queued = self._pending_by_key.get(item.key)
+            if queued is not None:
+                merged = merge_printer_messages(queued.message, item.message)
+                if merged is not None:
+                    replacement = item if merged is item.message else _Outgoing(merged, item.key)
+                    self.queue[self.queue.index(queued)] = replacement
+                    self._pending_by_key[item.key] = replacement
+                    self.coalesced += 1
+                    return True
+
+        if full:
+            oldest = self.queue.popleft()
+            if oldest.key and self._pending_by_key.get(oldest.key) is oldest:
+                del self._pending_by_key[oldest.key]
+            self.dropped += 1
+            now = time.monotonic()
+            if self.behind_since is None:
+                self.behind_since = now
+            elif now - self.behind_since > manager.max_lag_seconds:
+                return False
+
+        self.queue.append(item)
+        if item.key:
+            self._pending_by_key[item.key] = item
+        self._wakeup.set()
+        return True
+
+    async def _run(self):
+        manager = self.manager
+        try:
+            while True:
+                if not self.queue:
+                    self.behind_since = None
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                item = self.queue.popleft()
+                if item.key and self._pending_by_key.get(item.key) is item:
+                    del self._pending_by_key[item.key]
+                if self.encoding == 'msgpack':
+                    payload = item.binary
+                    send = self.websocket.send_bytes(payload)
+                else:
+                    payload = item.text
+                    send = self.websocket.send_text(payload)
+                await asyncio.wait_for(send, timeout=manager.send_timeout)
+                self.sent += 1
+                self.bytes_sent += len(payload)
+                metadata = manager.connection_metadata.get(self.websocket)
+                if metadata is not None:
+                    metadata['last_ping'] = datetime.now()
+        except asyncio.CancelledError:
+            pass
+        except asyncio.TimeoutError:
+            logger.warning(f"Timeout enviando mensaje a {self.client_id}, desconectando")
+            manager.disconnect(self.websocket)
+        except Exception as e:
+            logger.error(f"Error enviando mensaje a {self.client_id}: {e}")
+            manager.disconnect(self.websocket)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            'encoding': self.encoding,
+            'queue_depth': len(self.queue),
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'bytes_sent': self.bytes_sent,
+            'behind_for': round(time.monotonic() - self.behind_since, 1) if self.behind_since else 0,
+        }
+
+
 class WebSocketManager:
     def __init__(self):
         self.active_connections: List[WebSocket] = []
         self.printer_subscriptions: Dict[str, Set[WebSocket]] = {}
         self.connection_metadata: Dict[WebSocket, Dict] = {}
+        self._writers: Dict[WebSocket, _ClientWriter] = {}
         self._cleanup_task = None
         self._shutdown_event = asyncio.Event()
+        # Cola de envío por cliente
+        self.max_queue_size = int(os.getenv("FLEET_WS_MAX_QUEUE", "100"))
+        self.overflow_policy = os.getenv("FLEET_WS_OVERFLOW_POLICY", "coalesce")  # coalesce | drop_oldest
+        self.max_lag_seconds = float(os.getenv("FLEET_WS_MAX_LAG", "15"))
+        self.send_timeout = 5.0
+        self.messages_encoded = 0
+        self.lagging_disconnects = 0
+        self._closed_stats = {'sent': 0, 'dropped': 0, 'coalesced': 0, 'bytes_sent': 0}
     
     async def connect(self, websocket: WebSocket, client_id: str = None):
-        """Acepta una nueva conexión WebSocket"""
-        await websocket.accept()
+        """Acepta una nueva conexión WebSocket negociando la codificación de los mensajes"""
+        subprotocol, encoding = negotiate_encoding(websocket.scope.get('subprotocols', []))
+        await websocket.accept(subprotocol=subprotocol)
         self.active_connections.append(websocket)
         self.connection_metadata[websocket] = {
             'client_id': client_id or f"client_{len(self.active_connections)}_{datetime.now().timestamp()}",
             'connected_at': datetime.now(),
             'last_ping': datetime.now(),
+            'encoding': encoding,
             'subscriptions': set()
         }
-        logger.info(f"Cliente conectado: {self.connection_metadata[websocket]['client_id']}")
+        client_id = self.connection_metadata[websocket]['client_id']
+        self._writers[websocket] = _ClientWriter(self, websocket, client_id, encoding)
+        logger.info(f"Cliente conectado: {client_id} ({encoding})")
         
         # Enviar mensaje de bienvenida
         await self.send_personal_message({
             'type': 'connection_established',
             'client_id': self.connection_metadata[websocket]['client_id'],
+            'encoding': encoding,
             'timestamp': datetime.now().isoformat()
         }, websocket)
         
@@ -54,6 +311,13 @@ class WebSocketManager:
             
             self.active_connections.remove(websocket)
             self.connection_metadata.pop(websocket, None)
+            
+            writer = self._writers.pop(websocket, None)
+            if writer is not None:
+                for key in self._closed_stats:
+                    self._closed_stats[key] += getattr(writer, key)
+                if writer.task is not asyncio.current_task():
+                    writer.task.cancel()
     
     async def subscribe_to_printer(self, websocket: WebSocket, printer_id: str):
         """Suscribe un cliente a actualizaciones de una impresora específica"""
@@ -79,116 +343,126 @@ class WebSocketManager:
     
     async def broadcast_printer_data(self, printer_id: str, data: dict):
         """Envía datos de impresora a todos los clientes suscritos con timeout"""
-        if printer_id not in self.printer_subscriptions:
-            return
+        await self._broadcast_printer_message(printer_id, {
+            'type': 'printer_update',
+            'printer_id': printer_id,
+            'data': data
+        })
+    
+    async def broadcast_printer_snapshot(self, printer_id: str, seq: int, data: dict):
+        """Envía el documento completo de una impresora con su número de secuencia"""
+        await self._broadcast_printer_message(printer_id, {
+            'type': 'printer_snapshot',
+            'printer_id': printer_id,
+            'seq': seq,
+            'data': data
+        })
+    
+    async def broadcast_printer_delta(self, printer_id: str, seq: int, changes: dict, removed: list = None):
+        """Envía solo los campos modificados de una impresora.
         
+        Los clientes aplican el delta si ``seq`` es el siguiente al último recibido;
+        si detectan un hueco piden un snapshot con ``resync``.
+        """
         message = {
-            'type': 'printer_update',
+            'type': 'printer_delta',
             'printer_id': printer_id,
-            'data': data,
-            'timestamp': datetime.now().isoformat()
+            'seq': seq,
+            'changes': changes
         }
-        
-        try:
-            await asyncio.wait_for(
-                self._send_to_subscribers(printer_id, message),
-                timeout=5.0  # Timeout de 5 segundos máximo
-            )
-        except asyncio.TimeoutError:
-            logger.warning(f"Timeout enviando datos a suscriptores de {printer_id}")
-        except Exception as e:
-            logger.error(f"Error enviando broadcast para {printer_id}: {e}")
+        if removed:
+            message['removed'] = removed
+        await self._broadcast_printer_message(printer_id, message)
     
-    async def _send_to_subscribers(self, printer_id: str, message: dict):
-        """Envía mensaje a suscriptores con manejo robusto de errores"""
-        disconnected_clients = []
-        subscribers = list(self.printer_subscriptions.get(printer_id, set()))
-        
-        if not subscribers:
+    async def broadcast_fleet_update(self, updates: List[dict]):
+        """Envía en un único frame ``fleet_update`` los cambios de varias impresoras.
+
+        Cada cliente recibe solo las impresoras a las que está suscrito; los clientes
+        con la misma selección comparten el mensaje serializado.
+        """
+        per_client: Dict[WebSocket, List[int]] = {}
+        for index, update in enumerate(updates):
+            for websocket in self.printer_subscriptions.get(update['printer_id'], ()):
+                per_client.setdefault(websocket, []).append(index)
+        if not per_client:
             return
         
-        # Enviar mensajes en lotes para mejorar rendimiento
-        tasks = []
-        for websocket in subscribers:
-            task = asyncio.create_task(
-                self._send_message_safe(websocket, message),
-                name=f"send_to_{self.connection_metadata.get(websocket, {}).get('client_id', 'unknown')}"
-            )
-            tasks.append((websocket, task))
-        
-        # Esperar todas las tareas con timeout individual
-        for websocket, task in tasks:
-            try:
-                await asyncio.wait_for(task, timeout=2.0)
-                # Actualizar último ping exitoso
-                if websocket in self.connection_metadata:
-                    self.connection_metadata[websocket]['last_ping'] = datetime.now()
-            except asyncio.TimeoutError:
-                logger.warning(f"Timeout enviando mensaje a cliente")
-                disconnected_clients.append(websocket)
-                task.cancel()
-            except Exception as e:
-                logger.error(f"Error enviando mensaje: {e}")
-                disconnected_clients.append(websocket)
+        timestamp = datetime.now().isoformat()
+        groups: Dict[tuple, List[WebSocket]] = {}
+        for websocket, indexes in per_client.items():
+            groups.setdefault(tuple(indexes), []).append(websocket)
+        for indexes, websockets in groups.items():
+            message = {
+                'type': 'fleet_update',
+                'updates': [updates[i] for i in indexes],
+                'timestamp': timestamp
+            }
+            self._enqueue(websockets, _Outgoing(message, FLEET_UPDATE_KEY))
+    
+    async def _broadcast_printer_message(self, printer_id: str, message: dict):
+        if printer_id not in self.printer_subscriptions:
+            return
         
-        # Limpiar clientes desconectados
-        for websocket in disconnected_clients:
-            self.disconnect(websocket)
+        message['timestamp'] = datetime.now().isoformat()
+        key = f"printer:{printer_id}" if message['type'] in COALESCIBLE_TYPES else None
+        self._enqueue(list(self.printer_subscriptions.get(printer_id, set())), _Outgoing(message, key))
     
-    async def _send_message_safe(self, websocket: WebSocket, message: dict):
-        """Envía mensaje de forma segura con manejo de errores"""
+    def _enqueue(self, websockets: List[WebSocket], item: _Outgoing):
+        """Entrega un mensaje (serializado una sola vez) a las colas de los clientes indicados"""
+        if not websockets:
+            return
+        self.messages_encoded += 1
+        for websocket in websockets:
+            writer = self._writers.get(websocket)
+            if writer is None:
+                continue
+            if not writer.enqueue(item):
+                logger.warning(f"Cliente {writer.client_id} rezagado más de {self.max_lag_seconds:.0f}s, desconectando")
+                self.lagging_disconnects += 1
+                self.disconnect(websocket)
+                asyncio.create_task(self._close_quietly(websocket, 1013, "Client too slow"))
+    
+    async def _close_quietly(self, websocket: WebSocket, code: int, reason: str):
         try:
-            await websocket.send_text(json.dumps(message))
-        except WebSocketDisconnect:
-            raise  # Re-raise para manejo superior
-        except Exception as e:
-            logger.error(f"Error enviando mensaje a WebSocket: {e}")
-            raise
+            await websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
     
     async def broadcast_to_all(self, message: dict):
-        """Envía un mensaje a todos los clientes conectados con timeout"""
+        """Envía un mensaje a todos los clientes conectados"""
         message['timestamp'] = datetime.now().isoformat()
-        disconnected_clients = []
-        
-        # Usar timeout para evitar bloqueos
-        tasks = []
-        for websocket in list(self.active_connections):
-            task = asyncio.create_task(
-                self._send_message_safe(websocket, message),
-                name=f"broadcast_to_{self.connection_metadata.get(websocket, {}).get('client_id', 'unknown')}"
-            )
-            tasks.append((websocket, task))
-        
-        # Esperar todas las tareas con timeout
-        for websocket, task in tasks:
-            try:
-                await asyncio.wait_for(task, timeout=2.0)
-            except asyncio.TimeoutError:
-                logger.warning("Timeout en broadcast a cliente")
-                disconnected_clients.append(websocket)
-                task.cancel()
-            except Exception as e:
-                logger.error(f"Error en broadcast: {e}")
-                disconnected_clients.append(websocket)
-        
-        # Limpiar clientes desconectados
-        for websocket in disconnected_clients:
-            self.disconnect(websocket)
+        self._enqueue(list(self.active_connections), _Outgoing(message))
     
     async def send_personal_message(self, message: dict, websocket: WebSocket):
-        """Envía un mensaje personal a un cliente específico"""
-        try:
-            message['timestamp'] = datetime.now().isoformat()
-            await asyncio.wait_for(
-                websocket.send_text(json.dumps(message)),
-                timeout=3.0
-            )
-        except asyncio.TimeoutError:
-            logger.warning("Timeout enviando mensaje personal")
-            self.disconnect(websocket)
-        except Exception as e:
-            logger.error(f"Error enviando mensaje personal: {e}")
-            self.disconnect(websocket)
+        """Envía un mensaje personal a un cliente específico.
+        
+        Pasa por la misma cola que los broadcasts para conservar el orden de entrega.
+        """
+        message['timestamp'] = datetime.now().isoformat()
+        self._enqueue([websocket], _Outgoing(message))
+    
+    def get_queue_metrics(self) -> Dict[str, Any]:
+        """Profundidad de cola y contadores de descarte/fusión por cliente"""
+        clients = {
+            writer.client_id: writer.get_metrics()
+            for writer in self._writers.values()
+        }
+        totals = {
+            key: value + sum(client[key] for client in clients.values())
+            for key, value in self._closed_stats.items()
+        }
+        return {
+            'max_queue_size': self.max_queue_size,
+            'overflow_policy': self.overflow_policy,
+            'max_lag_seconds': self.max_lag_seconds,
+            'messages_encoded': self.messages_encoded,
+            'lagging_disconnects': self.lagging_disconnects,
+            'total_sent': totals['sent'],
+            'total_dropped': totals['dropped'],
+            'total_coalesced': totals['coalesced'],
+            'total_bytes_sent': totals['bytes_sent'],
+            'clients': clients,
+        }
     
     def get_connection_count(self) -> int:
         """Retorna el número de conexiones activas"""
@@ -302,6 +576,11 @@ class WebSocketManager:
             except asyncio.TimeoutError:
                 logger.warning("Timeout cerrando conexiones WebSocket")
         
+        writers = [writer.task for writer in self._writers.values()]
+        for task in writers:
+            task.cancel()
+        await asyncio.gather(*writers, return_exceptions=True)
+        self._writers.clear()
         self.active_connections.clear()
         self.connection_metadata.clear()
         self.printer_subscriptions.clear()
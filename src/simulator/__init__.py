@@ -0,0 +1,5 @@
+"""Simulador de Moonraker y benchmark de la flota a escala."""
+
+from .moonraker import MoonrakerSimulator
+
+__all__ = ["MoonrakerSimulator"]
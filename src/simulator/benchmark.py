@@ -0,0 +1,485 @@
+"""
+Benchmark de la flota contra el simulador de Moonraker.
+
+Para cada tamaño de flota mide, con los servicios reales de KyberCore:
+
+- ``poll_cycle_s``: duración de un ciclo completo de ``FleetService.list_printers``
+  consultando por HTTP (sin caché de estado)
+- ``subscribe_warmup_s``: tiempo hasta que la caché tiene snapshot de todas las
+  impresoras en línea vía suscripciones WebSocket
+- ``api``: latencias p50/p99 de ``GET /api/fleet/printers`` y ``/printers/{id}``
+- ``fanout``: latencia p50/p99 desde que un cambio llega a la caché hasta que
+  los clientes WebSocket de ``WebSocketManager`` lo reciben vía ``RealtimeMonitor``
+- ``rss_mb`` y ``cpu_percent`` del proceso medido
+
+El simulador corre en otro proceso para que su coste no contamine CPU ni
+memoria. Con ``--baseline`` se comparan los resultados con una ejecución
+anterior y el proceso termina con código 1 si alguna métrica empeora más que
+``--tolerance``, de modo que las regresiones aparecen antes de publicar.
+
+Uso::
+
+    python -m src.simulator.benchmark --sizes 50,200,1000 --output bench.json
+    python -m src.simulator.benchmark --sizes 50,200 --baseline bench.json --tolerance 0.25
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+import httpx
+from fastapi import FastAPI
+
+from src.simulator.moonraker import MoonrakerSimulator
+
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:  # pragma: no cover - Windows
+    resource = None
+    RESOURCE_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Métricas comparadas con la línea base (todas: menos es mejor)
+COMPARED_METRICS = (
+    "poll_cycle_s",
+    "subscribe_warmup_s",
+    "api.list.p50_ms",
+    "api.list.p99_ms",
+    "api.detail.p50_ms",
+    "api.detail.p99_ms",
+    "fanout.p50_ms",
+    "fanout.p99_ms",
+    "rss_mb",
+    "cpu_percent",
+)
+
+# Diferencias absolutas por debajo de las cuales no se habla de regresión (ruido de medida)
+MIN_REGRESSION_DELTA = {"_s": 0.05, "_ms": 2.0, "rss_mb": 5.0, "cpu_percent": 5.0}
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Percentil por el método del rango más cercano (None sin muestras)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def _latency_summary(samples: List[float]) -> Dict[str, Any]:
+    to_ms = lambda value: None if value is None else round(value * 1000, 2)
+    return {
+        "samples": len(samples),
+        "p50_ms": to_ms(percentile(samples, 50)),
+        "p99_ms": to_ms(percentile(samples, 99)),
+        "max_ms": to_ms(max(samples) if samples else None),
+    }
+
+
+def rss_mb() -> Optional[float]:
+    """Memoria residente actual del proceso (MB)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if RESOURCE_AVAILABLE:
+        # Sin /proc solo se conoce el pico (KB en Linux, bytes en macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    return None
+
+
+def raise_fd_limit():
+    """Las flotas grandes necesitan miles de sockets: se sube el límite blando al duro."""
+    if not RESOURCE_AVAILABLE:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+class _BenchmarkClient:
+    """Cliente WebSocket en memoria que mide cuánto tarda en llegarle cada cambio."""
+
+    def __init__(self, seen: Dict[str, Dict[Any, float]]):
+        self.scope = {"subprotocols": []}
+        self.seen = seen
+        self.latencies: List[float] = []
+        self.frames = 0
+        self.bytes = 0
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, text: str):
+        now = time.monotonic()
+        self.frames += 1
+        self.bytes += len(text)
+        message = json.loads(text)
+        if message.get("type") != "fleet_update":
+            return
+        for update in message["updates"]:
+            document = update.get("changes") or update.get("data") or {}
+            realtime_data = document.get("realtime_data") or {}
+            if "extruder_temp" not in realtime_data or "bed_temp" not in realtime_data:
+                continue
+            key = (realtime_data["extruder_temp"], realtime_data["bed_temp"])
+            applied_at = self.seen.get(update["printer_id"], {}).get(key)
+            if applied_at is not None:
+                self.latencies.append(now - applied_at)
+
+    async def send_bytes(self, data: bytes):
+        self.frames += 1
+        self.bytes += len(data)
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        pass
+
+
+def _simulator_process(options: Dict[str, Any], conn):
+    """Proceso hijo: arranca el simulador, envía las impresoras y espera la orden de parar."""
+    raise_fd_limit()
+    logging.basicConfig(level=logging.WARNING)
+
+    async def serve():
+        simulator = MoonrakerSimulator(**options)
+        await simulator.start()
+        conn.send(simulator.fleet_printers())
+        await asyncio.to_thread(conn.recv)
+        await simulator.stop()
+
+    asyncio.run(serve())
+
+
+class _SimulatorHandle:
+    """Simulador en un proceso aparte (o en el mismo, para pruebas rápidas)."""
+
+    def __init__(self, options: Dict[str, Any], in_process: bool):
+        self.options = options
+        self.in_process = in_process
+        self.simulator: Optional[MoonrakerSimulator] = None
+        self._process = None
+        self._conn = None
+
+    async def start(self) -> Dict[str, Dict[str, Any]]:
+        if self.in_process:
+            self.simulator = MoonrakerSimulator(**self.options)
+            await self.simulator.start()
+            return self.simulator.fleet_printers()
+        context = multiprocessing.get_context("spawn")
+        self._conn, child = context.Pipe()
+        self._process = context.Process(target=_simulator_process, args=(self.options, child), daemon=True)
+        self._process.start()
+        return await asyncio.to_thread(self._conn.recv)
+
+    async def stop(self):
+        if self.simulator is not None:
+            await self.simulator.stop()
+        if self._process is not None:
+            self._conn.send("stop")
+            await asyncio.to_thread(self._process.join, 10)
+            if self._process.is_alive():
+                self._process.kill()
+
+
+class FleetBenchmark:
+    """Ejecuta la batería de mediciones para cada tamaño de flota."""
+
+    def __init__(
+        self,
+        duration: float = 10.0,
+        clients: int = 5,
+        api_requests: int = 200,
+        api_concurrency: int = 10,
+        poll_cycles: int = 3,
+        monitor_interval: Optional[float] = None,
+        warmup_timeout: float = 60.0,
+        simulator_options: Optional[Dict[str, Any]] = None,
+        in_process: bool = False,
+    ):
+        """
+        Args:
+            duration: Segundos de medición del fan-out WebSocket
+            clients: Clientes WebSocket simulados suscritos a toda la flota
+            api_requests: Peticiones por endpoint de la API
+            api_concurrency: Peticiones de API simultáneas
+            poll_cycles: Ciclos de polling HTTP que se promedian
+            monitor_interval: ``update_interval`` del RealtimeMonitor (None = el de producción)
+            warmup_timeout: Segundos máximos para completar las suscripciones
+            simulator_options: Argumentos de ``MoonrakerSimulator`` (latencia, errores...)
+            in_process: Ejecutar el simulador en este mismo proceso (CPU y memoria incluyen su coste)
+        """
+        self.duration = duration
+        self.clients = clients
+        self.api_requests = api_requests
+        self.api_concurrency = api_concurrency
+        self.poll_cycles = poll_cycles
+        self.monitor_interval = monitor_interval
+        self.warmup_timeout = warmup_timeout
+        self.simulator_options = dict(simulator_options or {})
+        self.in_process = in_process
+
+    async def run(self, sizes: Iterable[int]) -> Dict[str, Any]:
+        raise_fd_limit()
+        results = {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "simulator": self.simulator_options,
+            "in_process": self.in_process,
+            "sizes": {},
+        }
+        for size in sizes:
+            logger.warning(f"Benchmark: flota de {size} impresoras")
+            results["sizes"][str(size)] = await self.run_size(size)
+        return results
+
+    async def run_size(self, size: int) -> Dict[str, Any]:
+        from src.models.printer import Printer
+        from src.services.fleet_service import FleetService
+        from src.services.http_clients import http_clients
+
+        simulator = _SimulatorHandle({**self.simulator_options, "printers": size}, self.in_process)
+        printers = await simulator.start()
+        offline = self.simulator_options.get("offline", 0)
+        online_ids = list(printers)[offline:]
+
+        workdir = tempfile.mkdtemp(prefix="kybercore_bench_")
+        fleet = FleetService(printers_file=os.path.join(workdir, "printers.json"))
+        fleet.printers = {printer_id: Printer(**data) for printer_id, data in printers.items()}
+        wall_started, cpu_started = time.monotonic(), time.process_time()
+        result: Dict[str, Any] = {"printers": size, "offline": offline}
+        try:
+            result["poll_cycle_s"] = await self._measure_poll_cycle(fleet)
+            result["subscribe_warmup_s"] = await self._measure_subscription_warmup(fleet, online_ids)
+            result["api"] = await self._measure_api(fleet)
+            result["fanout"] = await self._measure_fanout(fleet)
+            result["rss_mb"] = rss_mb()
+        finally:
+            wall = time.monotonic() - wall_started
+            result["cpu_seconds"] = round(time.process_time() - cpu_started, 2)
+            result["cpu_percent"] = round(result["cpu_seconds"] / wall * 100, 1) if wall else None
+            await fleet.cleanup()
+            await http_clients.close()
+            await simulator.stop()
+        return result
+
+    async def _measure_poll_cycle(self, fleet) -> Optional[float]:
+        """Media de varios ciclos de polling HTTP completos (sin caché de estado)."""
+        from src.services.moonraker_query_planner import query_planner
+
+        durations = []
+        for _ in range(self.poll_cycles):
+            started = time.monotonic()
+            await fleet.list_printers()
+            durations.append(time.monotonic() - started)
+            # Que el siguiente ciclo no se sirva del memo del planificador de consultas
+            await asyncio.sleep(query_planner.ttl + 0.1)
+        return round(sum(durations) / len(durations), 3) if durations else None
+
+    async def _measure_subscription_warmup(self, fleet, online_ids: List[str]) -> Optional[float]:
+        started = time.monotonic()
+        await fleet.state_cache.start(subscribe=True)
+        deadline = started + self.warmup_timeout
+        while time.monotonic() < deadline:
+            if all(fleet.state_cache.get_meta(printer_id).get("connected") for printer_id in online_ids):
+                return round(time.monotonic() - started, 3)
+            await asyncio.sleep(0.05)
+        logger.warning(f"Las suscripciones no se completaron en {self.warmup_timeout:.0f}s")
+        return None
+
+    async def _measure_api(self, fleet) -> Dict[str, Any]:
+        from src.controllers import fleet_controller
+
+        app = FastAPI()
+        app.include_router(fleet_controller.router, prefix="/api/fleet")
+        printer_ids = list(fleet.printers)
+        rng = random.Random(0)
+        semaphore = asyncio.Semaphore(self.api_concurrency)
+        previous = fleet_controller.fleet_service
+        fleet_controller.fleet_service = fleet
+        try:
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+
+                async def timed(path, samples):
+                    async with semaphore:
+                        started = time.monotonic()
+                        response = await client.get(path)
+                        samples.append(time.monotonic() - started)
+                        response.raise_for_status()
+
+                summary = {}
+                for name, paths in (
+                    ("list", ["/api/fleet/printers"] * self.api_requests),
+                    ("detail", [f"/api/fleet/printers/{rng.choice(printer_ids)}" for _ in range(self.api_requests)]),
+                ):
+                    samples: List[float] = []
+                    await asyncio.gather(*(timed(path, samples) for path in paths))
+                    summary[name] = _latency_summary(samples)
+                return summary
+        finally:
+            fleet_controller.fleet_service = previous
+
+    async def _measure_fanout(self, fleet) -> Dict[str, Any]:
+        from src.services import realtime_monitor as monitor_module
+        from src.services.websocket_service import WebSocketManager
+
+        manager = WebSocketManager()
+        monitor = monitor_module.RealtimeMonitor()
+        if self.monitor_interval is not None:
+            monitor.update_interval = self.monitor_interval
+        # Momento en que la caché tuvo por primera vez cada par de temperaturas (por impresora)
+        seen: Dict[str, Dict[Any, float]] = {}
+
+        def on_change(printer_id, delta):
+            if "extruder" not in delta and "heater_bed" not in delta:
+                return
+            realtime_data = fleet.state_cache.get_realtime_data(printer_id)
+            values = seen.setdefault(printer_id, {})
+            values.setdefault((realtime_data.get("extruder_temp"), realtime_data.get("bed_temp")), time.monotonic())
+            if len(values) > 256:
+                values.pop(next(iter(values)))
+
+        clients = [_BenchmarkClient(seen) for _ in range(self.clients)]
+        previous = (monitor_module.fleet_service, monitor_module.websocket_manager)
+        monitor_module.fleet_service, monitor_module.websocket_manager = fleet, manager
+        fleet.state_cache.add_listener(on_change)
+        try:
+            for index, client in enumerate(clients):
+                await manager.connect(client, f"bench_{index}")
+                for printer_id in fleet.printers:
+                    await manager.subscribe_to_printer(client, printer_id)
+            await monitor.start_monitoring()
+            await asyncio.sleep(self.duration)
+            await monitor.stop_monitoring()
+        finally:
+            fleet.state_cache.remove_listener(on_change)
+            monitor_module.fleet_service, monitor_module.websocket_manager = previous
+            await manager.shutdown()
+
+        latencies = [latency for client in clients for latency in client.latencies]
+        return {
+            **_latency_summary(latencies),
+            "clients": self.clients,
+            "frames_per_client": round(sum(c.frames for c in clients) / max(1, len(clients)), 1),
+            "kbytes_per_client": round(sum(c.bytes for c in clients) / max(1, len(clients)) / 1024, 1),
+            "monitor_interval": monitor.update_interval,
+        }
+
+
+def _metric(result: Dict[str, Any], path: str) -> Optional[float]:
+    value: Any = result
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value if isinstance(value, (int, float)) else None
+
+
+def find_regressions(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Métricas que empeoran más que ``tolerance`` (fracción) respecto a la línea base."""
+    regressions = []
+    for size, result in results.get("sizes", {}).items():
+        previous = baseline.get("sizes", {}).get(size)
+        if previous is None:
+            continue
+        for path in COMPARED_METRICS:
+            current, before = _metric(result, path), _metric(previous, path)
+            if current is None or before is None:
+                continue
+            min_delta = next((delta for suffix, delta in MIN_REGRESSION_DELTA.items() if path.endswith(suffix)), 0.0)
+            if current > before * (1 + tolerance) and current - before > min_delta:
+                regressions.append(f"{size} impresoras: {path} {before} -> {current}")
+    return regressions
+
+
+def format_table(results: Dict[str, Any]) -> str:
+    header = ("impresoras", "poll s", "warmup s", "list p50/p99 ms", "detail p50/p99 ms",
+              "fan-out p50/p99 ms", "RSS MB", "CPU %")
+    rows = [header]
+    for size, r in results["sizes"].items():
+        api = r.get("api", {})
+        fanout = r.get("fanout", {})
+        rows.append((
+            size,
+            str(r.get("poll_cycle_s")),
+            str(r.get("subscribe_warmup_s")),
+            f"{api.get('list', {}).get('p50_ms')}/{api.get('list', {}).get('p99_ms')}",
+            f"{api.get('detail', {}).get('p50_ms')}/{api.get('detail', {}).get('p99_ms')}",
+            f"{fanout.get('p50_ms')}/{fanout.get('p99_ms')}",
+            str(r.get("rss_mb")),
+            str(r.get("cpu_percent")),
+        ))
+    widths = [max(len(str(row[i])) for row in rows) for i in range(len(header))]
+    return "\n".join("  ".join(str(cell).rjust(width) for cell, width in zip(row, widths)) for row in rows)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de KyberCore contra una flota Moonraker simulada")
+    parser.add_argument("--sizes", default="50,200,1000", help="Tamaños de flota separados por comas")
+    parser.add_argument("--duration", type=float, default=10.0, help="Segundos de medición del fan-out")
+    parser.add_argument("--clients", type=int, default=5, help="Clientes WebSocket simulados")
+    parser.add_argument("--api-requests", type=int, default=200)
+    parser.add_argument("--api-concurrency", type=int, default=10)
+    parser.add_argument("--monitor-interval", type=float, default=None)
+    parser.add_argument("--latency", type=float, default=0.005, help="Latencia simulada de Moonraker (s)")
+    parser.add_argument("--jitter", type=float, default=0.005)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--offline", type=int, default=0, help="Impresoras caídas en cada flota")
+    parser.add_argument("--in-process", action="store_true", help="Simulador en el mismo proceso")
+    parser.add_argument("--output", help="Guarda los resultados en JSON")
+    parser.add_argument("--baseline", help="Resultados JSON anteriores con los que comparar")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Empeoramiento relativo tolerado")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)
+    # Sin volcados de telemetría en el directorio temporal de cada flota
+    os.environ.setdefault("FLEET_TELEMETRY_SPILL", "false")
+
+    benchmark = FleetBenchmark(
+        duration=args.duration,
+        clients=args.clients,
+        api_requests=args.api_requests,
+        api_concurrency=args.api_concurrency,
+        monitor_interval=args.monitor_interval,
+        simulator_options={
+            "latency": args.latency,
+            "jitter": args.jitter,
+            "failure_rate": args.failure_rate,
+            "offline": args.offline,
+            "seed": 0,
+        },
+        in_process=args.in_process,
+    )
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    results = asyncio.run(benchmark.run(sizes))
+    print(format_table(results))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESIÓN: {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,563 @@
+"""
+Simulador local de Moonraker para N impresoras virtuales.
+
+Cada impresora escucha en su propio puerto de ``127.0.0.1`` (todas comparten
+un único ``AppRunner`` de aiohttp y se distinguen por el puerto local de la
+conexión) e implementa el subconjunto de la API que usa KyberCore:
+
+- ``/printer/info`` y ``/printer/objects/query``
+- WebSocket ``/websocket`` con ``printer.objects.subscribe`` y notificaciones
+  ``notify_status_update``, ``notify_filelist_changed`` y ``notify_klippy_*``
+- Archivos: listado, metadatos, subida, descarga y borrado
+- Impresión: start, pause, resume, cancel, ``gcode/script`` y reinicios
+
+La física es deliberadamente simple (las temperaturas tienden a su objetivo
+con algo de ruido y el progreso avanza con el tiempo) pero genera el mismo
+patrón de deltas que una flota real. Latencia, jitter, tasa de errores y
+hosts caídos (conexión rechazada o sin respuesta) son configurables.
+
+Uso desde la línea de comandos::
+
+    python -m src.simulator.moonraker --printers 50 --latency 0.02 --write-printers /tmp/printers.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+from aiohttp import WSMsgType, web
+
+logger = logging.getLogger(__name__)
+
+# Modos de caída de un host
+OFFLINE_REFUSED = "refused"  # el puerto deja de escuchar
+OFFLINE_HANG = "hang"  # acepta la conexión pero nunca responde
+
+
+class VirtualPrinter:
+    """Estado de Klipper de una impresora simulada."""
+
+    def __init__(self, printer_id: str, rng: random.Random, printing: bool = False,
+                 print_duration: Optional[float] = None):
+        self.id = printer_id
+        self.print_duration = print_duration
+        self.port: Optional[int] = None
+        self.site: Optional[web.TCPSite] = None
+        self.offline: Optional[str] = None
+        self.subscribers: Dict[web.WebSocketResponse, Optional[Dict[str, Any]]] = {}
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.requests = 0
+        self._rng = rng
+        self._restart_at: Optional[float] = None
+        self.status: Dict[str, Dict[str, Any]] = {
+            "webhooks": {"state": "ready", "state_message": "Printer is ready"},
+            "extruder": {"temperature": 24.0, "target": 0.0, "power": 0.0, "pressure_advance": 0.04,
+                         "smooth_time": 0.04, "motion_queue": None},
+            "heater_bed": {"temperature": 23.0, "target": 0.0, "power": 0.0},
+            "print_stats": {"state": "standby", "filename": "", "total_duration": 0.0, "print_duration": 0.0,
+                            "filament_used": 0.0, "message": ""},
+            "virtual_sdcard": {"progress": 0.0, "is_active": False, "file_position": 0},
+            "toolhead": {"homed_axes": "", "position": [0.0, 0.0, 0.0, 0.0], "print_time": 0.0},
+            "fan": {"speed": 0.0, "rpm": None},
+        }
+        if printing:
+            name = f"sim_{printer_id}.gcode"
+            self.add_file(name, b"; simulated\n" + b"G1 X1 Y1\n" * 1000)
+            self.start_print(name)
+            self.status["extruder"]["temperature"] = 210.0
+            self.status["heater_bed"]["temperature"] = 60.0
+            self.status["virtual_sdcard"]["progress"] = round(rng.random() * 0.9, 4)
+        # Último estado notificado: los cambios hechos por la API HTTP entre pasos también se envían
+        self._published = self._copy_status()
+
+    # === ARCHIVOS ===
+
+    def add_file(self, name: str, content: bytes) -> Dict[str, Any]:
+        item = {"path": name, "modified": time.time(), "size": len(content), "permissions": "rw"}
+        estimated_time = self.print_duration if self.print_duration is not None else 1800 + self._rng.randint(0, 7200)
+        self.files[name] = {**item, "content": content, "estimated_time": estimated_time}
+        return item
+
+    def file_item(self, name: str) -> Dict[str, Any]:
+        entry = self.files[name]
+        return {key: entry[key] for key in ("path", "modified", "size", "permissions")}
+
+    # === IMPRESIÓN ===
+
+    def start_print(self, filename: str):
+        self.status["print_stats"].update({"state": "printing", "filename": filename, "print_duration": 0.0,
+                                           "total_duration": 0.0, "filament_used": 0.0})
+        self.status["virtual_sdcard"].update({"progress": 0.0, "is_active": True})
+        self.status["extruder"]["target"] = 210.0
+        self.status["heater_bed"]["target"] = 60.0
+        self.status["fan"]["speed"] = 1.0
+
+    def set_print_state(self, state: str):
+        self.status["print_stats"]["state"] = state
+        self.status["virtual_sdcard"]["is_active"] = state == "printing"
+        if state in ("cancelled", "complete", "standby"):
+            self.status["extruder"]["target"] = 0.0
+            self.status["heater_bed"]["target"] = 0.0
+            self.status["fan"]["speed"] = 0.0
+
+    def restart(self, delay: float):
+        """Simula un reinicio de Klipper: ``startup`` durante ``delay`` segundos."""
+        self.status["webhooks"].update({"state": "startup", "state_message": "Klipper restarting"})
+        self.set_print_state("standby")
+        self._restart_at = time.monotonic() + delay
+
+    def shutdown(self):
+        self.status["webhooks"].update({"state": "shutdown", "state_message": "Emergency stop"})
+        self.set_print_state("standby")
+
+    # === SIMULACIÓN ===
+
+    def step(self, dt: float) -> Dict[str, Dict[str, Any]]:
+        """Avanza ``dt`` segundos y devuelve solo los campos que cambiaron."""
+        before = self._published
+        status = self.status
+        if self._restart_at is not None and time.monotonic() >= self._restart_at:
+            self._restart_at = None
+            status["webhooks"].update({"state": "ready", "state_message": "Printer is ready"})
+
+        for heater, ambient in (("extruder", 24.0), ("heater_bed", 23.0)):
+            fields = status[heater]
+            goal = fields["target"] or ambient
+            temperature = fields["temperature"] + (goal - fields["temperature"]) * min(1.0, dt * 0.3)
+            fields["temperature"] = round(temperature + self._rng.uniform(-0.3, 0.3), 2)
+            fields["power"] = round(min(1.0, max(0.0, (goal - temperature) / 20)), 2) if fields["target"] else 0.0
+
+        print_stats = status["print_stats"]
+        if print_stats["state"] == "printing":
+            print_stats["print_duration"] = round(print_stats["print_duration"] + dt, 2)
+            print_stats["total_duration"] = round(print_stats["total_duration"] + dt, 2)
+            print_stats["filament_used"] = round(print_stats["filament_used"] + dt * 0.8, 2)
+            entry = self.files.get(print_stats["filename"], {})
+            progress = status["virtual_sdcard"]["progress"] + dt / max(0.1, entry.get("estimated_time", 3600))
+            status["virtual_sdcard"]["progress"] = round(min(1.0, progress), 4)
+            status["toolhead"]["print_time"] = round(status["toolhead"]["print_time"] + dt, 2)
+            if progress >= 1.0:
+                self.set_print_state("complete")
+
+        delta = {}
+        for name, fields in status.items():
+            changed = {key: value for key, value in fields.items() if before[name].get(key) != value}
+            if changed:
+                delta[name] = changed
+        self._published = self._copy_status()
+        return delta
+
+    def _copy_status(self) -> Dict[str, Dict[str, Any]]:
+        return {name: dict(fields) for name, fields in self.status.items()}
+
+    def query(self, objects: Optional[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Estado de los objetos pedidos (``None`` = todos los campos del objeto)."""
+        if objects is None:
+            return {name: dict(fields) for name, fields in self.status.items()}
+        result = {}
+        for name, attrs in objects.items():
+            fields = self.status.get(name)
+            if fields is None:
+                continue
+            result[name] = dict(fields) if not attrs else {key: fields[key] for key in attrs if key in fields}
+        return result
+
+
+class MoonrakerSimulator:
+    """Lanza N impresoras virtuales en puertos locales."""
+
+    def __init__(
+        self,
+        printers: int = 10,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        failure_rate: float = 0.0,
+        offline: int = 0,
+        offline_mode: str = OFFLINE_REFUSED,
+        printing_ratio: float = 0.5,
+        update_interval: float = 0.25,
+        restart_delay: float = 1.0,
+        print_duration: Optional[float] = None,
+        host: str = "127.0.0.1",
+        seed: Optional[int] = None,
+    ):
+        """
+        Args:
+            printers: Número de impresoras virtuales
+            latency: Segundos añadidos a cada respuesta HTTP
+            jitter: Segundos aleatorios (0..jitter) sumados a la latencia
+            failure_rate: Probabilidad de responder 503 a una petición HTTP
+            offline: Impresoras que arrancan caídas
+            offline_mode: ``refused`` (puerto cerrado) o ``hang`` (sin respuesta)
+            printing_ratio: Fracción de impresoras que arrancan imprimiendo
+            update_interval: Segundos entre pasos de simulación / notificaciones
+            restart_delay: Segundos que dura un reinicio de Klipper
+            print_duration: Segundos que dura cada impresión (por defecto 30 min - 2,5 h aleatorios)
+        """
+        self.host = host
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.update_interval = update_interval
+        self.restart_delay = restart_delay
+        self._rng = random.Random(seed)
+        self.printers: Dict[str, VirtualPrinter] = {}
+        for index in range(printers):
+            printer_id = f"sim{index:04d}"
+            self.printers[printer_id] = VirtualPrinter(
+                printer_id, self._rng, printing=self._rng.random() < printing_ratio, print_duration=print_duration
+            )
+        self._initial_offline = {printer_id: offline_mode for printer_id in list(self.printers)[:offline]}
+        self._by_port: Dict[int, VirtualPrinter] = {}
+        self._runner: Optional[web.AppRunner] = None
+        self._ticker: Optional[asyncio.Task] = None
+        self.stats = {"http_requests": 0, "http_failures": 0, "notifications": 0, "ticks": 0}
+
+    # === CICLO DE VIDA ===
+
+    async def start(self):
+        app = web.Application(middlewares=[self._middleware], client_max_size=1024 ** 3)
+        app.router.add_get("/printer/info", self._printer_info)
+        app.router.add_get("/printer/objects/query", self._objects_query)
+        app.router.add_get("/websocket", self._websocket)
+        app.router.add_get("/server/files/list", self._files_list)
+        app.router.add_get("/server/files/metadata", self._files_metadata)
+        app.router.add_post("/server/files/upload", self._files_upload)
+        app.router.add_get("/server/files/gcodes/{filename:.+}", self._files_download)
+        app.router.add_delete("/server/files/gcodes/{filename:.+}", self._files_delete)
+        app.router.add_post("/printer/print/{action}", self._print_action)
+        app.router.add_post("/printer/gcode/script", self._gcode_script)
+        app.router.add_post("/printer/firmware_restart", self._restart)
+        app.router.add_post("/machine/services/restart", self._restart)
+        # Las peticiones colgadas (modo ``hang``) no deben retrasar el apagado
+        self._runner = web.AppRunner(app, handle_signals=False, access_log=None, shutdown_timeout=1.0)
+        await self._runner.setup()
+        for printer in self.printers.values():
+            await self._listen(printer)
+        for printer_id, mode in self._initial_offline.items():
+            await self.set_offline(printer_id, mode)
+        self._ticker = asyncio.create_task(self._tick_loop(), name="moonraker_simulator")
+        logger.info(f"Simulador Moonraker: {len(self.printers)} impresoras en {self.host}")
+
+    async def stop(self):
+        if self._ticker is not None:
+            self._ticker.cancel()
+            await asyncio.gather(self._ticker, return_exceptions=True)
+            self._ticker = None
+        for printer in self.printers.values():
+            await self._close_subscribers(printer)
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _listen(self, printer: VirtualPrinter):
+        site = web.TCPSite(self._runner, self.host, printer.port or 0, reuse_address=True)
+        await site.start()
+        printer.site = site
+        printer.port = site._server.sockets[0].getsockname()[1]
+        self._by_port[printer.port] = printer
+
+    async def set_offline(self, printer_id: str, mode: Optional[str] = OFFLINE_REFUSED):
+        """Tira (``mode``) o levanta (``None``) el host de una impresora."""
+        printer = self.printers[printer_id]
+        if mode == printer.offline:
+            return
+        if printer.offline == OFFLINE_REFUSED:
+            await self._listen(printer)
+        printer.offline = mode
+        if mode is not None:
+            await self._close_subscribers(printer)
+        if mode == OFFLINE_REFUSED:
+            await printer.site.stop()
+            printer.site = None
+
+    async def _close_subscribers(self, printer: VirtualPrinter):
+        subscribers, printer.subscribers = list(printer.subscribers), {}
+        for ws in subscribers:
+            await ws.close()
+
+    def fleet_printers(self) -> Dict[str, Dict[str, Any]]:
+        """Registros en el formato de ``printers.json`` apuntando a las impresoras virtuales."""
+        return {
+            printer_id: {
+                "id": printer_id,
+                "name": f"Simulada {printer_id}",
+                "model": "Simulator",
+                "ip": f"{self.host}:{printer.port}",
+                "status": "offline",
+                "capabilities": None,
+                "location": "simulador",
+            }
+            for printer_id, printer in self.printers.items()
+        }
+
+    # === SIMULACIÓN Y NOTIFICACIONES ===
+
+    async def _tick_loop(self):
+        last = time.monotonic()
+        while True:
+            await asyncio.sleep(self.update_interval)
+            now = time.monotonic()
+            dt, last = now - last, now
+            self.stats["ticks"] += 1
+            eventtime = time.monotonic()
+            for printer in self.printers.values():
+                delta = printer.step(dt)
+                if delta and printer.subscribers and printer.offline is None:
+                    await self._notify_status(printer, delta, eventtime)
+
+    async def _notify_status(self, printer: VirtualPrinter, delta: Dict[str, Dict[str, Any]], eventtime: float):
+        for ws, objects in list(printer.subscribers.items()):
+            filtered = {name: fields for name, fields in delta.items() if objects is None or name in objects}
+            if filtered:
+                await self._send(printer, ws, {"jsonrpc": "2.0", "method": "notify_status_update",
+                                               "params": [filtered, eventtime]})
+
+    async def _broadcast(self, printer: VirtualPrinter, method: str, params: List[Any]):
+        for ws in list(printer.subscribers):
+            await self._send(printer, ws, {"jsonrpc": "2.0", "method": method, "params": params})
+
+    async def _send(self, printer: VirtualPrinter, ws: web.WebSocketResponse, message: Dict[str, Any]):
+        try:
+            await ws.send_str(json.dumps(message))
+            self.stats["notifications"] += 1
+        except (ConnectionResetError, RuntimeError):
+            printer.subscribers.pop(ws, None)
+
+    # === HTTP ===
+
+    def _printer_for(self, request: web.Request) -> VirtualPrinter:
+        port = request.transport.get_extra_info("sockname")[1]
+        return self._by_port[port]
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        printer = self._printer_for(request)
+        printer.requests += 1
+        self.stats["http_requests"] += 1
+        if printer.offline == OFFLINE_REFUSED:
+            # Conexión keep-alive abierta antes de la caída: se corta como haría un host apagado
+            request.transport.close()
+            raise web.HTTPServiceUnavailable()
+        if printer.offline == OFFLINE_HANG:
+            await asyncio.sleep(3600)
+        delay = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.failure_rate and request.path != "/websocket" and self._rng.random() < self.failure_rate:
+            self.stats["http_failures"] += 1
+            return web.json_response({"error": {"code": 503, "message": "Simulated failure"}}, status=503)
+        request["printer"] = printer
+        return await handler(request)
+
+    @staticmethod
+    def _parse_objects(query) -> Dict[str, Any]:
+        objects = {}
+        for name, value in query.items():
+            objects[name] = value.split(",") if value else None
+        return objects
+
+    async def _printer_info(self, request: web.Request):
+        printer = request["printer"]
+        webhooks = printer.status["webhooks"]
+        return web.json_response({"result": {
+            "state": webhooks["state"],
+            "state_message": webhooks["state_message"],
+            "hostname": printer.id,
+            "software_version": "v0.12.0-sim",
+            "cpu_info": "Simulated CPU",
+            "klipper_path": "/home/pi/klipper",
+            "python_path": "/home/pi/klippy-env/bin/python",
+            "log_file": "/tmp/klippy.log",
+            "config_file": "/home/pi/printer_data/config/printer.cfg",
+        }})
+
+    async def _objects_query(self, request: web.Request):
+        printer = request["printer"]
+        status = printer.query(self._parse_objects(request.query))
+        return web.json_response({"result": {"eventtime": time.monotonic(), "status": status}})
+
+    async def _websocket(self, request: web.Request):
+        printer = request["printer"]
+        ws = web.WebSocketResponse(heartbeat=None)
+        await ws.prepare(request)
+        async for message in ws:
+            if message.type != WSMsgType.TEXT:
+                continue
+            try:
+                data = json.loads(message.data)
+            except ValueError:
+                continue
+            method, rpc_id = data.get("method"), data.get("id")
+            if method == "printer.objects.subscribe":
+                objects = (data.get("params") or {}).get("objects")
+                printer.subscribers[ws] = objects
+                reply = {"jsonrpc": "2.0", "id": rpc_id,
+                         "result": {"eventtime": time.monotonic(), "status": printer.query(objects)}}
+            elif method == "printer.info":
+                reply = {"jsonrpc": "2.0", "id": rpc_id, "result": dict(printer.status["webhooks"])}
+            else:
+                reply = {"jsonrpc": "2.0", "id": rpc_id, "error": {"code": -32601, "message": "Method not found"}}
+            await ws.send_str(json.dumps(reply))
+        printer.subscribers.pop(ws, None)
+        return ws
+
+    async def _files_list(self, request: web.Request):
+        printer = request["printer"]
+        return web.json_response({"result": [printer.file_item(name) for name in printer.files]})
+
+    async def _files_metadata(self, request: web.Request):
+        printer = request["printer"]
+        filename = request.query.get("filename", "")
+        entry = printer.files.get(filename)
+        if entry is None:
+            return web.json_response({"error": {"code": 404, "message": f"Metadata not available for <{filename}>"}},
+                                     status=404)
+        return web.json_response({"result": {
+            "filename": filename,
+            "size": entry["size"],
+            "modified": entry["modified"],
+            "slicer": "Simulator",
+            "estimated_time": entry["estimated_time"],
+            "thumbnails": [],
+        }})
+
+    async def _files_upload(self, request: web.Request):
+        printer = request["printer"]
+        reader = await request.multipart()
+        fields, content, filename = {}, bytearray(), None
+        async for part in reader:
+            if part.filename:
+                filename = part.filename
+                while chunk := await part.read_chunk():
+                    content.extend(chunk)
+            else:
+                fields[part.name] = await part.text()
+        if not filename:
+            return web.json_response({"error": {"code": 400, "message": "No file"}}, status=400)
+        existed = filename in printer.files
+        item = printer.add_file(filename, bytes(content))
+        start = fields.get("print") == "true" and printer.status["print_stats"]["state"] != "printing"
+        if start:
+            printer.start_print(filename)
+        action = "modify_file" if existed else "create_file"
+        await self._broadcast(printer, "notify_filelist_changed", [{"action": action, "item": {**item, "root": "gcodes"}}])
+        return web.json_response({"result": {
+            "item": {**item, "root": "gcodes"},
+            "print_started": start,
+            "print_queued": False,
+            "action": action,
+        }}, status=201)
+
+    async def _files_download(self, request: web.Request):
+        printer = request["printer"]
+        entry = printer.files.get(request.match_info["filename"])
+        if entry is None:
+            raise web.HTTPNotFound()
+        return web.Response(body=entry["content"], content_type="application/octet-stream")
+
+    async def _files_delete(self, request: web.Request):
+        printer = request["printer"]
+        filename = request.match_info["filename"]
+        if filename not in printer.files:
+            raise web.HTTPNotFound()
+        item = {**printer.file_item(filename), "root": "gcodes"}
+        del printer.files[filename]
+        await self._broadcast(printer, "notify_filelist_changed", [{"action": "delete_file", "item": item}])
+        return web.json_response({"result": {"item": item, "action": "delete_file"}})
+
+    async def _print_action(self, request: web.Request):
+        printer = request["printer"]
+        action = request.match_info["action"]
+        state = printer.status["print_stats"]["state"]
+        if action == "start":
+            filename = request.query.get("filename", "")
+            if filename not in printer.files:
+                raise web.HTTPNotFound(text=f"File {filename} does not exist")
+            if state in ("printing", "paused"):
+                raise web.HTTPBadRequest(text="Printer is busy")
+            printer.start_print(filename)
+        elif action == "pause" and state == "printing":
+            printer.set_print_state("paused")
+        elif action == "resume" and state == "paused":
+            printer.set_print_state("printing")
+        elif action == "cancel" and state in ("printing", "paused"):
+            printer.set_print_state("cancelled")
+        elif action not in ("pause", "resume", "cancel"):
+            raise web.HTTPNotFound()
+        return web.json_response({"result": "ok"})
+
+    async def _gcode_script(self, request: web.Request):
+        printer = request["printer"]
+        script = request.query.get("script", "").strip().upper()
+        if script == "M112":
+            printer.shutdown()
+            await self._broadcast(printer, "notify_klippy_shutdown", [])
+        elif script.startswith("G28"):
+            printer.status["toolhead"]["homed_axes"] = "xyz"
+        return web.json_response({"result": "ok"})
+
+    async def _restart(self, request: web.Request):
+        printer = request["printer"]
+        printer.restart(self.restart_delay)
+        await self._broadcast(printer, "notify_klippy_disconnected", [])
+        asyncio.get_running_loop().call_later(
+            self.restart_delay, lambda: asyncio.ensure_future(self._broadcast(printer, "notify_klippy_ready", []))
+        )
+        return web.json_response({"result": "ok"})
+
+
+async def _serve(args):
+    simulator = MoonrakerSimulator(
+        printers=args.printers,
+        latency=args.latency,
+        jitter=args.jitter,
+        failure_rate=args.failure_rate,
+        offline=args.offline,
+        offline_mode=args.offline_mode,
+        printing_ratio=args.printing_ratio,
+        update_interval=args.update_interval,
+        print_duration=args.print_duration,
+        seed=args.seed,
+    )
+    await simulator.start()
+    printers = simulator.fleet_printers()
+    if args.write_printers:
+        with open(args.write_printers, "w") as f:
+            json.dump(printers, f, indent=4)
+        print(f"printers.json con {len(printers)} impresoras simuladas escrito en {args.write_printers}")
+    else:
+        print(json.dumps(printers, indent=2))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await simulator.stop()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Simulador local de una flota Moonraker")
+    parser.add_argument("--printers", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.0, help="Segundos añadidos a cada respuesta")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Segundos aleatorios extra (0..jitter)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Probabilidad de responder 503")
+    parser.add_argument("--offline", type=int, default=0, help="Impresoras que arrancan caídas")
+    parser.add_argument("--offline-mode", choices=[OFFLINE_REFUSED, OFFLINE_HANG], default=OFFLINE_REFUSED)
+    parser.add_argument("--printing-ratio", type=float, default=0.5)
+    parser.add_argument("--update-interval", type=float, default=0.25)
+    parser.add_argument("--print-duration", type=float, default=None, help="Segundos que dura cada impresión")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--write-printers", help="Escribe un printers.json que apunta al simulador")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -249,7 +249,8 @@ window.FleetBulkCommands = (function() {
             
             console.log('📡 Enviando comando masivo:', bulkCommand);
             
-            const response = await fetch('/api/fleet/bulk/command', {
+            // Los resultados llegan por SSE según responde cada impresora
+            const response = await fetch('/api/fleet/bulk/command/stream', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -257,20 +258,63 @@ window.FleetBulkCommands = (function() {
                 body: JSON.stringify(bulkCommand)
             });
             
-            if (response.ok) {
-                const result = await response.json();
-                displayBulkResults(result);
-            } else {
+            if (!response.ok) {
                 const errorData = await response.json();
                 displayBulkError(errorData.detail || 'Error del servidor');
+                return;
             }
             
+            const results = [];
+            await readEventStream(response, (event, data) => {
+                if (event === 'start') {
+                    resultsContent.innerHTML = `<div class="text-center">Ejecutando en ${data.total_printers} impresoras...</div>`;
+                } else if (event === 'result') {
+                    results.push(data);
+                    displayBulkResults({
+                        total_printers: selectedIds.length,
+                        successful: results.filter(r => r.success).length,
+                        summary: `${results.length}/${selectedIds.length} impresoras han respondido`,
+                        results
+                    });
+                } else if (event === 'done') {
+                    displayBulkResults({ ...data, results });
+                }
+            });
+            
         } catch (error) {
             console.error('Error en comando masivo:', error);
             displayBulkError('Error de conexión: ' + error.message);
         }
     }
     
+    /**
+     * Lee una respuesta text/event-stream e invoca onEvent(evento, datos) por cada mensaje
+     */
+    async function readEventStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const block = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                let event = 'message';
+                let data = '';
+                block.split('\n').forEach(line => {
+                    if (line.startsWith('event: ')) event = line.slice(7);
+                    else if (line.startsWith('data: ')) data += line.slice(6);
+                });
+                if (data) onEvent(event, JSON.parse(data));
+            }
+        }
+    }
+    
     /**
      * Muestra los resultados del comando masivo
      */
@@ -294,7 +338,7 @@ window.FleetBulkCommands = (function() {
             html += `
                 <div class="flex justify-between items-center p-2 bg-gray-50 rounded">
                     <span>${icon} ${result.printer_name || result.printer_id}</span>
-                    <span class="${statusClass} text-sm">${result.message}</span>
+                    <span class="${statusClass} text-sm">${result.success ? `OK (${result.duration_ms} ms)` : result.error}</span>
                 </div>
             `;
         });
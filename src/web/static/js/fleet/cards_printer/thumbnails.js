@@ -34,7 +34,8 @@ window.FleetCards.Thumbnails = {
             if (thumbnailsArray.length > 0) {
                 // Usar el primer thumbnail disponible (generalmente el más pequeño)
                 const thumbnail = thumbnailsArray[0];
-                const imgSrc = `data:image/png;base64,${thumbnail.data}`;
+                // La URL versionada la cachea el navegador; el base64 queda como respaldo
+                const imgSrc = thumbnail.url || `data:image/png;base64,${thumbnail.data}`;
                 
                 thumbnailElement.innerHTML = `
                     <img src="${imgSrc}" 
@@ -96,7 +97,7 @@ window.FleetCards.Thumbnails = {
             
             // Crear modal de thumbnails
             const thumbnailsHTML = thumbnailsArray.map((thumbnail, index) => {
-                const dataUrl = `data:image/png;base64,${thumbnail.data}`;
+                const dataUrl = thumbnail.url || `data:image/png;base64,${thumbnail.data}`;
                 
                 return `
                     <div class="bg-white rounded-lg p-4 border border-gray-200">
@@ -1,6 +1,19 @@
 // Módulo de comunicación WebSocket para la gestión de flota
 window.FleetCommunication = (function() {
     
+    // Codificaciones que se ofrecen al servidor, por orden de preferencia.
+    // Si el servidor no acepta ninguna, los mensajes llegan como JSON de texto.
+    const SUBPROTOCOLS = window.FleetMsgpack
+        ? ['kybercore.msgpack.v1', 'kybercore.json.v1']
+        : ['kybercore.json.v1'];
+    
+    function decodeMessage(data) {
+        if (typeof data === 'string') {
+            return JSON.parse(data);
+        }
+        return window.FleetMsgpack.decode(data);
+    }
+    
     // WebSocket optimizado con reconexión inteligente
     function connectWebSocketOptimized() {
         const state = window.FleetState;
@@ -15,11 +28,12 @@ window.FleetCommunication = (function() {
             const wsUrl = `ws://${window.location.host}/api/ws/fleet`;
             console.log(`🌐 Conectando WebSocket optimizado (intento ${state.getReconnectAttempts() + 1}/${state.getMaxReconnectAttempts()}):`, wsUrl);
             
-            const websocket = new WebSocket(wsUrl);
+            const websocket = new WebSocket(wsUrl, SUBPROTOCOLS);
+            websocket.binaryType = 'arraybuffer';
             state.setWebSocket(websocket);
             
             websocket.onopen = () => {
-                console.log('✅ WebSocket conectado exitosamente');
+                console.log(`✅ WebSocket conectado exitosamente (${websocket.protocol || 'json'})`);
                 state.setWebSocketConnected(true);
                 state.resetReconnectAttempts();
                 ui.updateLastUpdateStatus('connected');
@@ -30,21 +44,20 @@ window.FleetCommunication = (function() {
                     state.clearEmergencyPollingInterval();
                 }
                 
-                // Suscribirse a actualizaciones
+                // Suscribirse a actualizaciones: el servidor responde con un snapshot
+                // completo (fleet_snapshot) y después solo envía deltas numerados
+                state.clearSequences();
                 const subscriptionMessage = { type: 'subscribe_all' };
                 websocket.send(JSON.stringify(subscriptionMessage));
                 console.log('📡 Suscripción enviada');
                 
                 // Iniciar heartbeat para mantener conexión
                 startHeartbeat();
-                
-                // Cargar datos iniciales vía WebSocket
-                requestInitialData();
             };
             
             websocket.onmessage = (event) => {
                 try {
-                    const message = JSON.parse(event.data);
+                    const message = decodeMessage(event.data);
                     console.log('📨 Mensaje WebSocket:', message.type);
                     
                     window.FleetMessageHandler.handleMessage(message);
@@ -115,6 +128,24 @@ window.FleetCommunication = (function() {
         }
     }
     
+    // Pedir el estado completo de impresoras cuyos deltas llegaron con hueco
+    let pendingResync = new Set();
+    let resyncTimer = null;
+    function requestResync(printerIds) {
+        (printerIds || []).forEach(id => pendingResync.add(id));
+        if (resyncTimer) return;
+        
+        // Agrupa las peticiones de un mismo ciclo en un único mensaje
+        resyncTimer = setTimeout(() => {
+            resyncTimer = null;
+            const ws = window.FleetState.getWebSocket();
+            if (ws && ws.readyState === WebSocket.OPEN && pendingResync.size) {
+                ws.send(JSON.stringify({ type: 'resync', printer_ids: [...pendingResync] }));
+            }
+            pendingResync.clear();
+        }, 50);
+    }
+    
     // Polling de emergencia - solo cuando WebSocket falla completamente
     function startEmergencyPolling() {
         const state = window.FleetState;
@@ -186,6 +217,7 @@ window.FleetCommunication = (function() {
         stopOptimizedCommunication,
         startHeartbeat,
         requestInitialData,
+        requestResync,
         startEmergencyPolling
     };
 })();
@@ -1,6 +1,45 @@
 // Módulo para manejar mensajes WebSocket de la gestión de flota
 window.FleetMessageHandler = (function() {
     
+    // Aplica un snapshot o delta secuenciado de una impresora; devuelve true si cambió el estado
+    function applyPrinterMessage(message) {
+        const state = window.FleetState;
+        const table = window.FleetTable;
+        
+        if (message.type === 'printer_snapshot') {
+            state.setSequence(message.printer_id, message.seq);
+            if (state.getPrinterById(message.printer_id)) {
+                state.updatePrinter(message.printer_id, message.data);
+            } else {
+                state.addPrinter(message.data);
+            }
+            table.updateSinglePrinter(message.printer_id, state.getPrinterById(message.printer_id));
+            return true;
+        }
+        
+        const lastSeq = state.getSequence(message.printer_id);
+        // Un delta fusionado en la cola del servidor cubre desde from_seq hasta seq
+        const firstSeq = message.from_seq ?? message.seq;
+        
+        // Hueco en la secuencia o impresora desconocida: pedir el estado completo
+        if (lastSeq === undefined || firstSeq !== lastSeq + 1) {
+            if (lastSeq === undefined || message.seq > lastSeq) {
+                console.warn(`⚠️ Hueco de secuencia en ${message.printer_id} (${lastSeq} → ${message.seq}), resincronizando`);
+                window.FleetCommunication.requestResync([message.printer_id]);
+            }
+            return false;
+        }
+        
+        const updated = state.applyPrinterDelta(message.printer_id, message.changes, message.removed);
+        if (!updated) {
+            window.FleetCommunication.requestResync([message.printer_id]);
+            return false;
+        }
+        state.setSequence(message.printer_id, message.seq);
+        table.updateSinglePrinter(message.printer_id, updated);
+        return true;
+    }
+    
     function handleMessage(message) {
         const state = window.FleetState;
         const ui = window.FleetUI;
@@ -41,6 +80,50 @@ window.FleetMessageHandler = (function() {
                 }
                 break;
                 
+            case 'fleet_snapshot':
+                if (message.printers) {
+                    console.log(`📸 Snapshot de ${message.printers.length} impresoras`);
+                    
+                    // Los números de secuencia marcan la base sobre la que se aplican los deltas
+                    message.printers.forEach(printer => {
+                        state.setSequence(printer.id, printer.seq);
+                        const known = state.getPrinterById(printer.id);
+                        if (known) {
+                            state.updatePrinter(printer.id, printer);
+                        } else {
+                            state.addPrinter(printer);
+                        }
+                    });
+                    
+                    const snapshotPrinters = state.getPrinters();
+                    table.populateFleetTable(snapshotPrinters);
+                    ui.updateFleetStatus(false, snapshotPrinters.length);
+                    
+                    if (window.FleetEventBus) {
+                        window.FleetEventBus.emit('printersUpdated', snapshotPrinters);
+                    }
+                }
+                break;
+                
+            case 'fleet_update': {
+                // Cambios de varias impresoras agrupados en un tick del servidor
+                let changed = false;
+                (message.updates || []).forEach(update => {
+                    changed = applyPrinterMessage(update) || changed;
+                });
+                if (changed && window.FleetEventBus) {
+                    window.FleetEventBus.emit('printersUpdated', state.getPrinters());
+                }
+                break;
+            }
+                
+            case 'printer_snapshot':
+            case 'printer_delta':
+                if (applyPrinterMessage(message) && window.FleetEventBus) {
+                    window.FleetEventBus.emit('printersUpdated', state.getPrinters());
+                }
+                break;
+                
             case 'printer_update':
                 console.log('🔄 Actualización de impresora:', message.printer_id);
                 
@@ -11,6 +11,36 @@ window.FleetState = (function() {
     // Lista de impresoras
     let printers = [];
     
+    // Último número de secuencia recibido por impresora (protocolo de deltas)
+    let sequences = {};
+    
+    // Aplica un delta anidado sobre un objeto (los diccionarios se fusionan recursivamente)
+    function mergeDelta(target, changes) {
+        const result = { ...target };
+        Object.entries(changes).forEach(([key, value]) => {
+            const current = result[key];
+            if (value && typeof value === 'object' && !Array.isArray(value) &&
+                current && typeof current === 'object' && !Array.isArray(current)) {
+                result[key] = mergeDelta(current, value);
+            } else {
+                result[key] = value;
+            }
+        });
+        return result;
+    }
+    
+    function removePath(target, path) {
+        const parts = path.split('.');
+        let node = target;
+        for (let i = 0; i < parts.length - 1; i++) {
+            if (!node || typeof node !== 'object') return;
+            node = node[parts[i]];
+        }
+        if (node && typeof node === 'object') {
+            delete node[parts[parts.length - 1]];
+        }
+    }
+    
     // Variables para actualizaciones optimizadas
     let websocket = null;
     let isWebSocketConnected = false;
@@ -74,6 +104,21 @@ window.FleetState = (function() {
                 printers[index] = { ...printers[index], ...updateData };
             }
         },
+        
+        // Secuencias de deltas
+        getSequence: (id) => sequences[id],
+        setSequence: (id, seq) => { sequences[id] = seq; },
+        clearSequences: () => { sequences = {}; },
+        
+        // Aplica un delta de campos; devuelve la impresora actualizada o null si no se conoce
+        applyPrinterDelta: (id, changes, removed) => {
+            const index = printers.findIndex(p => p.id === id);
+            if (index === -1) return null;
+            const updated = mergeDelta(printers[index], changes || {});
+            (removed || []).forEach(path => removePath(updated, path));
+            printers[index] = updated;
+            return updated;
+        },
         addPrinter: (printer) => {
             const existingIndex = printers.findIndex(p => p.id === printer.id);
             if (existingIndex !== -1) {
@@ -0,0 +1,137 @@
+"""
+Pruebas del motor de comandos masivos
+"""
+
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+import pytest_asyncio
+from fastapi import FastAPI
+
+from src.controllers import fleet_controller
+from src.models.printer import Printer
+from src.services.bulk_commands import BulkCommandEngine
+from src.services.fleet_service import FleetService
+
+
+@pytest_asyncio.fixture
+async def fleet(tmp_path, monkeypatch):
+    service = FleetService(printers_file=str(tmp_path / "printers.json"))
+    service.printers = {
+        f"p{i}": Printer(id=f"p{i}", name=f"Printer {i}", model="Voron", ip=f"10.0.0.{i}", status="printing" if i % 2 else "idle")
+        for i in range(1, 7)
+    }
+    delays = {printer_id: 0.0 for printer_id in service.printers}
+    calls = []
+
+    async def execute(printer, command, axis=None, parameters=None):
+        calls.append((printer.id, command, time.monotonic()))
+        await asyncio.sleep(delays[printer.id])
+        return {"success": True, "action": command}
+
+    async def no_polling():
+        raise AssertionError("el motor no debe sondear la flota")
+
+    monkeypatch.setattr(service, "_execute_single_command", execute)
+    monkeypatch.setattr(service, "list_printers", no_polling)
+    monkeypatch.setattr(fleet_controller, "fleet_service", service)
+    service.test_delays, service.test_calls = delays, calls
+    yield service
+    await service.close_session()
+
+
+class TestBulkCommandEngine:
+
+    @pytest.mark.asyncio
+    async def test_targets_come_from_memory(self, fleet):
+        printing = await fleet.get_target_printers(filters={"status": ["printing"]})
+        selected = await fleet.get_target_printers(printer_ids=["p2", "p3"], filters={"status": "idle"})
+
+        assert [p.id for p in printing] == ["p1", "p3", "p5"]
+        assert [p.id for p in selected] == ["p2"]
+
+    @pytest.mark.asyncio
+    async def test_results_stream_as_each_printer_finishes(self, fleet):
+        fleet.test_delays["p1"] = 0.3
+        started = time.monotonic()
+        stream = fleet.bulk_engine.stream(list(fleet.printers.values()), "pause")
+
+        first = await stream.__anext__()
+        first_latency = time.monotonic() - started
+        rest = [result async for result in stream]
+
+        assert first_latency < 0.1
+        assert first["printer_id"] != "p1"
+        assert rest[-1]["printer_id"] == "p1"
+        assert all(result["success"] for result in [first] + rest)
+
+    @pytest.mark.asyncio
+    async def test_slow_printers_hit_the_deadline(self, fleet):
+        fleet.test_delays["p3"] = 5.0
+
+        results = await fleet.execute_bulk_command(list(fleet.printers.values()), "pause", deadline=0.1)
+
+        assert [r["printer_id"] for r in results] == list(fleet.printers)
+        timed_out = [r for r in results if not r["success"]]
+        assert [r["printer_id"] for r in timed_out] == ["p3"]
+        assert timed_out[0]["timed_out"] is True
+        assert fleet.bulk_engine.get_stats()["timed_out"] == 1
+
+    @pytest.mark.asyncio
+    async def test_concurrency_is_bounded(self, fleet):
+        engine = BulkCommandEngine(fleet, max_concurrency=2)
+        for printer_id in fleet.test_delays:
+            fleet.test_delays[printer_id] = 0.05
+
+        started = time.monotonic()
+        await engine.run(list(fleet.printers.values()), "home")
+
+        # 6 impresoras de 2 en 2: al menos 3 rondas de 50 ms
+        assert time.monotonic() - started >= 0.15
+
+    @pytest.mark.asyncio
+    async def test_disruptive_commands_roll_out_in_waves(self, fleet):
+        engine = BulkCommandEngine(fleet, stagger_batch=2, stagger_interval=0.05)
+        printers = list(fleet.printers.values())
+
+        results = await engine.run(printers, "restart_firmware")
+
+        assert [r["wave"] for r in sorted(results, key=lambda r: r["printer_id"])] == [0, 0, 1, 1, 2, 2]
+        times = {printer_id: at for printer_id, _, at in fleet.test_calls}
+        assert times["p3"] - times["p2"] >= 0.05
+        assert times["p5"] - times["p4"] >= 0.05
+        # Los comandos no disruptivos no se escalonan
+        assert len(engine.plan_waves(printers, "pause")) == 1
+
+    @pytest.mark.asyncio
+    async def test_abandoned_stream_launches_no_more_waves(self, fleet):
+        engine = BulkCommandEngine(fleet, stagger_batch=3, stagger_interval=0.05)
+        stream = engine.stream(list(fleet.printers.values()), "restart_firmware")
+        await stream.__anext__()
+        await stream.aclose()
+        await asyncio.sleep(0.15)
+
+        assert sorted(printer_id for printer_id, _, _ in fleet.test_calls) == ["p1", "p2", "p3"]
+
+    @pytest.mark.asyncio
+    async def test_sse_endpoint_streams_events(self, fleet):
+        app = FastAPI()
+        app.include_router(fleet_controller.router, prefix="/api/fleet")
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post(
+                "/api/fleet/bulk/command/stream",
+                json={"command": "pause", "printer_ids": ["p1", "p2"]},
+            )
+            invalid = await client.post("/api/fleet/bulk/command/stream", json={"command": "explode"})
+
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = [
+            (block.split("\n")[0][len("event: "):], json.loads(block.split("\n")[1][len("data: "):]))
+            for block in response.text.strip().split("\n\n")
+        ]
+        assert [event for event, _ in events] == ["start", "result", "result", "done"]
+        assert events[-1][1]["successful"] == 2
+        assert invalid.status_code == 400
@@ -0,0 +1,126 @@
+"""
+Pruebas del circuit breaker por host de Moonraker
+"""
+
+import time
+
+import aiohttp
+import pytest
+
+from src.models.printer import Printer
+from src.services.circuit_breaker import (
+    CircuitBreaker, CircuitOpenError, CircuitState, HostHealthRegistry, host_health
+)
+from src.services.fleet_service import FleetService
+from src.services.moonraker_client import MoonrakerClient
+
+
+class TestCircuitBreaker:
+    """Transiciones de estado y puntuación de salud"""
+
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker("10.0.0.1:7125", failure_threshold=3)
+        for _ in range(3):
+            assert breaker.allow_request()
+            breaker.record_failure(0.1)
+
+        assert breaker.state == CircuitState.OPEN
+        assert breaker.is_open()
+        assert not breaker.allow_request()
+        assert breaker.health_score == 0
+
+    def test_opens_on_error_rate(self):
+        breaker = CircuitBreaker("h", failure_threshold=100, min_samples=4, error_rate_threshold=0.5)
+        for ok in (True, False, True, False):
+            breaker.record_success(0.01) if ok else breaker.record_failure(0.01)
+        assert breaker.state == CircuitState.OPEN
+
+    def test_half_open_probe_closes_on_success(self):
+        breaker = CircuitBreaker("h", failure_threshold=1, open_timeout=0.01)
+        breaker.record_failure(0.1)
+        time.sleep(0.02)
+
+        assert breaker.allow_request()
+        assert breaker.state == CircuitState.HALF_OPEN
+        # Solo una petición de prueba a la vez
+        assert not breaker.allow_request()
+
+        breaker.record_success(0.05)
+        assert breaker.state == CircuitState.CLOSED
+        assert breaker.allow_request()
+
+    def test_half_open_failure_doubles_timeout(self):
+        breaker = CircuitBreaker("h", failure_threshold=1, open_timeout=0.01, max_open_timeout=0.015)
+        breaker.record_failure(0.1)
+        time.sleep(0.02)
+        assert breaker.allow_request()
+
+        breaker.record_failure(0.1)
+        assert breaker.state == CircuitState.OPEN
+        assert breaker.open_timeout == 0.015
+
+    def test_health_score_penalizes_latency(self):
+        breaker = CircuitBreaker("h", slow_latency=1.0)
+        breaker.record_success(0.1)
+        assert breaker.health_score == 100
+        breaker.record_success(3.9)
+        assert breaker.health_score == 70
+
+    def test_registry_shares_breakers_per_host(self):
+        registry = HostHealthRegistry(failure_threshold=1)
+        registry.get_breaker("a:1").record_failure(0.1)
+
+        assert registry.get_breaker("a:1") is registry.get_breaker("a:1")
+        assert not registry.is_available("a:1")
+        assert registry.is_available("b:1")
+        assert registry.snapshot()["a:1"]["state"] == "open"
+
+
+class TestFleetIntegration:
+    """Uso del breaker desde MoonrakerClient y FleetService"""
+
+    @pytest.fixture
+    def fleet(self, tmp_path):
+        service = FleetService(printers_file=str(tmp_path / "printers.json"))
+        service.printers = {
+            "p1": Printer(id="p1", name="Printer 1", model="Voron", ip="127.0.0.1:2",
+                          status="ready", realtime_data={"extruder_temp": 210.0})
+        }
+        return service
+
+    @pytest.mark.asyncio
+    async def test_open_circuit_skips_network(self):
+        breaker = CircuitBreaker("127.0.0.1:1", failure_threshold=1)
+        breaker.record_failure(0.1)
+        async with aiohttp.ClientSession() as session:
+            client = MoonrakerClient("127.0.0.1", 1, session, breaker=breaker)
+            with pytest.raises(CircuitOpenError):
+                async with client._request("GET", f"{client.base_url}/printer/info"):
+                    pass
+            assert await client.get_printer_info() is None
+        assert breaker.rejected == 2
+
+    @pytest.mark.asyncio
+    async def test_connection_errors_are_recorded(self):
+        breaker = CircuitBreaker("127.0.0.1:1")
+        async with aiohttp.ClientSession() as session:
+            client = MoonrakerClient("127.0.0.1", 1, session, breaker=breaker)
+            assert await client.get_printer_info() is None
+        assert breaker.get_health()["consecutive_failures"] == 1
+
+    @pytest.mark.asyncio
+    async def test_list_printers_returns_stale_state_when_open(self, fleet):
+        printer = fleet.printers["p1"]
+        breaker = host_health.get_breaker("127.0.0.1:2")
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure(0.1)
+
+        printers = await fleet.list_printers()
+        assert printers[0].status == "ready"
+        assert printers[0].realtime_data == {"extruder_temp": 210.0, "stale": True}
+        assert printers[0].health["state"] == "open"
+        assert not fleet.is_printer_available(printer)
+
+        results = await fleet.execute_bulk_command([printer], "pause")
+        assert results[0]["success"] is False
+        assert "circuito abierto" in results[0]["error"]
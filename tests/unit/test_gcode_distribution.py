@@ -0,0 +1,186 @@
+"""
+Pruebas de la distribución en paralelo de G-code a varias impresoras
+"""
+
+import asyncio
+import time
+
+import httpx
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from fastapi import FastAPI
+
+from src.controllers import fleet_controller
+from src.models.printer import Printer
+from src.services.fleet_service import FleetService
+from src.services.gcode_distribution import BandwidthLimiter
+from src.services.http_clients import http_clients
+
+CONTENT = b"".join(b"G1 X%d Y%d E0.1\n" % (i, i) for i in range(100000))
+
+
+class FakeMoonraker:
+    """Moonraker que recibe subidas multipart; se puede hacer lento o fallar a voluntad"""
+
+    def __init__(self):
+        self.received = {}
+        self.uploads = 0
+        self.delay = 0.0
+        self.fail_with = None  # código HTTP con el que responder
+        self.fail_times = None  # número de subidas que fallan (None = todas mientras haya fail_with)
+        self.runner = None
+        self.port = None
+
+    async def upload(self, request):
+        self.uploads += 1
+        reader = await request.multipart()
+        fields, content = {}, bytearray()
+        async for part in reader:
+            if part.filename:
+                while chunk := await part.read_chunk():
+                    content.extend(chunk)
+            else:
+                fields[part.name] = await part.text()
+        await asyncio.sleep(self.delay)
+        if self.fail_with and (self.fail_times is None or self.uploads <= self.fail_times):
+            return web.Response(status=self.fail_with, text="error simulado")
+        self.received[part.filename] = {"content": bytes(content), "fields": fields}
+        return web.json_response({"result": {"item": {"path": part.filename, "root": "gcodes"}}}, status=201)
+
+    async def start(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/server/files/upload", self.upload)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+
+@pytest_asyncio.fixture
+async def printers():
+    servers = {f"p{i}": FakeMoonraker() for i in range(1, 4)}
+    for server in servers.values():
+        await server.start()
+    yield servers
+    for server in servers.values():
+        await server.runner.cleanup()
+
+
+@pytest_asyncio.fixture
+async def fleet(tmp_path, printers, monkeypatch):
+    service = FleetService(printers_file=str(tmp_path / "printers.json"))
+    service.printers = {
+        printer_id: Printer(id=printer_id, name=printer_id, model="Voron", ip=f"127.0.0.1:{server.port}")
+        for printer_id, server in printers.items()
+    }
+    service.distributor.retry_backoff = 0.01
+    monkeypatch.setattr(fleet_controller, "fleet_service", service)
+    yield service
+    await service.distributor.stop()
+    await http_clients.close()
+
+
+@pytest.fixture
+def gcode(tmp_path):
+    path = tmp_path / "part.gcode"
+    path.write_bytes(CONTENT)
+    return str(path)
+
+
+class TestGcodeDistribution:
+
+    @pytest.mark.asyncio
+    async def test_fan_out_takes_as_long_as_the_slowest_printer(self, fleet, printers, gcode):
+        for server in printers.values():
+            server.delay = 0.3
+
+        started = time.monotonic()
+        result = await fleet.distributor.distribute(gcode, list(printers), start_print=True)
+        elapsed = time.monotonic() - started
+
+        assert elapsed < 0.8
+        assert result["state"] == "completed"
+        for printer_id, server in printers.items():
+            assert server.received["part.gcode"]["content"] == CONTENT
+            assert server.received["part.gcode"]["fields"] == {"root": "gcodes", "print": "true"}
+            target = result["targets"][printer_id]
+            assert target["bytes_sent"] == len(CONTENT) and target["progress"] == 1.0
+
+    @pytest.mark.asyncio
+    async def test_concurrency_cap_is_global(self, fleet, printers, gcode):
+        fleet.distributor.max_concurrency = 1
+        fleet.distributor._semaphore = asyncio.Semaphore(1)
+        for server in printers.values():
+            server.delay = 0.1
+
+        started = time.monotonic()
+        await fleet.distributor.distribute(gcode, list(printers))
+
+        assert time.monotonic() - started >= 0.3
+
+    @pytest.mark.asyncio
+    async def test_transient_errors_are_retried_automatically(self, fleet, printers, gcode):
+        printers["p2"].fail_with, printers["p2"].fail_times = 503, 1
+
+        result = await fleet.distributor.distribute(gcode, list(printers))
+
+        assert result["state"] == "completed"
+        assert result["targets"]["p2"]["attempts"] == 2
+        assert printers["p2"].received["part.gcode"]["content"] == CONTENT
+        assert printers["p1"].uploads == 1
+
+    @pytest.mark.asyncio
+    async def test_retry_only_repeats_failed_targets(self, fleet, printers, gcode):
+        printers["p3"].fail_with = 400
+
+        result = await fleet.distributor.distribute(gcode, list(printers))
+        assert result["state"] == "partial"
+        assert result["targets"]["p3"]["state"] == "failed"
+        assert result["targets"]["p3"]["attempts"] == 1  # un 4xx no se reintenta solo
+
+        printers["p3"].fail_with = None
+        fleet.distributor.retry(result["id"])
+        result = await fleet.distributor.wait(result["id"])
+
+        assert result["state"] == "completed"
+        assert [server.uploads for server in printers.values()] == [1, 1, 2]
+
+    @pytest.mark.asyncio
+    async def test_endpoint_spools_upload_and_reports_progress(self, fleet, printers):
+        app = FastAPI()
+        app.include_router(fleet_controller.router, prefix="/api/fleet")
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post(
+                "/api/fleet/files/distributions",
+                files={"file": ("batch.gcode", CONTENT, "application/octet-stream")},
+                data={"printer_ids": "p1,p2"},
+            )
+            assert response.status_code == 200
+            distribution_id = response.json()["id"]
+
+            await fleet.distributor.wait(distribution_id)
+            progress = (await client.get(f"/api/fleet/files/distributions/{distribution_id}")).json()
+
+            unknown = await client.post(
+                "/api/fleet/files/distributions",
+                files={"file": ("batch.gcode", CONTENT, "application/octet-stream")},
+                data={"printer_ids": "p1,missing"},
+            )
+
+        assert progress["state"] == "completed"
+        assert set(progress["targets"]) == {"p1", "p2"}
+        assert printers["p2"].received["batch.gcode"]["content"] == CONTENT
+        assert unknown.status_code == 404
+
+
+class TestBandwidthLimiter:
+
+    @pytest.mark.asyncio
+    async def test_rate_is_enforced_across_consumers(self):
+        limiter = BandwidthLimiter(rate_bps=100_000)
+        started = time.monotonic()
+        # 100 KB de ráfaga inicial + 50 KB que deben esperar ~0.5 s
+        await asyncio.gather(*(limiter.consume(25_000) for _ in range(6)))
+        assert time.monotonic() - started >= 0.45
@@ -0,0 +1,84 @@
+"""
+Pruebas de la descarga de G-code en streaming con soporte de Range
+"""
+
+import httpx
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from fastapi import FastAPI
+
+from src.controllers import fleet_controller
+from src.models.printer import Printer
+from src.services.fleet_service import FleetService
+
+CONTENT = b"".join(b"G1 X%d Y%d\n" % (i, i) for i in range(50000))
+
+
+@pytest_asyncio.fixture
+async def moonraker(tmp_path):
+    """Moonraker mínimo que sirve los gcodes como ficheros (con soporte de Range)"""
+    (tmp_path / "big.gcode").write_bytes(CONTENT)
+
+    async def gcode(request):
+        path = tmp_path / request.match_info["name"]
+        if not path.exists():
+            return web.Response(status=404)
+        return web.FileResponse(path)
+
+    app = web.Application()
+    app.router.add_get("/server/files/gcodes/{name}", gcode)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    yield site._server.sockets[0].getsockname()[1]
+    await runner.cleanup()
+
+
+@pytest_asyncio.fixture
+async def fleet(tmp_path, moonraker, monkeypatch):
+    service = FleetService(printers_file=str(tmp_path / "printers.json"))
+    service.printers = {"p1": Printer(id="p1", name="Printer 1", model="Voron", ip=f"127.0.0.1:{moonraker}")}
+    monkeypatch.setattr(fleet_controller, "fleet_service", service)
+    yield service
+    await service.close_session()
+
+
+@pytest_asyncio.fixture
+async def api(fleet):
+    app = FastAPI()
+    app.include_router(fleet_controller.router, prefix="/api/fleet")
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+
+class TestGcodeDownload:
+
+    @pytest.mark.asyncio
+    async def test_full_download_is_streamed_in_chunks(self, fleet):
+        download = await fleet.open_printer_gcode_download("p1", "big.gcode")
+        chunks = [chunk async for chunk in download.iter_chunks(chunk_size=64 * 1024)]
+
+        assert download.status == 200
+        assert b"".join(chunks) == CONTENT
+        assert max(len(chunk) for chunk in chunks) <= 64 * 1024
+        stats = fleet.transfers.get_stats()
+        assert stats["completed"] == 1 and stats["bytes"] == len(CONTENT)
+        assert stats["active"] == []
+
+    @pytest.mark.asyncio
+    async def test_range_requests_resume_downloads(self, api):
+        response = await api.get("/api/fleet/printers/p1/files/big.gcode", headers={"Range": "bytes=100-199"})
+
+        assert response.status_code == 206
+        assert response.content == CONTENT[100:200]
+        assert response.headers["content-range"] == f"bytes 100-199/{len(CONTENT)}"
+        assert response.headers["accept-ranges"] == "bytes"
+
+    @pytest.mark.asyncio
+    async def test_missing_file_returns_404(self, api, fleet):
+        response = await api.get("/api/fleet/printers/p1/files/missing.gcode")
+
+        assert response.status_code == 404
+        assert fleet.transfers.get_stats()["failed"] == 1
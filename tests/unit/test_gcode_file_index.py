@@ -0,0 +1,117 @@
+"""
+Pruebas del índice de archivos G-code de la flota
+"""
+
+import asyncio
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+
+from src.models.printer import Printer
+from src.services.fleet_service import FleetService
+
+
+@pytest_asyncio.fixture
+async def moonraker():
+    """Servidor Moonraker mínimo con un listado de gcodes modificable"""
+    files = {
+        "cube.gcode": {"path": "cube.gcode", "modified": 100.0, "size": 1000, "permissions": "rw"},
+        "benchy.gcode": {"path": "benchy.gcode", "modified": 200.0, "size": 2000, "permissions": "rw"},
+    }
+    calls = {"list": 0, "metadata": []}
+
+    async def list_files(request):
+        calls["list"] += 1
+        return web.json_response({"result": list(files.values())})
+
+    async def metadata(request):
+        filename = request.query["filename"]
+        calls["metadata"].append(filename)
+        return web.json_response({"result": {"filename": filename, "estimated_time": files[filename]["size"] / 10}})
+
+    app = web.Application()
+    app.router.add_get("/server/files/list", list_files)
+    app.router.add_get("/server/files/metadata", metadata)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    yield port, files, calls
+    await runner.cleanup()
+
+
+@pytest_asyncio.fixture
+async def fleet(tmp_path, moonraker):
+    port, _, _ = moonraker
+    service = FleetService(printers_file=str(tmp_path / "printers.json"))
+    service.printers = {
+        "p1": Printer(id="p1", name="Printer 1", model="Voron", ip=f"127.0.0.1:{port}"),
+        "p2": Printer(id="p2", name="Printer 2", model="Voron", ip="127.0.0.1:1"),
+    }
+    yield service
+    await service.file_index.stop()
+    await service.close_session()
+
+
+class TestGcodeFileIndex:
+
+    @pytest.mark.asyncio
+    async def test_listing_is_served_from_memory_after_first_sync(self, fleet, moonraker):
+        _, _, calls = moonraker
+        first = await fleet.list_printer_gcode_files("p1")
+        second = await fleet.list_printer_gcode_files("p1")
+
+        assert calls["list"] == 1
+        assert sorted(calls["metadata"]) == ["benchy.gcode", "cube.gcode"]
+        assert first == second
+        cube = next(f for f in first if f["filename"] == "cube.gcode")
+        assert cube["estimated_time"] == 100.0
+
+        metadata = await fleet.get_printer_gcode_metadata("p1", "cube.gcode")
+        assert metadata["result"]["estimated_time"] == 100.0
+        assert len(calls["metadata"]) == 2
+
+    @pytest.mark.asyncio
+    async def test_reconcile_only_fetches_metadata_for_changed_files(self, fleet, moonraker):
+        _, files, calls = moonraker
+        await fleet.file_index.refresh("p1")
+        files["cube.gcode"] = {**files["cube.gcode"], "modified": 300.0, "size": 1500}
+        del files["benchy.gcode"]
+        calls["metadata"].clear()
+
+        await fleet.file_index.refresh("p1")
+
+        assert calls["metadata"] == ["cube.gcode"]
+        assert [f["filename"] for f in fleet.file_index.list_files("p1")] == ["cube.gcode"]
+        assert fleet.file_index.list_files("p1")[0]["estimated_time"] == 150.0
+
+    @pytest.mark.asyncio
+    async def test_filelist_notifications_update_the_index(self, fleet, moonraker):
+        await fleet.file_index.refresh("p1")
+
+        await fleet.state_cache._handle_notification("p1", {
+            "method": "notify_filelist_changed",
+            "params": [{
+                "action": "move_file",
+                "item": {"path": "parts/cube_v2.gcode", "root": "gcodes", "modified": 100.0, "size": 1000},
+                "source_item": {"path": "cube.gcode", "root": "gcodes"},
+            }],
+        })
+        await fleet.state_cache._handle_notification("p1", {
+            "method": "notify_filelist_changed",
+            "params": [{"action": "delete_file", "item": {"path": "benchy.gcode", "root": "gcodes"}}],
+        })
+
+        assert [f["filename"] for f in fleet.file_index.list_files("p1")] == ["parts/cube_v2.gcode"]
+
+    @pytest.mark.asyncio
+    async def test_fleet_wide_lookup(self, fleet):
+        await fleet.file_index.refresh("p1")
+        # p2 no responde: no se indexa y no se pierde el índice de p1
+        assert not await fleet.file_index.refresh("p2")
+
+        assert list(fleet.file_index.find("cube.gcode")) == ["p1"]
+        assert fleet.file_index.find("BENCH", exact=False)["p1"][0]["filename"] == "benchy.gcode"
+        assert fleet.file_index.find("missing.gcode") == {}
@@ -0,0 +1,100 @@
+"""
+Pruebas del registro de pools HTTP compartidos
+"""
+
+import asyncio
+import time
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+
+from src.models.printer import Printer
+from src.services.fleet_service import FleetService
+from src.services.http_clients import MOONRAKER_POOL, HttpClientRegistry, http_clients
+
+
+@pytest_asyncio.fixture
+async def server():
+    """Servidor HTTP con un endpoint rápido y otro lento"""
+
+    async def fast(request):
+        return web.json_response({"ok": True})
+
+    async def slow(request):
+        await asyncio.sleep(0.2)
+        return web.json_response({"ok": True})
+
+    app = web.Application()
+    app.router.add_get("/fast", fast)
+    app.router.add_get("/slow", slow)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    yield f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+    await runner.cleanup()
+
+
+@pytest_asyncio.fixture
+async def registry():
+    registry = HttpClientRegistry()
+    yield registry
+    await registry.close()
+
+
+async def _get(registry, name, url):
+    session = await registry.get_session(name)
+    async with session.get(url) as response:
+        return await response.json()
+
+
+class TestHttpClientRegistry:
+
+    @pytest.mark.asyncio
+    async def test_connections_are_reused_across_calls(self, registry, server):
+        registry.configure("api", limit=4)
+        for _ in range(3):
+            await _get(registry, "api", f"{server}/fast")
+
+        stats = registry.get_stats()["api"]
+        assert stats["requests"] == 3
+        assert stats["connections_created"] == 1
+        assert stats["connections_reused"] == 2
+        assert stats["sessions_created"] == 1
+
+    @pytest.mark.asyncio
+    async def test_queueing_is_reported(self, registry, server):
+        registry.configure("api", limit=1)
+        await asyncio.gather(*(_get(registry, "api", f"{server}/slow") for _ in range(2)))
+
+        stats = registry.get_stats()["api"]
+        assert stats["queued"] == 1
+        assert stats["queue_wait_max"] >= 0.15
+
+    @pytest.mark.asyncio
+    async def test_raising_the_limit_releases_queued_requests(self, registry, server):
+        registry.configure("api", limit=1)
+        started = time.monotonic()
+        requests = [asyncio.create_task(_get(registry, "api", f"{server}/slow")) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        registry.set_limit("api", 3)
+        await asyncio.gather(*requests)
+
+        assert time.monotonic() - started < 0.35
+        assert registry.get_stats()["api"]["limit"] == 3
+
+    @pytest.mark.asyncio
+    async def test_moonraker_pool_grows_with_the_fleet(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("HTTP_MOONRAKER_PER_HOST", "4")
+        service = FleetService(printers_file=str(tmp_path / "printers.json"))
+        service.printers = {
+            f"p{i}": Printer(id=f"p{i}", name=f"p{i}", model="Voron", ip=f"10.0.0.{i}") for i in range(20)
+        }
+        try:
+            session = await service._get_session()
+            assert session is await service._get_session()
+            assert session.connector.limit == 80
+            assert http_clients.get_stats()[MOONRAKER_POOL]["limit_per_host"] == 4
+        finally:
+            await service.close_session()
@@ -0,0 +1,88 @@
+"""
+Pruebas de la caché en memoria de los repositorios JSON
+"""
+
+import json
+import os
+
+import pytest
+
+from src.database.json_repository import BaseJSONRepository, JSONRepositoryError
+from src.database.write_behind import write_behind
+
+
+def _repo(tmp_path):
+    return BaseJSONRepository("items.json", data_key="items", base_path=tmp_path)
+
+
+def _write_external(repo, items):
+    """Edita el archivo por fuera del repositorio con una marca de tiempo distinta."""
+    write_behind.flush()
+    payload = json.loads(repo.file_path.read_text())
+    payload["items"] = items
+    repo.file_path.write_text(json.dumps(payload))
+    stat = os.stat(repo.file_path)
+    os.utime(repo.file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+
+class TestJSONRepositoryCache:
+
+    def test_steady_state_reads_do_not_parse(self, tmp_path):
+        repo = _repo(tmp_path)
+        repo.save([{"id": 1}])
+        loads = repo.get_cache_stats()["loads"]
+
+        for _ in range(20):
+            assert repo.load()["items"] == [{"id": 1}]
+
+        stats = repo.get_cache_stats()
+        assert stats["loads"] == loads and stats["hits"] >= 20
+
+    def test_external_edits_and_sibling_writes_are_seen(self, tmp_path):
+        repo, sibling = _repo(tmp_path), _repo(tmp_path)
+        repo.save([{"id": 1}])
+        assert sibling.load()["items"] == [{"id": 1}]
+
+        sibling.update_payload(lambda payload: {**payload, "items": payload["items"] + [{"id": 2}]})
+        assert [item["id"] for item in repo.load()["items"]] == [1, 2]
+
+        _write_external(repo, [{"id": 3}])
+        assert repo.load()["items"] == [{"id": 3}]
+
+    def test_failed_update_discards_partial_changes(self, tmp_path):
+        repo = _repo(tmp_path)
+        repo.save([{"id": 1}])
+
+        def updater(payload):
+            payload["items"].append({"id": "a medias"})
+            raise JSONRepositoryError("fallo en mitad de la actualización")
+
+        with pytest.raises(JSONRepositoryError):
+            repo.update_payload(updater)
+
+        assert repo.load()["items"] == [{"id": 1}]
+        write_behind.flush()
+        assert json.loads(repo.file_path.read_text())["items"] == [{"id": 1}]
+
+    def test_missing_and_corrupt_files(self, tmp_path):
+        repo = _repo(tmp_path)
+        repo.load()
+        write_behind.flush()
+        repo.file_path.write_text("{no es json")
+        with pytest.raises(JSONRepositoryError):
+            repo.load()
+
+        os.remove(repo.file_path)
+        with pytest.raises(JSONRepositoryError):
+            repo.load()
+
+    def test_unserializable_payload_keeps_the_file(self, tmp_path):
+        repo = _repo(tmp_path)
+        repo.save([{"id": 1}])
+
+        with pytest.raises(TypeError):
+            repo.save([{"id": 2, "when": object()}])
+
+        write_behind.flush()
+        assert json.loads(repo.file_path.read_text())["items"] == [{"id": 1}]
+        assert repo.load()["items"] == [{"id": 1}]
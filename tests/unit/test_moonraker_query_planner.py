@@ -0,0 +1,123 @@
+"""
+Pruebas del planificador de consultas a Moonraker (fusión, singleflight y memo)
+"""
+
+import asyncio
+
+import aiohttp
+import pytest
+import pytest_asyncio
+from aiohttp import web
+
+from src.services.circuit_breaker import CircuitBreaker
+from src.services.moonraker_client import MoonrakerClient
+from src.services.moonraker_query_planner import MoonrakerQueryPlanner
+
+STATUS = {
+    "webhooks": {"state": "ready", "state_message": "Printer is ready"},
+    "extruder": {"temperature": 210.0, "target": 210.0},
+    "heater_bed": {"temperature": 60.0, "target": 60.0},
+    "print_stats": {"state": "printing"},
+    "virtual_sdcard": {"progress": 0.5},
+}
+
+
+@pytest_asyncio.fixture
+async def moonraker():
+    """Servidor Moonraker mínimo que registra las consultas recibidas"""
+    queries = []
+
+    async def objects_query(request):
+        names = list(request.query.keys())
+        queries.append(names)
+        await asyncio.sleep(0.05)
+        return web.json_response({
+            "result": {"eventtime": 1.0, "status": {n: STATUS[n] for n in names if n in STATUS}}
+        })
+
+    async def printer_info(request):
+        queries.append(["info"])
+        await asyncio.sleep(0.05)
+        return web.json_response({"result": {"state": "ready", "hostname": "pi"}})
+
+    app = web.Application()
+    app.router.add_get("/printer/objects/query", objects_query)
+    app.router.add_get("/printer/info", printer_info)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    yield port, queries
+    await runner.cleanup()
+
+
+@pytest.fixture
+def planner(monkeypatch):
+    planner = MoonrakerQueryPlanner(ttl=1.0)
+    monkeypatch.setattr("src.services.moonraker_client.query_planner", planner)
+    return planner
+
+
+class TestQueryPlanner:
+
+    @pytest.mark.asyncio
+    async def test_concurrent_queries_share_one_request(self, moonraker, planner):
+        port, queries = moonraker
+        async with aiohttp.ClientSession() as session:
+            client = MoonrakerClient("127.0.0.1", port, session, breaker=CircuitBreaker("t"))
+            first = client.query_objects(["webhooks", "extruder", "heater_bed"])
+            second = client.get_temperatures()
+            a, b = await asyncio.gather(first, second)
+
+        assert len(queries) == 1
+        assert set(a["result"]["status"]) == {"webhooks", "extruder", "heater_bed"}
+        assert set(b["result"]["status"]) == {"extruder", "heater_bed"}
+        assert planner.stats["shared"] == 1
+
+    @pytest.mark.asyncio
+    async def test_recent_objects_are_merged_and_memoized(self, moonraker, planner):
+        port, queries = moonraker
+        async with aiohttp.ClientSession() as session:
+            client = MoonrakerClient("127.0.0.1", port, session, breaker=CircuitBreaker("t"))
+            await client.get_temperatures()
+            # La segunda consulta incluye los objetos pedidos antes
+            await client.get_print_stats()
+            temps = await client.get_temperatures()
+
+        assert len(queries) == 2
+        assert set(queries[1]) == {"extruder", "heater_bed", "print_stats", "virtual_sdcard"}
+        assert temps["result"]["status"]["extruder"]["temperature"] == 210.0
+        assert planner.stats["memo_hits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_memo_results_are_copies(self, moonraker, planner):
+        port, _ = moonraker
+        async with aiohttp.ClientSession() as session:
+            client = MoonrakerClient("127.0.0.1", port, session, breaker=CircuitBreaker("t"))
+            result = await client.get_temperatures()
+            result["result"]["status"]["extruder"]["temperature"] = 0
+            again = await client.get_temperatures()
+        assert again["result"]["status"]["extruder"]["temperature"] == 210.0
+
+    @pytest.mark.asyncio
+    async def test_printer_info_singleflight_and_max_age(self, moonraker, planner):
+        port, queries = moonraker
+        async with aiohttp.ClientSession() as session:
+            client = MoonrakerClient("127.0.0.1", port, session, breaker=CircuitBreaker("t"))
+            results = await asyncio.gather(*(client.get_printer_info() for _ in range(5)))
+            assert all(r["result"]["hostname"] == "pi" for r in results)
+            assert len(queries) == 1
+
+            await client.get_printer_info(max_age=60)
+            assert len(queries) == 1
+            await client.get_printer_info()
+            assert len(queries) == 2
+
+    @pytest.mark.asyncio
+    async def test_failed_query_is_not_memoized(self, planner):
+        async with aiohttp.ClientSession() as session:
+            client = MoonrakerClient("127.0.0.1", 1, session, breaker=CircuitBreaker("t", failure_threshold=10))
+            assert await client.get_temperatures() is None
+            assert await client.get_temperatures() is None
+        assert planner.stats["requests"] == 2
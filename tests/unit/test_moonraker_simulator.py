@@ -0,0 +1,135 @@
+"""
+Pruebas del simulador de Moonraker y del benchmark de la flota
+"""
+
+import asyncio
+
+import aiohttp
+import pytest
+import pytest_asyncio
+
+from src.services.moonraker_client import MoonrakerClient
+from src.simulator.benchmark import FleetBenchmark, find_regressions, percentile
+from src.simulator.moonraker import OFFLINE_HANG, MoonrakerSimulator
+
+
+@pytest_asyncio.fixture
+async def simulator():
+    sim = MoonrakerSimulator(printers=3, printing_ratio=0.0, update_interval=0.05, restart_delay=0.1, seed=1)
+    await sim.start()
+    yield sim
+    await sim.stop()
+
+
+@pytest_asyncio.fixture
+async def session():
+    async with aiohttp.ClientSession() as session:
+        yield session
+
+
+def _client(sim, printer_id, session):
+    return MoonrakerClient("127.0.0.1", sim.printers[printer_id].port, session)
+
+
+class TestMoonrakerSimulator:
+
+    @pytest.mark.asyncio
+    async def test_info_and_object_queries(self, simulator, session):
+        client = _client(simulator, "sim0000", session)
+
+        info = await client._fetch_printer_info()
+        status = await client._fetch_objects(["webhooks", "extruder"])
+
+        assert info["result"]["state"] == "ready"
+        assert set(status["result"]["status"]) == {"webhooks", "extruder"}
+        assert "temperature" in status["result"]["status"]["extruder"]
+
+    @pytest.mark.asyncio
+    async def test_subscription_streams_status_updates(self, simulator, session):
+        client = _client(simulator, "sim0001", session)
+        initial, updates = [], []
+
+        async def on_message(message):
+            updates.append(message)
+            return len(updates) < 3
+
+        async def on_subscribed(status):
+            initial.append(status)
+
+        subscribed = await asyncio.wait_for(
+            client.subscribe_to_updates(on_message, objects={"extruder": None}, on_subscribed=on_subscribed),
+            timeout=2,
+        )
+
+        assert subscribed is True
+        assert set(initial[0]) == {"extruder"}
+        assert all(m["method"] == "notify_status_update" and set(m["params"][0]) <= {"extruder"} for m in updates)
+
+    @pytest.mark.asyncio
+    async def test_upload_list_and_print(self, simulator, session):
+        client = _client(simulator, "sim0002", session)
+
+        uploaded = await client.upload_gcode_file(b"G28\nG1 X10\n", "cube.gcode")
+        files = await client.fetch_gcode_files()
+        started = await client.start_print("cube.gcode")
+        paused = await client.pause_print()
+
+        assert uploaded["result"]["item"]["path"] == "cube.gcode"
+        assert [f["path"] for f in files] == ["cube.gcode"]
+        assert started["success"] and paused["success"]
+        assert simulator.printers["sim0002"].status["print_stats"]["state"] == "paused"
+        assert await client.download_gcode_file("cube.gcode") == b"G28\nG1 X10\n"
+
+    @pytest.mark.asyncio
+    async def test_failures_and_offline_hosts(self, simulator, session):
+        simulator.failure_rate = 1.0
+        failing = await _client(simulator, "sim0000", session)._fetch_printer_info()
+        simulator.failure_rate = 0.0
+
+        await simulator.set_offline("sim0001")
+        with pytest.raises(aiohttp.ClientConnectionError):
+            async with session.get(f"http://127.0.0.1:{simulator.printers['sim0001'].port}/printer/info"):
+                pass
+
+        await simulator.set_offline("sim0002", OFFLINE_HANG)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(_client(simulator, "sim0002", session)._fetch_printer_info(), timeout=0.2)
+
+        await simulator.set_offline("sim0001", None)
+        recovered = await _client(simulator, "sim0001", session)._fetch_printer_info()
+
+        assert failing is None
+        assert simulator.stats["http_failures"] == 1
+        assert recovered["result"]["state"] == "ready"
+
+
+class TestFleetBenchmark:
+
+    def test_percentile_and_regressions(self):
+        assert percentile([0.1, 0.2, 0.3, 0.4], 50) == 0.2
+        assert percentile([], 99) is None
+
+        baseline = {"sizes": {"50": {"poll_cycle_s": 1.0, "api": {"list": {"p99_ms": 10.0}}}}}
+        current = {"sizes": {"50": {"poll_cycle_s": 1.5, "api": {"list": {"p99_ms": 11.0}}}}}
+
+        assert find_regressions(current, baseline, tolerance=0.2) == ["50 impresoras: poll_cycle_s 1.0 -> 1.5"]
+
+    @pytest.mark.asyncio
+    async def test_small_fleet_reports_every_metric(self, monkeypatch):
+        monkeypatch.setenv("FLEET_TELEMETRY_SPILL", "false")
+        benchmark = FleetBenchmark(
+            duration=1.0,
+            clients=2,
+            api_requests=10,
+            poll_cycles=1,
+            monitor_interval=0.1,
+            simulator_options={"update_interval": 0.05, "seed": 0},
+            in_process=True,
+        )
+
+        result = await benchmark.run_size(3)
+
+        assert result["poll_cycle_s"] is not None and result["subscribe_warmup_s"] is not None
+        assert result["api"]["list"]["samples"] == 10 and result["api"]["detail"]["p99_ms"] is not None
+        assert result["fanout"]["samples"] > 0
+        assert result["rss_mb"] > 0
@@ -16,6 +16,7 @@ from src.database import (
     ProductionRepository,
     JSONRepositoryError,
 )
+from src.database.write_behind import write_behind
 from src.services import (
     CustomerService,
     OrderService,
@@ -36,6 +37,8 @@ def temp_db_dir():
     """Crea un directorio temporal para pruebas."""
     temp_dir = tempfile.mkdtemp()
     yield Path(temp_dir)
+    # Escrituras diferidas pendientes antes de borrar el directorio
+    write_behind.flush()
     shutil.rmtree(temp_dir)
 
 
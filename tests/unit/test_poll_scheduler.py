@@ -0,0 +1,85 @@
+"""
+Pruebas para el planificador adaptativo de polling
+"""
+
+import asyncio
+
+import pytest
+
+from src.services.poll_scheduler import AdaptivePollScheduler
+
+
+def make_scheduler(printer_ids, poll_func, activity=None, **kwargs):
+    return AdaptivePollScheduler(
+        poll_func=poll_func,
+        printer_ids_func=lambda: printer_ids,
+        activity_func=activity or (lambda printer_id: "idle"),
+        tick=0.01,
+        **kwargs
+    )
+
+
+class TestAdaptivePollScheduler:
+    """Pruebas del cálculo de intervalos y del pool de workers"""
+
+    def test_intervals_follow_activity(self):
+        activity = {"busy": "active", "quiet": "idle", "dead": "offline"}
+        scheduler = make_scheduler([], None, activity=activity.get)
+
+        assert scheduler.next_interval("busy", 0) == scheduler.active_interval
+        assert scheduler.next_interval("quiet", 0) == scheduler.idle_interval
+        assert scheduler.next_interval("dead", 1) == scheduler.offline_base_interval
+        assert scheduler.next_interval("dead", 3) == scheduler.offline_base_interval * 4
+        assert scheduler.next_interval("dead", 20) == scheduler.offline_max_interval
+
+    @pytest.mark.asyncio
+    async def test_polls_every_printer_with_bounded_concurrency(self):
+        printer_ids = [f"p{i}" for i in range(120)]
+        polled = set()
+        in_flight = 0
+        max_in_flight = 0
+
+        async def poll(printer_id):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.005)
+            polled.add(printer_id)
+            in_flight -= 1
+            return True
+
+        scheduler = make_scheduler(printer_ids, poll, workers=10)
+        await scheduler.start()
+        try:
+            for _ in range(200):
+                if len(polled) == len(printer_ids):
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await scheduler.stop()
+
+        assert polled == set(printer_ids)
+        assert max_in_flight <= 10
+        metrics = scheduler.get_metrics()
+        assert metrics["total_polls"] >= len(printer_ids)
+        assert metrics["per_printer"]["p0"]["interval"] == scheduler.idle_interval
+
+    @pytest.mark.asyncio
+    async def test_failures_back_off_and_push_updated_printers_are_skipped(self):
+        async def poll(printer_id):
+            return False
+
+        scheduler = make_scheduler(
+            ["offline", "pushed"], poll,
+            should_poll=lambda printer_id: printer_id != "pushed",
+            offline_base_interval=0.02, offline_max_interval=0.04,
+        )
+        await scheduler.start()
+        await asyncio.sleep(0.2)
+        await scheduler.stop()
+
+        metrics = scheduler.get_metrics()
+        assert metrics["per_printer"]["offline"]["failures"] >= 2
+        assert metrics["per_printer"]["offline"]["interval"] == 0.04
+        assert metrics["per_printer"]["pushed"]["polls"] == 0
+        assert metrics["skipped_push_updated"] >= 1
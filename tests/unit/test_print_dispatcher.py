@@ -0,0 +1,194 @@
+"""
+Pruebas del despachador automático de la cola de impresión
+"""
+
+import asyncio
+import time
+
+import pytest
+import pytest_asyncio
+
+from src.models.printer import Printer
+from src.services.fleet_service import FleetService
+from src.services.print_dispatcher import COMPLETED, PrintDispatcher
+from src.simulator.moonraker import MoonrakerSimulator
+
+
+async def _until(condition, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("la condición no se cumplió a tiempo")
+        await asyncio.sleep(0.02)
+
+
+def _gcode(tmp_path, name):
+    path = tmp_path / name
+    path.write_bytes(b"G28\nG1 X10 Y10\n")
+    return str(path)
+
+
+@pytest.fixture
+def fleet(tmp_path):
+    service = FleetService(printers_file=str(tmp_path / "printers.json"))
+    service.printers = {
+        "p1": Printer(id="p1", name="Printer 1", model="Voron", ip="127.0.0.1:1")
+    }
+    return service
+
+
+@pytest_asyncio.fixture
+async def simulated_fleet(tmp_path, monkeypatch):
+    monkeypatch.setenv("FLEET_FILE_INDEX_ENABLED", "false")
+    simulator = MoonrakerSimulator(printers=2, printing_ratio=0.0, update_interval=0.05, print_duration=0.3, seed=3)
+    await simulator.start()
+    service = FleetService(printers_file=str(tmp_path / "printers.json"))
+    service.printers = {printer_id: Printer(**data) for printer_id, data in simulator.fleet_printers().items()}
+    service.dispatcher.sweep_interval = 0.2
+    yield simulator, service
+    await service.cleanup()
+    await simulator.stop()
+
+
+class TestQueue:
+
+    def test_priority_due_date_and_arrival_order(self, fleet, tmp_path):
+        dispatcher = fleet.dispatcher
+        path = _gcode(tmp_path, "part.gcode")
+        for job_id, priority, due in [
+            ("late", "normal", "2030-01-02T00:00:00"),
+            ("low", "low", None),
+            ("plain", "normal", None),
+            ("urgent", "urgent", None),
+            ("soon", "normal", "2030-01-01T00:00:00"),
+        ]:
+            dispatcher.enqueue([{"gcode_path": path}], job_id=job_id, priority=priority, due=due)
+
+        queued = [job["job_id"] for job in dispatcher.get_queue()["queued"]]
+        assert queued == ["urgent", "soon", "late", "plain", "low"]
+        assert dispatcher._pick("p1")["job_id"] == "urgent"
+
+        with pytest.raises(ValueError):
+            dispatcher.enqueue([{"gcode_path": path}], priority="asap")
+
+    def test_compatibility_filters(self, fleet, tmp_path):
+        fleet.printers["p1"].capabilities = ["PLA"]
+        dispatcher = fleet.dispatcher
+        path = _gcode(tmp_path, "part.gcode")
+        dispatcher.enqueue([{"gcode_path": path}], job_id="other", printer_ids=["p2"], priority="urgent")
+        dispatcher.enqueue([{"gcode_path": path}], job_id="abs", capabilities=["ABS"], priority="high")
+        dispatcher.enqueue([{"gcode_path": path}], job_id="pla", capabilities=["PLA"])
+
+        assert dispatcher._pick("p1")["job_id"] == "pla"
+        assert dispatcher._pick("p1") is None
+        assert len(dispatcher._heap) == 2
+
+    def test_log_is_shared_between_workers(self, fleet, tmp_path):
+        path = _gcode(tmp_path, "part.gcode")
+        fleet.dispatcher.enqueue([{"gcode_path": path}], job_id="j1")
+
+        other = PrintDispatcher(fleet, log_path=fleet.dispatcher.log_path)
+        other.origin = "otro-worker"
+        assert [job["job_id"] for job in other.get_queue()["queued"]] == ["j1"]
+
+        other.cancel("j1")
+        fleet.dispatcher._refresh()
+        assert fleet.dispatcher.jobs["j1"]["status"] == "cancelled"
+
+        fleet.dispatcher._load()
+        assert fleet.dispatcher.jobs["j1"]["status"] == "cancelled"
+        with open(fleet.dispatcher.log_path) as f:
+            assert len(f.readlines()) == 1
+
+
+class TestDispatching:
+
+    @pytest.mark.asyncio
+    async def test_sweep_runs_under_constant_wakeups(self, fleet, monkeypatch):
+        dispatcher = fleet.dispatcher
+        dispatcher.sweep_interval = 0.2
+        sweeps = []
+        monkeypatch.setattr(dispatcher, "_refresh", lambda: sweeps.append(time.monotonic()))
+        await dispatcher.start()
+        try:
+            # Cambios de estado más frecuentes que ``sweep_interval``: la espera nunca vence
+            for _ in range(20):
+                dispatcher.observe("p1", {"webhooks": {"state": "ready"}})
+                await asyncio.sleep(0.05)
+        finally:
+            await dispatcher.stop()
+
+        assert len(sweeps) >= 3
+
+    @pytest.mark.asyncio
+    async def test_idle_printers_receive_queued_jobs(self, simulated_fleet, tmp_path):
+        simulator, service = simulated_fleet
+        dispatcher = service.dispatcher
+        pinned = dispatcher.enqueue(
+            [{"gcode_path": _gcode(tmp_path, "a.gcode")}, {"gcode_path": _gcode(tmp_path, "b.gcode")}],
+            printer_ids=["sim0000"],
+        )
+        anywhere = dispatcher.enqueue([{"gcode_path": _gcode(tmp_path, "c.gcode")}], priority="high")
+
+        await service.state_cache.start()
+        await dispatcher.start()
+        await _until(lambda: all(dispatcher.jobs[job["job_id"]]["status"] == COMPLETED for job in (pinned, anywhere)))
+
+        job = dispatcher.get_job(pinned["job_id"])
+        assert [entry["state"] for entry in job["files"]] == [COMPLETED, COMPLETED]
+        assert set(simulator.printers["sim0000"].files) >= {"a.gcode", "b.gcode"}
+        metrics = dispatcher.get_metrics()
+        assert metrics["stats"]["files_started"] == 3
+        assert metrics["dispatch_latency"]["samples"] >= 1
+        assert metrics["fleet"]["busy_seconds"] > 0
+
+    @pytest.mark.asyncio
+    async def test_tracked_job_continues_with_next_file(self, simulated_fleet):
+        simulator, service = simulated_fleet
+        printer = simulator.printers["sim0001"]
+        for name in ("one.gcode", "two.gcode"):
+            printer.add_file(name, b"G28\n")
+        await service.state_cache.start()
+        await service.dispatcher.start()
+
+        await service.start_printer_print("sim0001", "one.gcode")
+        job = service.dispatcher.track("wizard-1", "sim0001", ["one.gcode", "two.gcode"])
+        await _until(lambda: service.dispatcher.jobs[job["job_id"]]["status"] == COMPLETED)
+
+        assert [entry["state"] for entry in service.dispatcher.jobs["wizard-1"]["files"]] == [COMPLETED, COMPLETED]
+
+    @pytest.mark.asyncio
+    async def test_leader_continues_job_tracked_by_follower(self, simulated_fleet):
+        simulator, service = simulated_fleet
+        printer = simulator.printers["sim0001"]
+        for name in ("one.gcode", "two.gcode"):
+            printer.add_file(name, b"G28\n")
+        leader = service.dispatcher
+        await service.state_cache.start()
+        await leader.start()
+
+        follower = PrintDispatcher(service, log_path=leader.log_path)
+        follower.origin = "otro-worker"
+        await service.start_printer_print("sim0001", "one.gcode")
+        follower.track("wizard-2", "sim0001", ["one.gcode", "two.gcode"])
+
+        await _until(lambda: leader.jobs.get("wizard-2", {}).get("status") == COMPLETED)
+        assert [entry["state"] for entry in leader.jobs["wizard-2"]["files"]] == [COMPLETED, COMPLETED]
+        assert "sim0001" not in leader._active
+
+    @pytest.mark.asyncio
+    async def test_cancelled_print_holds_the_job(self, simulated_fleet, tmp_path):
+        simulator, service = simulated_fleet
+        simulator.printers["sim0000"].print_duration = 30
+        dispatcher = service.dispatcher
+        job = dispatcher.enqueue([{"gcode_path": _gcode(tmp_path, "long.gcode")}, {"gcode_path": _gcode(tmp_path, "x.gcode")}],
+                                 printer_ids=["sim0000"])
+        await service.state_cache.start()
+        await dispatcher.start()
+        await _until(lambda: dispatcher.jobs[job["job_id"]]["files"][0].get("confirmed"))
+
+        await service.cancel_printer("sim0000")
+        await _until(lambda: dispatcher.jobs[job["job_id"]]["status"] == "failed")
+
+        assert simulator.printers["sim0000"].status["print_stats"]["state"] == "cancelled"
+        assert "sim0000" not in dispatcher._active
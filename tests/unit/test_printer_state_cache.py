@@ -0,0 +1,127 @@
+"""
+Pruebas para la caché de estado de la flota (suscripciones Moonraker)
+"""
+
+import asyncio
+import json
+
+import pytest
+import websockets
+
+from src.models.printer import Printer
+from src.services.fleet_service import FleetService
+from src.services.printer_state_cache import PrinterStateCache, build_realtime_data
+
+
+@pytest.fixture
+def fleet(tmp_path):
+    service = FleetService(printers_file=str(tmp_path / "printers.json"))
+    service.printers = {
+        "p1": Printer(id="p1", name="Printer 1", model="Voron", ip="127.0.0.1:1")
+    }
+    return service
+
+
+class TestPrinterStateCache:
+    """Pruebas del snapshot en memoria"""
+
+    def test_apply_status_merges_deltas(self, fleet):
+        cache = PrinterStateCache(fleet)
+        cache.apply_status("p1", {
+            "webhooks": {"state": "ready", "state_message": "Printer is ready"},
+            "extruder": {"temperature": 25.0, "target": 0.0},
+        })
+        cache.apply_status("p1", {"extruder": {"temperature": 180.5}})
+
+        status = cache.get_status("p1")
+        assert status["extruder"] == {"temperature": 180.5, "target": 0.0}
+        assert cache.get_state("p1") == "ready"
+
+    def test_apply_to_printer_builds_realtime_data(self, fleet):
+        cache = PrinterStateCache(fleet)
+        cache.apply_status("p1", {
+            "webhooks": {"state": "ready"},
+            "virtual_sdcard": {"progress": 0.4567},
+            "print_stats": {"state": "printing", "filename": "cube.gcode"},
+        })
+        printer = fleet.printers["p1"]
+
+        assert cache.apply_to_printer(printer)
+        assert printer.status == "ready"
+        assert printer.realtime_data["print_progress"] == 45.7
+        assert printer.realtime_data["print_filename"] == "cube.gcode"
+
+    def test_error_status_overrides_snapshot(self, fleet):
+        cache = PrinterStateCache(fleet)
+        cache.apply_status("p1", {"webhooks": {"state": "ready"}}, source="http")
+        cache.mark_error("p1", "unreachable")
+        printer = fleet.printers["p1"]
+
+        cache.apply_to_printer(printer)
+        assert printer.status == "unreachable"
+        assert not cache.is_fresh("p1", max_age=60)
+
+    def test_listeners_receive_deltas(self, fleet):
+        cache = PrinterStateCache(fleet)
+        received = []
+        cache.add_listener(lambda printer_id, delta: received.append((printer_id, delta)))
+
+        cache.apply_status("p1", {"heater_bed": {"temperature": 60.0}})
+        assert received == [("p1", {"heater_bed": {"temperature": 60.0}})]
+
+    def test_build_realtime_data_defaults(self):
+        data = build_realtime_data({})
+        assert data["extruder_temp"] == "N/A"
+        assert data["print_progress"] == 0
+        assert data["print_state"] == "unknown"
+
+    @pytest.mark.asyncio
+    async def test_klippy_ready_requests_resubscription(self, fleet):
+        cache = PrinterStateCache(fleet)
+        result = await cache._handle_notification("p1", {"method": "notify_klippy_ready"})
+        assert result is False
+        assert cache.get_meta("p1")["resubscribe"] is True
+
+    @pytest.mark.asyncio
+    async def test_list_printers_reads_snapshot(self, fleet):
+        fleet.state_cache.running = True
+        fleet.state_cache.apply_status("p1", {"webhooks": {"state": "printing"}})
+
+        printers = await fleet.list_printers()
+        assert printers[0].status == "printing"
+        fleet.state_cache.running = False
+
+    @pytest.mark.asyncio
+    async def test_subscription_applies_notifications(self, fleet):
+        """La suscripción aplica el estado inicial y los deltas recibidos por WebSocket"""
+
+        async def moonraker(websocket):
+            request = json.loads(await websocket.recv())
+            assert request["method"] == "printer.objects.subscribe"
+            await websocket.send(json.dumps({
+                "jsonrpc": "2.0",
+                "id": request["id"],
+                "result": {"status": {"webhooks": {"state": "ready"}, "extruder": {"temperature": 20.0}}},
+            }))
+            await websocket.send(json.dumps({
+                "jsonrpc": "2.0",
+                "method": "notify_status_update",
+                "params": [{"extruder": {"temperature": 200.0}}, 123.4],
+            }))
+            await asyncio.sleep(1)
+
+        async with websockets.serve(moonraker, "127.0.0.1", 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            fleet.printers["p1"].ip = f"127.0.0.1:{port}"
+            cache = fleet.state_cache
+            await cache.start()
+            try:
+                for _ in range(50):
+                    if cache.get_status("p1").get("extruder", {}).get("temperature") == 200.0:
+                        break
+                    await asyncio.sleep(0.05)
+                assert cache.get_state("p1") == "ready"
+                assert cache.get_status("p1")["extruder"]["temperature"] == 200.0
+                assert cache.get_meta("p1")["source"] == "websocket"
+            finally:
+                await fleet.cleanup()
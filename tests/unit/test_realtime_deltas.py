@@ -0,0 +1,113 @@
+"""
+Pruebas del protocolo de deltas con números de secuencia del monitor en tiempo real
+"""
+
+import pytest
+
+from src.models.printer import Printer
+from src.services import realtime_monitor as monitor_module
+from src.services.realtime_monitor import RealtimeMonitor, compute_delta
+
+
+class FakeManager:
+    """Sustituto de WebSocketManager que registra los mensajes emitidos"""
+
+    def __init__(self):
+        self.frames = []
+
+    @property
+    def sent(self):
+        return [update for frame in self.frames for update in frame]
+
+    async def broadcast_fleet_update(self, updates):
+        self.frames.append(updates)
+
+    def get_connection_count(self):
+        return 1
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    fake = FakeManager()
+    monkeypatch.setattr(monitor_module, "websocket_manager", fake)
+    return fake
+
+
+def make_printer(**realtime):
+    data = {"extruder_temp": 20.0, "bed_temp": 20.0, "hostname": "pi"}
+    data.update(realtime)
+    return Printer(id="p1", name="P1", model="Voron", ip="127.0.0.1", status="ready", realtime_data=data)
+
+
+class TestComputeDelta:
+
+    def test_only_changed_nested_fields(self):
+        previous = {"status": "ready", "realtime_data": {"extruder_temp": 20.0, "hostname": "pi"}}
+        current = {"status": "ready", "realtime_data": {"extruder_temp": 25.0, "hostname": "pi"}}
+        assert compute_delta(previous, current) == ({"realtime_data": {"extruder_temp": 25.0}}, [])
+
+    def test_removed_fields_use_dotted_paths(self):
+        previous = {"realtime_data": {"a": 1, "b": 2}, "location": "x"}
+        current = {"realtime_data": {"a": 1}}
+        changes, removed = compute_delta(previous, current)
+        assert changes == {}
+        assert sorted(removed) == ["location", "realtime_data.b"]
+
+
+class TestSequencedUpdates:
+
+    @pytest.mark.asyncio
+    async def test_first_update_is_snapshot_then_deltas(self, manager):
+        monitor = RealtimeMonitor()
+        await monitor._process_printer_data(make_printer())
+        await monitor.flush_updates()
+        await monitor._process_printer_data(make_printer(extruder_temp=30.0))
+        await monitor.flush_updates()
+
+        snapshot, delta = manager.sent
+        assert (snapshot["type"], snapshot["seq"]) == ("printer_snapshot", 1)
+        assert snapshot["data"]["realtime_data"]["hostname"] == "pi"
+        assert (delta["type"], delta["seq"]) == ("printer_delta", 2)
+        assert delta["changes"] == {"realtime_data": {"extruder_temp": 30.0}}
+
+    @pytest.mark.asyncio
+    async def test_changes_within_a_tick_share_one_frame(self, manager):
+        monitor = RealtimeMonitor()
+        for i in range(5):
+            printer = make_printer()
+            printer.id = f"p{i}"
+            await monitor._process_printer_data(printer)
+        await monitor._process_printer_data(make_printer(extruder_temp=30.0))
+        await monitor.flush_updates()
+        await monitor.flush_updates()
+
+        assert len(manager.frames) == 1
+        updates = manager.frames[0]
+        assert len(updates) == 5
+        # El delta de p1 se fusiona con su snapshot pendiente
+        assert updates[1]["type"] == "printer_snapshot"
+        assert updates[1]["seq"] == 2
+        assert updates[1]["data"]["realtime_data"]["extruder_temp"] == 30.0
+
+    @pytest.mark.asyncio
+    async def test_insignificant_changes_are_not_sent(self, manager):
+        monitor = RealtimeMonitor()
+        await monitor._process_printer_data(make_printer())
+        await monitor._process_printer_data(make_printer(extruder_temp=20.1))
+        await monitor.flush_updates()
+        assert len(manager.sent) == 1
+        assert monitor.sequences["p1"] == 1
+
+    @pytest.mark.asyncio
+    async def test_snapshot_returns_last_sent_document(self, manager, monkeypatch):
+        monitor = RealtimeMonitor()
+        await monitor._process_printer_data(make_printer(extruder_temp=40.0))
+
+        async def list_printers():
+            # Estado más reciente aún no enviado a los clientes
+            return [make_printer(extruder_temp=41.0)]
+
+        monkeypatch.setattr(monitor_module.fleet_service, "list_printers", list_printers)
+        snapshot = await monitor.get_snapshot(["p1"])
+        assert snapshot[0]["seq"] == 1
+        assert snapshot[0]["realtime_data"]["extruder_temp"] == 40.0
@@ -0,0 +1,108 @@
+"""
+Pruebas de los índices por clave y por campo de los repositorios JSON
+"""
+
+import json
+import os
+
+import pytest
+
+from src.database import CustomersRepository, OrdersRepository, ProductionRepository
+from src.database.json_repository import JSONRepositoryError
+from src.database.write_behind import write_behind
+
+
+def _at(repo, tmp_path):
+    """Apunta un repositorio al directorio temporal de la prueba."""
+    repo._file_path = tmp_path / repo._file_path.name
+    repo._initialize_file()
+    return repo
+
+
+def _orders(tmp_path):
+    repo = _at(OrdersRepository(), tmp_path)
+    repo.save([
+        {"id": "o1", "customer_id": "c1", "status": "pending"},
+        {"order_id": "o2", "customer_id": "c2", "status": "pending"},
+        {"id": "o3", "customer_id": "c1", "status": "completed"},
+    ])
+    return repo
+
+
+class TestRecordIndexes:
+
+    def test_lookup_by_any_key_field(self, tmp_path):
+        repo = _orders(tmp_path)
+
+        assert repo.get_order_by_id("o2")["customer_id"] == "c2"
+        assert repo.get_order_by_id("o3")["status"] == "completed"
+        with pytest.raises(JSONRepositoryError):
+            repo.get_order_by_id("nope")
+
+    def test_filters_use_secondary_indexes(self, tmp_path):
+        repo = _orders(tmp_path)
+
+        assert [o["id"] for o in repo.list_orders_by(customer_id="c1")] == ["o1", "o3"]
+        assert [o["id"] for o in repo.list_orders_by(customer_id="c1", status="pending")] == ["o1"]
+        assert repo.list_orders_by(status="cancelled") == []
+        assert len(repo.list_orders_by()) == 3
+
+    def test_upsert_and_delete_keep_the_index_without_rebuilding(self, tmp_path):
+        repo = _orders(tmp_path)
+        repo.list_orders_by(status="pending")
+        builds = repo.get_cache_stats()["index_builds"]
+
+        repo.upsert_order({"id": "o1", "customer_id": "c1", "status": "completed"})
+        repo.upsert_order({"id": "o4", "customer_id": "c2", "status": "pending"})
+        repo.delete_order("o2")
+
+        assert [o["id"] for o in repo.list_orders_by(status="completed")] == ["o1", "o3"]
+        assert [o["id"] for o in repo.list_orders_by(customer_id="c2")] == ["o4"]
+        assert repo.get_order_by_id("o4")["status"] == "pending"
+        assert repo.get_cache_stats()["index_builds"] == builds
+        with pytest.raises(JSONRepositoryError):
+            repo.delete_order("o2")
+
+        write_behind.flush()
+        on_disk = json.loads(repo.file_path.read_text())["orders"]
+        assert [o.get("id") for o in on_disk] == ["o1", "o3", "o4"]
+
+    def test_external_edit_rebuilds_the_index(self, tmp_path):
+        repo = _orders(tmp_path)
+        assert repo.get_order_by_id("o1")
+
+        write_behind.flush()
+        payload = json.loads(repo.file_path.read_text())
+        payload["orders"] = [{"id": "o9", "customer_id": "c9", "status": "pending"}]
+        repo.file_path.write_text(json.dumps(payload))
+        stat = os.stat(repo.file_path)
+        os.utime(repo.file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+        assert repo.find("o1") is None
+        assert [o["id"] for o in repo.list_orders_by(customer_id="c9")] == ["o9"]
+
+    def test_customer_update_does_not_touch_the_cached_record_on_failure(self, tmp_path):
+        repo = _at(CustomersRepository(), tmp_path)
+        repo.create_customer({"id": "c1", "name": "Ana"})
+
+        assert repo.update_customer("c1", {"name": "Bea"})["name"] == "Bea"
+        with pytest.raises(TypeError):
+            repo.update_customer("c1", {"name": object()})
+
+        assert repo.get_customer_by_id("c1")["name"] == "Bea"
+        repo.delete_customer("c1")
+        with pytest.raises(JSONRepositoryError):
+            repo.get_customer_by_id("c1")
+
+    def test_batches_by_order_and_status(self, tmp_path):
+        repo = _at(ProductionRepository(), tmp_path)
+        repo.upsert_batch({"id": "b1", "order_id": "o1", "status": "queued"})
+        repo.upsert_batch({"id": "b2", "order_id": "o2", "status": "in_progress"})
+        repo.upsert_batch({"id": "b3", "order_id": "o1", "status": "completed"})
+
+        assert [b["id"] for b in repo.list_batches_by(order_id="o1")] == ["b1", "b3"]
+        repo.upsert_batch({"id": "b1", "order_id": "o1", "status": "in_progress"})
+        assert [b["id"] for b in repo.list_batches_by(status="in_progress")] == ["b1", "b2"]
+        assert repo.list_batches_by(status="queued") == []
+        with pytest.raises(ValueError):
+            repo.get_batch("b9")
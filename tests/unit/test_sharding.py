@@ -0,0 +1,135 @@
+"""
+Pruebas del reparto de la flota entre nodos KyberCore
+"""
+
+import asyncio
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+
+from src.models.printer import Printer
+from src.services.fleet_service import FleetService
+from src.services.sharding import LOCAL_VIEW_PATH, HashRing
+from src.simulator.moonraker import MoonrakerSimulator
+
+
+async def _until(condition, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("la condición no se cumplió a tiempo")
+        await asyncio.sleep(0.02)
+
+
+@pytest_asyncio.fixture
+async def nodes(tmp_path, monkeypatch):
+    """Dos nodos con un registro compartido y la misma flota simulada."""
+    monkeypatch.setenv("FLEET_CLUSTER_DIR", str(tmp_path / "cluster"))
+    monkeypatch.setenv("FLEET_CLUSTER_HEARTBEAT", "0.05")
+    monkeypatch.setenv("FLEET_CLUSTER_NODE_TTL", "0.5")
+    simulator = MoonrakerSimulator(printers=8, printing_ratio=0.0, update_interval=0.05, seed=4)
+    await simulator.start()
+    services = {}
+    for node_id in ("node-a", "node-b"):
+        monkeypatch.setenv("FLEET_CLUSTER_NODE_ID", node_id)
+        service = FleetService(printers_file=str(tmp_path / node_id / "printers.json"))
+        service.printers = {printer_id: Printer(**data) for printer_id, data in simulator.fleet_printers().items()}
+        services[node_id] = service
+    yield simulator, services
+    for service in services.values():
+        await service.cleanup()
+    await simulator.stop()
+
+
+async def _serve_local_view(service):
+    async def local_view(request):
+        return web.json_response(await service.sharding.local_view())
+
+    app = web.Application()
+    app.router.add_get(LOCAL_VIEW_PATH, local_view)
+    runner = web.AppRunner(app, shutdown_timeout=1.0)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    service.sharding.url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+    return runner
+
+
+class TestHashRing:
+
+    def test_balance_and_minimal_movement(self):
+        keys = [f"printer-{i}" for i in range(600)]
+        ring = HashRing(["a", "b", "c"])
+        owners = {key: ring.owner(key) for key in keys}
+
+        counts = {node: sum(1 for owner in owners.values() if owner == node) for node in ring.nodes}
+        assert min(counts.values()) > 120
+
+        shrunk = HashRing(["a", "c"])
+        moved = [key for key in keys if shrunk.owner(key) != owners[key]]
+        assert moved and all(owners[key] == "b" for key in moved)
+        assert HashRing().owner("printer-1") is None
+
+
+class TestFleetSharding:
+
+    @pytest.mark.asyncio
+    async def test_nodes_split_the_fleet_and_take_over_a_dead_node(self, nodes):
+        simulator, services = nodes
+        a, b = services["node-a"], services["node-b"]
+        await a.sharding.start()
+        await b.sharding.start()
+        await _until(lambda: len(a.sharding.ring.nodes) == 2)
+        await a.state_cache.start()
+        await b.state_cache.start()
+
+        owned_a, owned_b = set(a.owned_printer_ids()), set(b.owned_printer_ids())
+        assert owned_a and owned_b and not owned_a & owned_b
+        assert owned_a | owned_b == set(simulator.printers)
+        assert set(a.state_cache._tasks) == owned_a and set(b.state_cache._tasks) == owned_b
+
+        # Nodo B deja de latir sin despedirse: A asume sus impresoras al vencer el TTL
+        b.sharding._task.cancel()
+        await _until(lambda: a.sharding.ring.nodes == ["node-a"])
+        assert set(a.owned_printer_ids()) == set(simulator.printers)
+        await _until(lambda: all(a.state_cache.get_state(p) == "ready" for p in owned_b))
+        assert set(a.state_cache._tasks) == set(simulator.printers)
+        assert a.sharding.stats["rebalances"] == 3
+
+    @pytest.mark.asyncio
+    async def test_aggregation_gives_a_fleet_wide_view(self, nodes):
+        simulator, services = nodes
+        a, b = services["node-a"], services["node-b"]
+        runner = await _serve_local_view(b)
+        try:
+            await a.sharding.start()
+            await b.sharding.start()
+            await _until(lambda: len(a.sharding.ring.nodes) == 2)
+            await a.state_cache.start()
+            await b.state_cache.start()
+            owned_b = set(b.owned_printer_ids())
+            await _until(lambda: all(b.state_cache.get_state(p) == "ready" for p in owned_b))
+
+            view = await a.sharding.aggregate()
+            by_id = {entry["id"]: entry for entry in view["printers"]}
+            assert view["total"] == len(simulator.printers)
+            assert view["nodes"]["node-b"] == {"ok": True, "url": b.sharding.url, "printers": len(owned_b)}
+            assert all(by_id[p]["node"] == "node-b" and by_id[p]["status"] != "unknown" for p in owned_b)
+        finally:
+            await runner.cleanup()
+
+        view = await a.sharding.aggregate()
+        by_id = {entry["id"]: entry for entry in view["printers"]}
+        assert view["nodes"]["node-b"]["ok"] is False
+        assert all(by_id[p]["stale"] and by_id[p]["status"] == "unknown" for p in owned_b)
+
+    @pytest.mark.asyncio
+    async def test_single_node_owns_everything(self, tmp_path):
+        service = FleetService(printers_file=str(tmp_path / "printers.json"))
+        service.printers = {"p1": Printer(id="p1", name="Printer 1", model="Voron", ip="127.0.0.1:1")}
+
+        assert service.sharding.enabled is False
+        assert service.owned_printer_ids() == ["p1"]
+        view = await service.sharding.aggregate()
+        assert [entry["id"] for entry in view["printers"]] == ["p1"]
@@ -0,0 +1,177 @@
+"""
+Pruebas del estado de la flota compartido entre workers
+"""
+
+import asyncio
+from datetime import datetime
+
+import pytest
+import pytest_asyncio
+
+from src.models.printer import Printer
+from src.models.task_models import TaskProgress, TaskStatus, TaskStatusEnum
+from src.schemas.printer import PrinterCreate
+from src.services import rotation_worker as rotation_module
+from src.services.fleet_service import FleetService
+from src.services.shared_state import FileStateBackend, SharedFleetState
+
+
+async def _until(condition, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("la condición no se cumplió a tiempo")
+        await asyncio.sleep(0.02)
+
+
+@pytest.fixture
+def shared_dir(tmp_path, monkeypatch):
+    # El líder de las pruebas mantiene la caché sin contactar impresoras
+    monkeypatch.setenv("FLEET_MOONRAKER_SUBSCRIPTIONS", "false")
+    monkeypatch.setenv("FLEET_FILE_INDEX_ENABLED", "false")
+    printers_file = tmp_path / "fleet" / "printers.json"
+    printers_file.parent.mkdir()
+    seed = FleetService(printers_file=str(printers_file))
+    seed.printers = {
+        f"p{i}": Printer(id=f"p{i}", name=f"Printer {i}", model="Voron", ip=f"10.0.0.{i}") for i in (1, 2)
+    }
+    seed._save_printers()
+    return tmp_path
+
+
+@pytest_asyncio.fixture
+async def workers(shared_dir, monkeypatch):
+    """Crea 'workers' (FleetService + coordinador) sobre el mismo directorio compartido"""
+    created = []
+
+    async def start(name):
+        fleet = FleetService(printers_file=str(shared_dir / "fleet" / "printers.json"))
+
+        async def no_polling():
+            return None
+
+        monkeypatch.setattr(fleet.state_cache.scheduler, "start", no_polling)
+        coordinator = SharedFleetState(
+            FileStateBackend(str(shared_dir / "shared")),
+            worker_id=name,
+            publish_interval=0.02,
+            poll_interval=0.02,
+            snapshot_interval=0.05,
+            election_interval=0.05,
+        )
+        await coordinator.start(fleet)
+        created.append((coordinator, fleet))
+        return coordinator, fleet
+
+    yield start
+    for coordinator, fleet in created:
+        await coordinator.stop()
+        await fleet.cleanup()
+
+
+class TestFileStateBackend:
+
+    def test_only_one_worker_holds_leadership(self, tmp_path):
+        first = FileStateBackend(str(tmp_path))
+        second = FileStateBackend(str(tmp_path))
+
+        assert first.try_acquire_leadership("w1") is True
+        assert second.try_acquire_leadership("w2") is False
+        assert second.get_leader()["worker_id"] == "w1"
+
+        first.close()
+        assert second.try_acquire_leadership("w2") is True
+        second.close()
+
+    def test_events_cross_instances_and_segments(self, tmp_path):
+        writer = FileStateBackend(str(tmp_path), segment_bytes=200, keep_segments=10)
+        reader = FileStateBackend(str(tmp_path))
+
+        for i in range(10):
+            writer.publish("test", {"n": i}, origin="w1")
+        events, cursor = reader.read_events(None)
+        for i in range(10, 15):
+            writer.publish("test", {"n": i}, origin="w1")
+        more, cursor = reader.read_events(cursor)
+
+        assert len(writer._segments()) > 1
+        assert [e["data"]["n"] for e in events + more] == list(range(15))
+        assert reader.read_events(cursor)[0] == []
+
+    def test_kv_roundtrip(self, tmp_path):
+        backend = FileStateBackend(str(tmp_path))
+        backend.set("tasks", "t1", {"status": "processing"})
+
+        assert FileStateBackend(str(tmp_path)).get("tasks", "t1") == {"status": "processing"}
+        backend.delete("tasks", "t1")
+        assert backend.get("tasks", "t1") is None
+
+
+class TestSharedFleetState:
+
+    @pytest.mark.asyncio
+    async def test_follower_mirrors_snapshot_and_deltas(self, workers):
+        leader, leader_fleet = await workers("w1")
+        leader_fleet.state_cache.apply_status("p1", {
+            "webhooks": {"state": "ready"},
+            "extruder": {"temperature": 25.0, "target": 0.0},
+        })
+        await asyncio.sleep(0.15)  # llega al snapshot
+
+        follower, follower_fleet = await workers("w2")
+        assert (leader.role, follower.role) == ("leader", "follower")
+        assert follower_fleet.state_cache.get_status("p1")["extruder"]["temperature"] == 25.0
+
+        leader_fleet.state_cache.apply_status("p1", {"extruder": {"temperature": 210.0, "target": 210.0}})
+        leader_fleet.state_cache.mark_error("p2", "timeout")
+        await _until(lambda: follower_fleet.state_cache.get_state("p2") == "timeout")
+
+        printers = {p.id: p for p in await follower_fleet.list_printers()}
+        assert printers["p1"].realtime_data["extruder_temp"] == 210.0
+        assert printers["p2"].status == "timeout"
+        assert follower_fleet.state_cache.mirror is True
+
+    @pytest.mark.asyncio
+    async def test_follower_takes_over_when_leader_stops(self, workers):
+        leader, _ = await workers("w1")
+        follower, follower_fleet = await workers("w2")
+
+        await leader.stop()
+        await _until(lambda: follower.role == "leader")
+
+        assert follower.stats["promotions"] == 1
+        assert follower_fleet.state_cache.running and not follower_fleet.state_cache.mirror
+
+    @pytest.mark.asyncio
+    async def test_printer_changes_reach_other_workers(self, workers):
+        _, leader_fleet = await workers("w1")
+        _, follower_fleet = await workers("w2")
+
+        added = follower_fleet.add_printer(PrinterCreate(name="Nueva", model="Prusa", ip="10.0.0.9"))
+        await _until(lambda: added.id in leader_fleet.printers)
+
+        follower_fleet.delete_printer("p1")
+        await _until(lambda: "p1" not in leader_fleet.printers)
+
+    @pytest.mark.asyncio
+    async def test_task_status_is_visible_from_any_worker(self, workers, monkeypatch):
+        leader, _ = await workers("w1")
+        follower, _ = await workers("w2")
+        task = TaskStatus(
+            task_id="t1",
+            session_id="s1",
+            status=TaskStatusEnum.PROCESSING,
+            progress=TaskProgress(total_files=2, completed=1, failed=0, in_progress=1, percentage=50.0),
+            created_at=datetime.now(),
+        )
+        worker = rotation_module.RotationWorker()
+        worker.tasks["t1"] = task
+        monkeypatch.setattr(rotation_module, "shared_state", leader)
+        worker._share_task("t1")
+
+        other = rotation_module.RotationWorker()
+        monkeypatch.setattr(rotation_module, "shared_state", follower)
+        seen = other.get_task_status("t1")
+
+        assert seen.to_dict()["progress"] == task.to_dict()["progress"]
+        assert seen.status == TaskStatusEnum.PROCESSING
@@ -0,0 +1,140 @@
+"""
+Pruebas del backend SQLite de los repositorios y de la migración desde JSON
+"""
+
+import importlib.util
+import json
+import sqlite3
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+from src.database import (
+    JobHistoryRepository,
+    JSONRepositoryError,
+    OrdersRepository,
+    PrintQueueRepository,
+    ProductionRepository,
+)
+
+
+def _load_migration():
+    path = Path(__file__).resolve().parents[2] / "scripts" / "migrate_json_to_sqlite.py"
+    spec = importlib.util.spec_from_file_location("migrate_json_to_sqlite", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def storage(request, tmp_path):
+    """Opciones de repositorio para cada backend sobre un directorio temporal."""
+    return {"base_path": tmp_path, "storage": request.param, "database": tmp_path / "kybercore.db"}
+
+
+class TestStorageBackends:
+
+    def test_same_behaviour_on_both_backends(self, storage):
+        repo = OrdersRepository(**storage)
+        repo.save([
+            {"id": "o1", "customer_id": "c1", "status": "pending", "lines": [{"qty": 2}]},
+            {"order_id": "o2", "customer_id": "c2", "status": "pending"},
+        ])
+        repo.upsert_order({"id": "o1", "customer_id": "c1", "status": "completed", "lines": [{"qty": 3}]})
+        repo.upsert_order({"id": "o3", "customer_id": "c1", "status": "pending"})
+
+        assert repo.get_order_by_id("o2")["customer_id"] == "c2"
+        assert repo.get_order_by_id("o1")["lines"] == [{"qty": 3}]
+        assert [o["id"] for o in repo.list_orders_by(customer_id="c1")] == ["o1", "o3"]
+        assert [o["id"] for o in repo.list_orders_by(customer_id="c1", status="pending")] == ["o3"]
+
+        repo.delete_order("o1")
+        with pytest.raises(JSONRepositoryError):
+            repo.delete_order("o1")
+        assert repo.count() == 2
+        assert "last_updated" in repo.load()["metadata"]
+
+    def test_date_ranges(self, storage):
+        repo = ProductionRepository(**storage)
+        now = datetime.utcnow()
+        repo.save([
+            {"id": "old", "created_at": (now - timedelta(days=40)).isoformat()},
+            {"id": "recent", "created_at": (now - timedelta(days=2)).isoformat() + "Z"},
+            {"id": "undated", "created_at": None},
+        ])
+
+        assert [b["id"] for b in repo.list_batches_created_between(start=now - timedelta(days=30))] == ["recent"]
+        assert [b["id"] for b in repo.list_batches_created_between(end=now - timedelta(days=30))] == ["old"]
+
+    def test_queue_positions_and_history(self, storage):
+        queue = PrintQueueRepository(**storage)
+        assert [queue.enqueue({"job_id": f"j{i}", "status": "queued"}) for i in range(3)] == [1, 2, 3]
+        assert queue.get_metadata()["next_queue_position"] == 4
+
+        history = JobHistoryRepository(**storage)
+        history.record_job({"job_id": "j1", "status": "completed"})
+        history.record_job({"job_id": "j2", "status": "failed"})
+        stats = history.get_metadata()
+        assert (stats["trabajos_exitosos"], stats["trabajos_fallidos"], stats["tasa_exito"]) == (1, 1, 50.0)
+
+        # Registrar de nuevo un trabajo sustituye su entrada y su contador
+        history.record_job({"job_id": "j2", "status": "completed"})
+        history.record_job({"job_id": "j2", "status": "completed"})
+        stats = history.get_metadata()
+        assert (stats["trabajos_exitosos"], stats["trabajos_fallidos"], stats["tasa_exito"]) == (2, 0, 100.0)
+        assert history.count() == 2 and "last_updated" not in stats
+
+
+class TestSQLiteBackend:
+
+    def test_row_level_writes_leave_no_json(self, tmp_path):
+        repo = OrdersRepository(base_path=tmp_path, storage="sqlite")
+        repo.upsert_order({"id": "o1", "status": "pending"})
+
+        assert not (tmp_path / "orders.json").exists()
+        conn = sqlite3.connect(tmp_path / "kybercore.db")
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute('SELECT "status" FROM orders WHERE "id" = ?', ("o1",)).fetchone() == ("pending",)
+        indexes = {row[1] for row in conn.execute("PRAGMA index_list(orders)")}
+        assert {"ix_orders_status", "ix_orders_customer_id", "ix_orders_created_at"} <= indexes
+
+    def test_failed_write_rolls_back(self, tmp_path):
+        repo = OrdersRepository(base_path=tmp_path, storage="sqlite")
+        repo.upsert_order({"id": "o1", "status": "pending"})
+
+        with pytest.raises(TypeError):
+            repo.save([{"id": "o2"}, {"id": "o3", "when": object()}])
+        assert [o["id"] for o in repo.list_orders()] == ["o1"]
+
+
+class TestMigration:
+
+    def test_imports_existing_files_once(self, tmp_path):
+        source = tmp_path / "base_datos"
+        source.mkdir()
+        (source / "orders.json").write_text(json.dumps({
+            "metadata": {"version": "1.0"},
+            "orders": [{"id": "o1", "customer_id": "c1", "status": "pending"}],
+        }))
+        (source / "print_queue.json").write_text(json.dumps({
+            "metadata": {"next_queue_position": 8},
+            "queue": [{"job_id": "j7", "status": "queued"}],
+        }))
+        (source / "historial_trabajos.json").write_text(json.dumps({
+            "historial_trabajos": {"estadisticas": {"trabajos_exitosos": 3}, "trabajos": [{"id": "job_001"}]},
+            "trabajos": [{"job_id": "j2", "status": "started"}],
+        }))
+        database = tmp_path / "kyber.db"
+        migration = _load_migration()
+
+        imported = migration.migrate(source, database)
+        assert imported == {"orders.json": 1, "print_queue.json": 1, "historial_trabajos.json": 2}
+        assert migration.migrate(source, database) == {}
+
+        options = {"base_path": source, "storage": "sqlite", "database": database}
+        assert OrdersRepository(**options).list_orders_by(customer_id="c1")[0]["id"] == "o1"
+        assert PrintQueueRepository(**options).enqueue({"job_id": "j8"}) == 8
+        history = JobHistoryRepository(**options)
+        assert [job.get("id") or job.get("job_id") for job in history.list_jobs()] == ["job_001", "j2"]
+        assert history.get_metadata()["trabajos_exitosos"] == 3
@@ -0,0 +1,139 @@
+"""
+Pruebas de las esperas de estado dirigidas por eventos (``wait_for``)
+"""
+
+import asyncio
+
+import pytest
+import pytest_asyncio
+
+from src.controllers import print_flow_controller
+from src.models.printer import Printer
+from src.services.fleet_service import FleetService
+from src.services.printer_state_cache import PrinterStateCache, klippy_state_in, ready_for_job
+from src.simulator.moonraker import MoonrakerSimulator
+
+
+@pytest.fixture
+def fleet(tmp_path):
+    service = FleetService(printers_file=str(tmp_path / "printers.json"))
+    service.printers = {
+        "p1": Printer(id="p1", name="Printer 1", model="Voron", ip="127.0.0.1:1")
+    }
+    return service
+
+
+@pytest_asyncio.fixture
+async def simulated_fleet(tmp_path):
+    simulator = MoonrakerSimulator(printers=1, printing_ratio=0.0, update_interval=0.05, restart_delay=0.3, seed=2)
+    await simulator.start()
+    service = FleetService(printers_file=str(tmp_path / "printers.json"))
+    service.printers = {printer_id: Printer(**data) for printer_id, data in simulator.fleet_printers().items()}
+    yield simulator, service
+    await service.cleanup()
+    await simulator.stop()
+
+
+class TestStateWaiters:
+
+    @pytest.mark.asyncio
+    async def test_many_waiters_resolve_from_one_update(self, fleet):
+        cache = PrinterStateCache(fleet)
+        cache.apply_status("p1", {"webhooks": {"state": "startup"}})
+
+        waits = [asyncio.create_task(cache.wait_for("p1", klippy_state_in("ready"), timeout=1)) for _ in range(50)]
+        await asyncio.sleep(0)
+        cache.apply_status("p1", {"webhooks": {"state": "ready"}})
+
+        assert await asyncio.gather(*waits) == [True] * 50
+        assert cache._waiters == {}
+
+    @pytest.mark.asyncio
+    async def test_timeout_and_satisfied_conditions(self, fleet):
+        cache = PrinterStateCache(fleet)
+        cache.apply_status("p1", {"webhooks": {"state": "ready"}, "print_stats": {"state": "printing"}})
+
+        assert await cache.wait_for("p1", klippy_state_in("ready"), timeout=0.01) is True
+        assert await cache.wait_for("p1", ready_for_job, timeout=0.05) is False
+
+        cache.mark_error("p1", "timeout")
+        assert await cache.wait_for("p1", klippy_state_in("ready"), timeout=0.01) is False
+
+    @pytest.mark.asyncio
+    async def test_waiters_speed_up_polling(self, fleet):
+        cache = PrinterStateCache(fleet)
+        cache.apply_status("p1", {"webhooks": {"state": "startup"}})
+        wait = asyncio.create_task(cache.wait_for("p1", klippy_state_in("ready"), timeout=1))
+        await asyncio.sleep(0)
+
+        assert cache.get_activity("p1") == "active"
+        cache.apply_status("p1", {"webhooks": {"state": "ready"}})
+        assert await wait is True
+        assert cache.get_activity("p1") == "idle"
+
+
+class TestEventDrivenFlows:
+
+    @pytest.mark.asyncio
+    async def test_recovery_reacts_to_klippy_ready(self, simulated_fleet):
+        simulator, service = simulated_fleet
+        printer_id = "sim0000"
+        simulator.printers[printer_id].shutdown()
+        await service.state_cache.start()
+        assert await service.wait_for(printer_id, klippy_state_in("shutdown"), timeout=2)
+
+        started = asyncio.get_running_loop().time()
+        result = await service.recover_printer(printer_id, "restart_firmware")
+        elapsed = asyncio.get_running_loop().time() - started
+
+        assert result["success"] is True
+        assert service.state_cache.get_state(printer_id) == "ready"
+        # restart_delay=0.3: la espera termina con la notificación, no con un sondeo de 2 s
+        assert elapsed < 1.5
+
+    @pytest.mark.asyncio
+    async def test_restart_wait_ignores_telemetry_until_klipper_restarts(self, simulated_fleet):
+        simulator, service = simulated_fleet
+        printer_id = "sim0000"
+        await service.state_cache.start()
+        assert await service.wait_for(printer_id, klippy_state_in("ready"), timeout=2)
+
+        # Las temperaturas siguen llegando con ``ready``: sin reinicio la espera no se resuelve
+        updated_at = service.state_cache._meta[printer_id]["updated_at"]
+        wait = asyncio.create_task(service._wait_printer_ready(printer_id, timeout=5))
+        await asyncio.sleep(0.3)
+        assert service.state_cache._meta[printer_id]["updated_at"] > updated_at
+        assert not wait.done()
+        wait.cancel()
+
+        started = asyncio.get_running_loop().time()
+        result = await service.recover_printer(printer_id, "restart_firmware")
+        elapsed = asyncio.get_running_loop().time() - started
+
+        assert result["success"] is True
+        # restart_delay=0.3: se espera al ``ready`` posterior al reinicio, no al snapshot previo
+        assert 0.3 <= elapsed < 1.5
+        assert service.state_cache.get_state(printer_id) == "ready"
+
+    @pytest.mark.asyncio
+    async def test_wait_without_cache_polls_the_printer(self, simulated_fleet):
+        simulator, service = simulated_fleet
+        service.wait_poll_interval = 0.05
+        simulator.printers["sim0000"].restart(0.2)
+
+        assert await service.wait_for("sim0000", klippy_state_in("ready"), timeout=2) is True
+        with pytest.raises(ValueError):
+            await service.wait_for("missing", klippy_state_in("ready"))
+
+    @pytest.mark.asyncio
+    async def test_dispatch_check_uses_snapshot(self, simulated_fleet, monkeypatch):
+        simulator, service = simulated_fleet
+        monkeypatch.setattr(print_flow_controller, "fleet_service", service)
+        await service.state_cache.start()
+        assert await service.wait_for("sim0000", klippy_state_in("ready"), timeout=2)
+        requests = simulator.stats["http_requests"]
+
+        result = await print_flow_controller.check_printer_status("http://invalid.invalid", "sim0000")
+
+        assert result["success"] is True and result["printer_state"] == "ready"
+        assert simulator.stats["http_requests"] == requests
@@ -0,0 +1,117 @@
+"""
+Pruebas del almacén de telemetría (buffers circulares y reducción multirresolución)
+"""
+
+import json
+import time
+
+import pytest
+
+from src.services.telemetry_store import TIERS, TelemetryStore
+
+
+def sample(temp, progress=0.0):
+    return {"extruder_temp": temp, "extruder_target": 210.0, "bed_temp": "N/A", "print_progress": progress}
+
+
+class TestTelemetryStore:
+
+    def test_raw_query_returns_recorded_samples(self):
+        store = TelemetryStore()
+        for i in range(5):
+            assert store.record("p1", sample(200.0 + i), timestamp=1000.0 + i)
+
+        result = store.query("p1", metrics=["extruder_temp", "bed_temp"], start=1000, end=1010)
+        assert result["resolution"] == 0
+        assert result["timestamps"] == [1000.0, 1001.0, 1002.0, 1003.0, 1004.0]
+        assert result["metrics"]["extruder_temp"] == [200.0, 201.0, 202.0, 203.0, 204.0]
+        # Valores no numéricos se guardan como huecos
+        assert result["metrics"]["bed_temp"] == [None] * 5
+
+    def test_samples_closer_than_min_interval_are_dropped(self):
+        store = TelemetryStore(min_sample_interval=1.0)
+        assert store.record("p1", sample(200.0), timestamp=1000.0)
+        assert not store.record("p1", sample(201.0), timestamp=1000.5)
+
+    def test_ring_buffer_memory_is_bounded(self):
+        store = TelemetryStore(min_sample_interval=0)
+        raw_capacity = TIERS[0][1]
+        for i in range(raw_capacity * 3):
+            store.record("p1", sample(float(i)), timestamp=float(i))
+        memory = store.get_stats()["memory_bytes"]
+        store.record("p1", sample(0.0), timestamp=float(raw_capacity * 3))
+
+        result = store.query("p1", metrics=["extruder_temp"], start=0, end=raw_capacity * 3, step=1)
+        assert len(result["timestamps"]) == raw_capacity
+        assert store.get_stats()["memory_bytes"] == memory
+
+    def test_old_ranges_use_coarser_tiers(self):
+        store = TelemetryStore(min_sample_interval=0)
+        # Dos horas a una muestra cada 2 s: la resolución cruda ya no cubre el inicio
+        for t in range(0, 7200, 2):
+            store.record("p1", sample(float(t % 100)), timestamp=float(t))
+
+        result = store.query("p1", metrics=["extruder_temp"], start=0, end=7200)
+        assert result["resolution"] == 10
+        assert result["timestamps"][0] == 0.0
+        # Media de las muestras 0, 2, 4, 6, 8
+        assert result["metrics"]["extruder_temp"][0] == 4.0
+
+    def test_step_rebuckets_to_requested_resolution(self):
+        store = TelemetryStore(min_sample_interval=0)
+        for t in range(0, 120):
+            store.record("p1", sample(float(t)), timestamp=float(t))
+
+        result = store.query("p1", metrics=["extruder_temp"], start=0, end=120, step=30)
+        assert result["resolution"] == 30
+        assert result["timestamps"] == [0.0, 30.0, 60.0, 90.0]
+        assert result["metrics"]["extruder_temp"][0] == 14.5
+
+    def test_unknown_metric_raises(self):
+        store = TelemetryStore()
+        with pytest.raises(ValueError):
+            store.query("p1", metrics=["humidity"])
+
+    @pytest.mark.asyncio
+    async def test_spill_survives_restart(self, tmp_path):
+        path = str(tmp_path / "telemetry.jsonl")
+        store = TelemetryStore(spill_path=path, min_sample_interval=0)
+        await store.start()
+        now = time.time() - 600
+        for t in range(0, 120):
+            store.record("p1", sample(float(t)), timestamp=now + t)
+        await store.stop()
+
+        with open(path) as f:
+            points = [json.loads(line) for line in f]
+        assert points and points[0]["printer_id"] == "p1"
+
+        restored = TelemetryStore(spill_path=path)
+        restored.load()
+        result = restored.query("p1", metrics=["extruder_temp"], start=now - 60, end=now + 120, step=10)
+        assert result["resolution"] == 10
+        assert len(result["timestamps"]) >= 10
+
+    @pytest.mark.asyncio
+    async def test_replay_keeps_rings_in_time_order_with_live_samples(self, tmp_path):
+        path = tmp_path / "telemetry.jsonl"
+        now = time.time()
+        with open(path, "w") as f:
+            for t in range(-3000, -100, 10):
+                f.write(json.dumps({"printer_id": "p1", "t": now + t, "v": [200.0, 210.0, None, None, None, None]}) + "\n")
+
+        store = TelemetryStore(spill_path=str(path), min_sample_interval=0)
+        for t in range(-60, 0):
+            store.record("p1", sample(205.0), timestamp=now + t)
+        await store.replay(compact=False)
+        for t in range(0, 60):
+            store.record("p1", sample(206.0), timestamp=now + t)
+
+        ten_seconds = store._series["p1"].tiers[1].ring
+        times, _ = ten_seconds.ordered()
+        assert list(times) == sorted(times)
+        assert ten_seconds.oldest() == pytest.approx(now - 3000, abs=10)
+
+        result = store.query("p1", metrics=["extruder_temp"], start=now - 3000, end=now + 60, step=10)
+        assert result["timestamps"] == sorted(result["timestamps"])
+        assert result["metrics"]["extruder_temp"][-2] == 206.0
@@ -0,0 +1,115 @@
+"""
+Pruebas de la caché de thumbnails y de la lectura parcial de G-code
+"""
+
+import asyncio
+import base64
+
+import aiohttp
+import pytest
+import pytest_asyncio
+from aiohttp import web
+
+from src.services.circuit_breaker import CircuitBreaker
+from src.services.moonraker_client import MoonrakerClient
+from src.services.thumbnail_cache import ThumbnailCache, thumbnail_cache_key
+
+PNG = base64.b64encode(b"\x89PNG fake image").decode()
+HEADER = (
+    "; generated by PrusaSlicer\n"
+    f"; thumbnail begin 16x16 {len(PNG)}\n; {PNG}\n; thumbnail end\n"
+    "; layer_height = 0.2\n"
+    "G28\n"
+)
+
+
+@pytest_asyncio.fixture
+async def gcode_server():
+    """Sirve un G-code de varios MB en trozos e informa de cuántos bytes llegó a enviar"""
+    sent = {"bytes": 0, "range": None}
+
+    async def gcode(request):
+        sent["range"] = request.headers.get("Range")
+        response = web.StreamResponse()
+        await response.prepare(request)
+        chunk = b"G1 X10 Y10 E0.1\n" * 4096
+        for data in [HEADER.encode()] + [chunk] * 80:
+            await response.write(data)
+            sent["bytes"] += len(data)
+            await asyncio.sleep(0)
+        return response
+
+    app = web.Application()
+    app.router.add_get("/server/files/gcodes/{name}", gcode)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    yield site._server.sockets[0].getsockname()[1], sent
+    await runner.cleanup()
+
+
+class TestHeaderRead:
+
+    @pytest.mark.asyncio
+    async def test_thumbnails_come_from_header_only(self, gcode_server):
+        port, sent = gcode_server
+        async with aiohttp.ClientSession() as session:
+            client = MoonrakerClient("127.0.0.1", port, session, breaker=CircuitBreaker("t"))
+            header = await client.read_gcode_header("cube.gcode")
+            thumbnails = client._extract_thumbnails_from_gcode(header.decode())
+
+        assert sent["range"] == "bytes=0-524287"
+        assert len(header) < 128 * 1024
+        assert thumbnails[0]["data"] == PNG
+        assert (thumbnails[0]["width"], thumbnails[0]["height"]) == (16, 16)
+
+
+class TestThumbnailCache:
+
+    @pytest.mark.asyncio
+    async def test_hits_skip_the_producer(self, tmp_path):
+        cache = ThumbnailCache(str(tmp_path))
+        calls = []
+
+        async def producer():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return [{"width": 16, "height": 16, "data": PNG}]
+
+        key = thumbnail_cache_key("p1", "cube.gcode", 100.0, 1000)
+        first, second = await asyncio.gather(cache.get_or_create(key, producer), cache.get_or_create(key, producer))
+        third = await ThumbnailCache(str(tmp_path)).get_or_create(key, producer)
+
+        assert first == second == third
+        assert len(calls) == 1
+
+    @pytest.mark.asyncio
+    async def test_incomplete_results_are_not_cached(self, tmp_path):
+        cache = ThumbnailCache(str(tmp_path))
+
+        async def producer():
+            return [{"width": 16, "height": 16}]
+
+        await cache.get_or_create("k", producer)
+        assert cache.get_stats()["entries"] == 0
+
+    @pytest.mark.asyncio
+    async def test_lru_eviction_keeps_size_bounded(self, tmp_path):
+        cache = ThumbnailCache(str(tmp_path), max_bytes=250)
+
+        def producer_for(i):
+            async def producer():
+                return [{"data": "x" * 80, "n": i}]
+            return producer
+
+        await cache.get_or_create("a", producer_for(0))
+        await cache.get_or_create("b", producer_for(1))
+        await cache.get_or_create("a", producer_for(0))  # "a" pasa a ser la más reciente
+        await cache.get_or_create("c", producer_for(2))
+
+        stats = cache.get_stats()
+        assert stats["bytes"] <= 250
+        assert stats["evictions"] == 1
+        assert not (tmp_path / "b.json").exists()
+        assert (tmp_path / "a.json").exists()
@@ -0,0 +1,186 @@
+"""
+Pruebas de las colas de envío por cliente del WebSocketManager
+"""
+
+import asyncio
+import json
+
+import pytest
+
+from src.services import websocket_service
+from src.services.websocket_service import (
+    SUBPROTOCOL_JSON,
+    SUBPROTOCOL_MSGPACK,
+    WebSocketManager,
+    merge_printer_messages,
+    negotiate_encoding,
+)
+
+
+class FakeWebSocket:
+    """WebSocket mínimo que registra lo enviado y puede bloquearse para simular un cliente lento"""
+
+    def __init__(self, subprotocols=()):
+        self.scope = {"subprotocols": list(subprotocols)}
+        self.subprotocol = None
+        self.sent = []
+        self.closed = None
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def accept(self, subprotocol=None):
+        self.subprotocol = subprotocol
+
+    async def send_text(self, text):
+        await self.gate.wait()
+        self.sent.append(json.loads(text))
+
+    async def send_bytes(self, data):
+        import msgpack
+        await self.gate.wait()
+        self.sent.append(msgpack.unpackb(data))
+
+    async def close(self, code=1000, reason=""):
+        self.closed = code
+
+
+async def drain():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class TestMergePrinterMessages:
+
+    def test_delta_after_delta_keeps_first_sequence(self):
+        older = {"type": "printer_delta", "seq": 2, "changes": {"realtime_data": {"a": 1, "b": 1}}, "removed": ["x"]}
+        newer = {"type": "printer_delta", "seq": 3, "changes": {"realtime_data": {"b": 2}, "x": 5}}
+        merged = merge_printer_messages(older, newer)
+        assert merged["from_seq"] == 2 and merged["seq"] == 3
+        assert merged["changes"] == {"realtime_data": {"a": 1, "b": 2}, "x": 5}
+        assert "removed" not in merged
+
+    def test_delta_is_applied_to_pending_snapshot(self):
+        older = {"type": "printer_snapshot", "seq": 1, "data": {"status": "idle", "location": "A"}}
+        newer = {"type": "printer_delta", "seq": 2, "changes": {"status": "printing"}, "removed": ["location"]}
+        merged = merge_printer_messages(older, newer)
+        assert merged["type"] == "printer_snapshot"
+        assert merged["seq"] == 2
+        assert merged["data"] == {"status": "printing"}
+
+
+class TestEncodingNegotiation:
+
+    def test_json_is_the_fallback(self, monkeypatch):
+        monkeypatch.setattr(websocket_service, "MSGPACK_AVAILABLE", False)
+        assert negotiate_encoding([SUBPROTOCOL_MSGPACK, SUBPROTOCOL_JSON]) == (SUBPROTOCOL_JSON, "json")
+        assert negotiate_encoding([]) == (None, "json")
+
+    @pytest.mark.asyncio
+    async def test_msgpack_clients_receive_binary_frames(self):
+        pytest.importorskip("msgpack")
+        manager = WebSocketManager()
+        binary, legacy = FakeWebSocket([SUBPROTOCOL_MSGPACK, SUBPROTOCOL_JSON]), FakeWebSocket()
+        for ws in (binary, legacy):
+            await manager.connect(ws)
+            await manager.subscribe_to_printer(ws, "p1")
+
+        await manager.broadcast_printer_snapshot("p1", 1, {"status": "ready"})
+        await drain()
+
+        assert binary.subprotocol == SUBPROTOCOL_MSGPACK and legacy.subprotocol is None
+        assert binary.sent[-1] == legacy.sent[-1]
+        await manager.shutdown()
+
+
+class TestClientSendQueues:
+
+    @pytest.mark.asyncio
+    async def test_broadcast_is_encoded_once_for_all_subscribers(self):
+        manager = WebSocketManager()
+        sockets = [FakeWebSocket() for _ in range(3)]
+        for ws in sockets:
+            await manager.connect(ws)
+            await manager.subscribe_to_printer(ws, "p1")
+
+        await manager.broadcast_printer_snapshot("p1", 1, {"status": "ready"})
+        await drain()
+
+        assert all(ws.sent[-1]["type"] == "printer_snapshot" for ws in sockets)
+        # Bienvenida (una por cliente) + un único broadcast
+        assert manager.messages_encoded == 4
+        await manager.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_slow_client_gets_coalesced_deltas(self):
+        manager = WebSocketManager()
+        manager.max_queue_size = 2
+        fast, slow = FakeWebSocket(), FakeWebSocket()
+        for ws in (fast, slow):
+            await manager.connect(ws)
+            await manager.subscribe_to_printer(ws, "p1")
+        await drain()
+        slow.gate.clear()
+
+        await manager.broadcast_printer_snapshot("p1", 1, {"temp": 20})
+        await drain()  # el cliente lento queda bloqueado enviando el snapshot
+        for seq in range(2, 6):
+            await manager.broadcast_printer_delta("p1", seq, {"temp": 20 + seq})
+            await drain()
+
+        assert [m["seq"] for m in fast.sent[1:]] == [1, 2, 3, 4, 5]
+        metrics = manager.get_queue_metrics()["clients"]
+        slow_id = manager.connection_metadata[slow]["client_id"]
+        assert metrics[slow_id]["queue_depth"] == 2
+        assert metrics[slow_id]["coalesced"] == 2
+
+        slow.gate.set()
+        await asyncio.sleep(0.01)
+        snapshot, first, merged = slow.sent[1:]
+        assert (snapshot["seq"], first["seq"]) == (1, 2)
+        assert (merged["from_seq"], merged["seq"], merged["changes"]) == (3, 5, {"temp": 25})
+        await manager.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_client_lagging_past_threshold_is_disconnected(self):
+        manager = WebSocketManager()
+        manager.max_queue_size = 1
+        manager.max_lag_seconds = 0
+        manager.overflow_policy = "drop_oldest"
+        slow = FakeWebSocket()
+        await manager.connect(slow)
+        await drain()
+        slow.gate.clear()
+
+        await manager.broadcast_to_all({"type": "a"})
+        await drain()
+        await manager.broadcast_to_all({"type": "b"})
+        await manager.broadcast_to_all({"type": "c"})
+        await asyncio.sleep(0.01)
+        await manager.broadcast_to_all({"type": "d"})
+        await drain()
+
+        assert manager.get_connection_count() == 0
+        assert manager.lagging_disconnects == 1
+        assert slow.closed == 1013
+        assert manager.get_queue_metrics()["total_dropped"] == 2
+        await manager.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_fleet_update_is_filtered_per_subscription(self):
+        manager = WebSocketManager()
+        everything, only_p2 = FakeWebSocket(), FakeWebSocket()
+        for ws in (everything, only_p2):
+            await manager.connect(ws)
+        for printer_id in ("p1", "p2"):
+            await manager.subscribe_to_printer(everything, printer_id)
+        await manager.subscribe_to_printer(only_p2, "p2")
+
+        await manager.broadcast_fleet_update([
+            {"type": "printer_delta", "printer_id": "p1", "seq": 2, "changes": {"a": 1}},
+            {"type": "printer_delta", "printer_id": "p2", "seq": 7, "changes": {"b": 1}},
+        ])
+        await drain()
+
+        assert [u["printer_id"] for u in everything.sent[-1]["updates"]] == ["p1", "p2"]
+        assert [u["printer_id"] for u in only_p2.sent[-1]["updates"]] == ["p2"]
+        await manager.shutdown()
@@ -0,0 +1,88 @@
+"""
+Pruebas del almacén de sesiones del wizard (un archivo por sesión)
+"""
+
+import json
+import os
+import time
+
+import pytest
+
+from src.database.wizard_session_store import WizardSessionStore
+from src.database.write_behind import write_behind
+
+
+@pytest.fixture
+def store(tmp_path):
+    return WizardSessionStore(tmp_path / "sessions", legacy_path=tmp_path / "wizard_sessions.json", cache_size=4)
+
+
+def _write_legacy(store, sessions):
+    store.legacy_path.write_text(json.dumps({"sessions": sessions, "metadata": {}}))
+
+
+class TestWizardSessionStore:
+
+    def test_one_file_per_session_and_copies(self, store):
+        for i in range(20):
+            store.save(f"s{i}", {"step": i, "files": [f"{i}.stl"]})
+        write_behind.flush()
+
+        assert len(os.listdir(store.directory)) == 20
+        assert json.loads((store.directory / "s7.json").read_text())["step"] == 7
+
+        session = store.load("s19")
+        session["files"].append("otro.stl")
+        assert store.load("s19")["files"] == ["19.stl"]
+        assert store.load("nope") == {}
+
+    def test_lru_keeps_hot_sessions_and_sees_other_workers(self, store):
+        for i in range(6):
+            store.save(f"s{i}", {"step": i})
+        write_behind.flush()
+        hits = store.stats["hits"]
+
+        store.load("s5")
+        assert store.stats["hits"] == hits + 1
+        assert "s0" not in store._cache and len(store._cache) == 4
+
+        # Otro worker reescribe la sesión: el stat invalida la copia en memoria
+        path = store.directory / "s5.json"
+        path.write_text(json.dumps({"step": 50}))
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+        assert store.load("s5") == {"step": 50}
+
+    def test_legacy_sessions_are_read_until_saved_again(self, store):
+        _write_legacy(store, {"old": {"step": "material_selection"}})
+
+        assert store.load("old") == {"step": "material_selection"}
+        assert store.load("old") == {"step": "material_selection"}
+        assert store.stats["legacy_reads"] == 1
+
+        store.save("old", {"step": "validation"})
+        write_behind.flush()
+        assert store.load("old")["step"] == "validation"
+        assert (store.directory / "old.json").exists()
+
+    def test_expiry_removes_abandoned_sessions_and_compacts_legacy(self, store):
+        now = time.time()
+        store.save("fresh", {"step": 1})
+        store.save("abandoned", {"step": 1})
+        store.save("migrated", {"step": 2})
+        write_behind.flush()
+        old = now - store.ttl - 60
+        os.utime(store.directory / "abandoned.json", (old, old))
+        _write_legacy(store, {
+            "migrated": {"updated_at": "2025-01-01T00:00:00"},
+            "stale": {"updated_at": "2025-01-01T00:00:00"},
+            "recent": {"updated_at": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        })
+
+        assert store.expire(now) == 3
+        assert sorted(os.listdir(store.directory)) == ["fresh.json", "migrated.json"]
+        assert list(json.loads(store.legacy_path.read_text())["sessions"]) == ["recent"]
+        assert store.load("abandoned") == {} and store.load("stale") == {}
+
+        assert store.expire(now + store.ttl * 2) == 3
+        assert not store.legacy_path.exists() and os.listdir(store.directory) == []
@@ -0,0 +1,114 @@
+"""
+Pruebas de la escritura diferida y atómica de los archivos JSON
+"""
+
+import json
+import os
+import time
+
+import pytest
+
+from src.database import OrdersRepository
+from src.database.write_behind import WriteBehindWriter, write_behind
+
+
+@pytest.fixture
+def writer():
+    writer = WriteBehindWriter(window=0.05)
+    yield writer
+    writer.close()
+
+
+class TestWriteBehindWriter:
+
+    def test_burst_is_coalesced_into_one_write(self, writer, tmp_path):
+        path = tmp_path / "sessions.json"
+        for i in range(50):
+            writer.dump_json(path, {"n": i})
+
+        assert not path.exists()
+        assert writer.load_json(path) == {"n": 49}
+
+        deadline = time.monotonic() + 5
+        while writer.pending(path) is not None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert json.loads(path.read_text()) == {"n": 49}
+
+        metrics = writer.get_metrics()
+        assert metrics["flushes"] == 1 and metrics["writes_coalesced"] == 49
+        assert metrics["pending_files"] == 0 and metrics["flush_latency_ms"]["max"] > 0
+
+    def test_failed_write_keeps_the_previous_file(self, writer, tmp_path, monkeypatch):
+        path = tmp_path / "orders.json"
+        writer.window = 0
+        writer.dump_json(path, {"v": 1})
+        writer.window = 60
+
+        writer.dump_json(path, {"v": 2})
+
+        def crash(*args):
+            raise OSError("disco lleno")
+
+        monkeypatch.setattr(os, "replace", crash)
+        with pytest.raises(OSError, match="disco lleno"):
+            writer.flush(path)
+
+        assert json.loads(path.read_text()) == {"v": 1}
+        assert os.listdir(tmp_path) == ["orders.json"]
+        assert writer.get_metrics()["errors"] == 1
+        assert writer.load_json(path) == {"v": 2}
+
+        monkeypatch.undo()
+        writer.flush(path)
+        assert json.loads(path.read_text()) == {"v": 2}
+
+    def test_persistent_failure_reaches_the_next_write_and_close(self, writer, tmp_path):
+        missing = tmp_path / "borrado" / "customers.json"
+        writer.max_retries = 2
+        writer.dump_json(missing, {"v": 1})
+        for _ in range(2):
+            with pytest.raises(OSError):
+                writer.flush(missing)
+        assert writer.get_metrics()["failing_files"] == [str(missing)]
+
+        # Sin más reintentos en segundo plano: la siguiente escritura falla en el momento
+        with pytest.raises(OSError):
+            writer.dump_json(missing, {"v": 2})
+        assert writer.load_json(missing) == {"v": 1}
+
+        with pytest.raises(OSError, match="customers.json"):
+            writer.close()
+
+        missing.parent.mkdir()
+        writer.dump_json(missing, {"v": 3})
+        assert writer.pending(missing) is None and json.loads(missing.read_text()) == {"v": 3}
+
+    def test_closed_writer_writes_immediately(self, writer, tmp_path):
+        path = tmp_path / "proyectos.json"
+        writer.window = 60
+        writer.dump_json(path, {"v": 1})
+
+        writer.close()
+        assert json.loads(path.read_text()) == {"v": 1}
+        writer.dump_json(path, {"v": 2})
+        assert writer.pending(path) is None and json.loads(path.read_text()) == {"v": 2}
+
+
+class TestRepositoryWriteBehind:
+
+    def test_repository_burst_and_cache_after_flush(self, tmp_path):
+        repo = OrdersRepository(base_path=tmp_path, storage="json")
+        flushes = write_behind.get_metrics()["flushes"]
+        for i in range(100):
+            repo.upsert_order({"id": f"o{i}", "status": "pending"})
+
+        # Un repositorio nuevo sobre el mismo archivo ve la versión pendiente
+        assert OrdersRepository(base_path=tmp_path, storage="json").count() == 100
+
+        write_behind.flush()
+        assert write_behind.get_metrics()["flushes"] - flushes <= 5
+        assert len(json.loads(repo.file_path.read_text())["orders"]) == 100
+
+        loads = repo.get_cache_stats()["loads"]
+        assert repo.get_order_by_id("o99")
+        assert repo.get_cache_stats()["loads"] == loads